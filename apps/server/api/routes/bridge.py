@@ -1,6 +1,9 @@
-"""Bridge and MQTT status endpoints for the Control Center."""
+"""Bridge, MQTT status and telemetry history endpoints for the Control Center."""
+from typing import Optional
+
 from fastapi import APIRouter, HTTPException
 import logging
+import time
 
 from services.bridge_service import get_bridge_status, restart_bridge_service
 from services.mqtt_service import get_mqtt_subscriber
@@ -33,6 +36,7 @@ async def bridge_status():
         "sensor_count": len(snapshot),
         "availability": snapshot.get("availability"),
         "state": snapshot.get("state"),
+        "signalling": sub.metrics(),
     }
 
     return status
@@ -52,3 +56,39 @@ async def bridge_restart():
             detail="Failed to restart bridge service",
         )
     return {"status": "restarting", "message": "Bridge service restart initiated"}
+
+
+@router.get("/api/telemetry/history")
+async def telemetry_history(
+    seconds: float = 60,
+    start: Optional[float] = None,
+    end: Optional[float] = None,
+    sensors: Optional[str] = None,
+    max_points: int = 600,
+):
+    """Recent live telemetry from the in-memory ring buffer.
+
+    Args:
+        seconds: Window length ending at ``end`` (default: 60), used when
+            ``start`` is not given
+        start: Window start, Unix epoch seconds
+        end: Window end, Unix epoch seconds (default: now)
+        sensors: Comma-separated sensor names (default: all)
+        max_points: Max samples returned per sensor (default: 600, max: 6000)
+
+    Returns:
+        - start / end: The window queried
+        - sensors: ``{name: {"t": [epoch seconds], "v": [values]}}``
+    """
+    buffer = get_mqtt_subscriber().buffer
+    end = time.time() if end is None else end
+    start = end - max(0.0, seconds) if start is None else start
+    if start > end:
+        raise HTTPException(status_code=400, detail="start must not be after end")
+    names = [name.strip() for name in sensors.split(",") if name.strip()] if sensors else None
+    return {
+        "start": start,
+        "end": end,
+        "buffer_seconds": buffer.duration,
+        "sensors": buffer.window(start, end, names, max(1, min(max_points, 6000))),
+    }
@@ -3,7 +3,8 @@ from fastapi import APIRouter, Request, UploadFile, File, Form, HTTPException
 from fastapi.responses import JSONResponse
 from sse_starlette.sse import EventSourceResponse
 from typing import Optional
-from PIL import Image
+from PIL import Image, ImageOps
+from google.genai import types as genai_types
 import asyncio
 import io
 import json
@@ -23,27 +24,33 @@ except ImportError:
 from services.gemini_service import (
     parse_gemini_error,
     get_vision_model,
+    get_model_name,
     get_author_instruction,
     build_advanced_customization_section,
     PROFILING_KNOWLEDGE,
     PROFILING_KNOWLEDGE_DISTILLED
 )
 from services.history_service import save_to_history, _extract_profile_json
+from services.cache_service import (
+    compute_bag_image_hash, get_cached_bag_analysis, save_bag_analysis_to_cache,
+)
 from services.meticulous_service import async_create_profile
 from services.validation_service import validate_profile
+from services.profile_repair_service import (
+    get_repair_metrics, record_repair, repair_profile, repair_profile_json_text,
+)
 from services.generation_progress import (
     GenerationPhase, ProgressEvent, GenerationState,
     create_generation, get_generation, get_latest_generation, remove_generation,
 )
+from services.generation_queue import QueueFullError, get_generation_queue
+from services.prompt_cache_service import get_prompt_cache
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
 
-# Concurrency guard: only one profile generation at a time.
-# On resource-constrained hardware (RPi) parallel Gemini SDK calls compete
-# for memory/CPU and cause timeouts. A single asyncio.Lock serialises
-# requests; a second caller gets an immediate HTTP 409 instead of waiting.
-_profile_generation_lock = asyncio.Lock()
+# Client-supplied generation IDs become SSE URL segments and log fields
+_GENERATION_ID_PATTERN = re.compile(r'^[A-Za-z0-9_-]{1,64}$')
 
 # Maximum validation-fix retry attempts. Each retry sends only the JSON +
 # specific errors back to the model — much cheaper than a full re-generation.
@@ -57,6 +64,106 @@ VALIDATION_RETRY_PROMPT = (
     "ORIGINAL JSON:\n```json\n{json}\n```\n"
 )
 
+# Minimum seconds between token-progress events while a reply is streaming.
+STREAM_PROGRESS_INTERVAL = 0.5
+
+# Seconds a client is asked to wait (Retry-After) when the generation queue is full.
+QUEUE_FULL_RETRY_AFTER = 30
+
+_JSON_FENCE_OPEN = re.compile(r'```json\s*', re.IGNORECASE)
+_PROFILE_CREATED_HEADER = re.compile(r'(?:\*\*)?Profile Created:(?:\*\*)?', re.IGNORECASE)
+
+
+class _ProfileStreamWatcher:
+    """Follow a streamed profile generation chunk by chunk.
+
+    Pushes token-progress events to the generation state and watches for
+    the closing fence of the ```json block.  As soon as it closes, the
+    profile is parsed and validated while the model is still writing, and
+    :meth:`feed` asks the caller to stop the stream when the remainder of
+    the reply cannot be used:
+
+    - the block is not parseable JSON even after the local syntax repair,
+      so a retry is needed regardless;
+    - the profile fails validation, the local repair cannot fix it and
+      the user summary has already been received, so the fix request can
+      start immediately.
+
+    Problems the local repairs fix are left to the post-stream validation,
+    so the rest of the reply (including the summary) is kept.
+    """
+
+    def __init__(self, progress: GenerationState):
+        self._progress = progress
+        self._last_emit = 0.0
+        self._fence_end: Optional[int] = None
+        self._open_from = 0
+        self.text = ""
+        self.tokens = 0
+        self.profile_json: Optional[dict] = None
+        self.validation = None
+        self.abort_reason: Optional[str] = None
+
+    def feed(self, chunk: str, tokens: Optional[int] = None) -> bool:
+        """Consume one streamed chunk; return True to abort the stream."""
+        scan_from = max(len(self.text) - 2, 0)
+        self.text += chunk
+        # Fall back to a rough 4-characters-per-token estimate
+        self.tokens = tokens if tokens is not None else len(self.text) // 4
+
+        now = time.monotonic()
+        if now - self._last_emit >= STREAM_PROGRESS_INTERVAL:
+            self._last_emit = now
+            self._progress.emit(ProgressEvent(
+                phase=GenerationPhase.GENERATING,
+                message=f"Generating espresso profile... ({self.tokens} tokens)",
+                tokens=self.tokens,
+            ))
+
+        if self.profile_json is not None:
+            return False
+        if self._fence_end is None:
+            opening = _JSON_FENCE_OPEN.search(self.text, self._open_from)
+            if opening is None:
+                return False
+            self._fence_end = opening.end()
+            scan_from = self._fence_end
+        close = self.text.find("```", max(scan_from, self._fence_end))
+        if close == -1:
+            return False
+        block = self.text[self._fence_end:close]
+        self._fence_end = None
+        self._open_from = close + 3
+        return self._block_closed(block)
+
+    def _block_closed(self, block: str) -> bool:
+        try:
+            parsed = json.loads(block.strip())
+        except json.JSONDecodeError:
+            parsed = repair_profile_json_text(block)
+            if parsed is None:
+                self.abort_reason = "malformed_json"
+                return True
+        if not (isinstance(parsed, dict) and ('name' in parsed or 'stages' in parsed)):
+            # Not the profile (e.g. an illustrative snippet) — keep watching
+            return False
+
+        self.profile_json = parsed
+        self._progress.emit(ProgressEvent(
+            phase=GenerationPhase.VALIDATING,
+            message="Validating profile while the summary finishes...",
+            tokens=self.tokens,
+        ))
+        self.validation = validate_profile(parsed)
+        if self.validation.is_valid or not _PROFILE_CREATED_HEADER.search(self.text):
+            return False
+        repaired, fixes = repair_profile(parsed)
+        if fixes and validate_profile(repaired).is_valid:
+            return False
+        self.abort_reason = "validation_failed"
+        return True
+
+
 # ── Load OEPF RFC once at import time ──────────────────────────────────────────
 # Embedding the RFC directly in the prompt eliminates a round-trip where the
 # Gemini CLI would call the get_profiling_knowledge MCP tool, saving ~3-5s.
@@ -370,6 +477,111 @@ _PROFILING_GUIDE_DISTILLED = (
 _OEPF_REFERENCE_DISTILLED = OEPF_SUMMARY
 
 
+def _with_profile_json(reply: str, profile: dict) -> str:
+    """Replace the first ```json block in *reply* with *profile*.
+
+    An unterminated block (e.g. from an aborted stream) is replaced up to the
+    end of the reply; when there is no block at all one is appended.
+    """
+    # Use a lambda replacement to avoid re.sub interpreting
+    # \uXXXX sequences in the JSON as regex escape sequences
+    replacement = '```json\n' + json.dumps(profile, indent=2) + '\n```'
+    updated, count = re.subn(
+        r'```json\s*[\s\S]*?(?:```|$)',
+        lambda _m: replacement,
+        reply,
+        count=1
+    )
+    if count:
+        return updated
+    return reply + "\n\nPROFILE JSON:\n" + replacement
+
+
+async def _generate_with_prompt_cache(prefix: str, suffix: str, cache_handle: Optional[str], on_chunk):
+    """Stream a generation, sending only *suffix* when *prefix* is cached."""
+    if cache_handle is None:
+        return await get_vision_model().async_generate_content(
+            [prefix + suffix], on_chunk=on_chunk
+        )
+    return await get_vision_model().async_generate_content(
+        [suffix], on_chunk=on_chunk, cached_content=cache_handle
+    )
+
+
+BAG_ANALYSIS_PROMPT = (
+    "Analyze this coffee bag. Extract: Roaster, Origin, Roast Level, and Flavor Notes. "
+    "Return ONLY a single concise sentence describing the coffee."
+)
+
+
+# Bag photos are downscaled to this long edge and re-encoded as JPEG before
+# the vision call; label text stays legible well below camera resolution.
+VISION_IMAGE_MAX_EDGE = 1024
+VISION_IMAGE_JPEG_QUALITY = 85
+
+
+def _load_bag_image(data: bytes) -> tuple[bytes, str, tuple[int, int]]:
+    """Prepare an uploaded bag photo for the vision model (CPU-bound).
+
+    JPEGs are decoded in draft mode, letting the decoder scale down by a
+    power of two instead of materialising the full camera resolution.  The
+    image is then rotated per its EXIF orientation, converted to RGB and
+    shrunk to ``VISION_IMAGE_MAX_EDGE`` on the long edge.
+
+    Returns:
+        Tuple of (JPEG bytes to upload, perceptual hash, final size).
+    """
+    img = Image.open(io.BytesIO(data))
+    img.draft('RGB', (VISION_IMAGE_MAX_EDGE, VISION_IMAGE_MAX_EDGE))
+    img = ImageOps.exif_transpose(img)
+    if img.mode != 'RGB':
+        img = img.convert('RGB')
+    img.thumbnail((VISION_IMAGE_MAX_EDGE, VISION_IMAGE_MAX_EDGE), Image.Resampling.LANCZOS)
+
+    buf = io.BytesIO()
+    img.save(buf, format='JPEG', quality=VISION_IMAGE_JPEG_QUALITY, optimize=True)
+    return buf.getvalue(), compute_bag_image_hash(img), img.size
+
+
+async def _analyze_bag_image(data: bytes, request_id: str) -> str:
+    """Describe a coffee bag photo in one sentence.
+
+    Re-photographed bags and retried uploads are answered from the
+    perceptual-hash cache, skipping the vision call entirely.
+    """
+    # Offload CPU-bound PIL ops to a thread
+    loop = asyncio.get_running_loop()
+    jpeg_bytes, image_hash, (width, height) = await loop.run_in_executor(
+        None, _load_bag_image, data
+    )
+
+    cached = get_cached_bag_analysis(image_hash)
+    if cached:
+        logger.info(
+            "Coffee analysis served from cache",
+            extra={"request_id": request_id, "image_hash": image_hash}
+        )
+        return cached
+
+    logger.debug(
+        "Image prepared for vision model",
+        extra={
+            "request_id": request_id,
+            "image_size": f"{width}x{height}",
+            "upload_bytes": len(data),
+            "vision_bytes": len(jpeg_bytes),
+            "image_hash": image_hash,
+        }
+    )
+
+    image_part = genai_types.Part.from_bytes(data=jpeg_bytes, mime_type="image/jpeg")
+    response = await get_vision_model().async_generate_content([BAG_ANALYSIS_PROMPT, image_part])
+    analysis = response.text.strip()
+    if analysis:
+        save_bag_analysis_to_cache(image_hash, analysis)
+    return analysis
+
+
 @router.post("/analyze_coffee")
 @router.post("/api/analyze_coffee")
 async def analyze_coffee(request: Request, file: UploadFile = File(...)):
@@ -388,33 +600,7 @@ async def analyze_coffee(request: Request, file: UploadFile = File(...)):
         )
         
         contents = await file.read()
-        
-        # Offload CPU-bound PIL ops to a thread
-        def _open_image(data: bytes):
-            img = Image.open(io.BytesIO(data))
-            if img.mode not in ('RGB', 'L'):
-                img = img.convert('RGB')
-            return img
-        
-        loop = asyncio.get_running_loop()
-        image = await loop.run_in_executor(None, _open_image, contents)
-        
-        logger.debug(
-            "Image loaded successfully",
-            extra={
-                "request_id": request_id,
-                "image_size": f"{image.width}x{image.height}",
-                "image_format": image.format
-            }
-        )
-        
-        response = await get_vision_model().async_generate_content([
-            "Analyze this coffee bag. Extract: Roaster, Origin, Roast Level, and Flavor Notes. "
-            "Return ONLY a single concise sentence describing the coffee.", 
-            image
-        ])
-        
-        analysis = response.text.strip()
+        analysis = await _analyze_bag_image(contents, request_id)
         
         logger.info(
             "Coffee analysis completed successfully",
@@ -453,41 +639,22 @@ async def analyze_coffee(request: Request, file: UploadFile = File(...)):
 
 # ── SSE progress endpoint ──────────────────────────────────────────────────────
 
-@router.get("/generate/progress")
-@router.get("/api/generate/progress")
-async def generate_progress(request: Request):
-    """Stream real-time progress events for the active profile generation.
-
-    Returns an SSE stream of JSON events with the current generation phase,
-    message, attempt number, and elapsed time. Clients should reconnect if
-    the stream closes unexpectedly.
-
-    Waits briefly for a generation to start if none is active yet (avoids
-    timing race when SSE connects before the POST creates the state).
-    """
-    # Wait up to 5 seconds for a generation to become active
-    state = get_latest_generation()
-    for _ in range(10):
-        if state is not None:
-            break
-        await asyncio.sleep(0.5)
-        state = get_latest_generation()
-
-    if state is None:
-        return JSONResponse(
-            status_code=404,
-            content={"error": "No active generation"}
-        )
-
+def _progress_response(state: GenerationState) -> EventSourceResponse:
+    """Serialise a generation's progress events as an SSE stream."""
     async def event_generator():
         async for event in state.stream():
             data = {
+                "generation_id": state.generation_id,
                 "phase": event.phase.value,
                 "message": event.message,
                 "attempt": event.attempt,
                 "max_attempts": event.max_attempts,
                 "elapsed": event.elapsed,
             }
+            if event.tokens is not None:
+                data["tokens"] = event.tokens
+            if event.position is not None:
+                data["position"] = event.position
             if event.result:
                 data["result"] = event.result
             if event.error:
@@ -497,6 +664,110 @@ async def generate_progress(request: Request):
     return EventSourceResponse(event_generator())
 
 
+async def _wait_for_generation(lookup) -> Optional[GenerationState]:
+    """Poll for up to 5 seconds for a generation state to appear.
+
+    Avoids a timing race when the SSE client connects before the POST
+    creates the state.
+    """
+    state = lookup()
+    for _ in range(10):
+        if state is not None:
+            break
+        await asyncio.sleep(0.5)
+        state = lookup()
+    return state
+
+
+@router.get("/generate/progress")
+@router.get("/api/generate/progress")
+async def generate_progress(request: Request):
+    """Stream real-time progress events for the most recent profile generation.
+
+    Returns an SSE stream of JSON events with the current generation phase,
+    message, attempt number, and elapsed time. Clients should reconnect if
+    the stream closes unexpectedly.  With several generations queued, use
+    ``/api/generate/progress/{generation_id}`` to follow a specific one.
+    """
+    state = await _wait_for_generation(get_latest_generation)
+    if state is None:
+        return JSONResponse(
+            status_code=404,
+            content={"error": "No active generation"}
+        )
+    return _progress_response(state)
+
+
+@router.get("/generate/progress/{generation_id}")
+@router.get("/api/generate/progress/{generation_id}")
+async def generate_progress_by_id(request: Request, generation_id: str):
+    """Stream progress events for one generation, including queue position."""
+    state = await _wait_for_generation(lambda: get_generation(generation_id))
+    if state is None:
+        return JSONResponse(
+            status_code=404,
+            content={"error": f"Generation {generation_id} not found"}
+        )
+    return _progress_response(state)
+
+
+@router.delete("/generate/{generation_id}")
+@router.delete("/api/generate/{generation_id}")
+async def cancel_generation(request: Request, generation_id: str):
+    """Cancel a queued or running profile generation."""
+    if not get_generation_queue().cancel(generation_id):
+        return JSONResponse(
+            status_code=404,
+            content={"error": f"No queued or running generation {generation_id}"}
+        )
+    logger.info(
+        "Profile generation cancellation requested",
+        extra={"request_id": request.state.request_id, "generation_id": generation_id}
+    )
+    return {"status": "cancelling", "generation_id": generation_id}
+
+
+@router.get("/generate/repair-metrics")
+@router.get("/api/generate/repair-metrics")
+async def generation_repair_metrics():
+    """Report how often invalid generated profiles were repaired locally."""
+    return get_repair_metrics()
+
+
+@router.get("/generate/queue")
+@router.get("/api/generate/queue")
+async def generation_queue_status():
+    """Report running and waiting profile generations."""
+    return get_generation_queue().snapshot()
+
+
+def _generation_conflict_response(generation_id: str) -> JSONResponse:
+    """409 for a generation_id that is already queued, running or retained."""
+    return JSONResponse(
+        status_code=409,
+        content={
+            "status": "conflict",
+            "message": f"Generation {generation_id} already exists."
+        }
+    )
+
+
+def _queue_full_response(request_id: str) -> JSONResponse:
+    """503 with ``Retry-After`` for a full generation queue."""
+    logger.info(
+        "Profile generation rejected — generation queue is full",
+        extra={"request_id": request_id, "endpoint": "/analyze_and_profile"}
+    )
+    return JSONResponse(
+        status_code=503,
+        headers={"Retry-After": str(QUEUE_FULL_RETRY_AFTER)},
+        content={
+            "status": "busy",
+            "message": "Too many profiles are already being generated. Please wait and try again."
+        }
+    )
+
+
 @router.post("/analyze_and_profile")
 @router.post("/api/analyze_and_profile")
 async def analyze_and_profile(
@@ -504,7 +775,9 @@ async def analyze_and_profile(
     file: Optional[UploadFile] = File(None),
     user_prefs: Optional[str] = Form(None),
     advanced_customization: Optional[str] = Form(None),
-    detailed_knowledge: Optional[str] = Form(None)
+    detailed_knowledge: Optional[str] = Form(None),
+    generation_id: Optional[str] = Form(None),
+    wait: Optional[str] = Form(None)
 ):
     """Unified endpoint: Analyze coffee bag and generate profile in a single LLM pass.
     
@@ -516,6 +789,15 @@ async def analyze_and_profile(
     - advanced_customization: Advanced equipment/extraction settings (basket, temp, dose, etc.)
     - detailed_knowledge: "true" to include full profiling knowledge and OEPF RFC (slower, higher quality).
                           Default is distilled/compact mode for faster generation.
+    - generation_id: Client-chosen job ID, so /api/generate/progress/{id} can be
+                     opened before this request returns. Generated when omitted.
+    - wait: "false" to return 202 with the job ID and queue position at once
+            instead of waiting for the result (delivered in the final SSE event).
+
+    Generations run through a bounded job queue; while all slots are busy the
+    job waits and its queue position is published on the progress stream.
+    A full queue is answered with 503 and ``Retry-After``; a generation_id
+    that is already in use with 409.
     """
     request_id = request.state.request_id
     
@@ -533,518 +815,602 @@ async def analyze_and_profile(
             detail="At least one of 'file' (image) or 'user_prefs' (preferences) must be provided"
         )
     
-    # Fast-reject if another generation is already running.
-    # Safe in CPython's single-threaded event loop: no await between the
-    # .locked() check and the ``async with`` acquisition, so no other
-    # coroutine can sneak in between the two statements (no TOCTOU issue).
-    if _profile_generation_lock.locked():
-        logger.info(
-            "Profile generation rejected — another request is in progress",
-            extra={"request_id": request_id, "endpoint": "/analyze_and_profile"}
+    if generation_id is not None and not _GENERATION_ID_PATTERN.match(generation_id):
+        raise HTTPException(
+            status_code=400,
+            detail="generation_id must be 1-64 letters, digits, '-' or '_'"
+        )
+    generation_id = generation_id or str(uuid.uuid4())[:8]
+
+    # Read the upload now: the request body is gone once a queued job runs.
+    # Nothing is awaited between the checks below and submit().
+    image_bytes = await file.read() if file else None
+    upload_filename = file.filename if file else None
+
+    queue = get_generation_queue()
+    if queue.has_job(generation_id) or get_generation(generation_id) is not None:
+        return _generation_conflict_response(generation_id)
+    if queue.is_full():
+        return _queue_full_response(request_id)
+
+    progress = create_generation(generation_id)
+    try:
+        task = queue.submit(
+            generation_id,
+            progress,
+            lambda: _run_profile_generation(
+                request_id=request_id,
+                generation_id=generation_id,
+                progress=progress,
+                image_bytes=image_bytes,
+                upload_filename=upload_filename,
+                user_prefs=user_prefs,
+                advanced_customization=advanced_customization,
+                detailed_knowledge=detailed_knowledge,
+            ),
         )
+    except QueueFullError:
+        remove_generation(generation_id)
+        return _queue_full_response(request_id)
+    except ValueError:
+        remove_generation(generation_id)
+        return _generation_conflict_response(generation_id)
+
+    if wait is not None and wait.lower() == "false":
         return JSONResponse(
-            status_code=409,
+            status_code=202,
             content={
-                "status": "busy",
-                "message": "A profile is already being generated. Please wait and try again."
+                "status": "queued",
+                "generation_id": generation_id,
+                "position": queue.position(generation_id),
             }
         )
-    
+
+    # Wait without propagating our own cancellation into the job: if the
+    # client disconnects, the generation still finishes and lands in history.
+    await asyncio.wait({task})
+    if task.cancelled():
+        return {"status": "cancelled", "generation_id": generation_id}
+    return task.result()
+
+
+async def _run_profile_generation(
+    *,
+    request_id: str,
+    generation_id: str,
+    progress: GenerationState,
+    image_bytes: Optional[bytes],
+    upload_filename: Optional[str],
+    user_prefs: Optional[str],
+    advanced_customization: Optional[str],
+    detailed_knowledge: Optional[str],
+) -> dict:
+    """Run one queued profile generation from analysis through upload."""
     coffee_analysis = None
-    generation_id = str(uuid.uuid4())[:8]
-    progress = create_generation(generation_id)
+    try:
+        logger.info(
+            "Starting profile creation",
+            extra={
+                "request_id": request_id,
+                "generation_id": generation_id,
+                "endpoint": "/analyze_and_profile",
+                "has_image": image_bytes is not None,
+                "has_preferences": user_prefs is not None,
+                "has_advanced_customization": advanced_customization is not None,
+                "knowledge_mode": "detailed" if (detailed_knowledge and detailed_knowledge.lower() == "true") else "distilled",
+                "upload_filename": upload_filename,
+                "preferences_preview": user_prefs[:100] if user_prefs and len(user_prefs) > 100 else user_prefs,
+                "advanced_customization_preview": (
+                    advanced_customization[:100]
+                    if advanced_customization and len(advanced_customization) > 100
+                    else advanced_customization
+                )
+            }
+        )
     
-    async with _profile_generation_lock:
-        try:
+        # ── Phase: Analyzing ──────────────────────────────────────────
+        if image_bytes is not None:
+            progress.emit(ProgressEvent(
+                phase=GenerationPhase.ANALYZING,
+                message="Analyzing coffee image..."
+            ))
+            logger.debug("Reading and analyzing image", extra={"request_id": request_id})
+        
+            # Analyze the coffee bag
+            analysis_start = time.monotonic()
+            coffee_analysis = await _analyze_bag_image(image_bytes, request_id)
+            analysis_elapsed = time.monotonic() - analysis_start
+        
             logger.info(
-                "Starting profile creation",
+                "Coffee analysis completed",
                 extra={
                     "request_id": request_id,
-                    "generation_id": generation_id,
-                    "endpoint": "/analyze_and_profile",
-                    "has_image": file is not None,
-                    "has_preferences": user_prefs is not None,
-                    "has_advanced_customization": advanced_customization is not None,
-                    "knowledge_mode": "detailed" if (detailed_knowledge and detailed_knowledge.lower() == "true") else "distilled",
-                    "upload_filename": file.filename if file else None,
-                    "preferences_preview": user_prefs[:100] if user_prefs and len(user_prefs) > 100 else user_prefs,
-                    "advanced_customization_preview": (
-                        advanced_customization[:100]
-                        if advanced_customization and len(advanced_customization) > 100
-                        else advanced_customization
-                    )
+                    "analysis": coffee_analysis,
+                    "analysis_seconds": round(analysis_elapsed, 1),
                 }
             )
-        
-            # ── Phase: Analyzing ──────────────────────────────────────────
-            if file:
-                progress.emit(ProgressEvent(
-                    phase=GenerationPhase.ANALYZING,
-                    message="Analyzing coffee image..."
-                ))
-                logger.debug("Reading and analyzing image", extra={"request_id": request_id})
-                contents = await file.read()
-            
-                # Offload CPU-bound PIL ops to a thread
-                def _open_image(data: bytes):
-                    img = Image.open(io.BytesIO(data))
-                    if img.mode not in ('RGB', 'L'):
-                        img = img.convert('RGB')
-                    return img
-            
-                loop = asyncio.get_running_loop()
-                image = await loop.run_in_executor(None, _open_image, contents)
-            
-                # Analyze the coffee bag
-                analysis_start = time.monotonic()
-                analysis_response = await get_vision_model().async_generate_content([
-                    "Analyze this coffee bag. Extract: Roaster, Origin, Roast Level, and Flavor Notes. "
-                    "Return ONLY a single concise sentence describing the coffee.", 
-                    image
-                ])
-                coffee_analysis = analysis_response.text.strip()
-                analysis_elapsed = time.monotonic() - analysis_start
-            
-                logger.info(
-                    "Coffee analysis completed",
-                    extra={
-                        "request_id": request_id,
-                        "analysis": coffee_analysis,
-                        "analysis_seconds": round(analysis_elapsed, 1),
-                    }
-                )
-        
-            # Get author instruction with configured name
-            author_instruction = get_author_instruction()
-        
-            # Build advanced customization section if provided
-            advanced_section = build_advanced_customization_section(advanced_customization)
-        
-            # Select prompt sections based on knowledge mode
-            use_detailed = detailed_knowledge and detailed_knowledge.lower() == "true"
-            if use_detailed:
-                guidelines = PROFILE_GUIDELINES
-                validation = VALIDATION_RULES
-                profiling_guide = _PROFILING_GUIDE
-                oepf_ref = _OEPF_REFERENCE
-            else:
-                guidelines = PROFILE_GUIDELINES_DISTILLED
-                validation = VALIDATION_RULES_DISTILLED
-                profiling_guide = _PROFILING_GUIDE_DISTILLED
-                oepf_ref = _OEPF_REFERENCE_DISTILLED
-
-            # Common tail shared by all three prompt branches
-            prompt_tail = (
-                guidelines +
-                validation +
-                ERROR_RECOVERY +
-                NAMING_CONVENTION +
-                author_instruction +
-                USER_SUMMARY_INSTRUCTIONS +
-                SDK_OUTPUT_INSTRUCTIONS +
-                OUTPUT_FORMAT +
-                profiling_guide +
-                oepf_ref
-            )
+    
+        # Get author instruction with configured name
+        author_instruction = get_author_instruction()
+    
+        # Build advanced customization section if provided
+        advanced_section = build_advanced_customization_section(advanced_customization)
+    
+        # Select prompt sections based on knowledge mode
+        use_detailed = detailed_knowledge and detailed_knowledge.lower() == "true"
+        if use_detailed:
+            guidelines = PROFILE_GUIDELINES
+            validation = VALIDATION_RULES
+            profiling_guide = _PROFILING_GUIDE
+            oepf_ref = _OEPF_REFERENCE
+        else:
+            guidelines = PROFILE_GUIDELINES_DISTILLED
+            validation = VALIDATION_RULES_DISTILLED
+            profiling_guide = _PROFILING_GUIDE_DISTILLED
+            oepf_ref = _OEPF_REFERENCE_DISTILLED
 
-            # Construct the profile creation prompt
-            if coffee_analysis and user_prefs:
-                # Both image and preferences provided
-                final_prompt = (
-                    BARISTA_PERSONA +
-                    SAFETY_RULES +
-                    f"CONTEXT: You control a Meticulous Espresso Machine via local API.\n"
-                    f"Coffee Analysis: '{coffee_analysis}'\n\n" +
-                    advanced_section +
-                    f"⚠️ MANDATORY USER REQUIREMENTS (MUST BE FOLLOWED EXACTLY):\n"
-                    f"'{user_prefs}'\n"
-                    f"You MUST honor ALL parameters specified above. If the user requests a specific dose, temperature, ratio, or any other value, use EXACTLY that value in your profile. Do NOT substitute with defaults.\n\n" +
-                    "TASK: Create a sophisticated espresso profile based on the coffee analysis while strictly adhering to the user's requirements and equipment parameters above.\n\n" +
-                    prompt_tail
-                )
-            elif coffee_analysis:
-                # Only image provided (may still have advanced customization)
-                final_prompt = (
-                    BARISTA_PERSONA +
-                    SAFETY_RULES +
-                    f"CONTEXT: You control a Meticulous Espresso Machine via local API.\n"
-                    f"Coffee Analysis: '{coffee_analysis}'\n\n" +
-                    advanced_section +
-                    "TASK: Create a sophisticated espresso profile for this coffee" +
-                    (", strictly adhering to the equipment parameters above.\n\n" if advanced_section else ".\n\n") +
-                    prompt_tail
-                )
-            else:
-                # Only user preferences provided (may still have advanced customization)
-                final_prompt = (
-                    BARISTA_PERSONA +
-                    SAFETY_RULES +
-                    f"CONTEXT: You control a Meticulous Espresso Machine via local API.\n\n" +
-                    advanced_section +
-                    f"⚠️ MANDATORY USER REQUIREMENTS (MUST BE FOLLOWED EXACTLY):\n"
-                    f"'{user_prefs}'\n"
-                    f"You MUST honor ALL parameters specified above. If the user requests a specific dose, temperature, ratio, or any other value, use EXACTLY that value in your profile. Do NOT substitute with defaults.\n\n" +
-                    "TASK: Create a sophisticated espresso profile while strictly adhering to the user's requirements and equipment parameters above.\n\n" +
-                    prompt_tail
-                )
-        
-            # ── Phase: Generating ─────────────────────────────────────────
-            progress.emit(ProgressEvent(
-                phase=GenerationPhase.GENERATING,
-                message="Generating espresso profile..."
-            ))
-            logger.debug(
-                "Executing profile generation via Gemini SDK",
-                extra={
-                    "request_id": request_id,
-                    "prompt_length": len(final_prompt),
-                    "knowledge_mode": "detailed" if use_detailed else "distilled"
-                }
+        # Static prefix: identical for every generation in this knowledge
+        # mode, so it can live in the provider's context cache
+        prompt_prefix = (
+            BARISTA_PERSONA +
+            SAFETY_RULES +
+            guidelines +
+            validation +
+            ERROR_RECOVERY +
+            NAMING_CONVENTION +
+            author_instruction +
+            USER_SUMMARY_INSTRUCTIONS +
+            SDK_OUTPUT_INSTRUCTIONS +
+            OUTPUT_FORMAT +
+            profiling_guide +
+            oepf_ref
+        )
+
+        # Variable suffix: the request itself
+        if coffee_analysis and user_prefs:
+            # Both image and preferences provided
+            prompt_suffix = (
+                f"CONTEXT: You control a Meticulous Espresso Machine via local API.\n"
+                f"Coffee Analysis: '{coffee_analysis}'\n\n" +
+                advanced_section +
+                f"⚠️ MANDATORY USER REQUIREMENTS (MUST BE FOLLOWED EXACTLY):\n"
+                f"'{user_prefs}'\n"
+                f"You MUST honor ALL parameters specified above. If the user requests a specific dose, temperature, ratio, or any other value, use EXACTLY that value in your profile. Do NOT substitute with defaults.\n\n" +
+                "TASK: Create a sophisticated espresso profile based on the coffee analysis while strictly adhering to the user's requirements and equipment parameters above.\n"
+            )
+        elif coffee_analysis:
+            # Only image provided (may still have advanced customization)
+            prompt_suffix = (
+                f"CONTEXT: You control a Meticulous Espresso Machine via local API.\n"
+                f"Coffee Analysis: '{coffee_analysis}'\n\n" +
+                advanced_section +
+                "TASK: Create a sophisticated espresso profile for this coffee" +
+                (", strictly adhering to the equipment parameters above.\n" if advanced_section else ".\n")
             )
-            generation_start = time.monotonic()
+        else:
+            # Only user preferences provided (may still have advanced customization)
+            prompt_suffix = (
+                f"CONTEXT: You control a Meticulous Espresso Machine via local API.\n\n" +
+                advanced_section +
+                f"⚠️ MANDATORY USER REQUIREMENTS (MUST BE FOLLOWED EXACTLY):\n"
+                f"'{user_prefs}'\n"
+                f"You MUST honor ALL parameters specified above. If the user requests a specific dose, temperature, ratio, or any other value, use EXACTLY that value in your profile. Do NOT substitute with defaults.\n\n" +
+                "TASK: Create a sophisticated espresso profile while strictly adhering to the user's requirements and equipment parameters above.\n"
+            )
+        knowledge_mode = "detailed" if use_detailed else "distilled"
+        prompt_cache = get_prompt_cache()
+        cache_handle = await prompt_cache.get_handle(knowledge_mode, get_model_name(), prompt_prefix)
+    
+        # ── Phase: Generating ─────────────────────────────────────────
+        progress.emit(ProgressEvent(
+            phase=GenerationPhase.GENERATING,
+            message="Generating espresso profile..."
+        ))
+        logger.debug(
+            "Executing profile generation via Gemini SDK",
+            extra={
+                "request_id": request_id,
+                "prompt_length": len(prompt_prefix) + len(prompt_suffix),
+                "knowledge_mode": knowledge_mode,
+                "cached_prefix": cache_handle is not None,
+            }
+        )
+        generation_start = time.monotonic()
+        watcher = _ProfileStreamWatcher(progress)
+        try:
             model_response = await asyncio.wait_for(
-                get_vision_model().async_generate_content([final_prompt]),
+                _generate_with_prompt_cache(prompt_prefix, prompt_suffix, cache_handle, watcher.feed),
                 timeout=300
             )
-            generation_elapsed = time.monotonic() - generation_start
-            reply = (model_response.text or "").strip()
-
-            logger.info(
-                "Gemini SDK generation completed",
-                extra={
-                    "request_id": request_id,
-                    "generation_seconds": round(generation_elapsed, 1),
-                    "reply_length": len(reply),
-                }
+        except asyncio.TimeoutError:
+            raise
+        except Exception as e:
+            if cache_handle is None or watcher.text:
+                raise
+            # The provider may have evicted the cache entry; drop it and
+            # send the full prompt once rather than failing the generation
+            logger.warning(
+                f"Generation with cached prompt prefix failed, retrying uncached: {e}",
+                extra={"request_id": request_id, "knowledge_mode": knowledge_mode},
             )
+            await prompt_cache.invalidate(knowledge_mode)
+            cache_handle = None
+            model_response = await asyncio.wait_for(
+                _generate_with_prompt_cache(prompt_prefix, prompt_suffix, None, watcher.feed),
+                timeout=300
+            )
+        generation_elapsed = time.monotonic() - generation_start
+        reply = (model_response.text or "").strip()
 
-            # ── Phase: Validating ─────────────────────────────────────────
-            progress.emit(ProgressEvent(
-                phase=GenerationPhase.VALIDATING,
-                message="Validating profile schema..."
-            ))
+        logger.info(
+            "Gemini SDK generation completed",
+            extra={
+                "request_id": request_id,
+                "generation_seconds": round(generation_elapsed, 1),
+                "reply_length": len(reply),
+                "streamed_tokens": watcher.tokens,
+                "stream_aborted": watcher.abort_reason,
+                "cached_prefix": cache_handle is not None,
+            }
+        )
 
-            profile_json_check = _extract_profile_json(reply)
-
-            # Validation + retry loop
-            attempt = 0
-            while attempt <= MAX_VALIDATION_RETRIES:
-                if not profile_json_check:
-                    if attempt < MAX_VALIDATION_RETRIES:
-                        # No JSON extracted — ask model to regenerate
-                        attempt += 1
-                        progress.emit(ProgressEvent(
-                            phase=GenerationPhase.RETRYING,
-                            message=f"No valid JSON found, retrying ({attempt}/{MAX_VALIDATION_RETRIES})...",
-                            attempt=attempt,
-                            max_attempts=MAX_VALIDATION_RETRIES + 1,
-                        ))
-                        logger.warning(
-                            "No profile JSON extracted, requesting retry",
-                            extra={"request_id": request_id, "attempt": attempt}
-                        )
-                        retry_prompt = (
-                            "Your previous response did not contain a valid JSON profile block. "
-                            "Please generate the complete profile JSON in a fenced ```json block. "
-                            "Include the full profile object with name, stages, variables, and temperature."
-                        )
-                        retry_start = time.monotonic()
-                        retry_response = await asyncio.wait_for(
-                            get_vision_model().async_generate_content([retry_prompt]),
-                            timeout=120
-                        )
-                        retry_elapsed = time.monotonic() - retry_start
-                        retry_text = (retry_response.text or "").strip()
-                        profile_json_check = _extract_profile_json(retry_text)
-                        # Merge retry JSON into the original reply if extraction succeeded
-                        if profile_json_check:
-                            reply = reply + "\n\nPROFILE JSON:\n```json\n" + json.dumps(profile_json_check, indent=2) + "\n```"
-                        logger.info(
-                            "Retry generation completed",
-                            extra={
-                                "request_id": request_id,
-                                "attempt": attempt,
-                                "retry_seconds": round(retry_elapsed, 1),
-                                "has_json": profile_json_check is not None,
-                            }
-                        )
-                        continue
-                    else:
-                        # Exhausted retries with no JSON
-                        break
-
-                # We have JSON — validate it
-                validation_result = validate_profile(profile_json_check)
-
-                if validation_result.is_valid:
-                    logger.info(
-                        "Profile validation passed",
-                        extra={"request_id": request_id, "attempt": attempt}
-                    )
-                    break
+        # ── Phase: Validating ─────────────────────────────────────────
+        progress.emit(ProgressEvent(
+            phase=GenerationPhase.VALIDATING,
+            message="Validating profile schema..."
+        ))
+
+        profile_json_check = _extract_profile_json(reply)
+        if profile_json_check is None:
+            # Fix fence/syntax slips locally before asking the model again
+            profile_json_check = repair_profile_json_text(reply)
+            record_repair(profile_json_check is not None, ["json_syntax"] if profile_json_check else [])
+            if profile_json_check is not None:
+                logger.info("Recovered profile JSON locally", extra={"request_id": request_id})
+                reply = _with_profile_json(reply, profile_json_check)
+        # Reuse the result validated mid-stream when it is the same profile
+        early_validation = (
+            watcher.validation
+            if watcher.profile_json is not None and watcher.profile_json == profile_json_check
+            else None
+        )
 
-                # Validation failed — try to fix
+        # Validation + retry loop
+        attempt = 0
+        locally_repaired = False
+        while attempt <= MAX_VALIDATION_RETRIES:
+            if not profile_json_check:
                 if attempt < MAX_VALIDATION_RETRIES:
+                    # No JSON extracted — ask model to regenerate
                     attempt += 1
                     progress.emit(ProgressEvent(
                         phase=GenerationPhase.RETRYING,
-                        message=f"Fixing validation issues (attempt {attempt}/{MAX_VALIDATION_RETRIES})...",
+                        message=f"No valid JSON found, retrying ({attempt}/{MAX_VALIDATION_RETRIES})...",
                         attempt=attempt,
                         max_attempts=MAX_VALIDATION_RETRIES + 1,
                     ))
                     logger.warning(
-                        "Profile validation failed, requesting fix",
-                        extra={
-                            "request_id": request_id,
-                            "attempt": attempt,
-                            "error_count": len(validation_result.errors),
-                            "errors": validation_result.errors[:5],
-                        }
+                        "No profile JSON extracted, requesting retry",
+                        extra={"request_id": request_id, "attempt": attempt}
                     )
-
-                    fix_prompt = VALIDATION_RETRY_PROMPT.format(
-                        errors=validation_result.error_summary(),
-                        json=json.dumps(profile_json_check, indent=2)
+                    retry_prompt = (
+                        "Your previous response did not contain a valid JSON profile block. "
+                        "Please generate the complete profile JSON in a fenced ```json block. "
+                        "Include the full profile object with name, stages, variables, and temperature."
                     )
                     retry_start = time.monotonic()
-                    fix_response = await asyncio.wait_for(
-                        get_vision_model().async_generate_content([fix_prompt]),
+                    retry_response = await asyncio.wait_for(
+                        get_vision_model().async_generate_content([retry_prompt]),
                         timeout=120
                     )
                     retry_elapsed = time.monotonic() - retry_start
-                    fix_text = (fix_response.text or "").strip()
-                    fixed_json = _extract_profile_json(fix_text)
-
+                    retry_text = (retry_response.text or "").strip()
+                    profile_json_check = (
+                        _extract_profile_json(retry_text) or repair_profile_json_text(retry_text)
+                    )
+                    locally_repaired = False
+                    # Merge retry JSON into the original reply if extraction succeeded
+                    if profile_json_check:
+                        reply = reply + "\n\nPROFILE JSON:\n```json\n" + json.dumps(profile_json_check, indent=2) + "\n```"
                     logger.info(
-                        "Validation fix attempt completed",
+                        "Retry generation completed",
                         extra={
                             "request_id": request_id,
                             "attempt": attempt,
                             "retry_seconds": round(retry_elapsed, 1),
-                            "has_json": fixed_json is not None,
+                            "has_json": profile_json_check is not None,
                         }
                     )
-
-                    if fixed_json:
-                        profile_json_check = fixed_json
-                        # Update the JSON in the reply so the user sees the corrected version
-                        # Use a lambda replacement to avoid re.sub interpreting
-                        # \uXXXX sequences in the JSON as regex escape sequences
-                        _replacement = '```json\n' + json.dumps(fixed_json, indent=2) + '\n```'
-                        reply = re.sub(
-                            r'```json\s*[\s\S]*?```',
-                            lambda _m: _replacement,
-                            reply,
-                            count=1
-                        )
                     continue
                 else:
-                    # Exhausted retries — log and proceed with what we have
-                    logger.warning(
-                        "Validation retries exhausted, proceeding with best-effort profile",
-                        extra={
-                            "request_id": request_id,
-                            "final_errors": validation_result.errors[:5],
-                        }
-                    )
+                    # Exhausted retries with no JSON
                     break
 
-            if not profile_json_check:
-                progress.emit(ProgressEvent(
-                    phase=GenerationPhase.FAILED,
-                    message="Failed to generate valid profile JSON",
-                    error="No valid profile JSON after retries",
-                ))
-                logger.error(
-                    "Model reply missing valid profile JSON after retries",
+            # We have JSON — validate it
+            validation_result = early_validation or validate_profile(profile_json_check)
+            early_validation = None
+
+            if not validation_result.is_valid and not locally_repaired:
+                # Try the deterministic repairs first; only fall back to an
+                # LLM round-trip when they cannot make the profile valid.
+                locally_repaired = True
+                repaired, fixes = repair_profile(profile_json_check)
+                repaired_result = validate_profile(repaired) if fixes else validation_result
+                record_repair(repaired_result.is_valid, fixes)
+                logger.info(
+                    "Local profile repair attempted",
                     extra={
                         "request_id": request_id,
-                        "reply_preview": reply[:500],
+                        "attempt": attempt,
+                        "fixes": fixes[:10],
+                        "repaired": repaired_result.is_valid,
                     }
                 )
-                # Still save to history so user can see what happened
-                history_entry = save_to_history(
-                    coffee_analysis=coffee_analysis,
-                    user_prefs=user_prefs,
-                    reply=reply
+                if fixes and (
+                    repaired_result.is_valid
+                    or len(repaired_result.errors) < len(validation_result.errors)
+                ):
+                    profile_json_check = repaired
+                    validation_result = repaired_result
+                    reply = _with_profile_json(reply, repaired)
+
+            if validation_result.is_valid:
+                logger.info(
+                    "Profile validation passed",
+                    extra={"request_id": request_id, "attempt": attempt}
                 )
-                return {
-                    "status": "error",
-                    "analysis": coffee_analysis,
-                    "reply": reply,
-                    "generation_id": generation_id,
-                    "message": (
-                        "The AI attempted to create a profile but encountered "
-                        "validation errors it couldn't resolve. Please try again — "
-                        "the AI will often succeed on a second attempt with a "
-                        "different approach."
-                    ),
-                    "history_id": history_entry.get("id")
-                }
+                break
 
-            # ── Phase: Uploading ──────────────────────────────────────────
-            progress.emit(ProgressEvent(
-                phase=GenerationPhase.UPLOADING,
-                message="Uploading profile to machine..."
-            ))
+            # Validation failed — try to fix
+            if attempt < MAX_VALIDATION_RETRIES:
+                attempt += 1
+                progress.emit(ProgressEvent(
+                    phase=GenerationPhase.RETRYING,
+                    message=f"Fixing validation issues (attempt {attempt}/{MAX_VALIDATION_RETRIES})...",
+                    attempt=attempt,
+                    max_attempts=MAX_VALIDATION_RETRIES + 1,
+                ))
+                logger.warning(
+                    "Profile validation failed, requesting fix",
+                    extra={
+                        "request_id": request_id,
+                        "attempt": attempt,
+                        "error_count": len(validation_result.errors),
+                        "errors": validation_result.errors[:5],
+                    }
+                )
 
-            create_start = time.monotonic()
-            create_result = await asyncio.wait_for(
-                async_create_profile(profile_json_check),
-                timeout=300
-            )
-            create_elapsed = time.monotonic() - create_start
+                fix_prompt = VALIDATION_RETRY_PROMPT.format(
+                    errors=validation_result.error_summary(),
+                    json=json.dumps(profile_json_check, indent=2)
+                )
+                retry_start = time.monotonic()
+                fix_response = await asyncio.wait_for(
+                    get_vision_model().async_generate_content([fix_prompt]),
+                    timeout=120
+                )
+                retry_elapsed = time.monotonic() - retry_start
+                fix_text = (fix_response.text or "").strip()
+                fixed_json = _extract_profile_json(fix_text) or repair_profile_json_text(fix_text)
 
-            logger.info(
-                "Machine profile creation completed",
-                extra={
-                    "request_id": request_id,
-                    "create_seconds": round(create_elapsed, 1),
-                }
-            )
+                logger.info(
+                    "Validation fix attempt completed",
+                    extra={
+                        "request_id": request_id,
+                        "attempt": attempt,
+                        "retry_seconds": round(retry_elapsed, 1),
+                        "has_json": fixed_json is not None,
+                    }
+                )
 
-            create_error = None
-            if isinstance(create_result, dict):
-                create_error = create_result.get("error")
+                if fixed_json:
+                    profile_json_check = fixed_json
+                    locally_repaired = False
+                    # Update the JSON in the reply so the user sees the corrected version
+                    reply = _with_profile_json(reply, fixed_json)
+                continue
             else:
-                create_error = getattr(create_result, "error", None)
-
-            if create_error:
-                friendly_message = parse_gemini_error(str(create_error))
-                progress.emit(ProgressEvent(
-                    phase=GenerationPhase.FAILED,
-                    message="Machine rejected the profile",
-                    error=friendly_message,
-                ))
-                logger.error(
-                    "Machine profile creation returned error",
+                # Exhausted retries — log and proceed with what we have
+                logger.warning(
+                    "Validation retries exhausted, proceeding with best-effort profile",
                     extra={
                         "request_id": request_id,
-                        "create_error": str(create_error)[:1000],
+                        "final_errors": validation_result.errors[:5],
                     }
                 )
-                return {
-                    "status": "error",
-                    "analysis": coffee_analysis,
-                    "reply": reply,
-                    "generation_id": generation_id,
-                    "message": friendly_message,
-                }
-
-            # ── Phase: Complete ───────────────────────────────────────────
-            has_profile_created_header = bool(
-                re.search(r'(?:\*\*)?Profile Created:(?:\*\*)?', reply, re.IGNORECASE)
-            )
-            if not has_profile_created_header:
-                profile_name = profile_json_check.get("name") if isinstance(profile_json_check, dict) else None
-                if not profile_name:
-                    profile_name = "Untitled Profile"
-                reply = f"**Profile Created:** {profile_name}\n\n{reply}".strip()
+                break
 
-            total_elapsed = time.monotonic() - generation_start
-        
-            logger.info(
-                "Profile creation completed successfully",
+        if not profile_json_check:
+            progress.emit(ProgressEvent(
+                phase=GenerationPhase.FAILED,
+                message="Failed to generate valid profile JSON",
+                error="No valid profile JSON after retries",
+            ))
+            logger.error(
+                "Model reply missing valid profile JSON after retries",
                 extra={
                     "request_id": request_id,
-                    "generation_id": generation_id,
-                    "analysis": coffee_analysis,
-                    "total_seconds": round(total_elapsed, 1),
-                    "output_preview": reply[:200] if len(reply) > 200 else reply
+                    "reply_preview": reply[:500],
                 }
             )
-        
-            # Save to history
+            # Still save to history so user can see what happened
             history_entry = save_to_history(
                 coffee_analysis=coffee_analysis,
                 user_prefs=user_prefs,
                 reply=reply
             )
-
-            progress.emit(ProgressEvent(
-                phase=GenerationPhase.COMPLETE,
-                message="Profile created!",
-                result={"status": "success", "generation_id": generation_id},
-            ))
-            
             return {
-                "status": "success",
+                "status": "error",
                 "analysis": coffee_analysis,
                 "reply": reply,
                 "generation_id": generation_id,
+                "message": (
+                    "The AI attempted to create a profile but encountered "
+                    "validation errors it couldn't resolve. Please try again — "
+                    "the AI will often succeed on a second attempt with a "
+                    "different approach."
+                ),
                 "history_id": history_entry.get("id")
             }
 
-        except asyncio.TimeoutError:
-            progress.emit(ProgressEvent(
-                phase=GenerationPhase.FAILED,
-                message="Profile generation timed out",
-                error="Timed out after 300 seconds",
-            ))
-            logger.error(
-                "Profile generation timed out after 300s",
-                extra={
-                    "request_id": request_id,
-                    "endpoint": "/analyze_and_profile",
-                    "coffee_analysis": coffee_analysis
-                }
-            )
-            raise HTTPException(
-                status_code=504,
-                detail={
-                    "status": "error",
-                    "analysis": coffee_analysis if coffee_analysis else None,
-                    "message": "Profile creation timed out. The AI took too long to respond. Please try again."
-                }
-            )
-        except HTTPException:
-            raise
-        except ValueError as e:
-            progress.emit(ProgressEvent(
-                phase=GenerationPhase.FAILED,
-                message="AI features unavailable",
-                error=str(e),
-            ))
-            logger.warning(
-                f"Profile creation unavailable: {str(e)}",
-                extra={
-                    "request_id": request_id,
-                    "endpoint": "/analyze_and_profile",
-                }
-            )
-            raise HTTPException(
-                status_code=503,
-                detail="AI features are unavailable. Please configure a Gemini API key in Settings."
-            )
-        except Exception as e:
+        # ── Phase: Uploading ──────────────────────────────────────────
+        progress.emit(ProgressEvent(
+            phase=GenerationPhase.UPLOADING,
+            message="Uploading profile to machine..."
+        ))
+
+        create_start = time.monotonic()
+        create_result = await asyncio.wait_for(
+            async_create_profile(profile_json_check),
+            timeout=300
+        )
+        create_elapsed = time.monotonic() - create_start
+
+        logger.info(
+            "Machine profile creation completed",
+            extra={
+                "request_id": request_id,
+                "create_seconds": round(create_elapsed, 1),
+            }
+        )
+
+        create_error = None
+        if isinstance(create_result, dict):
+            create_error = create_result.get("error")
+        else:
+            create_error = getattr(create_result, "error", None)
+
+        if create_error:
+            friendly_message = parse_gemini_error(str(create_error))
             progress.emit(ProgressEvent(
                 phase=GenerationPhase.FAILED,
-                message="Profile creation failed",
-                error=str(e),
+                message="Machine rejected the profile",
+                error=friendly_message,
             ))
             logger.error(
-                f"Profile creation failed: {str(e)}",
-                exc_info=True,
+                "Machine profile creation returned error",
                 extra={
                     "request_id": request_id,
-                    "endpoint": "/analyze_and_profile",
-                    "error_type": type(e).__name__,
-                    "coffee_analysis": coffee_analysis,
-                    "has_image": file is not None,
-                    "has_preferences": user_prefs is not None
-                }
-            )
-            raise HTTPException(
-                status_code=500,
-                detail={
-                    "status": "error",
-                    "analysis": coffee_analysis if coffee_analysis else None,
-                    "message": str(e)
+                    "create_error": str(create_error)[:1000],
                 }
             )
-        finally:
-            # Clean up generation state after a delay to allow SSE clients to read final event
-            async def _cleanup():
-                await asyncio.sleep(30)
-                remove_generation(generation_id)
-            asyncio.create_task(_cleanup())
+            return {
+                "status": "error",
+                "analysis": coffee_analysis,
+                "reply": reply,
+                "generation_id": generation_id,
+                "message": friendly_message,
+            }
+
+        # ── Phase: Complete ───────────────────────────────────────────
+        has_profile_created_header = bool(
+            re.search(r'(?:\*\*)?Profile Created:(?:\*\*)?', reply, re.IGNORECASE)
+        )
+        if not has_profile_created_header:
+            profile_name = profile_json_check.get("name") if isinstance(profile_json_check, dict) else None
+            if not profile_name:
+                profile_name = "Untitled Profile"
+            reply = f"**Profile Created:** {profile_name}\n\n{reply}".strip()
+
+        total_elapsed = time.monotonic() - generation_start
+    
+        logger.info(
+            "Profile creation completed successfully",
+            extra={
+                "request_id": request_id,
+                "generation_id": generation_id,
+                "analysis": coffee_analysis,
+                "total_seconds": round(total_elapsed, 1),
+                "output_preview": reply[:200] if len(reply) > 200 else reply
+            }
+        )
+    
+        # Save to history
+        history_entry = save_to_history(
+            coffee_analysis=coffee_analysis,
+            user_prefs=user_prefs,
+            reply=reply
+        )
+
+        result = {
+            "status": "success",
+            "analysis": coffee_analysis,
+            "reply": reply,
+            "generation_id": generation_id,
+            "history_id": history_entry.get("id")
+        }
+        progress.emit(ProgressEvent(
+            phase=GenerationPhase.COMPLETE,
+            message="Profile created!",
+            result=result,
+        ))
+        
+        return result
+
+    except asyncio.TimeoutError:
+        progress.emit(ProgressEvent(
+            phase=GenerationPhase.FAILED,
+            message="Profile generation timed out",
+            error="Timed out after 300 seconds",
+        ))
+        logger.error(
+            "Profile generation timed out after 300s",
+            extra={
+                "request_id": request_id,
+                "endpoint": "/analyze_and_profile",
+                "coffee_analysis": coffee_analysis
+            }
+        )
+        raise HTTPException(
+            status_code=504,
+            detail={
+                "status": "error",
+                "analysis": coffee_analysis if coffee_analysis else None,
+                "message": "Profile creation timed out. The AI took too long to respond. Please try again."
+            }
+        )
+    except HTTPException:
+        raise
+    except ValueError as e:
+        progress.emit(ProgressEvent(
+            phase=GenerationPhase.FAILED,
+            message="AI features unavailable",
+            error=str(e),
+        ))
+        logger.warning(
+            f"Profile creation unavailable: {str(e)}",
+            extra={
+                "request_id": request_id,
+                "endpoint": "/analyze_and_profile",
+            }
+        )
+        raise HTTPException(
+            status_code=503,
+            detail="AI features are unavailable. Please configure a Gemini API key in Settings."
+        )
+    except Exception as e:
+        progress.emit(ProgressEvent(
+            phase=GenerationPhase.FAILED,
+            message="Profile creation failed",
+            error=str(e),
+        ))
+        logger.error(
+            f"Profile creation failed: {str(e)}",
+            exc_info=True,
+            extra={
+                "request_id": request_id,
+                "endpoint": "/analyze_and_profile",
+                "error_type": type(e).__name__,
+                "coffee_analysis": coffee_analysis,
+                "has_image": image_bytes is not None,
+                "has_preferences": user_prefs is not None
+            }
+        )
+        raise HTTPException(
+            status_code=500,
+            detail={
+                "status": "error",
+                "analysis": coffee_analysis if coffee_analysis else None,
+                "message": str(e)
+            }
+        )
@@ -1,10 +1,20 @@
 """Profile history management endpoints."""
 from fastapi import APIRouter, Request, HTTPException
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, Response
 import json
 import logging
+import time
 
-from services.history_service import load_history, save_history
+from services.blob_store import get_blob
+from services.history_service import (
+    clear_entries,
+    delete_entry,
+    get_entry_by_id,
+    get_history_page,
+    load_history,
+    save_history,
+    search_history,
+)
 from utils.sanitization import clean_profile_name
 
 router = APIRouter()
@@ -35,11 +45,8 @@ async def get_history(
             extra={"request_id": request_id, "limit": limit, "offset": offset}
         )
         
-        history = load_history()
-        total = len(history)
-        
-        # Apply pagination
-        entries = history[offset:offset + limit]
+        # Reads only the requested page when history isn't loaded yet
+        entries, total = get_history_page(offset, limit)
         
         # Remove large fields from list view and ensure required fields exist
         sanitized_entries = []
@@ -71,6 +78,55 @@ async def get_history(
         )
 
 
+@router.get("/api/history/search")
+async def search_history_entries(request: Request, q: str = "", limit: int = 20):
+    """Full-text search over profile history.
+    
+    Matches the profile name, coffee analysis, preferences, notes and the
+    generated profile's fields.
+    
+    Args:
+        q: Search query; every word must match, the last one as a prefix
+        limit: Maximum number of results (default: 20, max: 100)
+    
+    Returns:
+        - results: Matching entries (list view fields) with a relevance score
+        - total: Number of results returned
+        - took_ms: Search time in milliseconds
+    """
+    request_id = request.state.request_id
+    limit = max(1, min(limit, 100))
+    
+    try:
+        start = time.perf_counter()
+        matches = search_history(q, limit)
+        took_ms = (time.perf_counter() - start) * 1000
+        
+        results = []
+        for entry, score in matches:
+            entry_copy = dict(entry)
+            entry_copy.pop("image_preview", None)
+            entry_copy["score"] = round(score, 4)
+            results.append(entry_copy)
+        
+        logger.debug(
+            "Searched profile history",
+            extra={"request_id": request_id, "results": len(results), "took_ms": round(took_ms, 2)}
+        )
+        return {"query": q, "results": results, "total": len(results), "took_ms": round(took_ms, 2)}
+        
+    except Exception as e:
+        logger.error(
+            f"Failed to search history: {str(e)}",
+            exc_info=True,
+            extra={"request_id": request_id, "error_type": type(e).__name__}
+        )
+        raise HTTPException(
+            status_code=500,
+            detail={"status": "error", "error": str(e), "message": "Failed to search history"}
+        )
+
+
 @router.get("/api/history/{entry_id}")
 async def get_history_entry(request: Request, entry_id: str):
     """Get a specific history entry by ID.
@@ -89,17 +145,18 @@ async def get_history_entry(request: Request, entry_id: str):
             extra={"request_id": request_id, "entry_id": entry_id}
         )
         
-        history = load_history()
-        
-        for entry in history:
-            if entry.get("id") == entry_id:
-                # Ensure profile_name is always a string
-                if not entry.get("profile_name"):
-                    pj = entry.get("profile_json")
-                    entry["profile_name"] = pj.get("name", "Untitled Profile") if isinstance(pj, dict) else "Untitled Profile"
-                return entry
+        entry = get_entry_by_id(entry_id)
+        if entry is None:
+            raise HTTPException(status_code=404, detail="History entry not found")
         
-        raise HTTPException(status_code=404, detail="History entry not found")
+        # Ensure profile_name is always a string
+        if not entry.get("profile_name"):
+            pj = entry.get("profile_json")
+            entry = {
+                **entry,
+                "profile_name": pj.get("name", "Untitled Profile") if isinstance(pj, dict) else "Untitled Profile",
+            }
+        return entry
         
     except HTTPException:
         raise
@@ -134,16 +191,9 @@ async def delete_history_entry(request: Request, entry_id: str):
             extra={"request_id": request_id, "entry_id": entry_id}
         )
         
-        history = load_history()
-        original_length = len(history)
-        
-        history = [entry for entry in history if entry.get("id") != entry_id]
-        
-        if len(history) == original_length:
+        if delete_entry(entry_id) is None:
             raise HTTPException(status_code=404, detail="History entry not found")
         
-        save_history(history)
-        
         return {"status": "success", "message": "History entry deleted"}
         
     except HTTPException:
@@ -175,7 +225,7 @@ async def clear_history(request: Request):
             extra={"request_id": request_id}
         )
         
-        save_history([])
+        clear_entries()
         
         return {"status": "success", "message": "All history cleared"}
         
@@ -204,7 +254,7 @@ async def migrate_history_profile_names(request: Request):
     
     try:
         history = load_history()
-        fixed_count = 0
+        fixed_ids = []
         
         for entry in history:
             old_name = entry.get("profile_name", "")
@@ -212,14 +262,15 @@ async def migrate_history_profile_names(request: Request):
             
             if old_name != new_name:
                 entry["profile_name"] = new_name
-                fixed_count += 1
+                fixed_ids.append(entry.get("id"))
                 logger.info(
                     f"Fixed profile name: '{old_name}' -> '{new_name}'",
                     extra={"request_id": request_id}
                 )
         
+        fixed_count = len(fixed_ids)
         if fixed_count > 0:
-            save_history(history)
+            save_history(history, fixed_ids)
         
         logger.info(
             f"Migration complete: {fixed_count} profile names fixed",
@@ -244,6 +295,42 @@ async def migrate_history_profile_names(request: Request):
         )
 
 
+@router.get("/api/history/{entry_id}/preview")
+async def get_history_preview(request: Request, entry_id: str):
+    """Get the image preview of a history entry.
+    
+    Args:
+        entry_id: The unique ID of the history entry
+    
+    Returns:
+        The preview image; immutable, so clients may cache it indefinitely
+    """
+    request_id = request.state.request_id
+    
+    entry = get_entry_by_id(entry_id)
+    if entry is None:
+        raise HTTPException(status_code=404, detail="History entry not found")
+    
+    digest = entry.get("image_preview_hash")
+    data = get_blob(digest) if digest else None
+    if data is None:
+        if digest:
+            logger.warning(
+                "Image preview blob missing",
+                extra={"request_id": request_id, "entry_id": entry_id, "digest": digest}
+            )
+        raise HTTPException(status_code=404, detail="No image preview for this entry")
+    
+    return Response(
+        content=data,
+        media_type=entry.get("image_preview_type") or "image/jpeg",
+        headers={
+            "Cache-Control": "public, max-age=31536000, immutable",
+            "ETag": f'"{digest}"',
+        },
+    )
+
+
 @router.get("/api/history/{entry_id}/json")
 async def get_profile_json(request: Request, entry_id: str):
     """Get the profile JSON for download.
@@ -262,31 +349,29 @@ async def get_profile_json(request: Request, entry_id: str):
             extra={"request_id": request_id, "entry_id": entry_id}
         )
         
-        history = load_history()
+        entry = get_entry_by_id(entry_id)
+        if entry is None:
+            raise HTTPException(status_code=404, detail="History entry not found")
         
-        for entry in history:
-            if entry.get("id") == entry_id:
-                if not entry.get("profile_json"):
-                    raise HTTPException(
-                        status_code=404, 
-                        detail="Profile JSON not available for this entry"
-                    )
-                
-                # Create filename from profile name
-                profile_name = entry.get("profile_name", "profile")
-                safe_filename = "".join(
-                    c if c.isalnum() or c in (' ', '-', '_') else ''
-                    for c in profile_name
-                ).strip().replace(' ', '-').lower()
-                
-                return JSONResponse(
-                    content=entry["profile_json"],
-                    headers={
-                        "Content-Disposition": f'attachment; filename="{safe_filename}.json"'
-                    }
-                )
+        if not entry.get("profile_json"):
+            raise HTTPException(
+                status_code=404, 
+                detail="Profile JSON not available for this entry"
+            )
         
-        raise HTTPException(status_code=404, detail="History entry not found")
+        # Create filename from profile name
+        profile_name = entry.get("profile_name", "profile")
+        safe_filename = "".join(
+            c if c.isalnum() or c in (' ', '-', '_') else ''
+            for c in profile_name
+        ).strip().replace(' ', '-').lower()
+        
+        return JSONResponse(
+            content=entry["profile_json"],
+            headers={
+                "Content-Disposition": f'attachment; filename="{safe_filename}.json"'
+            }
+        )
         
     except HTTPException:
         raise
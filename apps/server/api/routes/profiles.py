@@ -23,9 +23,10 @@ try:
 except ImportError:
     pass  # pillow-heif not installed; HEIC files will fail gracefully
 
-from config import DATA_DIR, MAX_UPLOAD_SIZE
+from config import DATA_DIR, MAX_UPLOAD_SIZE, IMAGE_CACHE_WARMUP_CONCURRENCY
 from services.meticulous_service import (
     async_list_profiles,
+    async_fetch_all_profiles,
     async_get_profile,
     async_save_profile,
     async_create_profile,
@@ -33,7 +34,15 @@ from services.meticulous_service import (
     async_execute_action,
     async_delete_profile,
 )
-from services.cache_service import _get_cached_image, _set_cached_image
+from services.cache_service import (
+    async_get_cached_llm_analysis,
+    async_save_llm_analysis_to_cache,
+    _get_cached_image,
+    _set_cached_image,
+    _get_cached_image_source_hash,
+    _set_cached_image_source_hash,
+    compute_image_source_hash,
+)
 from services.gemini_service import get_vision_model, PROFILING_KNOWLEDGE
 from services.profile_recommendation_service import recommendation_service
 from services.history_service import HISTORY_FILE, load_history, save_history, compute_content_hash, update_entry_sync_fields, get_entry_by_id as _get_entry_by_id
@@ -50,6 +59,13 @@ _history_lock = threading.Lock()
 
 IMAGE_CACHE_DIR = DATA_DIR / "image_cache"
 
+# Image cache warm-up: longest edge of cached thumbnails, startup delay so the
+# warm-up never competes with the first interactive requests, and a pause
+# between fetches to keep it low priority relative to machine control calls.
+IMAGE_WARMUP_THUMBNAIL_SIZE = 512
+IMAGE_WARMUP_STARTUP_DELAY = 15  # seconds
+IMAGE_WARMUP_FETCH_INTERVAL = 0.25  # seconds
+
 # Simple placeholder SVG for profiles without images (coffee bean icon)
 PLACEHOLDER_SVG = b'''<svg xmlns="http://www.w3.org/2000/svg" width="512" height="512" viewBox="0 0 256 256">
 <rect width="256" height="256" fill="#2d2d2d"/>
@@ -714,6 +730,61 @@ async def apply_profile_image(
         )
 
 
+async def _fetch_profile_image(image_path: str) -> tuple[bytes, str]:
+    """Resolve a profile's ``display.image`` reference to image bytes.
+
+    Data URIs are decoded locally; machine paths and absolute URLs are
+    fetched over HTTP (absolute URLs only when they point at the machine).
+
+    Args:
+        image_path: The profile's ``display.image`` value
+
+    Returns:
+        Tuple of (image bytes, media type)
+
+    Raises:
+        HTTPException: If the image cannot be resolved or fetched
+    """
+    if image_path.startswith("data:image/"):
+        mime_type, image_bytes = _parse_data_image_uri(image_path)
+        return image_bytes, mime_type
+
+    if image_path.startswith(("http://", "https://")):
+        image_url = image_path
+        if not _is_allowed_machine_image_url(image_url):
+            raise HTTPException(status_code=400, detail="Profile image URL host is not allowed")
+    else:
+        # Construct full URL to the machine
+        meticulous_ip = os.getenv("METICULOUS_IP")
+        if not meticulous_ip:
+            settings = load_settings()
+            meticulous_ip = settings.get("meticulousIp", "").strip()
+        if not meticulous_ip:
+            raise HTTPException(status_code=500, detail="METICULOUS_IP not configured")
+
+        image_url = f"http://{meticulous_ip}{image_path}"
+
+    # Fetch the image from the machine
+    async with httpx.AsyncClient() as client:
+        response = await client.get(image_url, timeout=10.0)
+
+        if response.status_code != 200:
+            raise HTTPException(
+                status_code=response.status_code,
+                detail="Failed to fetch image from machine"
+            )
+
+        raw_content_type = response.headers.get("content-type") if hasattr(response, "headers") else None
+        if not isinstance(raw_content_type, str):
+            raw_content_type = "image/png"
+
+        media_type = raw_content_type.split(";", 1)[0].strip() or "image/png"
+        if not media_type.startswith("image/"):
+            media_type = "image/png"
+
+        return response.content, media_type
+
+
 @router.get("/api/profile/{profile_name:path}/image-proxy")
 async def proxy_profile_image(
     profile_name: str,
@@ -770,57 +841,16 @@ async def proxy_profile_image(
                     raise HTTPException(status_code=404, detail="Profile has no image")
                 
                 image_path = full_profile.display.image
+                image_bytes, media_type = await _fetch_profile_image(image_path)
 
-                if image_path.startswith("data:image/"):
-                    mime_type, image_bytes = _parse_data_image_uri(image_path)
-
-                    _set_cached_image(profile_name, image_bytes)
-                    return Response(
-                        content=image_bytes,
-                        media_type=mime_type
-                    )
-                
-                if image_path.startswith(("http://", "https://")):
-                    image_url = image_path
-                    if not _is_allowed_machine_image_url(image_url):
-                        raise HTTPException(status_code=400, detail="Profile image URL host is not allowed")
-                else:
-                    # Construct full URL to the machine
-                    meticulous_ip = os.getenv("METICULOUS_IP")
-                    if not meticulous_ip:
-                        settings = load_settings()
-                        meticulous_ip = settings.get("meticulousIp", "").strip()
-                    if not meticulous_ip:
-                        raise HTTPException(status_code=500, detail="METICULOUS_IP not configured")
-
-                    image_url = f"http://{meticulous_ip}{image_path}"
-                
-                # Fetch the image from the machine
-                async with httpx.AsyncClient() as client:
-                    response = await client.get(image_url, timeout=10.0)
-                    
-                    if response.status_code != 200:
-                        raise HTTPException(
-                            status_code=response.status_code,
-                            detail="Failed to fetch image from machine"
-                        )
-                    
-                    raw_content_type = response.headers.get("content-type") if hasattr(response, "headers") else None
-                    if not isinstance(raw_content_type, str):
-                        raw_content_type = "image/png"
-
-                    media_type = raw_content_type.split(";", 1)[0].strip() or "image/png"
-                    if not media_type.startswith("image/"):
-                        media_type = "image/png"
+                # Cache the image for future requests
+                _set_cached_image(profile_name, image_bytes)
+                _set_cached_image_source_hash(profile_name, compute_image_source_hash(image_path))
 
-                    # Cache the image for future requests
-                    _set_cached_image(profile_name, response.content)
-                    
-                    # Return the image with appropriate content type
-                    return Response(
-                        content=response.content,
-                        media_type=media_type
-                    )
+                return Response(
+                    content=image_bytes,
+                    media_type=media_type
+                )
         
         # Profile not found on machine - return placeholder instead of 404
         # This prevents browser console errors for deleted/missing profiles
@@ -865,6 +895,112 @@ async def proxy_profile_image(
         )
 
 
+def _thumbnail_image(image_bytes: bytes) -> bytes:
+    """Downscale an oversized profile image to a cache thumbnail.
+
+    Images already within ``IMAGE_WARMUP_THUMBNAIL_SIZE`` (or that Pillow
+    cannot decode) are returned unchanged so the cache holds exactly what
+    the image proxy would have stored.
+    """
+    from PIL import Image as PILImage
+    import io
+
+    try:
+        img = PILImage.open(io.BytesIO(image_bytes))
+        if max(img.size) <= IMAGE_WARMUP_THUMBNAIL_SIZE:
+            return image_bytes
+        img.thumbnail(
+            (IMAGE_WARMUP_THUMBNAIL_SIZE, IMAGE_WARMUP_THUMBNAIL_SIZE),
+            PILImage.Resampling.LANCZOS,
+        )
+        if img.mode not in ("RGB", "RGBA"):
+            img = img.convert("RGBA")
+        buffer = io.BytesIO()
+        img.save(buffer, format="PNG", optimize=True)
+        return buffer.getvalue()
+    except Exception as e:
+        logger.debug(f"Could not thumbnail profile image, caching original: {e}")
+        return image_bytes
+
+
+async def warm_profile_image_cache(
+    concurrency: int = IMAGE_CACHE_WARMUP_CONCURRENCY,
+    fetch_interval: float = IMAGE_WARMUP_FETCH_INTERVAL,
+) -> dict:
+    """Prefetch and thumbnail every machine profile image into the image cache.
+
+    Uses a single ``async_fetch_all_profiles`` call instead of the
+    list + get round-trips the image proxy makes per profile. Images whose
+    cached copy was produced from the same ``display.image`` reference
+    (matching content hash) are skipped.
+
+    Args:
+        concurrency: Maximum number of images fetched at once
+        fetch_interval: Pause after each fetch, keeping the warm-up low priority
+
+    Returns:
+        Counts of fetched, skipped and failed images
+    """
+    stats = {"fetched": 0, "skipped": 0, "failed": 0}
+    profiles = await async_fetch_all_profiles()
+    if hasattr(profiles, 'error') and profiles.error:
+        logger.warning(f"Image cache warm-up skipped: machine API error: {profiles.error}")
+        return stats
+
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+
+    async def _warm_one(profile) -> None:
+        profile_name = getattr(profile, "name", None)
+        display = getattr(profile, "display", None)
+        image_ref = getattr(display, "image", None) if display else None
+        # pyMeticulous may parse display.image as a pydantic URL object
+        image_path = str(image_ref) if image_ref else ""
+        if not profile_name or not image_path:
+            return
+        if is_temp_profile(profile_name):
+            return
+
+        source_hash = compute_image_source_hash(image_path)
+        if (
+            _get_cached_image_source_hash(profile_name) == source_hash
+            and _get_cached_image(profile_name) is not None
+        ):
+            stats["skipped"] += 1
+            return
+
+        async with semaphore:
+            try:
+                image_bytes, _media_type = await _fetch_profile_image(image_path)
+                image_bytes = await asyncio.to_thread(_thumbnail_image, image_bytes)
+                _set_cached_image(profile_name, image_bytes)
+                _set_cached_image_source_hash(profile_name, source_hash)
+                stats["fetched"] += 1
+            except Exception as e:
+                stats["failed"] += 1
+                logger.debug(f"Image cache warm-up failed for {profile_name}: {e}")
+            if fetch_interval > 0:
+                await asyncio.sleep(fetch_interval)
+
+    await asyncio.gather(*(_warm_one(profile) for profile in profiles))
+    logger.info(
+        "Image cache warm-up complete: %d fetched, %d already cached, %d failed",
+        stats["fetched"], stats["skipped"], stats["failed"],
+        extra=stats,
+    )
+    return stats
+
+
+async def image_cache_warmup_task(delay: float = IMAGE_WARMUP_STARTUP_DELAY):
+    """Background task: warm the profile image cache shortly after startup."""
+    await asyncio.sleep(delay)
+    try:
+        await warm_profile_image_cache()
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        logger.warning(f"Image cache warm-up failed: {e}")
+
+
 @router.get("/api/profile/{profile_name:path}/target-curves")
 async def get_profile_target_curves(
     profile_name: str,
@@ -1140,13 +1276,14 @@ async def edit_profile(profile_name: str, request: Request):
         if new_name is not None and new_name != old_name:
             with _history_lock:
                 history = load_history()
-                updated = 0
+                renamed_ids = []
                 for entry in history:
                     if entry.get("profile_name") == old_name:
                         entry["profile_name"] = new_name
-                        updated += 1
+                        renamed_ids.append(entry.get("id"))
+                updated = len(renamed_ids)
                 if updated:
-                    save_history(history)
+                    save_history(history, renamed_ids)
             if updated:
                 logger.info(
                     f"Updated {updated} history entries from '{old_name}' to '{new_name}'",
@@ -1358,7 +1495,7 @@ async def get_llm_analysis_cache(
         }
     )
     
-    cached = get_cached_llm_analysis(profile_name, shot_date, shot_filename)
+    cached = await async_get_cached_llm_analysis(profile_name, shot_date, shot_filename)
     
     if cached:
         logger.info(
@@ -1423,7 +1560,7 @@ async def analyze_shot_with_llm(
         
         # Check cache first (unless force refresh)
         if not force_refresh:
-            cached_analysis = get_cached_llm_analysis(profile_name, shot_date, shot_filename)
+            cached_analysis = await async_get_cached_llm_analysis(profile_name, shot_date, shot_filename)
             if cached_analysis:
                 logger.info(
                     "Returning cached LLM analysis",
@@ -1604,7 +1741,7 @@ Focus on actionable insights. Be specific with numbers where possible (e.g., "gr
         llm_analysis = response.text if response else "Analysis generation failed"
         
         # Save to cache
-        save_llm_analysis_to_cache(profile_name, shot_date, shot_filename, llm_analysis)
+        await async_save_llm_analysis_to_cache(profile_name, shot_date, shot_filename, llm_analysis)
         
         logger.info(
             "LLM shot analysis completed and cached",
@@ -2219,7 +2356,7 @@ async def import_profile(request: Request):
             
             history.insert(0, new_entry)
             
-            save_history(history)
+            save_history(history, [entry_id])
         
         # Upload profile to the Meticulous machine when imported from a file.
         # Profiles imported from the machine (source="machine") already exist there.
@@ -2399,7 +2536,7 @@ async def import_all_profiles(request: Request):
                         
                         history.insert(0, new_entry)
                         
-                        save_history(history)
+                        save_history(history, [entry_id])
                     
                     imported.append(profile_name)
                     
@@ -2935,7 +3072,7 @@ async def auto_sync_profiles(request: Request):
                     if not isinstance(history, list):
                         history = history.get("entries", [])
                     history.insert(0, new_entry)
-                    save_history(history)
+                    save_history(history, [entry_id])
                     imported.append(profile_name)
                 except Exception as exc:
                     logger.warning(
@@ -3155,7 +3292,7 @@ Remember: NO information should be lost in this conversion!"""
                         entry["reply"] = converted_description
                         entry["description_converted"] = True
                         break
-                save_history(history)
+                save_history(history, [entry_id])
         
         logger.info(
             f"Description converted successfully for: {profile_name}",
@@ -3223,7 +3360,7 @@ async def regenerate_profile_description(entry_id: str, request: Request):
             )
 
         target_entry["reply"] = new_description
-        save_history(history)
+        save_history(history, [entry_id])
 
         logger.info(
             f"AI description regenerated for: {profile_name}",
@@ -16,10 +16,13 @@ from services.meticulous_service import (
     MachineUnreachableError,
 )
 from services.cache_service import (
-    get_cached_llm_analysis, save_llm_analysis_to_cache,
+    async_get_cached_llm_analysis, async_save_llm_analysis_to_cache,
     _get_cached_shots, _set_cached_shots
 )
-from services.analysis_service import _perform_local_shot_analysis
+from services.analysis_service import _perform_local_shot_analysis, _profile_to_analysis_data
+from services.shot_recorder import (
+    get_latest_live_shot, live_shot_to_shot_data, reconcile_live_shot,
+)
 from services.gemini_service import get_vision_model, PROFILING_KNOWLEDGE, compute_taste_hash
 from prompt_builder import build_taste_context
 
@@ -35,6 +38,30 @@ def _safe_float(val, default=0.0):
         return default
 
 
+async def _find_latest_machine_shot():
+    """Return ``(date, filename, shot_data)`` of the machine's newest shot, or None."""
+    dates_result = await async_get_history_dates()
+    if hasattr(dates_result, "error") and dates_result.error:
+        raise HTTPException(status_code=502, detail=f"Machine API error: {dates_result.error}")
+
+    dates = sorted([d.name for d in dates_result], reverse=True) if dates_result else []
+
+    # Walk dates newest-first until we find a file
+    for date in dates:
+        files_result = await async_get_shot_files(date)
+        if hasattr(files_result, "error") and files_result.error:
+            continue
+        files = sorted([f.name for f in files_result], reverse=True) if files_result else []
+        if not files:
+            continue
+
+        filename = files[0]
+        shot_data = await fetch_shot_data(date, filename)
+        return date, filename, shot_data
+
+    return None
+
+
 @router.get("/api/last-shot")
 async def get_last_shot(request: Request):
     """Return metadata for the most recent shot without loading full telemetry.
@@ -44,49 +71,33 @@ async def get_last_shot(request: Request):
     """
     request_id = request.state.request_id
     try:
-        dates_result = await async_get_history_dates()
-        if hasattr(dates_result, "error") and dates_result.error:
-            raise HTTPException(status_code=502, detail=f"Machine API error: {dates_result.error}")
-
-        dates = sorted([d.name for d in dates_result], reverse=True) if dates_result else []
-        if not dates:
+        latest = await _find_latest_machine_shot()
+        if latest is None:
             raise HTTPException(status_code=404, detail="No shots found")
+        date, filename, shot_data = latest
+        reconcile_live_shot(shot_data, date, filename)
+
+        profile_name = shot_data.get("profile_name", "")
+        if not profile_name and isinstance(shot_data.get("profile"), dict):
+            profile_name = shot_data["profile"].get("name", "")
+
+        data_entries = shot_data.get("data", [])
+        final_weight = None
+        total_time_ms = None
+        if data_entries:
+            last_entry = data_entries[-1]
+            if isinstance(last_entry.get("shot"), dict):
+                final_weight = last_entry["shot"].get("weight")
+            total_time_ms = last_entry.get("time")
 
-        # Walk dates newest-first until we find a file
-        for date in dates:
-            files_result = await async_get_shot_files(date)
-            if hasattr(files_result, "error") and files_result.error:
-                continue
-            files = sorted([f.name for f in files_result], reverse=True) if files_result else []
-            if not files:
-                continue
-
-            filename = files[0]
-            shot_data = await fetch_shot_data(date, filename)
-
-            profile_name = shot_data.get("profile_name", "")
-            if not profile_name and isinstance(shot_data.get("profile"), dict):
-                profile_name = shot_data["profile"].get("name", "")
-
-            data_entries = shot_data.get("data", [])
-            final_weight = None
-            total_time_ms = None
-            if data_entries:
-                last_entry = data_entries[-1]
-                if isinstance(last_entry.get("shot"), dict):
-                    final_weight = last_entry["shot"].get("weight")
-                total_time_ms = last_entry.get("time")
-
-            return {
-                "profile_name": profile_name,
-                "date": date,
-                "filename": filename,
-                "timestamp": shot_data.get("time"),
-                "final_weight": final_weight,
-                "total_time": total_time_ms / 1000 if total_time_ms else None,
-            }
-
-        raise HTTPException(status_code=404, detail="No shots found")
+        return {
+            "profile_name": profile_name,
+            "date": date,
+            "filename": filename,
+            "timestamp": shot_data.get("time"),
+            "final_weight": final_weight,
+            "total_time": total_time_ms / 1000 if total_time_ms else None,
+        }
 
     except MachineUnreachableError:
         raise
@@ -113,6 +124,51 @@ async def get_last_shot(request: Request):
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@router.get("/api/shots/live/latest")
+async def get_latest_live_shot_record(
+    request: Request,
+    as_shot: bool = False,
+    reconcile: bool = False,
+):
+    """Return the most recent shot recorded from live MQTT telemetry.
+
+    Available as soon as brewing stops, before the machine has written
+    its own history file.  Once that file exists the record is linked to
+    it (``machine``: date/filename, ``reconciled``: true).
+
+    Args:
+        as_shot: Return ``shot_data`` in the machine's shot file layout
+            (as used by the analysis endpoints) instead of the columns
+        reconcile: Look up the machine's newest shot file to reconcile an
+            unreconciled record (default: false, so polling does not query
+            the machine; skipped while unreachable)
+
+    Returns 404 if no shot has been recorded yet.
+    """
+    request_id = request.state.request_id
+    record = get_latest_live_shot()
+    if record is None:
+        raise HTTPException(status_code=404, detail="No live shot recorded")
+
+    if reconcile and not record.get("reconciled"):
+        try:
+            latest = await _find_latest_machine_shot()
+            if latest is not None:
+                date, filename, shot_data = latest
+                record = reconcile_live_shot(shot_data, date, filename) or record
+        except Exception as e:
+            logger.debug(
+                f"Live shot not reconciled: {e}",
+                extra={"request_id": request_id, "error_type": type(e).__name__},
+            )
+
+    if as_shot:
+        result = {k: v for k, v in record.items() if k not in ("columns", "stages")}
+        result["shot_data"] = live_shot_to_shot_data(record)
+        return result
+    return record
+
+
 def _prepare_profile_for_llm(profile_data: dict, description: str | None) -> dict:
     """Prepare profile data for LLM, removing image and limiting description."""
     # Build clean profile without image
@@ -498,62 +554,7 @@ async def analyze_shot(
                 logger.debug(f"Found matching profile: {partial_profile.name} (id={partial_profile.id})")
                 full_profile = await async_get_profile(partial_profile.id)
                 if not (hasattr(full_profile, 'error') and full_profile.error):
-                    # Convert profile object to dict
-                    profile_data = {
-                        "name": full_profile.name,
-                        "temperature": getattr(full_profile, 'temperature', None),
-                        "final_weight": getattr(full_profile, 'final_weight', None),
-                        "variables": [],
-                        "stages": []
-                    }
-                    
-                    # Extract variables if present
-                    if hasattr(full_profile, 'variables') and full_profile.variables:
-                        for var in full_profile.variables:
-                            var_dict = {
-                                "key": getattr(var, 'key', ''),
-                                "name": getattr(var, 'name', ''),
-                                "type": getattr(var, 'type', ''),
-                                "value": getattr(var, 'value', 0)
-                            }
-                            profile_data["variables"].append(var_dict)
-                    
-                    # Extract full stage data including dynamics and triggers
-                    if hasattr(full_profile, 'stages') and full_profile.stages:
-                        for stage in full_profile.stages:
-                            stage_dict = {
-                                "name": getattr(stage, 'name', 'Unknown'),
-                                "key": getattr(stage, 'key', ''),
-                                "type": getattr(stage, 'type', 'unknown'),
-                            }
-                            # Add dynamics - handle both direct attributes and dynamics object
-                            if hasattr(stage, 'dynamics') and stage.dynamics is not None:
-                                dynamics = stage.dynamics
-                                if hasattr(dynamics, 'points') and dynamics.points:
-                                    stage_dict['dynamics_points'] = dynamics.points
-                                if hasattr(dynamics, 'over'):
-                                    stage_dict['dynamics_over'] = dynamics.over
-                                if hasattr(dynamics, 'interpolation'):
-                                    stage_dict['dynamics_interpolation'] = dynamics.interpolation
-                            else:
-                                # Fallback: check for direct attributes
-                                for attr in ['dynamics_points', 'dynamics_over', 'dynamics_interpolation']:
-                                    val = getattr(stage, attr, None)
-                                    if val is not None:
-                                        stage_dict[attr] = val
-                            # Add exit triggers and limits
-                            for attr in ['exit_triggers', 'limits']:
-                                val = getattr(stage, attr, None)
-                                if val is not None:
-                                    # Convert to list of dicts if needed
-                                    if isinstance(val, list):
-                                        stage_dict[attr] = [
-                                            dict(item) if hasattr(item, '__dict__') else item
-                                            for item in val
-                                        ]
-                                    else:
-                                        stage_dict[attr] = val
-                            profile_data["stages"].append(stage_dict)
+                    profile_data = _profile_to_analysis_data(full_profile)
                 break
         
         if not profile_data:
@@ -628,7 +629,7 @@ async def get_llm_analysis_cache(
         }
     )
     
-    cached = get_cached_llm_analysis(profile_name, shot_date, shot_filename)
+    cached = await async_get_cached_llm_analysis(profile_name, shot_date, shot_filename)
     
     if cached:
         logger.info(
@@ -720,7 +721,7 @@ async def analyze_shot_with_llm(
         
         # Check cache first (unless force refresh)
         if not force_refresh:
-            cached_analysis = get_cached_llm_analysis(profile_name, shot_date, cache_filename)
+            cached_analysis = await async_get_cached_llm_analysis(profile_name, shot_date, cache_filename)
             if cached_analysis:
                 logger.info(
                     "Returning cached LLM analysis",
@@ -959,7 +960,7 @@ Rules for recommendations:
         llm_analysis = response.text if response else "Analysis generation failed"
         
         # Save to cache
-        save_llm_analysis_to_cache(profile_name, shot_date, cache_filename, llm_analysis)
+        await async_save_llm_analysis_to_cache(profile_name, shot_date, cache_filename, llm_analysis)
         
         logger.info(
             "LLM shot analysis completed and cached",
@@ -1415,13 +1416,13 @@ async def analyze_recommendations(
 
         # Try to find existing cached analysis for any date
         # We search the cache by profile + filename
-        from services.cache_service import get_cached_llm_analysis
+        from services.cache_service import async_get_cached_llm_analysis
 
         # Derive shot_date from filename (format: YYYY-MM-DDTHH:MM:SS.json typically)
         shot_date_match = re.match(r"(\d{4}-\d{2}-\d{2})", shot_filename)
         shot_date = shot_date_match.group(1) if shot_date_match else ""
 
-        cached_analysis = get_cached_llm_analysis(profile_name, shot_date, shot_filename)
+        cached_analysis = await async_get_cached_llm_analysis(profile_name, shot_date, shot_filename)
 
         if not cached_analysis:
             raise HTTPException(
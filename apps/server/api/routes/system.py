@@ -24,6 +24,21 @@ async def health_check():
     return {"status": "ok"}
 
 
+@router.get("/api/llm/metrics")
+async def llm_metrics():
+    """Report Gemini call latency, queue wait, in-flight counts and prompt cache use."""
+    from services.gemini_service import get_llm_call_metrics
+    from services.prompt_cache_service import get_prompt_cache
+    return {**get_llm_call_metrics(), "prompt_cache": get_prompt_cache().snapshot()}
+
+
+@router.get("/api/persistence/metrics")
+async def persistence_metrics():
+    """Report coalesced state writes and flush latency."""
+    from services.persistence_service import get_persistence
+    return get_persistence().metrics()
+
+
 # Data directory configuration
 TEST_MODE = os.environ.get("TEST_MODE") == "true"
 if TEST_MODE:
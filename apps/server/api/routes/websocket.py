@@ -1,117 +1,184 @@
 """WebSocket endpoint for live machine telemetry.
 
 Streams the latest MQTT sensor snapshot to connected browser clients
-at a capped rate of ~10 frames per second to protect low-powered hosts
-(e.g. Raspberry Pi).
+at a capped rate (10 frames per second by default, adapted per client
+between 1 and 20) to protect low-powered hosts (e.g. Raspberry Pi) and
+slow links.  Frames are built and serialized once by the subscriber's
+TelemetryBroadcaster; each connection only forwards them.
 
-Route: ws://host:3550/api/ws/live
+Route: ws://host:3550/api/ws/live[?mode=delta][&format=msgpack|cbor][&quantize=1][&fps=N][&backfill=S]
 """
 
 import asyncio
+import json
 import logging
 import os
 import time
-from fastapi import APIRouter, WebSocket, WebSocketDisconnect
+from typing import Optional
+
+from fastapi import APIRouter, Query, WebSocket, WebSocketDisconnect
 
 from services.mqtt_service import get_mqtt_subscriber
+from services.telemetry_broadcaster import DEFAULT_FPS, TelemetryClient
+from services.telemetry_frames import (
+    FORMAT_JSON,
+    FORMATS,
+    MODE_FULL,
+    MODES,
+    TelemetryFrameEncoder,
+    available_formats,
+    serialize_frame,
+)
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
 
-# Max update rate — 10 FPS → 100 ms between frames
-FRAME_INTERVAL = 0.1  # seconds
-
 TEST_MODE = os.environ.get("TEST_MODE") == "true"
 
+# Max samples per sensor in a connect-time backfill frame
+BACKFILL_MAX_POINTS = 600
+
+
+async def _send_payload(ws: WebSocket, payload) -> None:
+    """Send a serialized frame as a binary or text message."""
+    if isinstance(payload, bytes):
+        await ws.send_bytes(payload)
+    else:
+        await ws.send_text(payload)
+
+
+async def _send_frames(ws: WebSocket, client: TelemetryClient) -> None:
+    """Forward queued frames until the broadcaster closes the client."""
+    while True:
+        payload = await client.get()
+        if payload is None:
+            return
+        started = time.perf_counter()
+        await _send_payload(ws, payload)
+        client.record_send(time.perf_counter() - started)
+
+
+def _apply_control(client: TelemetryClient, text: str) -> None:
+    """Apply a client control message (``{"fps": n}`` / ``{"keyframe": true}``)."""
+    try:
+        message = json.loads(text)
+    except ValueError:
+        return
+    if not isinstance(message, dict):
+        return
+    if "fps" in message:
+        client.request_fps(message["fps"])
+    if message.get("keyframe"):
+        client.needs_keyframe = True
+
+
+async def _wait_for_close(ws: WebSocket, client: Optional[TelemetryClient] = None) -> None:
+    """Consume client messages until the socket closes."""
+    while True:
+        message = await ws.receive()
+        if message.get("type") == "websocket.disconnect":
+            return
+        if client is not None and message.get("text"):
+            _apply_control(client, message["text"])
+
 
 @router.websocket("/api/ws/live")
-async def live_telemetry(ws: WebSocket):
+async def live_telemetry(
+    ws: WebSocket,
+    mode: str = MODE_FULL,
+    fmt: str = Query(FORMAT_JSON, alias="format"),
+    quantize: bool = False,
+    fps: float = DEFAULT_FPS,
+    backfill: float = 0,
+):
     """Stream live machine telemetry over WebSocket.
 
     Protocol (server → client):
-      Each message is a JSON object with the full sensor snapshot,
-      plus a ``_ts`` field (Unix epoch float) for client-side staleness
-      detection.
-
-    The server rate-limits to ~10 FPS. If no new data arrives from MQTT
-    the connection stays open but silent (no empty keepalives).
+      Each message is a JSON object with a ``_ts`` field (Unix epoch
+      float) for client-side staleness detection.  With ``mode=full``
+      (default) it carries the full sensor snapshot; with ``mode=delta``
+      a keyframe (``_kf: true``) is followed by frames holding only the
+      changed keys — see :mod:`services.telemetry_frames`.  Unknown modes
+      fall back to ``full``.
+
+      ``format=msgpack`` / ``format=cbor`` send the same frames as binary
+      messages, and ``quantize=1`` sends float sensors as fixed-point
+      integers.  A binary format whose package is not installed closes
+      the socket with code 1003.
+
+      ``backfill=S`` sends the last *S* seconds of buffered sensor
+      history first, as one ``{"_backfill": {"t0": ..., "sensors":
+      {name: {"t": [offsets], "v": [values]}}}}`` frame, so a client
+      joining mid-shot can draw the curve so far.
+
+    During a shot, ``{"_analysis": {...}}`` frames carry the live analysis
+    events (see :mod:`services.live_analysis`), ending with the
+    ``verdict`` when brewing stops.  They are never dropped, even for a
+    client that falls behind.
+
+    The server rate-limits to ``fps`` frames per second (default 10,
+    at most 20) and lowers a client's rate while it can't keep up.  The
+    client may send ``{"fps": n}`` to change its rate and
+    ``{"keyframe": true}`` to ask for a resync.  If no new data arrives
+    from MQTT for 5 s a ``_heartbeat`` frame is sent instead.
     """
     await ws.accept()
 
+    fmt = fmt if fmt in FORMATS else FORMAT_JSON
+    if fmt not in available_formats():
+        logger.warning("WebSocket telemetry format %s unavailable (package not installed)", fmt)
+        await ws.close(code=1003, reason=f"{fmt} encoding not available")
+        return
+
     # Fetch subscriber fresh each time — survives MQTT hot-reload/reset
     subscriber = get_mqtt_subscriber()
     ws_id = id(ws)
     subscriber.register_ws(ws_id)
+    mode = mode if mode in MODES else MODE_FULL
 
-    logger.info("WebSocket client connected (id=%d, total=%d)",
-                ws_id, subscriber.ws_client_count)
+    logger.info("WebSocket client connected (id=%d, mode=%s, format=%s, fps=%s, total=%d)",
+                ws_id, mode, fmt, fps, subscriber.ws_client_count)
 
+    client = None
+    tasks = []
     try:
-        last_sent: dict = {}
-
-        # Send the current MQTT snapshot immediately so the browser
-        # does not have to wait for the next MQTT delta.
-        initial = subscriber.get_snapshot()
-        if initial:
-            initial["_ts"] = time.time()
-            try:
-                await ws.send_json(initial)
-                last_sent = {k: v for k, v in initial.items() if k != "_ts"}
-            except Exception:
-                return  # Client already gone
-
-        while True:
-            # Re-fetch subscriber to survive hot-reloads (reset_mqtt_subscriber)
-            subscriber = get_mqtt_subscriber()
-
-            # In TEST_MODE there's no MQTT data — just wait for the
-            # client to close.  We use receive_text() which will raise
-            # WebSocketDisconnect when the client closes the socket.
-            if TEST_MODE or subscriber.data_event is None:
-                try:
-                    await asyncio.wait_for(ws.receive_text(), timeout=1.0)
-                except asyncio.TimeoutError:
-                    continue
-                except WebSocketDisconnect:
-                    break
-                continue
-
-            # Clear the event *before* waiting so that any signal arriving
-            # between wait() returning and the next iteration is not lost.
-            subscriber.data_event.clear()
-
-            # Wait for new data from the MQTT thread (or timeout)
-            try:
-                await asyncio.wait_for(subscriber.data_event.wait(), timeout=5.0)
-            except asyncio.TimeoutError:
-                # No data in 5 s — send a heartbeat so the browser knows
-                # the connection is still alive
-                try:
-                    await ws.send_json({"_heartbeat": True, "_ts": time.time()})
-                except Exception:
-                    break
-                continue
-
-            # Rate-limit: sleep until at least FRAME_INTERVAL since last send
-            snapshot = subscriber.get_snapshot()
-            if snapshot == last_sent:
-                continue  # No actual change
-
-            await asyncio.sleep(FRAME_INTERVAL)
-
-            snapshot["_ts"] = time.time()
-            try:
-                await ws.send_json(snapshot)
-            except Exception:
-                break
-
-            last_sent = {k: v for k, v in snapshot.items() if k != "_ts"}
+        if backfill > 0:
+            history = subscriber.buffer.backfill(backfill, max_points=BACKFILL_MAX_POINTS)
+            if history["sensors"]:
+                frame = {"_backfill": history, "_ts": time.time()}
+                await _send_payload(ws, serialize_frame(frame, fmt))
+
+        # In TEST_MODE (or with MQTT disabled) there's no MQTT data — send
+        # the current snapshot, then just wait for the client to close.
+        if TEST_MODE or subscriber.data_event is None:
+            initial = subscriber.get_snapshot()
+            if initial:
+                frame = TelemetryFrameEncoder(mode).encode(initial)
+                await _send_payload(ws, serialize_frame(frame, fmt, quantize))
+            await _wait_for_close(ws)
+            return
+
+        client = subscriber.broadcaster.add_client(mode, fmt=fmt, quantize=quantize, fps=fps)
+        tasks = [
+            asyncio.create_task(_send_frames(ws, client)),
+            asyncio.create_task(_wait_for_close(ws, client)),
+        ]
+        # Whichever ends first (broadcaster closed us, send failed, or the
+        # client went away) ends the connection
+        done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            if not task.cancelled() and task.exception() is not None:
+                raise task.exception()
 
     except WebSocketDisconnect:
         pass
     except Exception as exc:
         logger.warning("WebSocket error: %s", exc)
     finally:
+        for task in tasks:
+            task.cancel()
+        if client is not None:
+            subscriber.broadcaster.remove_client(client)
         subscriber.unregister_ws(ws_id)
         logger.info("WebSocket client disconnected (id=%d, remaining=%d)",
                     ws_id, subscriber.ws_client_count)
@@ -22,7 +22,22 @@ Attributes:
     UPDATE_CHECK_INTERVAL: Seconds between update checks (default: 7200 = 2 hours)
     MAX_UPLOAD_SIZE: Maximum file upload size in bytes (default: 10 MB)
     LLM_CACHE_TTL_SECONDS: TTL for LLM analysis cache (default: 259200 = 3 days)
+    LLM_CACHE_MAX_ENTRIES: Max LLM analyses kept before LRU eviction (default: 2000)
     SHOT_CACHE_STALE_SECONDS: Staleness threshold for shot cache (default: 3600 = 1 hour)
+    BAG_ANALYSIS_CACHE_MAX_ENTRIES: Coffee bag analyses kept in the photo cache (default: 200)
+    BAG_ANALYSIS_HASH_THRESHOLD: Max perceptual-hash bit distance for a bag photo cache hit (default: 0 = exact hash)
+    IMAGE_CACHE_WARMUP: Prefetch profile images into the image cache at startup (default: on)
+    IMAGE_CACHE_WARMUP_CONCURRENCY: Max concurrent image fetches during warm-up (default: 2)
+    LLM_MAX_CONCURRENCY: Max concurrent Gemini API calls (default: 4)
+    GENERATION_MAX_CONCURRENCY: Profile generations run in parallel (default: 1)
+    GENERATION_MAX_QUEUE: Profile generations allowed to wait for a slot (default: 8)
+    STORAGE_BACKEND: Where persistent state is stored, "sqlite" or "json" (default: sqlite)
+    PERSIST_FLUSH_INTERVAL_MS: Max delay before changed state is written to storage (default: 500)
+    HISTORY_MAX_ENTRIES: Profile history entries kept, oldest dropped first; 0 keeps all (default: 0)
+    TELEMETRY_BUFFER_SECONDS: Seconds of live telemetry kept in memory (default: 600)
+    TELEMETRY_BUFFER_HZ: Max samples per second kept per sensor in that buffer (default: 10)
+    PROMPT_CACHE_BACKEND: Context cache for the static prompt prefix, "gemini" or "off" (default: gemini)
+    PROMPT_CACHE_TTL_SECONDS: Lifetime of a cached prompt prefix (default: 3600)
     VERSION_PATTERN: Compiled regex for version extraction
     STAGE_STATUS_RETRACTING: Constant for stage status
 
@@ -67,7 +82,34 @@ class Config:
     
     # Cache Settings
     LLM_CACHE_TTL_SECONDS = 259200  # 3 days (72 hours)
+    LLM_CACHE_MAX_ENTRIES = max(1, int(os.environ.get("LLM_CACHE_MAX_ENTRIES", "2000") or 2000))
     SHOT_CACHE_STALE_SECONDS = 3600  # 1 hour
+    BAG_ANALYSIS_CACHE_MAX_ENTRIES = max(1, int(os.environ.get("BAG_ANALYSIS_CACHE_MAX_ENTRIES", "200") or 200))
+    BAG_ANALYSIS_HASH_THRESHOLD = max(0, int(os.environ.get("BAG_ANALYSIS_HASH_THRESHOLD", "0") or 0))
+    
+    # Image Cache Warm-up (background prefetch of profile images at startup)
+    IMAGE_CACHE_WARMUP = os.environ.get("IMAGE_CACHE_WARMUP", "true").strip().lower() not in ("0", "false", "no", "off")
+    IMAGE_CACHE_WARMUP_CONCURRENCY = max(1, int(os.environ.get("IMAGE_CACHE_WARMUP_CONCURRENCY", "2") or 2))
+    
+    # LLM Calls (bounded concurrency for Gemini API requests)
+    LLM_MAX_CONCURRENCY = max(1, int(os.environ.get("LLM_MAX_CONCURRENCY", "4") or 4))
+    
+    # Profile Generation Queue (parallel jobs and waiting-room size)
+    GENERATION_MAX_CONCURRENCY = max(1, int(os.environ.get("GENERATION_MAX_CONCURRENCY", "1") or 1))
+    GENERATION_MAX_QUEUE = max(0, int(os.environ.get("GENERATION_MAX_QUEUE", "8") or 8))
+    
+    # Persistence (SQLite database or per-service JSON files; coalesced writes)
+    STORAGE_BACKEND = "json" if os.environ.get("STORAGE_BACKEND", "sqlite").strip().lower() == "json" else "sqlite"
+    PERSIST_FLUSH_INTERVAL_MS = max(0, int(os.environ.get("PERSIST_FLUSH_INTERVAL_MS", "500") or 500))
+    HISTORY_MAX_ENTRIES = max(0, int(os.environ.get("HISTORY_MAX_ENTRIES", "0") or 0))
+    
+    # Live telemetry history (fixed-size in-memory ring buffer)
+    TELEMETRY_BUFFER_SECONDS = max(10, int(os.environ.get("TELEMETRY_BUFFER_SECONDS", "600") or 600))
+    TELEMETRY_BUFFER_HZ = max(1, int(os.environ.get("TELEMETRY_BUFFER_HZ", "10") or 10))
+    
+    # Prompt Context Cache (static persona/guidelines/knowledge prefix)
+    PROMPT_CACHE_BACKEND = os.environ.get("PROMPT_CACHE_BACKEND", "gemini").strip().lower()
+    PROMPT_CACHE_TTL_SECONDS = max(300, int(os.environ.get("PROMPT_CACHE_TTL_SECONDS", "3600") or 3600))
     
     # Stage Status Constants
     STAGE_STATUS_RETRACTING = "retracting"
@@ -91,4 +133,19 @@ MAX_UPLOAD_SIZE = config.MAX_UPLOAD_SIZE
 VERSION_PATTERN = config.VERSION_PATTERN
 STAGE_STATUS_RETRACTING = config.STAGE_STATUS_RETRACTING
 LLM_CACHE_TTL_SECONDS = config.LLM_CACHE_TTL_SECONDS
-SHOT_CACHE_STALE_SECONDS = config.SHOT_CACHE_STALE_SECONDS
\ No newline at end of file
+LLM_CACHE_MAX_ENTRIES = config.LLM_CACHE_MAX_ENTRIES
+SHOT_CACHE_STALE_SECONDS = config.SHOT_CACHE_STALE_SECONDS
+BAG_ANALYSIS_CACHE_MAX_ENTRIES = config.BAG_ANALYSIS_CACHE_MAX_ENTRIES
+BAG_ANALYSIS_HASH_THRESHOLD = config.BAG_ANALYSIS_HASH_THRESHOLD
+IMAGE_CACHE_WARMUP = config.IMAGE_CACHE_WARMUP
+IMAGE_CACHE_WARMUP_CONCURRENCY = config.IMAGE_CACHE_WARMUP_CONCURRENCY
+LLM_MAX_CONCURRENCY = config.LLM_MAX_CONCURRENCY
+GENERATION_MAX_CONCURRENCY = config.GENERATION_MAX_CONCURRENCY
+GENERATION_MAX_QUEUE = config.GENERATION_MAX_QUEUE
+PROMPT_CACHE_BACKEND = config.PROMPT_CACHE_BACKEND
+PROMPT_CACHE_TTL_SECONDS = config.PROMPT_CACHE_TTL_SECONDS
+PERSIST_FLUSH_INTERVAL_MS = config.PERSIST_FLUSH_INTERVAL_MS
+STORAGE_BACKEND = config.STORAGE_BACKEND
+HISTORY_MAX_ENTRIES = config.HISTORY_MAX_ENTRIES
+TELEMETRY_BUFFER_SECONDS = config.TELEMETRY_BUFFER_SECONDS
+TELEMETRY_BUFFER_HZ = config.TELEMETRY_BUFFER_HZ
\ No newline at end of file
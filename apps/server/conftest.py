@@ -14,6 +14,12 @@ from unittest.mock import Mock, patch
 # This runs at import time, ensuring environment is set up early
 os.environ["TEST_MODE"] = "true"
 
+# Send full prompts; prompt cache tests install a local backend explicitly
+os.environ["PROMPT_CACHE_BACKEND"] = "off"
+
+# Tests inspect the JSON files; database storage tests use their own manager
+os.environ["STORAGE_BACKEND"] = "json"
+
 # Create a temporary directory for test data
 test_data_dir = tempfile.mkdtemp(prefix="meticai_test_")
 os.environ["DATA_DIR"] = test_data_dir
@@ -45,9 +51,15 @@ def _reset_in_memory_caches():
     import services.meticulous_service as _ms
     import services.temp_profile_service as _tps
     import services.pour_over_preferences as _pop
+    import services.gemini_service as _gs
+    import services.profile_repair_service as _prs
+    import services.prompt_cache_service as _pcs
+    import services.persistence_service as _ps
 
-    _cs._llm_cache = None
+    _cs.close_llm_store()
     _cs._shot_cache = None
+    _cs._image_cache_index = None
+    _cs._bag_analysis_cache = None
     _ss._settings_cache = None
     _hs._history_cache = None
     _ms._profile_list_cache = None
@@ -55,16 +67,49 @@ def _reset_in_memory_caches():
     _tps._set_active(None)
     _tps._reset_lock()
     _pop._cache = None
+    _gs._llm_metrics.reset()
+    _prs.reset_repair_metrics()
+    _pcs.reset_prompt_cache()
+    _ps.get_persistence().reset_metrics()
 
     # Also reset settings file on disk to defaults to prevent cross-test leaks
     from config import DATA_DIR
     settings_file = DATA_DIR / "settings.json"
     if settings_file.exists():
         settings_file.unlink()
+    bag_cache_file = DATA_DIR / "bag_analysis_cache.json"
+    if bag_cache_file.exists():
+        bag_cache_file.unlink()
 
     yield
 
 
+@pytest.fixture()
+def sqlite_storage(tmp_path, monkeypatch):
+    """Store the shared persistence datasets in a fresh SQLite database."""
+    from services.database import Database
+    from services.persistence_service import get_persistence
+
+    manager = get_persistence()
+    db = Database(tmp_path / "meticai.db")
+    monkeypatch.setattr(manager, "backend", "sqlite")
+    monkeypatch.setattr(manager, "_database", lambda: db)
+    for dataset in manager._datasets.values():
+        dataset.rows = None
+    yield db
+    for dataset in manager._datasets.values():
+        dataset.rows = None
+    db.close()
+
+
+@pytest.fixture(params=["json", "sqlite"])
+def storage_backend(request):
+    """Run a test once with JSON files and once with the SQLite database."""
+    if request.param == "sqlite":
+        request.getfixturevalue("sqlite_storage")
+    return request.param
+
+
 @pytest.fixture()
 def mock_validate_profile():
     """Mock validate_profile to return valid for tests that need it.
@@ -81,11 +126,26 @@ def mock_validate_profile():
         yield
 
 
+@pytest.fixture()
+def no_local_repair():
+    """Disable local profile repair so tests exercise the LLM retry path.
+
+    Tests that mock ``validate_profile`` to fail regardless of content
+    should request this fixture; otherwise the repair engine's extra
+    validation call consumes their mocked results.
+    """
+    with patch("api.routes.coffee.repair_profile", side_effect=lambda p: (p, [])):
+        yield
+
+
 @pytest.fixture(autouse=True)
 def _reset_generation_progress():
     """Clear in-memory generation state between tests."""
     from services.generation_progress import _active_generations
+    import services.generation_queue as _gq
     _active_generations.clear()
+    _gq._queue = None
     yield
     _active_generations.clear()
+    _gq._queue = None
 
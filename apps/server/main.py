@@ -12,7 +12,7 @@ import tempfile
 import requests.exceptions
 import httpx
 from logging_config import setup_logging
-from config import UPDATE_CHECK_INTERVAL
+from config import UPDATE_CHECK_INTERVAL, IMAGE_CACHE_WARMUP
 
 # Initialize logging system with environment-aware defaults
 log_dir = os.environ.get("LOG_DIR", "/app/logs")
@@ -157,6 +157,11 @@ async def lifespan(app: FastAPI):
     except Exception as e:
         logger.warning("Failed to hydrate settings into environment: %s", e)
 
+    # Coalesce writes of history, annotations, caches and schedules
+    from services.persistence_service import get_persistence
+    persistence = get_persistence()
+    persistence.start()
+
     # Start the periodic update checker
     logger.info(
         f"Starting periodic update checker "
@@ -201,12 +206,33 @@ async def lifespan(app: FastAPI):
         await load_dialin_sessions()
     except Exception as e:
         logger.warning("Failed to restore dial-in sessions at startup: %s", e)
+
+    # Prefetch profile images in the background so the first catalogue view
+    # is served from the image cache instead of dozens of serial proxies
+    image_warmup_task = None
+    if IMAGE_CACHE_WARMUP:
+        image_warmup_task = asyncio.create_task(_image_cache_warmup_task())
+
+    # Expire old LLM analyses in the background instead of on lookup
+    llm_sweep_task = asyncio.create_task(_llm_cache_sweeper())
     
     yield
     
     # Cleanup on shutdown
     update_task.cancel()
     recurring_task.cancel()
+    llm_sweep_task.cancel()
+    try:
+        await llm_sweep_task
+    except asyncio.CancelledError:
+        pass
+    _close_llm_store()
+    if image_warmup_task is not None:
+        image_warmup_task.cancel()
+        try:
+            await image_warmup_task
+        except asyncio.CancelledError:
+            pass
     try:
         await update_task
     except asyncio.CancelledError:
@@ -233,6 +259,11 @@ async def lifespan(app: FastAPI):
     # Stop MQTT subscriber
     mqtt_sub.stop()
 
+    # Write any state changed since the last flush
+    await persistence.stop()
+    from services.database import close_database
+    close_database()
+
 
 app = FastAPI(
     lifespan=lifespan,
@@ -375,6 +406,11 @@ from services.scheduling_state import (
     restore_scheduled_shots as _restore_scheduled_shots,
     load_recurring_schedules as _load_recurring_schedules,
 )
+from services.cache_service import (
+    llm_cache_sweeper as _llm_cache_sweeper,
+    close_llm_store as _close_llm_store,
+)
 from api.routes.profiles import (
-    _schedule_next_recurring, _recurring_schedule_checker
+    _schedule_next_recurring, _recurring_schedule_checker,
+    image_cache_warmup_task as _image_cache_warmup_task,
 )
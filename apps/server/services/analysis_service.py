@@ -967,6 +967,66 @@ def generate_estimated_target_curves(profile_data: dict) -> list[dict]:
     return data_points
 
 
+def _profile_to_analysis_data(full_profile: Any) -> dict:
+    """Convert a machine profile object to the dict the analysis expects."""
+    profile_data = {
+        "name": full_profile.name,
+        "temperature": getattr(full_profile, 'temperature', None),
+        "final_weight": getattr(full_profile, 'final_weight', None),
+        "variables": [],
+        "stages": []
+    }
+
+    # Extract variables if present
+    if hasattr(full_profile, 'variables') and full_profile.variables:
+        for var in full_profile.variables:
+            var_dict = {
+                "key": getattr(var, 'key', ''),
+                "name": getattr(var, 'name', ''),
+                "type": getattr(var, 'type', ''),
+                "value": getattr(var, 'value', 0)
+            }
+            profile_data["variables"].append(var_dict)
+
+    # Extract full stage data including dynamics and triggers
+    if hasattr(full_profile, 'stages') and full_profile.stages:
+        for stage in full_profile.stages:
+            stage_dict = {
+                "name": getattr(stage, 'name', 'Unknown'),
+                "key": getattr(stage, 'key', ''),
+                "type": getattr(stage, 'type', 'unknown'),
+            }
+            # Add dynamics - handle both direct attributes and dynamics object
+            if hasattr(stage, 'dynamics') and stage.dynamics is not None:
+                dynamics = stage.dynamics
+                if hasattr(dynamics, 'points') and dynamics.points:
+                    stage_dict['dynamics_points'] = dynamics.points
+                if hasattr(dynamics, 'over'):
+                    stage_dict['dynamics_over'] = dynamics.over
+                if hasattr(dynamics, 'interpolation'):
+                    stage_dict['dynamics_interpolation'] = dynamics.interpolation
+            else:
+                # Fallback: check for direct attributes
+                for attr in ['dynamics_points', 'dynamics_over', 'dynamics_interpolation']:
+                    val = getattr(stage, attr, None)
+                    if val is not None:
+                        stage_dict[attr] = val
+            # Add exit triggers and limits
+            for attr in ['exit_triggers', 'limits']:
+                val = getattr(stage, attr, None)
+                if val is not None:
+                    # Convert to list of dicts if needed
+                    if isinstance(val, list):
+                        stage_dict[attr] = [
+                            dict(item) if hasattr(item, '__dict__') else item
+                            for item in val
+                        ]
+                    else:
+                        stage_dict[attr] = val
+            profile_data["stages"].append(stage_dict)
+    return profile_data
+
+
 def _perform_local_shot_analysis(shot_data: dict, profile_data: dict) -> dict:
     """Perform complete local analysis of shot vs profile.
     
@@ -995,18 +1055,6 @@ def _perform_local_shot_analysis(shot_data: dict, profile_data: dict) -> dict:
         if t >= FLOW_IGNORE_WINDOW:
             max_flow = max(max_flow, flow)
     
-    target_weight = profile_data.get("final_weight", 0) or 0
-    
-    # Weight analysis
-    weight_deviation = 0
-    weight_status = "on_target"
-    if target_weight > 0:
-        weight_deviation = ((final_weight - target_weight) / target_weight) * 100
-        if final_weight < target_weight * 0.95:  # More than 5% under
-            weight_status = "under"
-        elif final_weight > target_weight * 1.1:  # More than 10% over
-            weight_status = "over"
-    
     # Extract shot stage data
     shot_stages = _extract_shot_stage_data(shot_data)
     
@@ -1020,6 +1068,39 @@ def _perform_local_shot_analysis(shot_data: dict, profile_data: dict) -> dict:
     # Generate profile target curves for chart overlay
     profile_target_curves = _generate_profile_target_curves(profile_data, shot_stage_times, shot_data)
     
+    analysis = _analyze_shot_stages(
+        shot_stages, profile_data, final_weight, total_time, max_pressure, max_flow
+    )
+    analysis["profile_target_curves"] = profile_target_curves
+    return analysis
+
+
+def _analyze_shot_stages(
+    shot_stages: dict[str, dict],
+    profile_data: dict,
+    final_weight: float,
+    total_time: float,
+    max_pressure: float,
+    max_flow: float,
+) -> dict:
+    """Compare per-stage shot statistics with the profile.
+    
+    Shared by the post-shot analysis and the live in-shot analyzer, which
+    builds *shot_stages* incrementally instead of from the shot file.
+    Returns the analysis without the chart target curves.
+    """
+    target_weight = profile_data.get("final_weight", 0) or 0
+    
+    # Weight analysis
+    weight_deviation = 0
+    weight_status = "on_target"
+    if target_weight > 0:
+        weight_deviation = ((final_weight - target_weight) / target_weight) * 100
+        if final_weight < target_weight * 0.95:  # More than 5% under
+            weight_status = "under"
+        elif final_weight > target_weight * 1.1:  # More than 10% over
+            weight_status = "over"
+    
     # Profile stages
     profile_stages = profile_data.get("stages", [])
     profile_variables = profile_data.get("variables", [])
@@ -1148,8 +1229,7 @@ def _perform_local_shot_analysis(shot_data: dict, profile_data: dict) -> dict:
             "name": profile_data.get("name", "Unknown"),
             "temperature": profile_data.get("temperature"),
             "stage_count": len(profile_stages)
-        },
-        "profile_target_curves": profile_target_curves
+        }
     }
 
 
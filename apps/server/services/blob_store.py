@@ -0,0 +1,78 @@
+"""Content-addressed storage for binary blobs (history image previews).
+
+Blobs are stored as files named by the SHA-256 of their content under
+``DATA_DIR/blobs/<first two hex chars>/``, so identical images are stored
+once and records only need to keep the digest.  Blobs are immutable: a
+digest always refers to the same bytes, which makes them safe to cache
+indefinitely on the client.
+"""
+
+import os
+import re
+import tempfile
+from hashlib import sha256
+from pathlib import Path
+from typing import Optional
+
+from config import DATA_DIR
+from logging_config import get_logger
+
+logger = get_logger()
+
+BLOB_DIR = DATA_DIR / "blobs"
+
+_DIGEST_RE = re.compile(r"^[0-9a-f]{64}$")
+
+
+def blob_path(digest: str) -> Path:
+    """Return the file path of *digest*.
+
+    Raises:
+        ValueError: If *digest* is not a lowercase hex SHA-256.
+    """
+    if not _DIGEST_RE.match(digest or ""):
+        raise ValueError(f"Invalid blob digest: {digest!r}")
+    return BLOB_DIR / digest[:2] / digest
+
+
+def put_blob(data: bytes) -> str:
+    """Store *data* and return its digest (a no-op if it already exists)."""
+    digest = sha256(data).hexdigest()
+    path = blob_path(digest)
+    if path.exists():
+        return digest
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temp_fd, temp_path = tempfile.mkstemp(dir=path.parent, prefix=".blob.", suffix=".tmp")
+    try:
+        with os.fdopen(temp_fd, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, path)
+    except Exception:
+        try:
+            os.unlink(temp_path)
+        except OSError:
+            pass
+        raise
+    return digest
+
+
+def get_blob(digest: str) -> Optional[bytes]:
+    """Return the bytes stored under *digest*, or None if missing or invalid."""
+    try:
+        return blob_path(digest).read_bytes()
+    except (ValueError, FileNotFoundError):
+        return None
+
+
+def delete_blob(digest: str) -> bool:
+    """Delete the blob *digest*. Returns True if a file was removed."""
+    try:
+        blob_path(digest).unlink()
+        return True
+    except (ValueError, FileNotFoundError):
+        return False
+    except OSError as e:
+        logger.warning(f"Could not delete blob {digest}: {e}")
+        return False
@@ -1,18 +1,32 @@
 """Cache service for managing LLM analysis, shot history, and profile image caches.
 
 This module provides caching functionality for:
-- LLM analysis results (with TTL-based expiration)
+- LLM analysis results (SQLite store with TTL expiry and an LRU size bound)
 - Shot history data (with staleness tracking)
 - Profile images (binary file cache)
+- Coffee bag analyses (keyed by perceptual image hash, LRU-bounded)
 """
 
+import asyncio
+import hashlib
 import json
+import threading
 import time
 from typing import Optional
 from logging_config import get_logger
 
-from config import DATA_DIR, LLM_CACHE_TTL_SECONDS, SHOT_CACHE_STALE_SECONDS
-from utils.file_utils import atomic_write_json
+from config import (
+    DATA_DIR,
+    LLM_CACHE_TTL_SECONDS,
+    LLM_CACHE_MAX_ENTRIES,
+    STORAGE_BACKEND,
+    SHOT_CACHE_STALE_SECONDS,
+    BAG_ANALYSIS_CACHE_MAX_ENTRIES,
+    BAG_ANALYSIS_HASH_THRESHOLD,
+)
+from services.llm_analysis_store import LLMAnalysisStore
+from services.database import DATABASE_FILE
+from services.persistence_service import get_persistence, mark_dirty, read_dataset, register_dataset
 from utils.sanitization import sanitize_profile_name_for_filename
 
 logger = get_logger()
@@ -21,41 +35,47 @@ logger = get_logger()
 # LLM Analysis Cache Configuration
 # ============================================
 
-LLM_CACHE_FILE = DATA_DIR / "llm_analysis_cache.json"
+# Analyses share the main database unless per-service JSON storage is used
+LLM_CACHE_DB = DATABASE_FILE if STORAGE_BACKEND == "sqlite" else DATA_DIR / "llm_analysis_cache.db"
 
-# In-memory cache (loaded from disk on first access, write-through on save)
-_llm_cache: Optional[dict] = None
+# Standalone analysis database used before the shared one
+LLM_CACHE_STANDALONE_DB = DATA_DIR / "llm_analysis_cache.db"
 
+# Pre-SQLite cache file, imported into the database on first use
+LLM_CACHE_FILE = DATA_DIR / "llm_analysis_cache.json"
 
-def _ensure_llm_cache_file():
-    """Ensure the LLM cache file and directory exist."""
-    LLM_CACHE_FILE.parent.mkdir(parents=True, exist_ok=True)
-    if not LLM_CACHE_FILE.exists():
-        LLM_CACHE_FILE.write_text("{}")
+# Seconds between background sweeps of expired analyses
+LLM_CACHE_SWEEP_INTERVAL = 3600
 
+_llm_store: Optional[LLMAnalysisStore] = None
+_llm_store_lock = threading.Lock()
 
-def _load_llm_cache() -> dict:
-    """Load LLM analysis cache, using in-memory copy when available."""
-    global _llm_cache
-    if _llm_cache is not None:
-        return _llm_cache
-    _ensure_llm_cache_file()
-    try:
-        data = json.loads(LLM_CACHE_FILE.read_text())
-    except (json.JSONDecodeError, IOError):
-        data = None
-    if not isinstance(data, dict):
-        data = {}
-    _llm_cache = data
-    return _llm_cache
+
+def _get_llm_store() -> LLMAnalysisStore:
+    """Open the analysis store on first use, importing the legacy JSON cache."""
+    global _llm_store
+    if _llm_store is None:
+        with _llm_store_lock:
+            if _llm_store is None:
+                store = LLMAnalysisStore(
+                    LLM_CACHE_DB,
+                    ttl_seconds=LLM_CACHE_TTL_SECONDS,
+                    max_entries=LLM_CACHE_MAX_ENTRIES,
+                )
+                store.import_legacy_json(LLM_CACHE_FILE)
+                if LLM_CACHE_DB != LLM_CACHE_STANDALONE_DB:
+                    store.import_legacy_db(LLM_CACHE_STANDALONE_DB)
+                _llm_store = store
+    return _llm_store
 
 
-def _save_llm_cache(cache: dict):
-    """Write-through: update in-memory cache and persist to disk."""
-    global _llm_cache
-    _llm_cache = cache
-    _ensure_llm_cache_file()
-    atomic_write_json(LLM_CACHE_FILE, cache)
+def close_llm_store():
+    """Close the analysis store; the next access reopens it."""
+    global _llm_store
+    with _llm_store_lock:
+        if _llm_store is not None:
+            _llm_store.close()
+            _llm_store = None
 
 
 def _get_llm_cache_key(profile_name: str, shot_date: str, shot_filename: str) -> str:
@@ -65,38 +85,40 @@ def _get_llm_cache_key(profile_name: str, shot_date: str, shot_filename: str) ->
 
 def get_cached_llm_analysis(profile_name: str, shot_date: str, shot_filename: str) -> Optional[str]:
     """Get cached LLM analysis if it exists and is not expired."""
-    cache = _load_llm_cache()
     key = _get_llm_cache_key(profile_name, shot_date, shot_filename)
-    
-    if key in cache:
-        entry = cache[key]
-        timestamp = entry.get("timestamp", 0)
-        now = time.time()
-        
-        if now - timestamp < LLM_CACHE_TTL_SECONDS:
-            return entry.get("analysis")
-        else:
-            # Expired - remove from cache
-            del cache[key]
-            _save_llm_cache(cache)
-    
-    return None
+    return _get_llm_store().get(key)
 
 
 def save_llm_analysis_to_cache(profile_name: str, shot_date: str, shot_filename: str, analysis: str):
     """Save LLM analysis to cache."""
-    cache = _load_llm_cache()
     key = _get_llm_cache_key(profile_name, shot_date, shot_filename)
-    
-    cache[key] = {
-        "analysis": analysis,
-        "timestamp": time.time(),
-        "profile_name": profile_name,
-        "shot_date": shot_date,
-        "shot_filename": shot_filename
-    }
-    
-    _save_llm_cache(cache)
+    _get_llm_store().put(
+        key,
+        analysis,
+        profile_name=profile_name,
+        shot_date=shot_date,
+        shot_filename=shot_filename,
+    )
+
+
+async def async_get_cached_llm_analysis(profile_name: str, shot_date: str, shot_filename: str) -> Optional[str]:
+    """``get_cached_llm_analysis`` run in a worker thread, off the event loop."""
+    return await asyncio.to_thread(get_cached_llm_analysis, profile_name, shot_date, shot_filename)
+
+
+async def async_save_llm_analysis_to_cache(profile_name: str, shot_date: str, shot_filename: str, analysis: str):
+    """``save_llm_analysis_to_cache`` run in a worker thread, off the event loop."""
+    await asyncio.to_thread(save_llm_analysis_to_cache, profile_name, shot_date, shot_filename, analysis)
+
+
+async def llm_cache_sweeper(interval: float = LLM_CACHE_SWEEP_INTERVAL):
+    """Periodically delete expired LLM analyses (runs until cancelled)."""
+    while True:
+        try:
+            await asyncio.to_thread(_get_llm_store().sweep)
+        except Exception as e:
+            logger.warning(f"LLM analysis cache sweep failed: {e}")
+        await asyncio.sleep(interval)
 
 
 # ============================================
@@ -105,12 +127,20 @@ def save_llm_analysis_to_cache(profile_name: str, shot_date: str, shot_filename:
 
 SHOT_CACHE_FILE = DATA_DIR / "shot_cache.json"
 
-# In-memory cache (loaded from disk on first access, write-through on save)
+# In-memory cache (loaded from disk on first access; saves are coalesced
+# by the persistence service)
 _shot_cache: Optional[dict] = None
 
+register_dataset(
+    "shot_cache", lambda: SHOT_CACHE_FILE, lambda: dict(_shot_cache or {}),
+    collection="shot_cache",
+)
+
 
 def _ensure_shot_cache_file():
-    """Ensure the shot cache file and directory exist."""
+    """Ensure the shot cache file and directory exist (JSON storage only)."""
+    if get_persistence().uses_database("shot_cache"):
+        return
     SHOT_CACHE_FILE.parent.mkdir(parents=True, exist_ok=True)
     if not SHOT_CACHE_FILE.exists():
         SHOT_CACHE_FILE.write_text("{}")
@@ -123,8 +153,7 @@ def _load_shot_cache() -> dict:
         return _shot_cache
     _ensure_shot_cache_file()
     try:
-        with open(SHOT_CACHE_FILE, 'r', encoding='utf-8') as f:
-            data = json.load(f)
+        data = read_dataset("shot_cache")
     except (json.JSONDecodeError, FileNotFoundError):
         data = None
     if not isinstance(data, dict):
@@ -134,11 +163,10 @@ def _load_shot_cache() -> dict:
 
 
 def _save_shot_cache(cache: dict):
-    """Write-through: update in-memory cache and persist to disk."""
+    """Update the in-memory cache and schedule it to be written to disk."""
     global _shot_cache
     _shot_cache = cache
-    _ensure_shot_cache_file()
-    atomic_write_json(SHOT_CACHE_FILE, cache)
+    mark_dirty("shot_cache")
 
 
 def _get_cached_shots(profile_name: str, limit: int) -> tuple[Optional[dict], bool, Optional[float]]:
@@ -190,6 +218,15 @@ def _set_cached_shots(profile_name: str, data: dict, limit: int):
 # ============================================
 
 IMAGE_CACHE_DIR = DATA_DIR / "image_cache"
+IMAGE_CACHE_INDEX_FILE = IMAGE_CACHE_DIR / "index.json"
+
+# In-memory copy of the image cache index: sanitized name -> source hash
+_image_cache_index: Optional[dict] = None
+
+register_dataset(
+    "image_cache_index", lambda: IMAGE_CACHE_INDEX_FILE, lambda: dict(_image_cache_index or {}),
+    collection="image_cache_index",
+)
 
 
 def _ensure_image_cache_dir():
@@ -246,3 +283,166 @@ def _set_cached_image(profile_name: str, image_data: bytes):
         logger.info(f"Cached image for profile: {profile_name} ({len(image_data)} bytes)")
     except Exception as e:
         logger.warning(f"Failed to cache image for {profile_name}: {e}")
+
+
+def compute_image_source_hash(image_source: str) -> str:
+    """Compute a content hash for a profile's ``display.image`` reference.
+
+    The reference is either a data URI (the image content itself) or a
+    machine path/URL, so hashing it lets callers detect a changed image
+    without fetching it.
+    """
+    return hashlib.sha256(image_source.encode("utf-8")).hexdigest()
+
+
+def _load_image_cache_index() -> dict:
+    """Load the image cache index, using in-memory copy when available."""
+    global _image_cache_index
+    if _image_cache_index is not None:
+        return _image_cache_index
+    try:
+        data = read_dataset("image_cache_index") if get_persistence().has_data("image_cache_index") else None
+    except (json.JSONDecodeError, OSError):
+        data = None
+    if not isinstance(data, dict):
+        data = {}
+    _image_cache_index = data
+    return _image_cache_index
+
+
+def _get_cached_image_source_hash(profile_name: str) -> Optional[str]:
+    """Get the source hash recorded for a profile's cached image, if any."""
+    safe_name = sanitize_profile_name_for_filename(profile_name)
+    return _load_image_cache_index().get(safe_name)
+
+
+def _set_cached_image_source_hash(profile_name: str, source_hash: str):
+    """Record the source hash of a profile's cached image."""
+    index = _load_image_cache_index()
+    safe_name = sanitize_profile_name_for_filename(profile_name)
+    if index.get(safe_name) == source_hash:
+        return
+    index[safe_name] = source_hash
+    try:
+        mark_dirty("image_cache_index", [safe_name])
+    except Exception as e:
+        logger.warning(f"Failed to persist image cache index for {profile_name}: {e}")
+
+
+# ============================================
+# Coffee Bag Analysis Cache
+# ============================================
+
+BAG_ANALYSIS_CACHE_FILE = DATA_DIR / "bag_analysis_cache.json"
+
+# Side length of the difference-hash grid (8 → 64-bit hash)
+_BAG_HASH_SIZE = 8
+
+# In-memory cache: image hash (hex) -> {"analysis", "timestamp", "last_used"}
+_bag_analysis_cache: Optional[dict] = None
+
+register_dataset(
+    "bag_analysis_cache", lambda: BAG_ANALYSIS_CACHE_FILE, lambda: dict(_bag_analysis_cache or {}),
+    collection="bag_analysis_cache",
+)
+
+
+def compute_bag_image_hash(image) -> str:
+    """Compute a 64-bit perceptual (difference) hash of a bag photo.
+
+    The image is normalised first — EXIF orientation applied, converted to
+    greyscale and shrunk to a 9x8 grid — so re-photographing the same bag or
+    re-uploading it at a different size or compression yields a hash within
+    a few bits of the original.
+
+    Args:
+        image: A PIL image.
+
+    Returns:
+        The hash as a 16-character hex string.
+    """
+    from PIL import Image, ImageOps
+
+    normalised = ImageOps.exif_transpose(image)
+    grid = normalised.convert("L").resize(
+        (_BAG_HASH_SIZE + 1, _BAG_HASH_SIZE), Image.Resampling.LANCZOS
+    )
+    pixels = grid.tobytes()
+    bits = 0
+    for row in range(_BAG_HASH_SIZE):
+        offset = row * (_BAG_HASH_SIZE + 1)
+        for col in range(_BAG_HASH_SIZE):
+            bits = (bits << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return f"{bits:016x}"
+
+
+def _hash_distance(a: str, b: str) -> int:
+    """Hamming distance between two hex-encoded image hashes."""
+    return bin(int(a, 16) ^ int(b, 16)).count("1")
+
+
+def _load_bag_analysis_cache() -> dict:
+    """Load the bag analysis cache, using in-memory copy when available."""
+    global _bag_analysis_cache
+    if _bag_analysis_cache is not None:
+        return _bag_analysis_cache
+    try:
+        data = read_dataset("bag_analysis_cache") if get_persistence().has_data("bag_analysis_cache") else None
+    except (json.JSONDecodeError, OSError):
+        data = None
+    if not isinstance(data, dict):
+        data = {}
+    _bag_analysis_cache = data
+    return _bag_analysis_cache
+
+
+def _save_bag_analysis_cache(cache: dict, keys: list):
+    """Update the in-memory cache and schedule the changed *keys* for writing."""
+    global _bag_analysis_cache
+    _bag_analysis_cache = cache
+    try:
+        mark_dirty("bag_analysis_cache", keys)
+    except Exception as e:
+        logger.warning(f"Failed to persist bag analysis cache: {e}")
+
+
+def get_cached_bag_analysis(image_hash: str) -> Optional[str]:
+    """Return the stored analysis for the closest matching bag photo.
+
+    Matches the exact hash first, then (if ``BAG_ANALYSIS_HASH_THRESHOLD``
+    is non-zero) the nearest stored hash within that many bits.  A hit
+    refreshes the entry's LRU position.
+    """
+    cache = _load_bag_analysis_cache()
+    key = image_hash if image_hash in cache else None
+    if key is None and BAG_ANALYSIS_HASH_THRESHOLD > 0:
+        best = BAG_ANALYSIS_HASH_THRESHOLD + 1
+        for candidate in cache:
+            distance = _hash_distance(image_hash, candidate)
+            if distance < best:
+                key, best = candidate, distance
+    if key is None:
+        return None
+
+    entry = cache[key]
+    entry["last_used"] = time.time()
+    _save_bag_analysis_cache(cache, [key])
+    return entry.get("analysis")
+
+
+def save_bag_analysis_to_cache(image_hash: str, analysis: str):
+    """Store a bag analysis, evicting least recently used entries when full."""
+    cache = _load_bag_analysis_cache()
+    now = time.time()
+    cache[image_hash] = {"analysis": analysis, "timestamp": now, "last_used": now}
+
+    changed = [image_hash]
+    overflow = len(cache) - BAG_ANALYSIS_CACHE_MAX_ENTRIES
+    if overflow > 0:
+        by_age = sorted(cache, key=lambda k: cache[k].get("last_used", 0))
+        for stale in by_age[:overflow]:
+            del cache[stale]
+            changed.append(stale)
+
+    _save_bag_analysis_cache(cache, changed)
+
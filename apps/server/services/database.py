@@ -0,0 +1,257 @@
+"""Embedded SQLite database holding MeticAI's persistent state.
+
+One database file (``meticai.db`` in ``DATA_DIR``) in WAL mode replaces the
+per-service JSON files.  Entities are stored as JSON documents in named
+*collections* and accessed through :class:`Repository`; several
+collections can be updated atomically inside :meth:`Database.transaction`.
+
+WAL mode plus ``busy_timeout`` lets other processes (backups, inspection
+scripts) read the file while the server is running.  Other processes must
+not write to it: the persistence service caches each collection's rows in
+memory, so outside changes are ignored or overwritten by its next flush.
+"""
+
+import json
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Iterator, List, Optional
+
+from config import DATA_DIR
+from logging_config import get_logger
+
+logger = get_logger()
+
+DATABASE_FILE = DATA_DIR / "meticai.db"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS documents (
+    collection  TEXT NOT NULL,
+    key         TEXT NOT NULL,
+    seq         INTEGER NOT NULL DEFAULT 0,
+    data        TEXT NOT NULL,
+    updated_at  REAL NOT NULL,
+    PRIMARY KEY (collection, key)
+);
+CREATE INDEX IF NOT EXISTS idx_documents_order ON documents (collection, seq);
+CREATE TABLE IF NOT EXISTS meta (
+    key    TEXT PRIMARY KEY,
+    value  TEXT NOT NULL
+);
+"""
+
+
+class Repository:
+    """Key/document access to one collection."""
+
+    def __init__(self, db: "Database", collection: str):
+        self._db = db
+        self.collection = collection
+
+    def get(self, key: str) -> Optional[Any]:
+        row = self._db.execute(
+            "SELECT data FROM documents WHERE collection = ? AND key = ?",
+            (self.collection, key),
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def items(self) -> List[tuple]:
+        """Return ``(key, document)`` pairs in insertion-sequence order."""
+        rows = self._db.execute(
+            "SELECT key, data FROM documents WHERE collection = ? ORDER BY seq, key",
+            (self.collection,),
+        ).fetchall()
+        return [(key, json.loads(data)) for key, data in rows]
+
+    def page(self, offset: int, limit: int) -> List[Any]:
+        """Return documents ``offset .. offset + limit`` in sequence order."""
+        rows = self._db.execute(
+            "SELECT data FROM documents WHERE collection = ? ORDER BY seq, key LIMIT ? OFFSET ?",
+            (self.collection, limit, offset),
+        ).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def keys(self) -> List[str]:
+        return [row[0] for row in self._db.execute(
+            "SELECT key FROM documents WHERE collection = ? ORDER BY seq, key",
+            (self.collection,),
+        )]
+
+    def count(self) -> int:
+        return self._db.execute(
+            "SELECT COUNT(*) FROM documents WHERE collection = ?", (self.collection,)
+        ).fetchone()[0]
+
+    def put(self, key: str, document: Any, seq: int = 0) -> None:
+        self.put_many([(key, document, seq)])
+
+    def put_many(self, rows) -> None:
+        """Upsert ``(key, document, seq)`` rows."""
+        self.put_serialized([(key, json.dumps(doc, default=str), seq) for key, doc, seq in rows])
+
+    def put_serialized(self, rows) -> None:
+        """Upsert ``(key, json_text, seq)`` rows whose documents are already encoded."""
+        now = time.time()
+        self._db.executemany(
+            "INSERT INTO documents (collection, key, seq, data, updated_at) VALUES (?, ?, ?, ?, ?) "
+            "ON CONFLICT (collection, key) DO UPDATE SET "
+            "seq = excluded.seq, data = excluded.data, updated_at = excluded.updated_at",
+            [(self.collection, key, seq, text, now) for key, text, seq in rows],
+        )
+
+    def delete(self, key: str) -> bool:
+        return self.delete_many([key]) > 0
+
+    def delete_many(self, keys) -> int:
+        removed = 0
+        for key in keys:
+            removed += self._db.execute(
+                "DELETE FROM documents WHERE collection = ? AND key = ?",
+                (self.collection, key),
+            ).rowcount
+        return removed
+
+    def clear(self) -> int:
+        return self._db.execute(
+            "DELETE FROM documents WHERE collection = ?", (self.collection,)
+        ).rowcount
+
+
+class Database:
+    """Thread-safe wrapper around one SQLite connection."""
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.RLock()
+        self._depth = 0
+        self._conn = sqlite3.connect(
+            str(self.path), check_same_thread=False, isolation_level=None, timeout=5.0,
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("PRAGMA busy_timeout=5000")
+        self._conn.executescript(_SCHEMA)
+
+    def execute(self, sql: str, params=()) -> sqlite3.Cursor:
+        with self._lock:
+            return self._conn.execute(sql, params)
+
+    def executemany(self, sql: str, rows) -> sqlite3.Cursor:
+        with self._lock:
+            return self._conn.executemany(sql, rows)
+
+    @contextmanager
+    def transaction(self) -> Iterator["Database"]:
+        """Run the enclosed repository calls atomically.
+
+        Uses ``BEGIN IMMEDIATE`` so a concurrent writer in another process
+        waits (up to the busy timeout) instead of failing mid-transaction.
+        Nested calls join the outer transaction.
+        """
+        with self._lock:
+            outer = self._depth == 0
+            if outer:
+                self._conn.execute("BEGIN IMMEDIATE")
+            self._depth += 1
+            try:
+                yield self
+            except BaseException:
+                self._depth -= 1
+                if outer:
+                    self._conn.execute("ROLLBACK")
+                raise
+            self._depth -= 1
+            if outer:
+                self._conn.execute("COMMIT")
+
+    def repository(self, collection: str) -> Repository:
+        return Repository(self, collection)
+
+    def get_meta(self, key: str) -> Optional[str]:
+        row = self.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def set_meta(self, key: str, value: str) -> None:
+        self.execute(
+            "INSERT INTO meta (key, value) VALUES (?, ?) "
+            "ON CONFLICT (key) DO UPDATE SET value = excluded.value",
+            (key, value),
+        )
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+def list_seq(index: int, length: int) -> int:
+    """Sequence number of a list item, counted from the end of the list.
+
+    Prepending (how history grows) leaves the existing items' numbers
+    unchanged, so only the new row has to be written.
+    """
+    return index - length
+
+
+def import_json_file(db: Database, collection: str, path: Path, kind: str) -> Optional[int]:
+    """Copy a legacy JSON file into *collection* once.
+
+    ``kind`` is ``"dict"`` (one row per top-level key) or ``"list"`` (one
+    row per item, keyed by its ``id``).  The import is recorded in the
+    ``meta`` table so it never runs twice; the JSON file is left in place
+    as a backup.
+
+    Returns:
+        Number of imported rows, or None when the collection was already
+        migrated.
+    """
+    marker = f"migrated:{collection}"
+    if db.get_meta(marker) is not None:
+        return None
+    data: Any = None
+    if path.exists():
+        try:
+            data = json.loads(path.read_text(encoding="utf-8"))
+        except (json.JSONDecodeError, OSError) as e:
+            logger.warning(f"Skipping unreadable {path.name} during migration: {e}")
+
+    rows = []
+    if kind == "list" and isinstance(data, list):
+        items = [item for item in data if isinstance(item, dict) and item.get("id")]
+        rows = [(str(item["id"]), item, list_seq(i, len(items))) for i, item in enumerate(items)]
+    elif kind == "dict" and isinstance(data, dict):
+        rows = [(str(key), value, 0) for key, value in data.items()]
+
+    with db.transaction():
+        repo = db.repository(collection)
+        if rows:
+            repo.put_many(rows)
+        db.set_meta(marker, json.dumps({"source": path.name, "rows": len(rows), "at": time.time()}))
+    if rows:
+        logger.info(f"Migrated {len(rows)} {collection} entries from {path.name} into the database")
+    return len(rows)
+
+
+_database: Optional[Database] = None
+_database_lock = threading.Lock()
+
+
+def get_database() -> Database:
+    """Return the process-wide database, opening it on first use."""
+    global _database
+    if _database is None:
+        with _database_lock:
+            if _database is None:
+                _database = Database(DATABASE_FILE)
+    return _database
+
+
+def close_database() -> None:
+    """Close the shared database; the next access reopens it."""
+    global _database
+    with _database_lock:
+        if _database is not None:
+            _database.close()
+            _database = None
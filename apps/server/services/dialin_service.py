@@ -11,6 +11,7 @@ from typing import Optional
 from uuid import uuid4
 
 from config import DATA_DIR
+from services.persistence_service import get_persistence, mark_dirty, read_dataset, register_dataset
 from models.dialin import (
     CoffeeDetails,
     DialInIteration,
@@ -56,23 +57,25 @@ def _get_state_lock() -> asyncio.Lock:
 _PERSISTENCE_FILE: Path = DATA_DIR / "dialin_sessions.json"
 
 
-async def _persist() -> None:
-    """Write active sessions to disk atomically (tmp + rename)."""
-    try:
-        DATA_DIR.mkdir(parents=True, exist_ok=True)
+def _snapshot_active_sessions() -> dict:
+    """Serialize the active sessions for the persistence flusher."""
+    return {
+        sid: session.model_dump(mode="json")
+        for sid, session in _sessions.items()
+        if session.status == SessionStatus.ACTIVE
+    }
+
 
-        active = {
-            sid: session.model_dump(mode="json")
-            for sid, session in _sessions.items()
-            if session.status == SessionStatus.ACTIVE
-        }
+register_dataset(
+    "dialin_sessions", lambda: _PERSISTENCE_FILE, _snapshot_active_sessions,
+    collection="dialin_sessions",
+)
 
-        tmp = _PERSISTENCE_FILE.with_suffix(".tmp")
-        with open(tmp, "w") as f:
-            json.dump(active, f, indent=2)
-        tmp.replace(_PERSISTENCE_FILE)
 
-        logger.debug("Persisted %d active dial-in sessions", len(active))
+async def _persist() -> None:
+    """Schedule the active sessions to be written to disk."""
+    try:
+        mark_dirty("dialin_sessions")
     except Exception as e:
         logger.error("Failed to persist dial-in sessions: %s", e, exc_info=True)
 
@@ -80,12 +83,11 @@ async def _persist() -> None:
 async def _load() -> None:
     """Load sessions from disk on startup."""
     try:
-        if not _PERSISTENCE_FILE.exists():
+        if not get_persistence().has_data("dialin_sessions"):
             logger.info("No persisted dial-in sessions found (first run)")
             return
 
-        with open(_PERSISTENCE_FILE, "r") as f:
-            data = json.load(f)
+        data = read_dataset("dialin_sessions")
 
         if not isinstance(data, dict):
             logger.warning("Invalid dial-in sessions file format, ignoring")
@@ -5,7 +5,11 @@ import asyncio
 import hashlib
 import os
 import re
+import time
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
 from typing import Optional
+from config import LLM_MAX_CONCURRENCY
 from services.settings_service import get_author_name
 from logging_config import get_logger
 
@@ -15,6 +19,14 @@ logger = get_logger()
 _gemini_client: Optional[genai.Client] = None
 _DEFAULT_MODEL = "gemini-2.5-flash"
 
+# Bound on concurrent LLM calls.  Calls go through the SDK's native async
+# client, so they no longer occupy the default executor shared with
+# pyMeticulous, Pillow and file I/O; the semaphore keeps a burst of
+# generations from piling up requests against the API.  Recreated when the
+# running event loop changes (tests use a new loop per function).
+_llm_semaphore: Optional[asyncio.Semaphore] = None
+_llm_semaphore_loop: Optional[asyncio.AbstractEventLoop] = None
+
 
 def get_model_name() -> str:
     """Return the configured Gemini model name, resolved at call time.
@@ -477,6 +489,9 @@ def reset_vision_model():
     """
     global _gemini_client
     _gemini_client = None
+    # Cached prompt prefixes belong to the old key's project
+    from services.prompt_cache_service import reset_prompt_cache
+    reset_prompt_cache()
 
 
 def get_gemini_client() -> genai.Client:
@@ -509,6 +524,108 @@ def get_vision_model():
     return _GeminiModelWrapper(get_gemini_client())
 
 
+def _get_llm_semaphore() -> asyncio.Semaphore:
+    """Return the LLM call semaphore, (re)creating it when needed."""
+    global _llm_semaphore, _llm_semaphore_loop
+    running_loop = asyncio.get_running_loop()
+    if _llm_semaphore is None or running_loop is not _llm_semaphore_loop:
+        _llm_semaphore = asyncio.Semaphore(LLM_MAX_CONCURRENCY)
+        _llm_semaphore_loop = running_loop
+    return _llm_semaphore
+
+
+class _LLMCallMetrics:
+    """Running latency, queue-wait and in-flight counters for LLM calls."""
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.calls = 0
+        self.errors = 0
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.queued = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+        self.last_latency = 0.0
+        self.total_queue_wait = 0.0
+        self.max_queue_wait = 0.0
+
+    def snapshot(self) -> dict:
+        """Return the counters as a JSON-serialisable dict (times in ms)."""
+        completed = max(self.calls, 1)
+        return {
+            "max_concurrency": LLM_MAX_CONCURRENCY,
+            "calls": self.calls,
+            "errors": self.errors,
+            "in_flight": self.in_flight,
+            "peak_in_flight": self.peak_in_flight,
+            "queued": self.queued,
+            "latency_ms": {
+                "avg": round(self.total_latency / completed * 1000, 1),
+                "max": round(self.max_latency * 1000, 1),
+                "last": round(self.last_latency * 1000, 1),
+            },
+            "queue_wait_ms": {
+                "avg": round(self.total_queue_wait / completed * 1000, 1),
+                "max": round(self.max_queue_wait * 1000, 1),
+            },
+        }
+
+
+_llm_metrics = _LLMCallMetrics()
+
+
+def get_llm_call_metrics() -> dict:
+    """Return a snapshot of LLM call latency, queue wait and concurrency."""
+    return _llm_metrics.snapshot()
+
+
+@asynccontextmanager
+async def llm_call_slot(kind: str = "generate"):
+    """Hold one of the bounded LLM call slots for the duration of a call.
+
+    Records how long the caller queued for a slot, how long the call took
+    and how many calls are in flight, and logs calls that had to wait.
+    """
+    metrics = _llm_metrics
+    metrics.queued += 1
+    queued_at = time.monotonic()
+    try:
+        await _get_llm_semaphore().acquire()
+    finally:
+        metrics.queued -= 1
+    started = time.monotonic()
+    queue_wait = started - queued_at
+    metrics.in_flight += 1
+    metrics.peak_in_flight = max(metrics.peak_in_flight, metrics.in_flight)
+    try:
+        yield
+    except BaseException:
+        metrics.errors += 1
+        raise
+    finally:
+        latency = time.monotonic() - started
+        metrics.in_flight -= 1
+        metrics.calls += 1
+        metrics.total_latency += latency
+        metrics.max_latency = max(metrics.max_latency, latency)
+        metrics.last_latency = latency
+        metrics.total_queue_wait += queue_wait
+        metrics.max_queue_wait = max(metrics.max_queue_wait, queue_wait)
+        _get_llm_semaphore().release()
+        if queue_wait >= 1.0:
+            logger.info(
+                "LLM call waited for a free slot",
+                extra={
+                    "kind": kind,
+                    "queue_wait_seconds": round(queue_wait, 1),
+                    "latency_seconds": round(latency, 1),
+                },
+            )
+
+
 class _GeminiModelWrapper:
     """Thin wrapper around google.genai.Client to provide the old GenerativeModel interface."""
     
@@ -530,16 +647,70 @@ class _GeminiModelWrapper:
             contents=contents,
         )
 
-    async def async_generate_content(self, contents):
-        """Non-blocking wrapper around generate_content.
+    async def async_generate_content(self, contents, on_chunk=None, cached_content=None):
+        """Non-blocking counterpart of generate_content.
         
-        Runs the synchronous Gemini SDK call in a thread pool executor
-        so it doesn't block the asyncio event loop.
+        Uses the SDK's native async client, so long generations never
+        occupy the default thread pool used for machine calls and file
+        I/O.  Calls are bounded by ``LLM_MAX_CONCURRENCY`` and recorded
+        in the LLM call metrics.
+
+        When ``on_chunk`` is given the response is streamed instead and
+        the callback is invoked as ``on_chunk(text, tokens)`` for every
+        text chunk, where ``tokens`` is the cumulative output token count
+        reported by the API (or ``None`` when unavailable).  Returning a
+        truthy value from the callback stops the stream early.
+
+        ``cached_content`` names a context-cache entry (see
+        ``prompt_cache_service``) whose contents precede ``contents``.
         """
-        loop = asyncio.get_running_loop()
-        return await loop.run_in_executor(
-            None, self.generate_content, contents
-        )
+        request = _generate_request(contents, cached_content)
+        if on_chunk is not None:
+            async with llm_call_slot("stream"):
+                return await self._async_stream_content(request, on_chunk)
+        async with llm_call_slot("generate"):
+            return await self._client.aio.models.generate_content(**request)
+
+    async def _async_stream_content(self, request, on_chunk) -> "StreamedResponse":
+        """Stream a generation through the SDK's async client."""
+        stream = await self._client.aio.models.generate_content_stream(**request)
+        parts: list[str] = []
+        aborted = False
+        try:
+            async for chunk in stream:
+                text = chunk.text or ""
+                if not text:
+                    continue
+                parts.append(text)
+                usage = getattr(chunk, "usage_metadata", None)
+                tokens = getattr(usage, "candidates_token_count", None)
+                if on_chunk(text, tokens if isinstance(tokens, int) else None):
+                    aborted = True
+                    break
+        finally:
+            aclose = getattr(stream, "aclose", None)
+            if aclose is not None:
+                await aclose()
+        return StreamedResponse(text="".join(parts), aborted=aborted)
+
+
+def _generate_request(contents, cached_content=None) -> dict:
+    """Build generate_content keyword arguments, referencing a cached prefix if given."""
+    request = {"model": get_model_name(), "contents": contents}
+    if cached_content:
+        request["config"] = genai.types.GenerateContentConfig(cached_content=cached_content)
+    return request
+
+
+@dataclass
+class StreamedResponse:
+    """Aggregated result of a streamed generation.
+
+    Mirrors the ``.text`` attribute of ``GenerateContentResponse`` so
+    callers can treat streamed and one-shot responses alike.
+    """
+    text: str
+    aborted: bool = False
 
 
 def get_author_instruction() -> str:
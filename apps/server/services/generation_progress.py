@@ -21,6 +21,7 @@ class GenerationPhase(str, Enum):
     UPLOADING = "uploading"
     COMPLETE = "complete"
     FAILED = "failed"
+    CANCELLED = "cancelled"
     KEEPALIVE = "keepalive"
 
 
@@ -34,6 +35,8 @@ class ProgressEvent:
     elapsed: float = 0.0      # seconds since generation started
     result: Optional[Dict[str, Any]] = None
     error: Optional[str] = None
+    tokens: Optional[int] = None  # output tokens streamed so far
+    position: Optional[int] = None  # 1-based queue position while QUEUED
 
 
 @dataclass
@@ -50,7 +53,9 @@ class GenerationState:
         event.elapsed = round(time.monotonic() - self.created_at, 1)
         self.events.append(event)
 
-        if event.phase in (GenerationPhase.COMPLETE, GenerationPhase.FAILED):
+        if event.phase in (
+            GenerationPhase.COMPLETE, GenerationPhase.FAILED, GenerationPhase.CANCELLED
+        ):
             self._completed = True
 
         # Wake up all waiting SSE consumers
@@ -102,7 +107,7 @@ class GenerationState:
         }
 
 
-# In-memory store of active generations (only one at a time due to lock)
+# In-memory store of queued, running and recently finished generations
 _active_generations: Dict[str, GenerationState] = {}
 
 
@@ -0,0 +1,202 @@
+"""Job queue for profile generations.
+
+Runs up to ``GENERATION_MAX_CONCURRENCY`` generations at once and holds the
+rest in FIFO order, publishing their queue position through the job's
+:class:`GenerationState`.  Resource use on small hosts is bounded by the
+parallelism limit rather than by rejecting concurrent requests; only when
+``GENERATION_MAX_QUEUE`` jobs are already waiting is a new one refused.
+"""
+
+import asyncio
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from config import GENERATION_MAX_CONCURRENCY, GENERATION_MAX_QUEUE
+from logging_config import get_logger
+from services.generation_progress import (
+    GenerationPhase, GenerationState, ProgressEvent, remove_generation,
+)
+
+logger = get_logger()
+
+# Seconds a finished job's state is kept so SSE clients can read the final event
+STATE_RETENTION_SECONDS = 30
+
+
+class QueueFullError(Exception):
+    """Raised when the generation queue cannot accept another job."""
+
+
+@dataclass
+class _Job:
+    generation_id: str
+    state: GenerationState
+    task: Optional[asyncio.Task] = None
+    slot: Optional[asyncio.Future] = field(default=None, repr=False)
+    started: bool = False
+
+
+class GenerationQueue:
+    """Bounded-parallelism FIFO queue of profile generation jobs."""
+
+    def __init__(self, max_concurrent: int = 1, max_pending: int = 8):
+        self.max_concurrent = max(1, max_concurrent)
+        self.max_pending = max(0, max_pending)
+        self._jobs: Dict[str, _Job] = {}
+        self._waiting: List[_Job] = []
+        self._running: set = set()
+
+    # ── Introspection ─────────────────────────────────────────────────────
+
+    def is_full(self) -> bool:
+        """Return True when a new job would have to be refused."""
+        return (
+            len(self._running) >= self.max_concurrent
+            and len(self._waiting) >= self.max_pending
+        )
+
+    def has_job(self, generation_id: str) -> bool:
+        return generation_id in self._jobs
+
+    def position(self, generation_id: str) -> Optional[int]:
+        """Return the 1-based queue position, 0 when running, None if unknown."""
+        job = self._jobs.get(generation_id)
+        if job is None:
+            return None
+        if job in self._waiting:
+            return self._waiting.index(job) + 1
+        return 0
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "max_concurrent": self.max_concurrent,
+            "max_pending": self.max_pending,
+            "running": sorted(self._running),
+            "waiting": [job.generation_id for job in self._waiting],
+        }
+
+    # ── Submission / cancellation ─────────────────────────────────────────
+
+    def submit(
+        self,
+        generation_id: str,
+        state: GenerationState,
+        run: Callable[[], Awaitable[Any]],
+    ) -> asyncio.Task:
+        """Queue a generation and return the task that will produce its result.
+
+        The job either takes a free slot immediately or joins the back of the
+        queue.  The returned task ends cancelled if the job is cancelled.
+
+        Args:
+            generation_id: Unique job ID (also the progress-state key).
+            state: Progress state that receives queue and cancel events.
+            run: Zero-argument coroutine factory performing the generation.
+
+        Raises:
+            QueueFullError: If the queue is full.
+            ValueError: If a job with the same ID is already queued or running.
+        """
+        if generation_id in self._jobs:
+            raise ValueError(f"Generation {generation_id} already exists")
+        if self.is_full():
+            raise QueueFullError(
+                f"{len(self._running)} generations running and "
+                f"{len(self._waiting)} waiting"
+            )
+        job = _Job(generation_id=generation_id, state=state)
+        self._jobs[generation_id] = job
+        if len(self._running) < self.max_concurrent and not self._waiting:
+            self._running.add(generation_id)
+        else:
+            job.slot = asyncio.get_running_loop().create_future()
+            self._waiting.append(job)
+            self._announce_positions()
+        job.task = asyncio.create_task(self._run(job, run))
+        job.task.add_done_callback(lambda task: self._finish(job, task))
+        return job.task
+
+    def cancel(self, generation_id: str) -> bool:
+        """Cancel a queued or running job. Returns False if it is unknown."""
+        job = self._jobs.get(generation_id)
+        if job is None or job.task is None or job.task.done():
+            return False
+        job.task.cancel()
+        if job in self._waiting:
+            # Move everyone behind it up now rather than when the task unwinds
+            self._waiting.remove(job)
+            self._announce_positions()
+        return True
+
+    # ── Internals ─────────────────────────────────────────────────────────
+
+    @staticmethod
+    async def _run(job: _Job, run: Callable[[], Awaitable[Any]]) -> Any:
+        if job.slot is not None:
+            await job.slot
+        job.started = True
+        return await run()
+
+    def _finish(self, job: _Job, task: asyncio.Task) -> None:
+        """Release the job's slot or queue place once its task is done."""
+        self._jobs.pop(job.generation_id, None)
+        if job in self._waiting:
+            self._waiting.remove(job)
+            self._announce_positions()
+        if job.generation_id in self._running:
+            self._release(job)
+
+        if task.cancelled():
+            logger.info(
+                "Profile generation cancelled",
+                extra={"generation_id": job.generation_id, "started": job.started},
+            )
+            job.state.emit(ProgressEvent(
+                phase=GenerationPhase.CANCELLED,
+                message="Generation cancelled",
+            ))
+        else:
+            # Mark the exception retrieved; the generation already reported it
+            task.exception()
+
+        asyncio.get_running_loop().call_later(
+            STATE_RETENTION_SECONDS, remove_generation, job.generation_id
+        )
+
+    def _release(self, job: _Job) -> None:
+        self._running.discard(job.generation_id)
+        promoted = False
+        while self._waiting and len(self._running) < self.max_concurrent:
+            nxt = self._waiting.pop(0)
+            if nxt.slot.done():
+                continue  # cancelled while waiting; its callback is pending
+            self._running.add(nxt.generation_id)
+            nxt.slot.set_result(None)
+            promoted = True
+        if promoted:
+            self._announce_positions()
+
+    def _announce_positions(self) -> None:
+        for index, job in enumerate(self._waiting, start=1):
+            job.state.emit(ProgressEvent(
+                phase=GenerationPhase.QUEUED,
+                message=(
+                    "Waiting for the next free slot..." if index == 1
+                    else f"Waiting in queue ({index - 1} ahead)..."
+                ),
+                position=index,
+            ))
+
+
+_queue: Optional[GenerationQueue] = None
+
+
+def get_generation_queue() -> GenerationQueue:
+    """Return the process-wide generation queue, creating it on first use."""
+    global _queue
+    if _queue is None:
+        _queue = GenerationQueue(
+            max_concurrent=GENERATION_MAX_CONCURRENCY,
+            max_pending=GENERATION_MAX_QUEUE,
+        )
+    return _queue
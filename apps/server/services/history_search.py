@@ -0,0 +1,282 @@
+"""In-process full-text index over profile history.
+
+An inverted index (token -> entry id -> weighted term frequency) covering
+the profile name, coffee analysis, user preferences, notes and the text
+fields of the generated profile JSON.  Queries are ranked with BM25; all
+query terms must match, and the last term also matches as a prefix so
+results update while the user is typing.
+
+The index is built lazily from the history on the first search and then
+kept current by the history service, which re-indexes an entry whenever it
+is added or edited and removes it when it is deleted.  Other code saves
+history by editing entries in place; such saves only mark the index stale
+(or, when the ids of the changed entries are known, just those entries),
+and the next search re-indexes the entries whose indexed fields changed.
+"""
+
+import json
+import math
+import re
+import threading
+from bisect import bisect_left
+from collections import Counter
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+# Relative weight of a term occurrence per field
+FIELD_WEIGHTS = {
+    "profile_name": 3.0,
+    "notes": 2.0,
+    "coffee_analysis": 1.0,
+    "user_preferences": 1.0,
+    "profile_json": 1.0,
+}
+
+# Profile JSON keys whose values are identifiers, not searchable text
+_SKIPPED_PROFILE_KEYS = {"id", "previous_authors", "author_id", "last_changed"}
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+# BM25 parameters
+_K1 = 1.2
+_B = 0.75
+
+
+def tokenize(text: str) -> List[str]:
+    """Split *text* into lowercase word tokens."""
+    return _TOKEN_RE.findall(text.casefold())
+
+
+def _profile_text(value: Any, depth: int = 0) -> Iterable[str]:
+    """Yield the string values of a profile JSON document."""
+    if depth > 6:
+        return
+    if isinstance(value, str):
+        yield value
+    elif isinstance(value, dict):
+        for key, item in value.items():
+            if key not in _SKIPPED_PROFILE_KEYS:
+                yield from _profile_text(item, depth + 1)
+    elif isinstance(value, list):
+        for item in value:
+            yield from _profile_text(item, depth + 1)
+
+
+def entry_terms(entry: dict) -> Counter:
+    """Return the weighted term frequencies of a history entry."""
+    terms: Counter = Counter()
+    for field, weight in FIELD_WEIGHTS.items():
+        value = entry.get(field)
+        if not value:
+            continue
+        texts = _profile_text(value) if field == "profile_json" else [str(value)]
+        for text in texts:
+            for token in tokenize(text):
+                terms[token] += weight
+    return terms
+
+
+def entry_signature(entry: dict) -> tuple:
+    """Fingerprint of the indexed fields, used to detect edits.
+
+    The profile JSON is compared by content, so edits made inside the
+    same dict are noticed too.
+    """
+    return tuple(
+        hash(json.dumps(entry.get(field), sort_keys=True, default=str))
+        if field == "profile_json" else entry.get(field)
+        for field in FIELD_WEIGHTS
+    )
+
+
+class HistorySearchIndex:
+    """Incrementally updated inverted index with BM25 ranking."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._postings: Dict[str, Dict[str, float]] = {}
+        self._doc_terms: Dict[str, Counter] = {}
+        self._doc_lengths: Dict[str, float] = {}
+        self._signatures: Dict[str, tuple] = {}
+        self._total_length = 0.0
+        self._vocabulary: Optional[List[str]] = None
+        self.built = False
+        self.stale = False
+        # Ids of entries edited in place since the last sync
+        self._changed: set = set()
+
+    def __len__(self) -> int:
+        return len(self._doc_terms)
+
+    def rebuild(self, entries: Iterable[dict]) -> None:
+        """Replace the index contents with *entries*."""
+        with self._lock:
+            self._clear()
+            for entry in entries:
+                self._add(entry)
+            self.built = True
+            self.stale = False
+            self._changed.clear()
+
+    @property
+    def needs_sync(self) -> bool:
+        """True if in-place edits are waiting for :meth:`sync`."""
+        return self.stale or bool(self._changed)
+
+    def mark_changed(self, entry_ids: Iterable[Any]) -> None:
+        """Record in-place edits of *entry_ids* for the next :meth:`sync`."""
+        with self._lock:
+            if self.built:
+                self._changed.update(str(entry_id) for entry_id in entry_ids)
+
+    def sync(self, entries: Iterable[dict]) -> int:
+        """Re-index changed entries and drop missing ones after in-place edits.
+
+        When only :meth:`mark_changed` edits are pending, just those entries
+        are re-indexed; after a :attr:`stale` save every entry is compared
+        with its indexed signature.
+
+        Returns:
+            Number of entries added, re-indexed or removed.
+        """
+        with self._lock:
+            changed = None if self.stale else self._changed
+            seen = set()
+            updated = 0
+            for entry in entries:
+                if not entry.get("id"):
+                    continue
+                doc_id = str(entry["id"])
+                if changed is not None:
+                    if doc_id in changed:
+                        seen.add(doc_id)
+                        self._remove(doc_id)
+                        self._add(entry)
+                        updated += 1
+                    continue
+                seen.add(doc_id)
+                if self._signatures.get(doc_id) != entry_signature(entry):
+                    self._remove(doc_id)
+                    self._add(entry)
+                    updated += 1
+            missing = self._doc_terms if changed is None else changed
+            for doc_id in [d for d in missing if d not in seen and d in self._doc_terms]:
+                self._remove(doc_id)
+                updated += 1
+            self.stale = False
+            self._changed = set()
+            return updated
+
+    def invalidate(self) -> None:
+        """Drop the index; the next search rebuilds it."""
+        with self._lock:
+            self._clear()
+            self.built = False
+            self.stale = False
+            self._changed.clear()
+
+    def index_entry(self, entry: dict) -> None:
+        """Add or re-index one entry (ignored until the index is built)."""
+        with self._lock:
+            if not self.built or not entry.get("id"):
+                return
+            self._remove(str(entry["id"]))
+            self._add(entry)
+
+    def remove(self, entry_id: str) -> None:
+        """Remove an entry from the index."""
+        with self._lock:
+            self._remove(str(entry_id))
+
+    def search(self, query: str, limit: int = 20) -> List[Tuple[str, float]]:
+        """Return ``(entry_id, score)`` pairs, best match first.
+
+        Every query term must occur in an entry; the last term also matches
+        any indexed word it is a prefix of.
+        """
+        tokens = tokenize(query)
+        if not tokens:
+            return []
+        with self._lock:
+            n_docs = len(self._doc_terms)
+            if n_docs == 0:
+                return []
+            avg_length = self._total_length / n_docs or 1.0
+            scores: Optional[Dict[str, float]] = None
+            unique = list(dict.fromkeys(tokens))
+            for i, token in enumerate(unique):
+                variants = [token]
+                if i == len(unique) - 1:
+                    variants = self._with_prefix(token) or variants
+                term_scores: Dict[str, float] = {}
+                for variant in variants:
+                    postings = self._postings.get(variant)
+                    if not postings:
+                        continue
+                    idf = math.log(1 + (n_docs - len(postings) + 0.5) / (len(postings) + 0.5))
+                    for doc_id, tf in postings.items():
+                        norm = tf + _K1 * (1 - _B + _B * self._doc_lengths[doc_id] / avg_length)
+                        score = idf * tf * (_K1 + 1) / norm
+                        term_scores[doc_id] = max(term_scores.get(doc_id, 0.0), score)
+                if scores is None:
+                    scores = term_scores
+                else:
+                    scores = {
+                        doc_id: score + term_scores[doc_id]
+                        for doc_id, score in scores.items() if doc_id in term_scores
+                    }
+                if not scores:
+                    return []
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+        return ranked[:max(0, limit)]
+
+    # ── Internals (caller holds the lock) ─────────────────────────────────
+
+    def _clear(self) -> None:
+        self._postings.clear()
+        self._doc_terms.clear()
+        self._doc_lengths.clear()
+        self._signatures.clear()
+        self._total_length = 0.0
+        self._vocabulary = None
+
+    def _add(self, entry: dict) -> None:
+        if not entry.get("id"):
+            return
+        doc_id = str(entry["id"])
+        terms = entry_terms(entry)
+        self._doc_terms[doc_id] = terms
+        self._signatures[doc_id] = entry_signature(entry)
+        length = sum(terms.values())
+        self._doc_lengths[doc_id] = length
+        self._total_length += length
+        for token, tf in terms.items():
+            postings = self._postings.setdefault(token, {})
+            if not postings:
+                self._vocabulary = None
+            postings[doc_id] = tf
+
+    def _remove(self, doc_id: str) -> None:
+        terms = self._doc_terms.pop(doc_id, None)
+        if terms is None:
+            return
+        self._total_length -= self._doc_lengths.pop(doc_id, 0.0)
+        self._signatures.pop(doc_id, None)
+        for token in terms:
+            postings = self._postings.get(token)
+            if postings is None:
+                continue
+            postings.pop(doc_id, None)
+            if not postings:
+                del self._postings[token]
+                self._vocabulary = None
+
+    def _with_prefix(self, prefix: str) -> List[str]:
+        if self._vocabulary is None:
+            self._vocabulary = sorted(self._postings)
+        start = bisect_left(self._vocabulary, prefix)
+        matches = []
+        for token in self._vocabulary[start:]:
+            if not token.startswith(prefix):
+                break
+            matches.append(token)
+        return matches
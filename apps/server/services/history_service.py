@@ -1,5 +1,7 @@
 """History service for managing profile creation history."""
 
+import base64
+import binascii
 import hashlib
 import json
 import re
@@ -9,25 +11,99 @@ from pathlib import Path
 from typing import Optional
 
 from logging_config import get_logger
-from config import DATA_DIR
-from utils.file_utils import atomic_write_json
+from config import DATA_DIR, HISTORY_MAX_ENTRIES
+from services.blob_store import delete_blob, put_blob
+from services.history_search import HistorySearchIndex
+from services.persistence_service import (
+    after_write, get_persistence, mark_dirty, read_dataset, register_dataset,
+)
 from utils.sanitization import clean_profile_name
 
 logger = get_logger()
 
 HISTORY_FILE = DATA_DIR / "profile_history.json"
 
-# In-memory cache (loaded from disk on first access, write-through on save)
+# In-memory cache (loaded from disk on first access; saves are coalesced
+# by the persistence service)
 _history_cache: Optional[list] = None
 
+# Full-text index over the cached history, built on the first search
+_search_index = HistorySearchIndex()
+
+register_dataset(
+    "history", lambda: HISTORY_FILE, lambda: list(_history_cache or []),
+    collection="history", kind="list",
+)
+
 
 def ensure_history_file():
-    """Ensure the history file and directory exist."""
+    """Ensure the history file and directory exist (JSON storage only)."""
+    if get_persistence().uses_database("history"):
+        return
     HISTORY_FILE.parent.mkdir(parents=True, exist_ok=True)
     if not HISTORY_FILE.exists():
         HISTORY_FILE.write_text("[]")
 
 
+_DATA_URL_RE = re.compile(r"^data:(?P<mime>[\w.+-]+/[\w.+-]+);base64,(?P<data>.*)$", re.DOTALL)
+
+
+def _store_image_preview(image_preview: str) -> Optional[tuple]:
+    """Move a base64 preview (plain or data URL) into the blob store.
+
+    Returns:
+        ``(digest, media_type)``, or None if the preview is not valid base64.
+    """
+    media_type = "image/jpeg"
+    data = image_preview
+    match = _DATA_URL_RE.match(image_preview)
+    if match:
+        media_type, data = match.group("mime"), match.group("data")
+    try:
+        raw = base64.b64decode(data, validate=True)
+    except (binascii.Error, ValueError):
+        return None
+    if not raw:
+        return None
+    return put_blob(raw), media_type
+
+
+def _externalize_preview(entry: dict) -> bool:
+    """Replace an inline ``image_preview`` with a blob reference.
+
+    Returns True if the entry was changed.
+    """
+    preview = entry.get("image_preview")
+    if not preview and "image_preview" not in entry:
+        return False
+    entry.pop("image_preview", None)
+    if isinstance(preview, str) and preview:
+        stored = _store_image_preview(preview)
+        if stored:
+            entry["image_preview_hash"], entry["image_preview_type"] = stored
+    return True
+
+
+def release_image_previews(removed: list) -> None:
+    """Delete the preview blobs of *removed* entries once nothing uses them.
+
+    Call it after saving the history without them.  The blobs are only
+    deleted once that save is stored, so a crash or failed write never
+    leaves stored entries pointing at missing blobs, and only if no entry
+    in the history uses them by then.
+    """
+    digests = {e.get("image_preview_hash") for e in removed if isinstance(e, dict)} - {None}
+    if not digests:
+        return
+
+    def delete_unused():
+        in_use = {e.get("image_preview_hash") for e in _history_cache or [] if isinstance(e, dict)}
+        for digest in digests - in_use:
+            delete_blob(digest)
+
+    after_write("history", delete_unused)
+
+
 def load_history() -> list:
     """Load history, using in-memory copy when available.
     
@@ -37,10 +113,10 @@ def load_history() -> list:
     global _history_cache
     if _history_cache is not None:
         return _history_cache
+    _search_index.invalidate()
     ensure_history_file()
     try:
-        with open(HISTORY_FILE, 'r', encoding='utf-8') as f:
-            raw = json.load(f)
+        raw = read_dataset("history")
     except (json.JSONDecodeError, FileNotFoundError):
         raw = []
 
@@ -57,6 +133,7 @@ def load_history() -> list:
     # can be derived).  Entries like {"id": "test123", "name": "TestProfile"}
     # are test artefacts and must be dropped.
     valid = []
+    moved_previews = 0
     for entry in raw:
         if not isinstance(entry, dict):
             continue
@@ -69,13 +146,19 @@ def load_history() -> list:
                 entry.get("id"),
             )
             continue
+        # Previews used to be stored inline as base64
+        if _externalize_preview(entry):
+            moved_previews += 1
         valid.append(entry)
     
-    if len(valid) != len(raw):
-        logger.info(
-            "Filtered %d malformed entries from history (kept %d)",
-            len(raw) - len(valid), len(valid),
-        )
+    if moved_previews:
+        logger.info("Moved %d inline image previews to the blob store", moved_previews)
+    if len(valid) != len(raw) or moved_previews:
+        if len(valid) != len(raw):
+            logger.info(
+                "Filtered %d malformed entries from history (kept %d)",
+                len(raw) - len(valid), len(valid),
+            )
         # Persist the cleaned list so bad entries don't come back
         _history_cache = valid
         save_history(valid)
@@ -85,12 +168,73 @@ def load_history() -> list:
     return _history_cache
 
 
-def save_history(history: list):
-    """Write-through: update in-memory cache and persist to disk."""
+def save_history(history: list, changed_ids: Optional[list] = None, index_updated: bool = False):
+    """Update the in-memory cache and schedule it to be written to disk.
+
+    Pass the ids of the added, edited or removed entries as *changed_ids*
+    when they are known: with database storage only those entries are then
+    written, so the cost of a save does not grow with the history.
+
+    Replacing the cached list (rather than mutating it) drops the search
+    index, which is rebuilt on the next search.  In-place edits are
+    re-indexed on the next search: only the *changed_ids* entries when
+    given, otherwise every entry whose indexed fields changed.  Pass
+    *index_updated* when the caller has already updated the index itself.
+    """
     global _history_cache
+    if history is not _history_cache:
+        _search_index.invalidate()
+    elif not index_updated:
+        if changed_ids is not None:
+            _search_index.mark_changed(changed_ids)
+        else:
+            _search_index.stale = True
     _history_cache = history
-    ensure_history_file()
-    atomic_write_json(HISTORY_FILE, history)
+    mark_dirty("history", changed_ids)
+
+
+def _is_valid_entry(entry) -> bool:
+    """Same validity rules as load_history(), which cleans the stored data."""
+    return (
+        isinstance(entry, dict) and bool(entry.get("id"))
+        and bool(entry.get("profile_name") or entry.get("reply"))
+    )
+
+
+def get_history_page(offset: int, limit: int) -> tuple:
+    """Return ``(entries, total)`` for one page of history, newest first.
+
+    Served from the in-memory history when it is loaded.  Otherwise only
+    the requested page is read from storage (the whole file with JSON
+    storage), without loading the rest of the history.
+    """
+    offset, limit = max(0, offset), max(0, limit)
+    if _history_cache is not None:
+        return _history_cache[offset:offset + limit], len(_history_cache)
+    try:
+        entries, total = get_persistence().read_page("history", offset, limit)
+    except (json.JSONDecodeError, FileNotFoundError):
+        return [], 0
+    return [e for e in entries if _is_valid_entry(e)], total
+
+
+def search_history(query: str, limit: int = 20) -> list:
+    """Full-text search over history entries.
+
+    Args:
+        query: Free-text query; all words must match, the last as a prefix.
+        limit: Maximum number of results.
+
+    Returns:
+        ``(entry, score)`` pairs, best match first.
+    """
+    if not _search_index.built:
+        _search_index.rebuild(load_history())
+    elif _search_index.needs_sync:
+        _search_index.sync(load_history())
+    ranked = _search_index.search(query, limit)
+    entries = _get_entries([entry_id for entry_id, _ in ranked])
+    return [(entries[entry_id], score) for entry_id, score in ranked if entry_id in entries]
 
 
 def _extract_profile_json(reply: str) -> Optional[dict]:
@@ -147,7 +291,8 @@ def save_to_history(
         coffee_analysis: The coffee bag analysis text
         user_prefs: User preferences provided
         reply: The full LLM reply
-        image_preview: Optional base64 image preview (thumbnail)
+        image_preview: Optional base64 image preview (thumbnail), stored
+            in the blob store; the entry keeps only its digest
         
     Returns:
         The saved history entry
@@ -170,16 +315,29 @@ def save_to_history(
         "user_preferences": user_prefs,
         "reply": reply,
         "profile_json": profile_json,
-        "image_preview": image_preview  # Optional thumbnail
     }
+    if image_preview:
+        stored = _store_image_preview(image_preview)
+        if stored:
+            entry["image_preview_hash"], entry["image_preview_type"] = stored
     
     # Add to beginning of list (most recent first)
     history.insert(0, entry)
     
-    # Keep only last 100 entries to prevent file from growing too large
-    history = history[:100]
+    # Optional retention limit (HISTORY_MAX_ENTRIES; unlimited by default)
+    dropped = []
+    if HISTORY_MAX_ENTRIES and len(history) > HISTORY_MAX_ENTRIES:
+        dropped = history[HISTORY_MAX_ENTRIES:]
+        del history[HISTORY_MAX_ENTRIES:]
+        for old in dropped:
+            _search_index.remove(old.get("id", ""))
     
-    save_history(history)
+    _search_index.index_entry(entry)
+    save_history(
+        history, [entry_id] + [old.get("id") for old in dropped if old.get("id")],
+        index_updated=True,
+    )
+    release_image_previews(dropped)
     
     logger.info(
         f"Saved profile to history: {profile_name}",
@@ -211,7 +369,8 @@ def update_entry_notes(entry_id: str, notes: str) -> Optional[dict]:
                 entry.pop("notes", None)
                 entry.pop("notes_updated_at", None)
             
-            save_history(history)
+            _search_index.index_entry(entry)
+            save_history(history, [entry_id], index_updated=True)
             
             logger.info(
                 f"Updated notes for history entry: {entry.get('profile_name', entry_id)}",
@@ -223,20 +382,73 @@ def update_entry_notes(entry_id: str, notes: str) -> Optional[dict]:
     return None
 
 
+def delete_entry(entry_id: str) -> Optional[dict]:
+    """Delete a history entry and, once that is stored, its preview blob.
+
+    Returns:
+        The deleted entry, or None if not found.
+    """
+    history = load_history()
+    for index, entry in enumerate(history):
+        if entry.get("id") == entry_id:
+            del history[index]
+            _search_index.remove(entry_id)
+            save_history(history, [entry_id], index_updated=True)
+            release_image_previews([entry])
+            return entry
+    return None
+
+
+def clear_entries() -> int:
+    """Delete every history entry and their preview blobs.
+
+    Returns:
+        Number of entries deleted.
+    """
+    removed = list(load_history())
+    save_history([])
+    release_image_previews(removed)
+    return len(removed)
+
+
 def get_entry_by_id(entry_id: str) -> Optional[dict]:
     """Get a history entry by its ID.
     
+    With database storage the entry's row is read on its own, unless it
+    has unsaved changes; otherwise (and with JSON storage) it is looked up
+    in the loaded history.  Treat the result as read-only: edit entries
+    through the history list and ``save_history``.
+    
     Args:
         entry_id: The ID of the entry to find.
     
     Returns:
         The entry dict, or None if not found.
     """
-    history = load_history()
-    for entry in history:
-        if entry.get("id") == entry_id:
-            return entry
-    return None
+    return _get_entries([entry_id]).get(entry_id)
+
+
+def _get_entries(entry_ids: list) -> dict:
+    """Look up several entries (see ``get_entry_by_id``); returns id -> entry."""
+    found = {}
+    remaining = set()
+    persistence = get_persistence()
+    keyed = persistence.uses_database("history")
+    for entry_id in entry_ids:
+        if keyed and not persistence.has_pending("history", entry_id):
+            entry = persistence.read_item("history", entry_id)
+            if entry is None:
+                continue
+            # Legacy inline previews are moved to the blob store by load_history()
+            if _is_valid_entry(entry) and "image_preview" not in entry:
+                found[entry_id] = entry
+                continue
+        remaining.add(entry_id)
+    if remaining:
+        for entry in load_history():
+            if entry.get("id") in remaining:
+                found[entry["id"]] = entry
+    return found
 
 
 def compute_content_hash(profile_dict: dict) -> str:
@@ -277,7 +489,8 @@ def update_entry_sync_fields(
             if reply is not None:
                 entry["reply"] = reply
 
-            save_history(history)
+            _search_index.index_entry(entry)
+            save_history(history, [entry_id], index_updated=True)
 
             logger.info(
                 f"Updated sync fields for history entry: {entry.get('profile_name', entry_id)}",
@@ -0,0 +1,263 @@
+"""Streaming shot analysis, computed while the shot is being pulled.
+
+The live shot recorder feeds every recorded row to a
+:class:`LiveShotAnalyzer`, which keeps running statistics per stage
+(:class:`OnlineStageStats` — the same figures ``_compute_stage_stats``
+computes from a finished shot, in O(1) memory per stage).  During the shot
+it reports, through its ``on_event`` callback:
+
+``exit_trigger``
+    A stage's exit trigger condition was met (as judged by
+    ``_determine_exit_trigger_hit``).
+``stage_complete``
+    A stage ended, with its assessment against the profile.
+``preinfusion_volume``
+    Pre-infusion stages already let through more than 10% of the
+    profile's target weight.
+``verdict``
+    The shot ended; carries the full local analysis (without chart
+    curves), identical to the post-shot analysis of the same data.
+
+The profile is looked up on the machine when the shot starts; stage
+statistics are collected from the first row, so a profile that arrives a
+moment later still gets a complete analysis.
+"""
+
+import logging
+from typing import Any, Callable, Dict, List, Optional
+
+from services.analysis_service import (
+    PREINFUSION_KEYWORDS,
+    STAGE_STATUS_RETRACTING,
+    _analyze_shot_stages,
+    _analyze_stage_execution,
+    _determine_exit_trigger_hit,
+    _profile_to_analysis_data,
+)
+from services.meticulous_service import async_get_profile, async_list_profiles
+
+logger = logging.getLogger(__name__)
+
+# Seconds of absolute shot time ignored for flow statistics (plunger retraction)
+FLOW_IGNORE_WINDOW = 3.5
+
+# Share of the target weight pre-infusion may use before it is flagged
+PREINFUSION_VOLUME_LIMIT = 0.10
+
+
+class OnlineStageStats:
+    """Running statistics of one stage, matching ``_compute_stage_stats``."""
+
+    __slots__ = (
+        "start_time", "end_time", "start_weight", "end_weight",
+        "start_pressure", "end_pressure", "min_pressure", "max_pressure", "_pressure_sum",
+        "start_flow", "end_flow", "_flow", "_flow_filtered", "count",
+    )
+
+    def __init__(self):
+        self.count = 0
+        # Flow statistics, all samples and past FLOW_IGNORE_WINDOW: [min, max, sum, n]
+        self._flow = [0.0, 0.0, 0.0, 0]
+        self._flow_filtered = [0.0, 0.0, 0.0, 0]
+
+    def add(self, t: float, pressure: float, flow: float, weight: float) -> None:
+        if self.count == 0:
+            self.start_time = self.end_time = t
+            self.start_weight = weight
+            self.start_pressure = self.min_pressure = self.max_pressure = pressure
+            self._pressure_sum = 0.0
+            self.start_flow = flow
+        self.count += 1
+        self.start_time = min(self.start_time, t)
+        self.end_time = max(self.end_time, t)
+        self.end_weight = weight
+        self.end_pressure = pressure
+        self.min_pressure = min(self.min_pressure, pressure)
+        self.max_pressure = max(self.max_pressure, pressure)
+        self._pressure_sum += pressure
+        self.end_flow = flow
+        self._add_flow(self._flow, flow)
+        if t >= FLOW_IGNORE_WINDOW:
+            self._add_flow(self._flow_filtered, flow)
+
+    @staticmethod
+    def _add_flow(acc: list, flow: float) -> None:
+        if acc[3] == 0:
+            acc[0] = acc[1] = flow
+        else:
+            acc[0] = min(acc[0], flow)
+            acc[1] = max(acc[1], flow)
+        acc[2] += flow
+        acc[3] += 1
+
+    def as_dict(self) -> Dict[str, Any]:
+        """The statistics in ``_compute_stage_stats`` form."""
+        if not self.count:
+            return {}
+        flow = self._flow_filtered if self._flow_filtered[3] else self._flow
+        return {
+            "start_time": self.start_time,
+            "end_time": self.end_time,
+            "duration": self.end_time - self.start_time,
+            "start_weight": self.start_weight,
+            "end_weight": self.end_weight,
+            "start_pressure": self.start_pressure,
+            "end_pressure": self.end_pressure,
+            "min_pressure": self.min_pressure,
+            "max_pressure": self.max_pressure,
+            "avg_pressure": self._pressure_sum / self.count,
+            "start_flow": self.start_flow,
+            "end_flow": self.end_flow,
+            "min_flow": flow[0],
+            "max_flow": flow[1],
+            "avg_flow": flow[2] / flow[3],
+            "entry_count": self.count,
+        }
+
+
+def _is_preinfusion(name: str, key: str = "") -> bool:
+    name, key = name.lower(), key.lower()
+    return any(kw in name for kw in PREINFUSION_KEYWORDS) or \
+        any(kw in key for kw in ['preinfusion', 'bloom', 'soak', 'fill'])
+
+
+class LiveShotAnalyzer:
+    """Incremental shot-vs-profile analysis for one shot."""
+
+    def __init__(
+        self,
+        profile: Optional[dict] = None,
+        on_event: Optional[Callable[[dict], None]] = None,
+    ):
+        self.profile: dict = profile or {}
+        self._on_event = on_event
+        self.stages: Dict[str, OnlineStageStats] = {}
+        self._current: Optional[str] = None
+        self._reported_exits: set = set()
+        self._preinfusion_flagged = False
+        self.final_weight = 0.0
+        self.total_time = 0.0
+        self.max_pressure = 0.0
+        self.max_flow = 0.0
+        self.events: List[dict] = []
+
+    def set_profile(self, profile: Optional[dict]) -> None:
+        """Attach the shot's profile (may arrive after the first rows)."""
+        self.profile = profile or {}
+
+    def _profile_stage(self, name: str) -> Optional[dict]:
+        wanted = name.lower().strip()
+        for stage in self.profile.get("stages", []):
+            if stage.get("name", "").lower().strip() == wanted:
+                return stage
+        return None
+
+    def _emit(self, event: dict) -> None:
+        self.events.append(event)
+        if self._on_event is not None:
+            try:
+                self._on_event(event)
+            except Exception as exc:
+                logger.warning("Live analysis event handler failed: %s", exc)
+
+    def add(
+        self,
+        t: float,
+        stage: Optional[str],
+        pressure: Optional[float],
+        flow: Optional[float],
+        weight: Optional[float],
+    ) -> None:
+        """Add one sample (*t* in seconds since the shot started)."""
+        pressure, flow, weight = pressure or 0.0, flow or 0.0, weight or 0.0
+        self.final_weight = max(self.final_weight, weight)
+        self.total_time = max(self.total_time, t)
+        self.max_pressure = max(self.max_pressure, pressure)
+        if t >= FLOW_IGNORE_WINDOW:
+            self.max_flow = max(self.max_flow, flow)
+
+        if stage and stage.lower().strip() == STAGE_STATUS_RETRACTING:
+            return
+        if stage and stage != self._current:
+            if self._current is not None:
+                self._complete_stage(self._current)
+            self._current = stage
+            # A stage entered again starts over, as in the post-shot analysis
+            self.stages[stage] = OnlineStageStats()
+            self._reported_exits.discard(stage)
+        if self._current is None:
+            return
+        stats = self.stages[self._current]
+        stats.add(t, pressure, flow, weight)
+        self._check_exit_triggers(self._current, stats)
+        self._check_preinfusion_volume()
+
+    def _check_exit_triggers(self, name: str, stats: OnlineStageStats) -> None:
+        if name in self._reported_exits:
+            return
+        profile_stage = self._profile_stage(name)
+        if not profile_stage or not profile_stage.get("exit_triggers"):
+            return
+        result = _determine_exit_trigger_hit(
+            stats.as_dict(), profile_stage["exit_triggers"],
+            variables=self.profile.get("variables", []),
+        )
+        if result["triggered"]:
+            self._reported_exits.add(name)
+            self._emit({"type": "exit_trigger", "stage": name,
+                        "time": round(stats.end_time, 1), "trigger": result["triggered"]})
+
+    def _check_preinfusion_volume(self) -> None:
+        target = self.profile.get("final_weight") or 0
+        if self._preinfusion_flagged or not target:
+            return
+        weight = 0.0
+        for name, stats in self.stages.items():
+            profile_stage = self._profile_stage(name) or {}
+            if _is_preinfusion(name, profile_stage.get("key", "")):
+                weight += max(0.0, stats.end_weight - stats.start_weight)
+        if weight > target * PREINFUSION_VOLUME_LIMIT:
+            self._preinfusion_flagged = True
+            percent = weight / target * 100
+            self._emit({
+                "type": "preinfusion_volume",
+                "severity": "warning" if percent <= 15 else "concern",
+                "message": f"Pre-infusion has already passed {percent:.1f}% of the {target:g}g target (target: ≤10%)",
+                "weight": round(weight, 1),
+            })
+
+    def _complete_stage(self, name: str) -> None:
+        profile_stage = self._profile_stage(name)
+        if profile_stage is None:
+            return
+        analysis = _analyze_stage_execution(
+            profile_stage, self.stages[name].as_dict(), self.total_time,
+            self.profile.get("variables", []),
+        )
+        self._emit({"type": "stage_complete", "stage": name, "assessment": analysis["assessment"]})
+
+    def finish(self) -> dict:
+        """Complete the analysis and emit the ``verdict`` event."""
+        if self._current is not None:
+            self._complete_stage(self._current)
+            self._current = None
+        analysis = _analyze_shot_stages(
+            {name: stats.as_dict() for name, stats in self.stages.items()},
+            self.profile, self.final_weight, self.total_time, self.max_pressure, self.max_flow,
+        )
+        self._emit({"type": "verdict", "analysis": analysis})
+        return analysis
+
+
+async def load_live_profile(profile_name: str) -> Optional[dict]:
+    """Fetch the machine profile named *profile_name* for analysis."""
+    if not profile_name:
+        return None
+    wanted = profile_name.lower().strip()
+    for partial_profile in await async_list_profiles():
+        if partial_profile.name.lower().strip() == wanted:
+            full_profile = await async_get_profile(partial_profile.id)
+            if hasattr(full_profile, 'error') and full_profile.error:
+                return None
+            return _profile_to_analysis_data(full_profile)
+    return None
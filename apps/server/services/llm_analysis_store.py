@@ -0,0 +1,244 @@
+"""Persistent store for LLM shot analyses.
+
+Analyses live in a SQLite database in WAL mode keyed by the cache key, so an
+insert or expiry touches one row instead of rewriting a JSON file holding
+every analysis.  Recently used entries are also kept in an in-memory LRU so
+repeated lookups of the same shot never reach the database.
+
+Bounds:
+- Entries older than ``ttl_seconds`` are never returned and are deleted by
+  :meth:`LLMAnalysisStore.sweep`, which the server runs periodically.
+- At most ``max_entries`` rows are kept; the least recently used are evicted
+  as new analyses are added.
+"""
+
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+from logging_config import get_logger
+
+logger = get_logger()
+
+# Number of analyses kept in memory
+HOT_SET_SIZE = 128
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS llm_analyses (
+    key           TEXT PRIMARY KEY,
+    profile_name  TEXT,
+    shot_date     TEXT,
+    shot_filename TEXT,
+    analysis      TEXT NOT NULL,
+    created_at    REAL NOT NULL,
+    last_used     REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_llm_analyses_created ON llm_analyses (created_at);
+CREATE INDEX IF NOT EXISTS idx_llm_analyses_last_used ON llm_analyses (last_used);
+"""
+
+
+class LLMAnalysisStore:
+    """SQLite-backed, TTL- and size-bounded analysis cache with a hot set."""
+
+    def __init__(self, db_path: Path, ttl_seconds: float, max_entries: int, hot_size: int = HOT_SET_SIZE):
+        self.db_path = Path(db_path)
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max(1, max_entries)
+        self.hot_size = max(0, hot_size)
+        self._lock = threading.Lock()
+        # key -> (analysis, created_at), most recently used last
+        self._hot: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()
+        # last_used times of hot-set hits, written back by sweep()
+        self._touched: Dict[str, float] = {}
+
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(self.db_path), check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+        self._count = self._conn.execute("SELECT COUNT(*) FROM llm_analyses").fetchone()[0]
+
+    # ── Lookup / insert ───────────────────────────────────────────────────
+
+    def get(self, key: str) -> Optional[str]:
+        """Return the analysis for *key*, or None if missing or expired."""
+        now = time.time()
+        with self._lock:
+            hot = self._hot.get(key)
+            if hot is not None:
+                analysis, created_at = hot
+                if now - created_at < self.ttl_seconds:
+                    self._hot.move_to_end(key)
+                    self._touched[key] = now
+                    return analysis
+                self._delete(key)
+                return None
+
+            row = self._conn.execute(
+                "SELECT analysis, created_at FROM llm_analyses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            analysis, created_at = row
+            if now - created_at >= self.ttl_seconds:
+                self._delete(key)
+                return None
+            self._conn.execute("UPDATE llm_analyses SET last_used = ? WHERE key = ?", (now, key))
+            self._remember(key, analysis, created_at)
+            return analysis
+
+    def put(self, key: str, analysis: str, *, profile_name: str = "", shot_date: str = "",
+            shot_filename: str = "", created_at: Optional[float] = None) -> None:
+        """Insert or replace an analysis, evicting the LRU entry when full."""
+        created_at = time.time() if created_at is None else created_at
+        with self._lock:
+            exists = self._conn.execute(
+                "SELECT 1 FROM llm_analyses WHERE key = ?", (key,)
+            ).fetchone() is not None
+            self._conn.execute(
+                "INSERT OR REPLACE INTO llm_analyses "
+                "(key, profile_name, shot_date, shot_filename, analysis, created_at, last_used) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, profile_name, shot_date, shot_filename, analysis, created_at, created_at),
+            )
+            if not exists:
+                self._count += 1
+            self._remember(key, analysis, created_at)
+            if self._count > self.max_entries:
+                self._evict(self._count - self.max_entries)
+
+    def __len__(self) -> int:
+        return self._count
+
+    # ── Maintenance ───────────────────────────────────────────────────────
+
+    def sweep(self) -> int:
+        """Delete expired entries and persist hot-set recency. Returns rows removed."""
+        cutoff = time.time() - self.ttl_seconds
+        with self._lock:
+            self._flush_touched()
+            removed = self._conn.execute(
+                "DELETE FROM llm_analyses WHERE created_at < ?", (cutoff,)
+            ).rowcount
+            for key in [k for k, (_, created) in self._hot.items() if created < cutoff]:
+                del self._hot[key]
+            self._count = self._conn.execute("SELECT COUNT(*) FROM llm_analyses").fetchone()[0]
+        if removed:
+            logger.info("Swept expired LLM analyses", extra={"removed": removed, "remaining": self._count})
+        return removed
+
+    def import_legacy_json(self, path: Path) -> int:
+        """Import unexpired entries from the old ``llm_analysis_cache.json``.
+
+        The file is renamed with a ``.migrated`` suffix afterwards so the
+        import runs once.  Returns the number of entries imported.
+        """
+        path = Path(path)
+        if not path.exists():
+            return 0
+        try:
+            data = json.loads(path.read_text())
+        except (json.JSONDecodeError, OSError):
+            data = None
+        imported = 0
+        now = time.time()
+        if isinstance(data, dict):
+            for key, entry in data.items():
+                if not isinstance(entry, dict) or not entry.get("analysis"):
+                    continue
+                created_at = entry.get("timestamp", 0)
+                if not isinstance(created_at, (int, float)) or now - created_at >= self.ttl_seconds:
+                    continue
+                self.put(
+                    key, entry["analysis"],
+                    profile_name=entry.get("profile_name", ""),
+                    shot_date=entry.get("shot_date", ""),
+                    shot_filename=entry.get("shot_filename", ""),
+                    created_at=created_at,
+                )
+                imported += 1
+        try:
+            path.replace(path.with_name(path.name + ".migrated"))
+        except OSError as e:
+            logger.warning(f"Could not rename migrated LLM cache file: {e}")
+        logger.info("Imported legacy LLM analysis cache", extra={"entries": imported})
+        return imported
+
+    def import_legacy_db(self, path: Path) -> int:
+        """Copy unexpired rows from a standalone analysis database.
+
+        Used when analyses move into the shared database; the old file is
+        renamed with a ``.migrated`` suffix afterwards.  Returns the number
+        of rows copied.
+        """
+        path = Path(path)
+        if not path.exists():
+            return 0
+        cutoff = time.time() - self.ttl_seconds
+        with self._lock:
+            self._conn.execute("ATTACH DATABASE ? AS legacy", (str(path),))
+            try:
+                copied = self._conn.execute(
+                    "INSERT OR IGNORE INTO llm_analyses SELECT * FROM legacy.llm_analyses "
+                    "WHERE created_at >= ?", (cutoff,)
+                ).rowcount
+            except sqlite3.DatabaseError as e:
+                logger.warning(f"Could not import legacy LLM analysis database: {e}")
+                copied = 0
+            finally:
+                self._conn.execute("DETACH DATABASE legacy")
+            self._count = self._conn.execute("SELECT COUNT(*) FROM llm_analyses").fetchone()[0]
+        for suffix in ("", "-wal", "-shm"):
+            legacy_file = path.with_name(path.name + suffix)
+            if legacy_file.exists():
+                try:
+                    legacy_file.replace(legacy_file.with_name(legacy_file.name + ".migrated"))
+                except OSError as e:
+                    logger.warning(f"Could not rename migrated {legacy_file.name}: {e}")
+        logger.info("Imported legacy LLM analysis database", extra={"entries": copied})
+        if self._count > self.max_entries:
+            with self._lock:
+                self._evict(self._count - self.max_entries)
+        return copied
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+    # ── Internals (caller holds the lock) ─────────────────────────────────
+
+    def _remember(self, key: str, analysis: str, created_at: float) -> None:
+        if self.hot_size == 0:
+            return
+        self._hot[key] = (analysis, created_at)
+        self._hot.move_to_end(key)
+        while len(self._hot) > self.hot_size:
+            self._hot.popitem(last=False)
+
+    def _delete(self, key: str) -> None:
+        self._hot.pop(key, None)
+        self._touched.pop(key, None)
+        if self._conn.execute("DELETE FROM llm_analyses WHERE key = ?", (key,)).rowcount:
+            self._count -= 1
+
+    def _flush_touched(self) -> None:
+        if self._touched:
+            self._conn.executemany(
+                "UPDATE llm_analyses SET last_used = ? WHERE key = ?",
+                [(ts, key) for key, ts in self._touched.items()],
+            )
+            self._touched.clear()
+
+    def _evict(self, n: int) -> None:
+        # Hot-set recency may not be in the table yet
+        self._flush_touched()
+        victims = [row[0] for row in self._conn.execute(
+            "SELECT key FROM llm_analyses ORDER BY last_used LIMIT ?", (n,)
+        )]
+        for key in victims:
+            self._delete(key)
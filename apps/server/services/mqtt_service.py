@@ -4,20 +4,36 @@ to WebSocket clients.
 Architecture:
   mosquitto (:1883) ← meticulous-bridge (Socket.IO → MQTT)
   FastAPI server subscribes to `meticulous_espresso/sensor/#`
-  WebSocket endpoint reads latest state dict and pushes to clients at ≤10 FPS.
+  A single TelemetryBroadcaster per subscriber builds frames from the latest
+  state dict and fans them out to WebSocket clients at ≤20 FPS.
+  Numeric sensor samples are also kept in a fixed-size TelemetryRingBuffer
+  (the last TELEMETRY_BUFFER_SECONDS) for history queries and backfill,
+  and a LiveShotRecorder turns each brewing spell into a local shot record,
+  analysing it as it runs and pushing the results to WebSocket clients.
 
 The subscriber runs in a background *thread* (paho-mqtt v1 uses its own
 network loop) and bridges into asyncio via an `asyncio.Event` that is set
-whenever new data arrives.
+whenever new data arrives.  The bridge publishes a burst of sensor topics
+per machine tick, so the MQTT thread only queues each update (no lock) and
+schedules at most one event-loop wake-up per frame interval; the loop then
+applies the whole batch to the snapshot under a single lock acquisition.
 """
 
 import asyncio
+import functools
 import json
 import logging
 import os
 import threading
 import time
-from typing import Any, Callable, Dict, Optional, Set
+from collections import deque
+from typing import Any, Callable, Deque, Dict, Optional, Set, Tuple
+
+from config import TELEMETRY_BUFFER_HZ, TELEMETRY_BUFFER_SECONDS
+from services.telemetry_broadcaster import FRAME_INTERVAL, TelemetryBroadcaster
+from services.live_analysis import LiveShotAnalyzer, load_live_profile
+from services.shot_recorder import LiveShotRecorder, save_live_shot
+from services.telemetry_buffer import TelemetryRingBuffer
 
 logger = logging.getLogger(__name__)
 
@@ -75,7 +91,9 @@ class MQTTSubscriber:
     """Thread-safe MQTT subscriber that keeps the latest sensor snapshot.
 
     Call `start()` during FastAPI lifespan startup and `stop()` on shutdown.
-    WebSocket handlers read `self.snapshot` and wait on `self.data_event`.
+    WebSocket handlers subscribe to `broadcaster`, which waits on
+    `self.data_event` and reads `self.snapshot`.  Recent numeric samples
+    are kept in `self.buffer`, and shots are recorded by `self.recorder`.
     """
 
     def __init__(self) -> None:
@@ -90,6 +108,18 @@ class MQTTSubscriber:
         self._loop: Optional[asyncio.AbstractEventLoop] = None
         self.data_event: Optional[asyncio.Event] = None
         self._connected_ws: Set[int] = set()  # track WebSocket client count
+        self._broadcaster: Optional[TelemetryBroadcaster] = None
+        self.buffer = TelemetryRingBuffer(
+            TELEMETRY_BUFFER_SECONDS, TELEMETRY_BUFFER_HZ,
+            sensors=_FLOAT_SENSORS | _BOOL_SENSORS | _INT_SENSORS,
+        )
+        self.recorder = LiveShotRecorder(on_start=self._on_shot_start, on_event=self._push_analysis)
+        # Updates queued by the MQTT thread: (key, value, time, is_sensor)
+        self._pending: Deque[Tuple[str, Any, float, bool]] = deque()
+        self._flush_scheduled = False
+        self._next_flush = 0.0
+        self.coalesce_interval = FRAME_INTERVAL
+        self._stats = {"messages": 0, "wakeups": 0, "flushes": 0, "lock_acquisitions": 0}
 
     # -- lifecycle -----------------------------------------------------------
 
@@ -134,6 +164,8 @@ class MQTTSubscriber:
     def stop(self) -> None:
         """Disconnect and join the background thread."""
         self._running = False
+        if self._broadcaster is not None:
+            self._broadcaster.stop()
         if self._client is not None:
             try:
                 self._client.loop_stop(force=True)
@@ -176,10 +208,8 @@ class MQTTSubscriber:
         payload = msg.payload.decode("utf-8", errors="replace")
 
         if topic == AVAILABILITY_TOPIC:
-            with self._lock:
-                self._availability = payload
-                self.snapshot["availability"] = payload
-            self._signal_update()
+            self._availability = payload
+            self._queue_update("availability", payload)
             return
 
         if topic == HEALTH_TOPIC:
@@ -187,19 +217,14 @@ class MQTTSubscriber:
                 data = json.loads(payload)
             except json.JSONDecodeError:
                 data = payload
-            with self._lock:
-                self._health = data
-                self.snapshot["health"] = data
-            self._signal_update()
+            self._health = data
+            self._queue_update("health", data)
             return
 
         # Sensor topics: meticulous_espresso/sensor/{key}/state
         if topic.startswith(TOPIC_PREFIX) and topic.endswith("/state"):
             sensor_key = topic[len(TOPIC_PREFIX):-len("/state")]
-            value = _coerce_value(sensor_key, payload)
-            with self._lock:
-                self.snapshot[sensor_key] = value
-            self._signal_update()
+            self._queue_update(sensor_key, _coerce_value(sensor_key, payload), sensor=True)
 
     def _on_disconnect(self, client: Any, userdata: Any, rc: int) -> None:
         if rc != 0:
@@ -207,16 +232,110 @@ class MQTTSubscriber:
 
     # -- helpers -------------------------------------------------------------
 
+    def _on_shot_start(self, record: Dict[str, Any], analyzer: LiveShotAnalyzer) -> None:
+        """Thread-safe: look up the shot's profile on the event loop."""
+        if self._loop is not None:
+            asyncio.run_coroutine_threadsafe(
+                self._load_shot_profile(record["profile_name"], analyzer), self._loop)
+
+    async def _load_shot_profile(self, profile_name: str, analyzer: LiveShotAnalyzer) -> None:
+        try:
+            analyzer.set_profile(await load_live_profile(profile_name))
+        except Exception as exc:
+            logger.info("Live analysis without profile %r: %s", profile_name, exc)
+
+    def _push_analysis(self, event: Dict[str, Any]) -> None:
+        """Thread-safe: send a live analysis event to WebSocket clients."""
+        if self._loop is not None and self._broadcaster is not None:
+            frame = {"_analysis": event, "_ts": time.time()}
+            # Analysis events are never dropped for a congested client
+            broadcast = functools.partial(self._broadcaster.broadcast, frame, priority=True)
+            self._loop.call_soon_threadsafe(broadcast)
+
+    def _save_shot(self, record: Dict[str, Any]) -> None:
+        try:
+            save_live_shot(record)
+            logger.info("Recorded live shot %s (%.1f s, %s)",
+                        record["id"], record["duration"], record.get("profile_name") or "unknown profile")
+        except Exception as exc:
+            logger.warning("Failed to store live shot: %s", exc, exc_info=True)
+
+    def _queue_update(self, key: str, value: Any, sensor: bool = False) -> None:
+        """Queue one update from the paho thread and make sure it gets applied."""
+        self._pending.append((key, value, time.time(), sensor))
+        self._stats["messages"] += 1
+        if self._loop is None or self.data_event is None:
+            # No event loop (MQTT not started, tests) — apply right away
+            self._flush_pending()
+            return
+        self._signal_update()
+
     def _signal_update(self) -> None:
-        """Thread-safe: set the asyncio Event from the paho thread."""
-        if self._loop and self.data_event:
-            self._loop.call_soon_threadsafe(self.data_event.set)
+        """Thread-safe: schedule one coalesced flush on the event loop.
+
+        Further updates arriving before it runs ride along, and flushes are
+        spaced at least ``coalesce_interval`` apart.
+        """
+        if not (self._loop and self.data_event) or self._flush_scheduled:
+            return
+        self._flush_scheduled = True
+        self._stats["wakeups"] += 1
+        delay = max(0.0, self._next_flush - time.monotonic())
+        self._loop.call_soon_threadsafe(self._arm_flush, delay)
+
+    def _arm_flush(self, delay: float) -> None:
+        if delay > 0:
+            self._loop.call_later(delay, self._flush_pending)
+        else:
+            self._flush_pending()
+
+    def _flush_pending(self) -> None:
+        """Apply all queued updates to the snapshot and wake the broadcaster."""
+        # Cleared before draining, so an update queued meanwhile either is
+        # drained here or schedules the next flush
+        self._flush_scheduled = False
+        self._next_flush = time.monotonic() + self.coalesce_interval
+        updates = []
+        while self._pending:
+            updates.append(self._pending.popleft())
+        if not updates:
+            return
+
+        finished = None
+        with self._lock:
+            for key, value, _, _ in updates:
+                self.snapshot[key] = value
+            if any(sensor for _, _, _, sensor in updates):
+                finished = self.recorder.update(self.snapshot, updates[-1][2])
+        self._stats["flushes"] += 1
+        self._stats["lock_acquisitions"] += 1
+
+        for key, value, t, sensor in updates:
+            if sensor:
+                self.buffer.record(key, value, t)
+        if finished is not None:
+            self._save_shot(finished)
+        if self.data_event is not None:
+            self.data_event.set()
+
+    def metrics(self) -> Dict[str, Any]:
+        """Message, loop wake-up and flush counters of the MQTT hot path."""
+        stats = dict(self._stats)
+        stats["messages_per_wakeup"] = round(stats["messages"] / stats["wakeups"], 1) if stats["wakeups"] else None
+        return stats
 
     def get_snapshot(self) -> Dict[str, Any]:
         """Return a copy of the current sensor snapshot."""
         with self._lock:
             return dict(self.snapshot)
 
+    @property
+    def broadcaster(self) -> TelemetryBroadcaster:
+        """The telemetry fan-out shared by all WebSocket clients."""
+        if self._broadcaster is None:
+            self._broadcaster = TelemetryBroadcaster(self)
+        return self._broadcaster
+
     @property
     def ws_client_count(self) -> int:
         with self._ws_lock:
@@ -0,0 +1,649 @@
+"""Write-coalescing persistence for the services' in-memory state.
+
+Services that keep their state in memory (history, settings, shot
+annotations, the shot cache, dial-in sessions and the schedules) register
+a *dataset* here, read it back with :func:`read_dataset` and call
+:func:`mark_dirty` after each mutation instead of writing it themselves.
+
+Where a dataset is stored depends on ``STORAGE_BACKEND``:
+
+- ``sqlite`` (default): one row per entry in the shared database
+  (:mod:`services.database`).  A flush writes only the rows that changed
+  since the last one, and all datasets in a flush commit in one
+  transaction.  Each dataset's legacy JSON file is imported on first use.
+  Callers that know which entries changed pass their keys to
+  :func:`mark_dirty`, so only those entries are serialized (for history,
+  saving one entry no longer costs time proportional to its length).
+- ``json``: the whole dataset is rewritten to its JSON file.
+
+While the background flusher is running (started from the app lifespan),
+dirty datasets are written at most once every ``PERSIST_FLUSH_INTERVAL_MS``:
+a burst of twenty rating edits becomes one write.  Each flush takes the
+services' snapshots on the event loop, then serializes and writes them in a
+worker thread (fsync + rename for files, one transaction for the database).
+Snapshots are shallow copies: an entry that is edited while it is being
+serialized is marked dirty again by that edit, so the next flush writes its
+final state.  ``mark_dirty`` may be called from any thread.  Cleanup that
+must wait until a change is stored (e.g. deleting a blob the old data
+referenced) is registered with :func:`after_write`.  When the flusher
+is not running — scripts, tests, or before startup — ``mark_dirty`` writes
+through synchronously as the services used to.
+"""
+
+import asyncio
+import json
+import os
+import tempfile
+import threading
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, NamedTuple, Optional, Tuple, Union
+
+from config import PERSIST_FLUSH_INTERVAL_MS, STORAGE_BACKEND
+from logging_config import get_logger
+from services.database import Database, get_database, import_json_file, list_seq
+
+logger = get_logger()
+
+
+def write_text_durable(filepath: Path, text: str) -> None:
+    """Atomically replace *filepath* with *text*, fsyncing before the rename."""
+    filepath.parent.mkdir(parents=True, exist_ok=True)
+    temp_fd, temp_path = tempfile.mkstemp(
+        dir=filepath.parent,
+        prefix=f'.{filepath.name}.',
+        suffix='.tmp'
+    )
+    try:
+        with os.fdopen(temp_fd, 'w', encoding='utf-8') as f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, filepath)
+    except Exception:
+        try:
+            os.unlink(temp_path)
+        except OSError:
+            pass
+        raise
+
+
+@dataclass
+class _Dataset:
+    name: str
+    path: Callable[[], Path]
+    snapshot: Callable[[], Any]
+    indent: Optional[int] = 2
+    collection: Optional[str] = None
+    kind: str = "dict"
+    # Database rows as last written: key -> (seq, json text); None until primed
+    rows: Optional[Dict[str, Tuple[int, str]]] = field(default=None, repr=False)
+
+
+class _RowPatch(NamedTuple):
+    """Changed rows of a dataset, written without diffing the whole dataset."""
+
+    rows: List[Tuple[str, str, int]]
+    removed: List[str]
+
+
+class PersistenceManager:
+    """Registry of datasets plus the background flusher that writes them."""
+
+    def __init__(
+        self,
+        interval_ms: int = 500,
+        backend: str = "json",
+        database: Optional[Callable[[], Database]] = None,
+    ):
+        self.interval = max(0, interval_ms) / 1000
+        self.backend = backend
+        self._database = database or get_database
+        self._db_lock = threading.RLock()
+        self._datasets: Dict[str, _Dataset] = {}
+        # Guards _dirty and _dirty_keys, which worker threads mark too
+        self._dirty_lock = threading.Lock()
+        self._dirty: set = set()
+        # Datasets marked with keys only: name -> changed keys
+        self._dirty_keys: Dict[str, set] = {}
+        # after_write callbacks: waiting for the next flush / in its write
+        self._callbacks: Dict[str, List[Callable[[], None]]] = {}
+        self._in_flight: Dict[str, List[Callable[[], None]]] = {}
+        # Keys of the datasets being written (None: all of them)
+        self._writing: Dict[str, Optional[set]] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._flush_lock: Optional[asyncio.Lock] = None
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            "marks": 0,
+            "writes": 0,
+            "rows_written": 0,
+            "flushes": 0,
+            "errors": 0,
+            "last_flush_ms": 0.0,
+            "max_flush_ms": 0.0,
+            "total_flush_ms": 0.0,
+        }
+
+    # ── Registration / marking ────────────────────────────────────────────
+
+    def register(
+        self,
+        name: str,
+        path: Union[Path, Callable[[], Path]],
+        snapshot: Callable[[], Any],
+        indent: Optional[int] = 2,
+        collection: Optional[str] = None,
+        kind: str = "dict",
+    ) -> None:
+        """Register (or re-register) a dataset.
+
+        Args:
+            name: Unique dataset name.
+            path: JSON file, or a callable returning it (so module-level
+                paths patched by tests are honoured).  With the SQLite
+                backend it is only read once, to migrate existing data.
+            snapshot: Returns the JSON-serializable data to write; called at
+                flush time, so it always reflects the latest state.
+            indent: JSON indentation.
+            collection: Database collection; datasets without one always
+                use their JSON file.
+            kind: ``"dict"`` (a row per key) or ``"list"`` (a row per item,
+                keyed by its ``id``, order preserved).
+        """
+        path_fn = path if callable(path) else (lambda p=Path(path): p)
+        self._datasets[name] = _Dataset(
+            name=name, path=path_fn, snapshot=snapshot, indent=indent,
+            collection=collection, kind=kind,
+        )
+
+    def uses_database(self, name: str) -> bool:
+        """Return True if *name* is stored in the SQLite database."""
+        return self.backend == "sqlite" and self._datasets[name].collection is not None
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def mark_dirty(self, name: str, keys: Optional[Iterable[Any]] = None) -> None:
+        """Schedule *name* for writing, or write it now if not running.
+
+        Args:
+            name: Dataset name.
+            keys: Keys (list datasets: item ids) of the only entries that
+                were added, changed or removed.  None means anything may
+                have changed.  Ignored for file storage.
+
+        Raises:
+            KeyError: If the dataset is not registered.
+            Exception: Serialization or I/O errors, in write-through mode only.
+        """
+        if name not in self._datasets:
+            raise KeyError(f"Unknown dataset: {name}")
+        with self._stats_lock:
+            self._stats["marks"] += 1
+        if keys is not None:
+            keys = {str(key) for key in keys}
+        if not self.running:
+            self._write(self._datasets[name], self._serialize(self._datasets[name], keys))
+            return
+        self._set_dirty(name, keys)
+        try:
+            on_loop = asyncio.get_running_loop() is self._loop
+        except RuntimeError:
+            on_loop = False
+        if on_loop:
+            self._wakeup.set()
+        else:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    def _set_dirty(self, name: str, keys: Optional[set]) -> None:
+        with self._dirty_lock:
+            if keys is None:
+                self._dirty_keys.pop(name, None)
+            elif name not in self._dirty or name in self._dirty_keys:
+                self._dirty_keys.setdefault(name, set()).update(keys)
+            self._dirty.add(name)
+
+    def after_write(self, name: str, callback: Callable[[], None]) -> None:
+        """Run *callback* once the changes marked so far for *name* are stored.
+
+        Call it after the ``mark_dirty`` of those changes.  The callback runs
+        on the event loop after the flush that writes them has committed, or
+        right away if nothing is pending.  If the write fails it waits for
+        the retry.
+        """
+        with self._dirty_lock:
+            if name in self._dirty:
+                self._callbacks.setdefault(name, []).append(callback)
+                return
+            if name in self._in_flight:
+                self._in_flight[name].append(callback)
+                return
+        self._run_callbacks(name, [callback])
+
+    def _take_dirty(self, names: Iterable[str]) -> Dict[str, Optional[set]]:
+        """Clear the dirty state of *names*; return the changed keys of each.
+
+        Their ``after_write`` callbacks move to ``_in_flight`` until
+        :meth:`_end_write`.
+        """
+        taken = {}
+        with self._dirty_lock:
+            for name in names:
+                if name in self._dirty:
+                    self._dirty.discard(name)
+                    taken[name] = self._dirty_keys.pop(name, None)
+                    self._writing[name] = taken[name]
+                    self._in_flight[name] = self._callbacks.pop(name, [])
+        return taken
+
+    def _end_write(self, name: str, keys: Optional[set], ok: bool) -> None:
+        """Finish the write of a taken dataset: run its callbacks, or re-queue it."""
+        with self._dirty_lock:
+            self._writing.pop(name, None)
+            callbacks = self._in_flight.pop(name, [])
+        if ok:
+            self._run_callbacks(name, callbacks)
+            return
+        # Keep the changes pending so the next tick retries them
+        self._set_dirty(name, keys)
+        with self._dirty_lock:
+            self._callbacks[name] = callbacks + self._callbacks.get(name, [])
+
+    def _run_callbacks(self, name: str, callbacks: List[Callable[[], None]]) -> None:
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                logger.warning(f"after_write callback of {name} failed: {e}", exc_info=True)
+
+    def is_dirty(self, name: str) -> bool:
+        with self._dirty_lock:
+            return name in self._dirty
+
+    def has_pending(self, name: str, key: Any) -> bool:
+        """Return True if entry *key* of *name* may differ from what is stored.
+
+        That is while a change to it (or an unkeyed change) is marked or
+        being written.
+        """
+        key = str(key)
+        with self._dirty_lock:
+            if name in self._dirty:
+                keys = self._dirty_keys.get(name)
+                if keys is None or key in keys:
+                    return True
+            if name in self._writing:
+                keys = self._writing[name]
+                if keys is None or key in keys:
+                    return True
+            return False
+
+    # ── Reading ───────────────────────────────────────────────────────────
+
+    def read(self, name: str) -> Any:
+        """Return the stored data of *name*.
+
+        Raises:
+            KeyError: If the dataset is not registered.
+            FileNotFoundError, json.JSONDecodeError: For a missing or corrupt
+                JSON file (file storage only).
+        """
+        dataset = self._datasets[name]
+        if not self.uses_database(name):
+            with open(dataset.path(), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        with self._db_lock:
+            rows = self._prime(dataset)
+            ordered = sorted(rows.items(), key=lambda item: (item[1][0], item[0]))
+            if dataset.kind == "list":
+                return [json.loads(text) for _, (_, text) in ordered]
+            return {key: json.loads(text) for key, (_, text) in ordered}
+
+    def read_page(self, name: str, offset: int, limit: int) -> Tuple[List[Any], int]:
+        """Return one page of a list dataset and the dataset's length.
+
+        From the database only the requested rows are read and decoded; the
+        dataset must not have unflushed changes.  File storage reads the
+        whole file.
+
+        Raises:
+            KeyError: If the dataset is not registered.
+            FileNotFoundError, json.JSONDecodeError: As for :meth:`read`.
+        """
+        dataset = self._datasets[name]
+        offset, limit = max(0, offset), max(0, limit)
+        if not self.uses_database(name) or self.is_dirty(name):
+            data = self.read(name)
+            if not isinstance(data, list):
+                return [], 0
+            return data[offset:offset + limit], len(data)
+        with self._db_lock:
+            db = self._database()
+            import_json_file(db, dataset.collection, dataset.path(), dataset.kind)
+            repo = db.repository(dataset.collection)
+            return repo.page(offset, limit), repo.count()
+
+    def read_item(self, name: str, key: Any) -> Any:
+        """Return the stored entry *key* of a database dataset, or None.
+
+        Only that row is read and decoded.  Check :meth:`has_pending` first
+        if the in-memory data may have unflushed changes.
+
+        Raises:
+            KeyError: If the dataset is not registered.
+            ValueError: If the dataset is not stored in the database.
+        """
+        dataset = self._datasets[name]
+        if not self.uses_database(name):
+            raise ValueError(f"{name} is not stored in the database")
+        with self._db_lock:
+            db = self._database()
+            import_json_file(db, dataset.collection, dataset.path(), dataset.kind)
+            return db.repository(dataset.collection).get(str(key))
+
+    def has_data(self, name: str) -> bool:
+        """Return True if anything has been stored for *name*."""
+        if not self.uses_database(name):
+            return self._datasets[name].path().exists()
+        with self._db_lock:
+            return bool(self._prime(self._datasets[name]))
+
+    def clear(self, name: str) -> None:
+        """Delete the stored data of *name* (the file, or its rows)."""
+        dataset = self._datasets[name]
+        taken = self._take_dirty([name])
+        if not self.uses_database(name):
+            dataset.path().unlink(missing_ok=True)
+        else:
+            with self._db_lock:
+                self._prime(dataset)
+                self._database().repository(dataset.collection).clear()
+                dataset.rows = {}
+        if taken:
+            self._end_write(name, None, True)
+
+    def _prime(self, dataset: _Dataset) -> Dict[str, Tuple[int, str]]:
+        """Migrate the legacy file if needed and cache the dataset's rows."""
+        if dataset.rows is None:
+            db = self._database()
+            import_json_file(db, dataset.collection, dataset.path(), dataset.kind)
+            dataset.rows = {
+                key: (seq, text) for key, seq, text in db.execute(
+                    "SELECT key, seq, data FROM documents WHERE collection = ?",
+                    (dataset.collection,),
+                )
+            }
+        return dataset.rows
+
+    # ── Flusher lifecycle ─────────────────────────────────────────────────
+
+    def start(self) -> None:
+        """Start the background flusher on the running event loop."""
+        if self.running:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._task = asyncio.create_task(self._run())
+        logger.info(
+            "Started persistence flusher",
+            extra={"interval_ms": int(self.interval * 1000), "datasets": sorted(self._datasets)},
+        )
+
+    async def stop(self) -> None:
+        """Stop the flusher after writing everything still dirty."""
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        await self.flush()
+
+    async def flush(self, names: Optional[Iterable[str]] = None) -> None:
+        """Write dirty datasets now (all of them, or just *names*)."""
+        with self._dirty_lock:
+            pending = sorted(self._dirty if names is None else self._dirty.intersection(names))
+        if not pending:
+            return
+        lock = self._flush_lock
+        if lock is None or asyncio.get_running_loop() is not self._loop:
+            lock = asyncio.Lock()
+        async with lock:
+            batch = []
+            failed: List[str] = []
+            # A concurrent flush may have written some of them meanwhile
+            taken = self._take_dirty(pending)
+            for name, keys in taken.items():
+                dataset = self._datasets[name]
+                try:
+                    batch.append((dataset, dataset.snapshot(), keys))
+                except Exception as e:
+                    self._record_error(name, e)
+                    failed.append(name)
+            try:
+                if batch:
+                    start = time.perf_counter()
+                    failed += await asyncio.to_thread(self._write_batch, batch)
+                    elapsed_ms = (time.perf_counter() - start) * 1000
+            except BaseException:
+                # Cancelled mid-write (e.g. by stop()): write it all again
+                failed = list(taken)
+                raise
+            finally:
+                for name, keys in taken.items():
+                    self._end_write(name, keys, name not in failed)
+                if failed and self._wakeup is not None:
+                    self._wakeup.set()
+            if not batch:
+                return
+            with self._stats_lock:
+                self._stats["flushes"] += 1
+                self._stats["last_flush_ms"] = elapsed_ms
+                self._stats["max_flush_ms"] = max(self._stats["max_flush_ms"], elapsed_ms)
+                self._stats["total_flush_ms"] += elapsed_ms
+
+    async def _run(self) -> None:
+        while True:
+            await self._wakeup.wait()
+            # Let the burst that woke us finish before writing
+            await asyncio.sleep(self.interval)
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Persistence flush failed: {e}", exc_info=True)
+
+    # ── Writing ───────────────────────────────────────────────────────────
+
+    def _serialize(
+        self, dataset: _Dataset, keys: Optional[set] = None,
+    ) -> Union[str, List[Tuple[str, str, int]], _RowPatch]:
+        """Encode a snapshot as file text, or as ``(key, json, seq)`` rows.
+
+        With *keys*, only those entries are encoded (as a :class:`_RowPatch`).
+        """
+        return self._encode(dataset, dataset.snapshot(), keys)
+
+    def _encode(
+        self, dataset: _Dataset, data: Any, keys: Optional[set] = None,
+    ) -> Union[str, List[Tuple[str, str, int]], _RowPatch]:
+        if not self.uses_database(dataset.name):
+            return json.dumps(data, indent=dataset.indent, default=str)
+        if keys is not None:
+            return self._serialize_keys(dataset, data, keys)
+        if dataset.kind == "list":
+            items = [item for item in data or [] if isinstance(item, dict) and item.get("id")]
+            return [
+                (str(item["id"]), json.dumps(item, default=str), list_seq(i, len(items)))
+                for i, item in enumerate(items)
+            ]
+        return [(str(key), json.dumps(value, default=str), 0) for key, value in (data or {}).items()]
+
+    def _serialize_keys(self, dataset: _Dataset, data: Any, keys: set) -> _RowPatch:
+        found = {}
+        if dataset.kind == "list":
+            # Positions are still needed for the sequence numbers
+            items = [item for item in data or [] if isinstance(item, dict) and item.get("id")]
+            for i, item in enumerate(items):
+                key = str(item["id"])
+                if key in keys:
+                    found[key] = (json.dumps(item, default=str), list_seq(i, len(items)))
+        else:
+            for key in keys:
+                if key in (data or {}):
+                    found[key] = (json.dumps(data[key], default=str), 0)
+        return _RowPatch(
+            rows=[(key, text, seq) for key, (text, seq) in found.items()],
+            removed=[key for key in keys if key not in found],
+        )
+
+    def _write(self, dataset: _Dataset, payload) -> None:
+        if isinstance(payload, str):
+            write_text_durable(dataset.path(), payload)
+            with self._stats_lock:
+                self._stats["writes"] += 1
+        else:
+            self._write_rows([(dataset, payload)])
+
+    def _write_rows(self, batch) -> None:
+        """Write the changed rows of several datasets in one transaction."""
+        with self._db_lock:
+            db = self._database()
+            updates = []
+            rows_written = 0
+            with db.transaction():
+                for dataset, rows in batch:
+                    previous = self._prime(dataset)
+                    if isinstance(rows, _RowPatch):
+                        changed = [
+                            (key, text, seq) for key, text, seq in rows.rows
+                            if previous.get(key) != (seq, text)
+                        ]
+                        removed = [key for key in rows.removed if key in previous]
+                        current = None
+                    else:
+                        current = {key: (seq, text) for key, text, seq in rows}
+                        changed = [
+                            (key, text, seq) for key, (seq, text) in current.items()
+                            if previous.get(key) != (seq, text)
+                        ]
+                        removed = [key for key in previous if key not in current]
+                    repo = db.repository(dataset.collection)
+                    if changed:
+                        repo.put_serialized(changed)
+                    if removed:
+                        repo.delete_many(removed)
+                    rows_written += len(changed) + len(removed)
+                    updates.append((dataset, current, changed, removed))
+            for dataset, current, changed, removed in updates:
+                if current is not None:
+                    dataset.rows = current
+                    continue
+                # Patch the row cache in place, after the commit succeeded
+                dataset.rows.update((key, (seq, text)) for key, text, seq in changed)
+                for key in removed:
+                    dataset.rows.pop(key, None)
+        with self._stats_lock:
+            self._stats["writes"] += len(batch)
+            self._stats["rows_written"] += rows_written
+
+    def _write_batch(self, batch) -> List[str]:
+        """Serialize and write ``(dataset, snapshot, keys)`` items.
+
+        Returns:
+            The names of the datasets that failed.
+        """
+        failed = []
+        db_batch = []
+        for dataset, data, keys in batch:
+            try:
+                payload = self._encode(dataset, data, keys)
+                if not isinstance(payload, str):
+                    db_batch.append((dataset, payload))
+                    continue
+                self._write(dataset, payload)
+            except Exception as e:
+                self._record_error(dataset.name, e)
+                failed.append(dataset.name)
+        if db_batch:
+            try:
+                self._write_rows(db_batch)
+            except Exception as e:
+                self._record_error(", ".join(d.name for d, _ in db_batch), e)
+                failed.extend(d.name for d, _ in db_batch)
+        return failed
+
+    def _record_error(self, name: str, error: Exception) -> None:
+        with self._stats_lock:
+            self._stats["errors"] += 1
+        logger.error(f"Failed to persist {name}: {error}", exc_info=True)
+
+    # ── Metrics ───────────────────────────────────────────────────────────
+
+    def metrics(self) -> Dict[str, Any]:
+        """Return mark/write counts and flush latency (ms)."""
+        with self._stats_lock:
+            stats = dict(self._stats)
+        flushes = stats.pop("flushes")
+        total_ms = stats.pop("total_flush_ms")
+        with self._dirty_lock:
+            pending = sorted(self._dirty)
+        return {
+            "running": self.running,
+            "backend": self.backend,
+            "interval_ms": int(self.interval * 1000),
+            "pending": pending,
+            "flushes": flushes,
+            "avg_flush_ms": round(total_ms / flushes, 2) if flushes else 0.0,
+            "last_flush_ms": round(stats.pop("last_flush_ms"), 2),
+            "max_flush_ms": round(stats.pop("max_flush_ms"), 2),
+            **stats,
+        }
+
+    def reset_metrics(self) -> None:
+        with self._stats_lock:
+            for key in self._stats:
+                self._stats[key] = 0 if isinstance(self._stats[key], int) else 0.0
+
+
+_manager = PersistenceManager(PERSIST_FLUSH_INTERVAL_MS, backend=STORAGE_BACKEND)
+
+
+def get_persistence() -> PersistenceManager:
+    """Return the process-wide persistence manager."""
+    return _manager
+
+
+def register_dataset(
+    name: str,
+    path: Union[Path, Callable[[], Path]],
+    snapshot: Callable[[], Any],
+    indent: Optional[int] = 2,
+    collection: Optional[str] = None,
+    kind: str = "dict",
+) -> None:
+    """Register a dataset with the shared manager (see ``PersistenceManager.register``)."""
+    _manager.register(name, path, snapshot, indent, collection=collection, kind=kind)
+
+
+def read_dataset(name: str) -> Any:
+    """Read a dataset of the shared manager (see ``PersistenceManager.read``)."""
+    return _manager.read(name)
+
+
+def mark_dirty(name: str, keys: Optional[Iterable[Any]] = None) -> None:
+    """Mark a dataset of the shared manager as changed (see ``PersistenceManager.mark_dirty``)."""
+    _manager.mark_dirty(name, keys)
+
+
+def after_write(name: str, callback: Callable[[], None]) -> None:
+    """Run *callback* once a dataset's changes are stored (see ``PersistenceManager.after_write``)."""
+    _manager.after_write(name, callback)
@@ -7,21 +7,25 @@ and keyword tags.  No AI/LLM calls — everything is deterministic.
 
 import asyncio
 import hashlib
+import heapq
 import json
 import threading
 from collections import OrderedDict
-from typing import Optional
+from typing import Any, Iterable, Optional
 
 from logging_config import get_logger
+from services.history_service import compute_content_hash
 from services.meticulous_service import async_fetch_all_profiles
+from utils.file_utils import deep_convert_to_dict
 
 logger = get_logger()
 
 _MAX_CACHE_SIZE = 50
+_MAX_NEIGHBOUR_SOURCES = 500
 
 
 # ---------------------------------------------------------------------------
-# LRU cache (unchanged)
+# LRU cache
 # ---------------------------------------------------------------------------
 
 class _LRUCache:
@@ -29,17 +33,17 @@ class _LRUCache:
 
     def __init__(self, maxsize: int = _MAX_CACHE_SIZE):
         self._maxsize = maxsize
-        self._cache: OrderedDict[str, list[dict]] = OrderedDict()
+        self._cache: OrderedDict[str, Any] = OrderedDict()
         self._lock = threading.Lock()
 
-    def get(self, key: str) -> Optional[list[dict]]:
+    def get(self, key: str) -> Optional[Any]:
         with self._lock:
             if key in self._cache:
                 self._cache.move_to_end(key)
                 return self._cache[key]
             return None
 
-    def put(self, key: str, value: list[dict]) -> None:
+    def put(self, key: str, value: Any) -> None:
         with self._lock:
             if key in self._cache:
                 self._cache.move_to_end(key)
@@ -47,13 +51,29 @@ class _LRUCache:
             while len(self._cache) > self._maxsize:
                 self._cache.popitem(last=False)
 
+    def pop(self, key: str) -> Optional[Any]:
+        with self._lock:
+            return self._cache.pop(key, None)
+
+    def items(self) -> list[tuple[str, Any]]:
+        """Snapshot of (key, value) pairs, least recently used first."""
+        with self._lock:
+            return list(self._cache.items())
+
     def clear(self) -> None:
         with self._lock:
             self._cache.clear()
 
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._cache)
+
 
-def _cache_key(tags: list[str], limit: int) -> str:
-    raw = json.dumps({"tags": sorted(tags), "limit": limit}, sort_keys=True)
+def _cache_key(tags: list[str], limit: int, version: str = "") -> str:
+    raw = json.dumps(
+        {"tags": sorted(tags), "limit": limit, "catalogue": version},
+        sort_keys=True,
+    )
     return hashlib.sha256(raw.encode()).hexdigest()[:16]
 
 
@@ -278,12 +298,27 @@ def _score_profile(
       - Peak pressure similarity:    15
       - Temperature similarity:      10
     """
+    return _score_features(
+        user_tags,
+        user_fingerprint,
+        _extract_fingerprint(candidate),
+        _extract_name_tags(candidate),
+    )
+
+
+def _score_features(
+    user_tags: set[str],
+    user_fingerprint: dict | None,
+    cand_fp: dict,
+    cand_tags: set[str],
+) -> tuple[float, list[str], str]:
+    """Score a candidate from its pre-extracted fingerprint and name tags.
+
+    Same scoring as :func:`_score_profile`, without re-walking the stages.
+    """
     reasons: list[str] = []
     score = 0.0
 
-    cand_fp = _extract_fingerprint(candidate)
-    cand_tags = _extract_name_tags(candidate)
-
     # --- Stage structure (35 points) ---
     if user_fingerprint:
         struct_score = 0.0
@@ -371,16 +406,295 @@ def _score_profile(
     return min(round(score, 1), 100), reasons, explanation
 
 
+# ---------------------------------------------------------------------------
+# Precomputed catalogue index
+# ---------------------------------------------------------------------------
+
+def _profile_content_hash(profile: object) -> str:
+    """Content hash of a profile, used to detect changed catalogue entries."""
+    return compute_content_hash(deep_convert_to_dict(profile))
+
+
+def _bit_jaccard(a_bits: int, a_count: int, b_bits: int, b_count: int) -> float:
+    """Jaccard similarity of two tag bitsets, given each set's cardinality.
+
+    Cardinalities may exceed the popcount when a set holds tags outside the
+    index vocabulary; those still count towards the union, matching
+    :func:`_jaccard` on the equivalent sets.
+    """
+    union = a_count + b_count
+    if union == 0:
+        return 0.0
+    inter = (a_bits & b_bits).bit_count()
+    return inter / (union - inter)
+
+
+def _query_tags(user_tags: set[str], user_fingerprint: dict | None) -> set[str]:
+    """Tags used for candidate generation: query tags plus structural techniques."""
+    tags = {t.lower() for t in user_tags}
+    return tags | (user_fingerprint or {}).get("technique_tags", set())
+
+
+class _CatalogueIndex:
+    """Precomputed scoring features for one catalogue snapshot.
+
+    Fingerprints and name tags are extracted once per profile (reused across
+    rebuilds by content hash) and laid out column-wise, with technique and
+    tag sets encoded as integer bitsets. An inverted tag index limits each
+    query to profiles sharing a tag with it. Scoring is then a single pass
+    over flat columns with no stage/dynamics walking; match reasons are
+    only built for the top-k results.
+    """
+
+    def __init__(self, profiles: list, feature_cache: Optional[dict] = None):
+        feature_cache = feature_cache if feature_cache is not None else {}
+
+        self.profiles = profiles
+        self.names: list[str] = []
+        self.content_hashes: list[str] = []
+        self.fingerprints: list[dict] = []
+        self.name_tags: list[set[str]] = []
+        self.features: dict[str, tuple[dict, set[str]]] = {}
+
+        for profile in profiles:
+            content_hash = _profile_content_hash(profile)
+            features = feature_cache.get(content_hash)
+            if features is None:
+                features = (_extract_fingerprint(profile), _extract_name_tags(profile))
+            self.features[content_hash] = features
+            self.names.append(getattr(profile, "name", "Unknown"))
+            self.content_hashes.append(content_hash)
+            self.fingerprints.append(features[0])
+            self.name_tags.append(features[1])
+
+        self.version = hashlib.sha256(
+            "\n".join(sorted(self.content_hashes)).encode()
+        ).hexdigest()[:16]
+
+        # Tag vocabulary (every technique/name tag seen in the catalogue) and
+        # inverted index from tag to the catalogue positions carrying it
+        self._bit_of: dict[str, int] = {}
+        self.postings: dict[str, list[int]] = {}
+        for position, (fp, tags) in enumerate(zip(self.fingerprints, self.name_tags)):
+            for tag in sorted(tags | fp["technique_tags"]):
+                if tag not in self._bit_of:
+                    self._bit_of[tag] = 1 << len(self._bit_of)
+                self.postings.setdefault(tag, []).append(position)
+
+        # Feature columns
+        self.control_modes = [fp["control_mode"] for fp in self.fingerprints]
+        self.stage_counts = [fp["stage_count"] for fp in self.fingerprints]
+        self.is_flat = [fp["is_flat"] for fp in self.fingerprints]
+        self.peaks = [fp.get("peak_pressure", 0) for fp in self.fingerprints]
+        self.weights = [fp.get("final_weight") for fp in self.fingerprints]
+        self.temps = [fp.get("temperature") for fp in self.fingerprints]
+        self.tech_bits: list[int] = []
+        self.tech_counts: list[int] = []
+        self.tag_bits: list[int] = []
+        self.tag_counts: list[int] = []
+        for fp, tags in zip(self.fingerprints, self.name_tags):
+            techniques = fp["technique_tags"]
+            all_tags = tags | techniques
+            self.tech_bits.append(self._bits(techniques))
+            self.tech_counts.append(len(techniques))
+            self.tag_bits.append(self._bits(all_tags))
+            self.tag_counts.append(len(all_tags))
+
+    def __len__(self) -> int:
+        return len(self.profiles)
+
+    def _bits(self, tags: Iterable[str]) -> int:
+        bits = 0
+        for tag in tags:
+            bits |= self._bit_of.get(tag, 0)
+        return bits
+
+    def position_of(self, profile_name: str) -> Optional[int]:
+        """Index of the first profile with *profile_name*, or ``None``."""
+        try:
+            return self.names.index(profile_name)
+        except ValueError:
+            return None
+
+    def score_all(
+        self,
+        user_tags: set[str],
+        user_fingerprint: dict | None,
+        positions: Optional[Iterable[int]] = None,
+    ) -> list[tuple[int, float]]:
+        """Score catalogue entries against a query without building reasons.
+
+        Produces exactly the scores :func:`_score_features` would.
+
+        Args:
+            user_tags: Query tags
+            user_fingerprint: Query fingerprint (or ``None``)
+            positions: Catalogue positions to score (default: all)
+
+        Returns:
+            List of (position, score) pairs in catalogue order
+        """
+        fp = user_fingerprint or {}
+        user_lower = {t.lower() for t in user_tags}
+        u_tag_bits = self._bits(user_lower)
+        u_tag_count = len(user_lower)
+
+        if user_fingerprint:
+            u_mode = user_fingerprint["control_mode"]
+            u_techniques = user_fingerprint.get("technique_tags", set())
+            u_tech_bits = self._bits(u_techniques)
+            u_tech_count = len(u_techniques)
+            u_stage_count = user_fingerprint["stage_count"]
+            u_flat = user_fingerprint["is_flat"]
+        u_weight = fp.get("final_weight")
+        u_peak = fp.get("peak_pressure", 0)
+        u_temp = fp.get("temperature")
+
+        if positions is None:
+            positions = range(len(self.profiles))
+
+        results: list[tuple[int, float]] = []
+        for i in positions:
+            score = 0.0
+
+            if user_fingerprint:
+                struct_score = 0.0
+                c_mode = self.control_modes[i]
+                if u_mode == c_mode:
+                    struct_score += 12
+                elif u_mode != "unknown" and c_mode != "unknown":
+                    if "mixed" in (u_mode, c_mode):
+                        struct_score += 4
+
+                if u_tech_count or self.tech_counts[i]:
+                    struct_score += _bit_jaccard(
+                        u_tech_bits, u_tech_count, self.tech_bits[i], self.tech_counts[i]
+                    ) * 15
+
+                count_diff = abs(u_stage_count - self.stage_counts[i])
+                if count_diff == 0:
+                    struct_score += 4
+                elif count_diff <= 1:
+                    struct_score += 2
+                elif count_diff <= 2:
+                    struct_score += 1
+
+                if u_flat == self.is_flat[i]:
+                    struct_score += 4
+
+                score += min(struct_score, 35)
+
+            if u_tag_count:
+                score += _bit_jaccard(
+                    u_tag_bits, u_tag_count, self.tag_bits[i], self.tag_counts[i]
+                ) * 25
+
+            score += _proximity_score(u_weight, self.weights[i], 2.0, 10.0, 15)[0]
+
+            c_peak = self.peaks[i]
+            if u_peak > 0 and c_peak > 0:
+                score += _proximity_score(u_peak, c_peak, 0.5, 3.0, 15)[0]
+
+            score += _proximity_score(u_temp, self.temps[i], 2.0, 5.0, 10)[0]
+
+            results.append((i, min(round(score, 1), 100)))
+        return results
+
+    def shares_tags(self, position: int, tags: Iterable[str]) -> bool:
+        """Whether the profile at *position* carries any of *tags*."""
+        return bool(self.tag_bits[position] & self._bits(tags))
+
+    def candidates(self, tags: Iterable[str]) -> list[int]:
+        """Catalogue positions sharing at least one of *tags*, in catalogue order."""
+        hits: set[int] = set()
+        for tag in tags:
+            hits.update(self.postings.get(tag, ()))
+        return sorted(hits)
+
+    def top_k(
+        self,
+        user_tags: set[str],
+        user_fingerprint: dict | None,
+        limit: int,
+        exclude_name: Optional[str] = None,
+    ) -> list[int]:
+        """Positions of the top *limit* positively-scored profiles for a query.
+
+        Only profiles sharing a tag or structural technique with the query
+        are scored. If that yields fewer than *limit* matches, the remaining
+        profiles are scored on structure alone (structural fallback). Ties
+        keep catalogue order, as a stable descending sort would.
+        """
+        query_tags = _query_tags(user_tags, user_fingerprint)
+
+        def _eligible(positions: Iterable[int]) -> list[int]:
+            if exclude_name is None:
+                return list(positions)
+            return [i for i in positions if self.names[i] != exclude_name]
+
+        candidates = _eligible(self.candidates(query_tags))
+        scored = [
+            (i, s) for i, s in self.score_all(user_tags, user_fingerprint, candidates)
+            if s > 0
+        ]
+        if len(scored) < limit and len(candidates) < len(self.profiles):
+            candidate_set = set(candidates)
+            rest = _eligible(i for i in range(len(self.profiles)) if i not in candidate_set)
+            scored.extend(
+                (i, s) for i, s in self.score_all(user_tags, user_fingerprint, rest)
+                if s > 0
+            )
+            scored.sort(key=lambda item: item[0])
+        return [i for i, _ in heapq.nlargest(limit, scored, key=lambda item: item[1])]
+
+    def rank(
+        self,
+        user_tags: set[str],
+        user_fingerprint: dict | None,
+        limit: int,
+        exclude_name: Optional[str] = None,
+    ) -> list[dict]:
+        """Return result dicts for the top *limit* profiles for a query."""
+        return [
+            self.explain(user_tags, user_fingerprint, i)
+            for i in self.top_k(user_tags, user_fingerprint, limit, exclude_name)
+        ]
+
+    def explain(self, user_tags: set[str], user_fingerprint: dict | None, position: int) -> dict:
+        """Build the full result dict (score, reasons) for one catalogue entry."""
+        s, reasons, explanation = _score_features(
+            user_tags, user_fingerprint,
+            self.fingerprints[position], self.name_tags[position],
+        )
+        return {
+            "profile_name": self.names[position],
+            "score": s,
+            "explanation": explanation,
+            "match_reasons": reasons,
+        }
+
+
 # ---------------------------------------------------------------------------
 # Service class
 # ---------------------------------------------------------------------------
 
 class ProfileRecommendationService:
-    """Local-only profile recommendation engine — zero AI tokens."""
+    """Local-only profile recommendation engine — zero AI tokens.
+
+    Cached recommendations are keyed by catalogue version. When the catalogue
+    changes, entries are carried over to the new version unless a profile
+    they included changed, or a new/changed profile would now rank in them.
+    ``find_similar`` keeps a per-source neighbour table that is patched with
+    only the added/removed profiles on each catalogue change.
+    """
 
     def __init__(self) -> None:
         self._cache = _LRUCache(_MAX_CACHE_SIZE)
         self._async_lock: asyncio.Lock | None = None
+        self._index: _CatalogueIndex | None = None
+        self._index_source: object = None
+        # source content hash -> {candidate content hash: score}
+        self._neighbours: OrderedDict[str, dict[str, float]] = OrderedDict()
 
     def _get_async_lock(self) -> asyncio.Lock:
         if self._async_lock is None:
@@ -393,47 +707,52 @@ class ProfileRecommendationService:
         limit: int = 5,
     ) -> list[dict]:
         """Return recommendations as list of {profile_name, score, explanation, match_reasons}."""
-        key = _cache_key(tags, limit)
-        cached = self._cache.get(key)
+        cached = self._get_cached(tags, limit)
         if cached is not None:
             return cached
 
         async with self._get_async_lock():
-            cached = self._cache.get(key)
-            if cached is not None:
-                return cached
-            results = await self._compute(tags, limit)
-            self._cache.put(key, results)
+            index = await self._get_index()
+            if index is None:
+                return []
+            key = _cache_key(tags, limit, index.version)
+            entry = self._cache.get(key)
+            if entry is not None:
+                return entry["results"]
+            results, members = self._compute(index, tags, limit)
+            self._cache.put(key, {
+                "tags": list(tags),
+                "limit": limit,
+                "version": index.version,
+                "results": results,
+                "members": members,
+            })
             return results
 
-    async def _compute(
+    def _get_cached(self, tags: list[str], limit: int) -> Optional[list[dict]]:
+        """Cache lookup against the current catalogue version, without fetching."""
+        index = self._index
+        if index is None or self._index_source is None:
+            return None
+        entry = self._cache.get(_cache_key(tags, limit, index.version))
+        return entry["results"] if entry is not None else None
+
+    def _compute(
         self,
+        index: _CatalogueIndex,
         tags: list[str],
         limit: int,
-    ) -> list[dict]:
-        """Score all profiles and return top results."""
-        profiles = await self._fetch_profiles()
-        if not profiles:
-            return []
-
+    ) -> tuple[list[dict], set[str]]:
+        """Score all profiles; return top results and their content hashes."""
         user_tags = set(tags) if tags else set()
 
         # Build a synthetic "user fingerprint" by averaging the top tag-matching
         # profiles, or just use tags as structural hints
-        user_fingerprint = self._build_user_fingerprint(user_tags, profiles)
-
-        scored: list[dict] = []
-        for p in profiles:
-            s, reasons, explanation = _score_profile(user_tags, user_fingerprint, p)
-            scored.append({
-                "profile_name": getattr(p, "name", "Unknown"),
-                "score": s,
-                "explanation": explanation,
-                "match_reasons": reasons,
-            })
+        user_fingerprint = self._build_user_fingerprint(user_tags, index.profiles)
 
-        scored.sort(key=lambda x: x["score"], reverse=True)
-        return [s for s in scored if s["score"] > 0][:limit]
+        top = index.top_k(user_tags, user_fingerprint, limit)
+        results = [index.explain(user_tags, user_fingerprint, i) for i in top]
+        return results, {index.content_hashes[i] for i in top}
 
     async def find_similar(
         self,
@@ -441,42 +760,117 @@ class ProfileRecommendationService:
         limit: int = 10,
     ) -> list[dict]:
         """Find profiles structurally similar to a given profile."""
-        profiles = await self._fetch_profiles()
-        if not profiles:
+        index = await self._get_index()
+        if index is None:
             return []
 
-        # Find source
-        source = None
-        for p in profiles:
-            if getattr(p, "name", "") == source_profile_name:
-                source = p
-                break
+        source = index.position_of(source_profile_name)
         if source is None:
             return []
 
-        source_fp = _extract_fingerprint(source)
-        source_tags = _extract_name_tags(source)
-
-        scored: list[dict] = []
-        for p in profiles:
-            if getattr(p, "name", "") == source_profile_name:
-                continue
-            s, reasons, explanation = _score_profile(source_tags, source_fp, p)
-            scored.append({
-                "profile_name": getattr(p, "name", "Unknown"),
-                "score": s,
-                "explanation": explanation,
-                "match_reasons": reasons,
-            })
-
-        scored.sort(key=lambda x: x["score"], reverse=True)
-        return [s for s in scored if s["score"] > 0][:limit]
+        source_hash = index.content_hashes[source]
+        source_fp, source_tags = index.features[source_hash]
+        neighbours = self._neighbours.get(source_hash)
+        if neighbours is None:
+            neighbours = {
+                index.content_hashes[i]: score
+                for i, score in index.score_all(source_tags, source_fp)
+                if i != source and score > 0
+            }
+            self._neighbours[source_hash] = neighbours
+            while len(self._neighbours) > _MAX_NEIGHBOUR_SOURCES:
+                self._neighbours.popitem(last=False)
+        else:
+            self._neighbours.move_to_end(source_hash)
+
+        position = {h: i for i, h in enumerate(index.content_hashes)}
+        ranked = [
+            (position[h], score) for h, score in neighbours.items()
+            if h in position and index.names[position[h]] != source_profile_name
+        ]
+        ranked.sort(key=lambda item: item[0])
+        top = heapq.nlargest(limit, ranked, key=lambda item: item[1])
+        return [index.explain(source_tags, source_fp, i) for i, _ in top]
 
     def invalidate_cache(self) -> None:
-        """Called when profiles are created/edited/deleted."""
-        self._cache.clear()
+        """Called when profiles are created/edited/deleted.
+
+        Marks the catalogue as changed; the next query refetches it and only
+        drops the cached results the change affects.
+        """
+        self._index_source = None
         logger.debug("Profile recommendation cache invalidated")
 
+    async def _get_index(self) -> _CatalogueIndex | None:
+        """Return the catalogue index, rebuilding it when the catalogue changed.
+
+        The machine service returns the same list object while its short-lived
+        profile cache is fresh, so an identity check skips re-hashing. On a
+        rebuild, features of unchanged profiles are reused by content hash.
+        """
+        profiles = await self._fetch_profiles()
+        if not profiles:
+            return None
+        if self._index is not None and profiles is self._index_source:
+            return self._index
+
+        previous = self._index
+        index = _CatalogueIndex(profiles, previous.features if previous else None)
+        if previous is not None and previous.version != index.version:
+            self._migrate(previous, index)
+        self._index = index
+        self._index_source = profiles
+        return index
+
+    def _migrate(self, old: _CatalogueIndex, new: _CatalogueIndex) -> None:
+        """Carry cached results and neighbour tables over to a new catalogue."""
+        old_hashes = set(old.content_hashes)
+        removed = old_hashes - set(new.content_hashes)
+        removed_positions = [i for i, h in enumerate(old.content_hashes) if h in removed]
+        added = [i for i, h in enumerate(new.content_hashes) if h not in old_hashes]
+
+        kept = 0
+        for key, entry in self._cache.items():
+            self._cache.pop(key)
+            if entry["version"] != old.version or entry["members"] & removed:
+                continue
+            user_tags = set(entry["tags"])
+            user_fp = self._build_user_fingerprint(user_tags, new.profiles)
+            query = _query_tags(user_tags, user_fp)
+            # Adding or removing a tag-sharing candidate can toggle the
+            # structural fallback, so treat either as affecting the result.
+            if any(old.shares_tags(i, query) for i in removed_positions):
+                continue
+            if added:
+                results = entry["results"]
+                floor = results[-1]["score"] if len(results) >= entry["limit"] else 0
+                if any(
+                    score > 0 and (score >= floor or new.shares_tags(i, query))
+                    for i, score in new.score_all(user_tags, user_fp, added)
+                ):
+                    continue
+            entry["version"] = new.version
+            self._cache.put(_cache_key(entry["tags"], entry["limit"], new.version), entry)
+            kept += 1
+
+        for source_hash in list(self._neighbours):
+            if source_hash in removed:
+                del self._neighbours[source_hash]
+                continue
+            neighbours = self._neighbours[source_hash]
+            for h in removed:
+                neighbours.pop(h, None)
+            if added:
+                source_fp, source_tags = new.features[source_hash]
+                for i, score in new.score_all(source_tags, source_fp, added):
+                    if score > 0 and new.content_hashes[i] != source_hash:
+                        neighbours[new.content_hashes[i]] = score
+
+        logger.debug(
+            "Recommendation catalogue changed: %d added, %d removed, %d cached results kept",
+            len(added), len(removed), kept,
+        )
+
     @staticmethod
     async def _fetch_profiles() -> list:
         """Fetch full profiles (with stages) from the machine."""
@@ -485,7 +879,7 @@ class ProfileRecommendationService:
             if hasattr(result, "error") and result.error:
                 logger.warning(f"Failed to fetch profiles: {result.error}")
                 return []
-            return list(result)
+            return result if isinstance(result, list) else list(result)
         except Exception as e:
             logger.warning(f"Failed to fetch profiles for recommendations: {e}")
             return []
@@ -0,0 +1,308 @@
+"""Deterministic local repair of LLM-generated profile JSON.
+
+Fixes the failure classes the model most often produces so that
+``analyze_and_profile`` can skip a 10-20s Gemini retry:
+
+- JSON syntax slips: missing or unterminated fences, trailing commas,
+  ``//`` comments, smart quotes, Python literals, truncated output.
+- Structural rule violations checked by ``_basic_validate``: paradox exit
+  triggers, missing time backups, missing cross-type limits, unsupported
+  ``dynamics.over`` / ``interpolation`` values, out-of-range pressures.
+- Variables: ``$key`` references without a definition get one; adjustable
+  variables that are never referenced are dropped.
+- Missing top-level fields filled from defaults.
+
+Repairs never invent stages; a profile without any is left to the LLM.
+"""
+
+import copy
+import json
+import re
+import threading
+from collections import Counter
+from typing import Any, Dict, List, Optional, Tuple
+
+from logging_config import get_logger
+
+logger = get_logger()
+
+MAX_PRESSURE_BAR = 15.0
+
+# Backup exit trigger appended when a stage lacks a time trigger
+_TIME_BACKUP_TRIGGER = {"type": "time", "value": 60, "comparison": ">=", "relative": True}
+
+# Cross-type limits added when missing (upper bounds from the prompt guidelines)
+_DEFAULT_LIMITS = {
+    "flow": {"type": "pressure", "value": 10},
+    "pressure": {"type": "flow", "value": 6},
+}
+
+# Values for variables that are referenced but never defined, by stage type
+_DEFAULT_VARIABLE_VALUES = {"pressure": 9.0, "flow": 2.0, "power": 50.0}
+
+_PROFILE_DEFAULTS = {"temperature": 93.0, "variables": []}
+
+_FENCED_BLOCK = re.compile(r'```(?:json)?\s*([\s\S]*?)(?:```|$)', re.IGNORECASE)
+_TRAILING_COMMA = re.compile(r',(\s*[}\]])')
+_LINE_COMMENT = re.compile(r'^\s*//.*$', re.MULTILINE)
+_PY_LITERALS = {"True": "true", "False": "false", "None": "null"}
+_PY_LITERAL = re.compile(r'\b(True|False|None)\b')
+
+
+# ── Metrics ───────────────────────────────────────────────────────────────────
+
+_metrics_lock = threading.Lock()
+_metrics: Dict[str, Any] = {"attempts": 0, "repaired": 0, "fixes": Counter()}
+
+
+def record_repair(succeeded: bool, fixes: List[str]) -> None:
+    """Record the outcome of one local repair attempt."""
+    with _metrics_lock:
+        _metrics["attempts"] += 1
+        if succeeded:
+            _metrics["repaired"] += 1
+        _metrics["fixes"].update(fix.split(":", 1)[0] for fix in fixes)
+
+
+def get_repair_metrics() -> Dict[str, Any]:
+    """Return attempt/success counts, the repair rate and per-fix counts."""
+    with _metrics_lock:
+        attempts = _metrics["attempts"]
+        return {
+            "attempts": attempts,
+            "repaired": _metrics["repaired"],
+            "repair_rate": round(_metrics["repaired"] / attempts, 3) if attempts else 0.0,
+            "fixes": dict(_metrics["fixes"]),
+        }
+
+
+def reset_repair_metrics() -> None:
+    """Clear the repair counters."""
+    with _metrics_lock:
+        _metrics["attempts"] = 0
+        _metrics["repaired"] = 0
+        _metrics["fixes"] = Counter()
+
+
+# ── JSON text repair ──────────────────────────────────────────────────────────
+
+def _close_brackets(text: str) -> str:
+    """Append the closers missing from truncated JSON (strings respected)."""
+    stack: List[str] = []
+    in_string = False
+    escaped = False
+    for ch in text:
+        if in_string:
+            if escaped:
+                escaped = False
+            elif ch == "\\":
+                escaped = True
+            elif ch == '"':
+                in_string = False
+        elif ch == '"':
+            in_string = True
+        elif ch in "{[":
+            stack.append("}" if ch == "{" else "]")
+        elif ch in "}]" and stack:
+            stack.pop()
+    if in_string:
+        text += '"'
+    return text.rstrip().rstrip(",") + "".join(reversed(stack))
+
+
+def _replace_py_literals(text: str) -> str:
+    """Turn ``True``/``False``/``None`` into JSON literals outside strings."""
+    parts: List[str] = []
+    start = 0
+    in_string = False
+    escaped = False
+    for i, ch in enumerate(text):
+        if in_string:
+            if escaped:
+                escaped = False
+            elif ch == "\\":
+                escaped = True
+            elif ch == '"':
+                in_string = False
+                parts.append(text[start:i + 1])
+                start = i + 1
+        elif ch == '"':
+            parts.append(_PY_LITERAL.sub(lambda m: _PY_LITERALS[m.group(1)], text[start:i]))
+            start = i
+            in_string = True
+    tail = text[start:]
+    parts.append(tail if in_string else _PY_LITERAL.sub(lambda m: _PY_LITERALS[m.group(1)], tail))
+    return "".join(parts)
+
+
+def _clean_json_text(text: str) -> str:
+    text = text.strip()
+    text = text.replace("“", '"').replace("”", '"').replace("’", "'")
+    text = _LINE_COMMENT.sub("", text)
+    text = _replace_py_literals(text)
+    text = _close_brackets(text)
+    return _TRAILING_COMMA.sub(r"\1", text)
+
+
+def _is_profile(value: Any) -> bool:
+    return isinstance(value, dict) and ("name" in value or "stages" in value)
+
+
+def repair_profile_json_text(reply: str) -> Optional[dict]:
+    """Recover a profile object from a reply that strict extraction rejected.
+
+    Tries fenced blocks (including an unterminated final one) and then the
+    outermost brace span of an unfenced reply, applying syntax clean-ups to
+    each candidate.
+
+    Returns:
+        The parsed profile dict, or None when nothing profile-shaped parses.
+    """
+    candidates = [m.group(1) for m in _FENCED_BLOCK.finditer(reply)]
+    start = reply.find("{")
+    if start != -1:
+        end = reply.rfind("}")
+        candidates.append(reply[start:end + 1] if end > start else reply[start:])
+
+    for candidate in candidates:
+        if "{" not in candidate:
+            continue
+        candidate = candidate[candidate.find("{"):]
+        for text in (candidate, _clean_json_text(candidate)):
+            try:
+                parsed = json.loads(text)
+            except json.JSONDecodeError:
+                continue
+            if _is_profile(parsed):
+                return parsed
+    return None
+
+
+# ── Structural repair ─────────────────────────────────────────────────────────
+
+def _collect_refs(obj: Any, refs: Dict[str, str], stage_type: str) -> None:
+    if isinstance(obj, str):
+        if obj.startswith("$") and len(obj) > 1:
+            refs.setdefault(obj[1:], stage_type)
+    elif isinstance(obj, list):
+        for item in obj:
+            _collect_refs(item, refs, stage_type)
+    elif isinstance(obj, dict):
+        for val in obj.values():
+            _collect_refs(val, refs, stage_type)
+
+
+def _clamp_pressure(value: Any) -> Any:
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return min(max(value, 0), MAX_PRESSURE_BAR)
+    return value
+
+
+def _repair_stage(stage: dict, label: str, fixes: List[str]) -> None:
+    stype = stage.get("type")
+
+    triggers = [t for t in stage.get("exit_triggers") or [] if isinstance(t, dict)]
+    if stype in ("flow", "pressure"):
+        kept = [t for t in triggers if t.get("type") != stype]
+        if len(kept) != len(triggers):
+            fixes.append(f"paradox_trigger: removed {stype} exit trigger from '{label}'")
+            triggers = kept
+    if not any(t.get("type") == "time" for t in triggers) and len(triggers) <= 1:
+        triggers.append(dict(_TIME_BACKUP_TRIGGER))
+        fixes.append(f"time_backup: added time exit trigger to '{label}'")
+    stage["exit_triggers"] = triggers
+
+    limits = [lim for lim in stage.get("limits") or [] if isinstance(lim, dict)]
+    needed = _DEFAULT_LIMITS.get(stype)
+    if needed and not any(lim.get("type") == needed["type"] for lim in limits):
+        limits.append(dict(needed))
+        fixes.append(f"cross_limit: added {needed['type']} limit to '{label}'")
+    for lim in limits:
+        if lim.get("type") == "pressure":
+            clamped = _clamp_pressure(lim.get("value"))
+            if clamped != lim.get("value"):
+                lim["value"] = clamped
+                fixes.append(f"clamp: pressure limit in '{label}'")
+    stage["limits"] = limits
+
+    dynamics = stage.get("dynamics")
+    if isinstance(dynamics, dict):
+        if dynamics.get("over") not in (None, "time", "weight", "piston_position"):
+            dynamics["over"] = "time"
+            fixes.append(f"dynamics_over: reset to 'time' in '{label}'")
+        if dynamics.get("interpolation") not in (None, "linear", "curve"):
+            dynamics["interpolation"] = "linear"
+            fixes.append(f"interpolation: reset to 'linear' in '{label}'")
+        if stype == "pressure":
+            for point in dynamics.get("points") or []:
+                if isinstance(point, list) and len(point) == 2:
+                    clamped = _clamp_pressure(point[1])
+                    if clamped != point[1]:
+                        point[1] = clamped
+                        fixes.append(f"clamp: pressure point in '{label}'")
+
+
+def _repair_variables(profile: dict, fixes: List[str]) -> None:
+    refs: Dict[str, str] = {}
+    for stage in profile.get("stages", []):
+        if isinstance(stage, dict):
+            _collect_refs(stage, refs, stage.get("type") or "pressure")
+
+    variables = [v for v in profile.get("variables") or [] if isinstance(v, dict)]
+    defined = {v.get("key") for v in variables}
+    for key, stype in refs.items():
+        if key in defined:
+            continue
+        var_type = stype if stype in _DEFAULT_VARIABLE_VALUES else "pressure"
+        variables.append({
+            "name": key.replace("_", " ").title(),
+            "key": key,
+            "type": var_type,
+            "value": _DEFAULT_VARIABLE_VALUES[var_type],
+        })
+        fixes.append(f"undefined_variable: defined ${key}")
+
+    kept = []
+    for var in variables:
+        key = var.get("key")
+        is_info = not var.get("adjustable", True) or str(key).startswith("info_")
+        if key and not is_info and key not in refs:
+            fixes.append(f"unused_variable: removed '{key}'")
+            continue
+        kept.append(var)
+    profile["variables"] = kept
+
+
+def repair_profile(profile: dict) -> Tuple[dict, List[str]]:
+    """Apply deterministic fixes to a profile that failed validation.
+
+    Args:
+        profile: Parsed profile JSON (left unmodified).
+
+    Returns:
+        Tuple of (repaired copy, list of applied fixes). An empty fix list
+        means nothing could be repaired locally.
+    """
+    fixes: List[str] = []
+    repaired = copy.deepcopy(profile)
+    stages = repaired.get("stages")
+    if not isinstance(stages, list) or not stages:
+        return repaired, fixes
+
+    if not repaired.get("name"):
+        repaired["name"] = "Untitled Profile"
+        fixes.append("default_field: name")
+    for field, default in _PROFILE_DEFAULTS.items():
+        if field not in repaired:
+            repaired[field] = copy.deepcopy(default)
+            fixes.append(f"default_field: {field}")
+
+    for i, stage in enumerate(stages):
+        if isinstance(stage, dict):
+            _repair_stage(stage, stage.get("name") or f"Stage {i + 1}", fixes)
+
+    _repair_variables(repaired, fixes)
+
+    if fixes:
+        logger.debug("Locally repaired profile", extra={"fixes": fixes[:10]})
+    return repaired, fixes
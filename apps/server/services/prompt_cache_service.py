@@ -0,0 +1,256 @@
+"""Context caching for the static profile-generation prompt prefix.
+
+Every generation sends the same persona, guidelines, validation rules and
+reference material (~10K chars distilled, ~40K detailed); only the coffee
+analysis and user requirements change.  This module keeps that prefix in the
+provider's context cache and hands out the cache handle so each generation
+only uploads its variable suffix.
+
+Handles are tracked per *slot* (the knowledge mode).  A slot's handle is
+replaced — and the old one deleted — when its prefix or the model changes,
+its TTL is refreshed as it nears expiry, and everything is dropped when the
+API key changes.  The storage is a pluggable backend so the lifecycle can be
+exercised against :class:`LocalPromptCacheBackend` in tests.
+"""
+
+import asyncio
+import hashlib
+import itertools
+import time
+from dataclasses import dataclass
+from typing import Dict, Optional, Protocol, Tuple
+
+from config import PROMPT_CACHE_BACKEND, PROMPT_CACHE_TTL_SECONDS
+from logging_config import get_logger
+
+logger = get_logger()
+
+# Refresh a handle's TTL once less than this fraction of it remains
+_REFRESH_FRACTION = 0.25
+
+# Handles this close to expiry are treated as already expired
+_EXPIRY_SLACK_SECONDS = 30
+
+# After a failed create, send full prompts for that slot and prefix for this
+# long before trying again
+_FAILURE_BACKOFF_SECONDS = 600
+
+
+class PromptCacheBackend(Protocol):
+    """Storage for cached prompt prefixes."""
+
+    async def create(self, model: str, prefix: str, ttl_seconds: int) -> str:
+        """Cache *prefix* for *model* and return its handle."""
+
+    async def refresh(self, handle: str, ttl_seconds: int) -> None:
+        """Extend a handle's lifetime by *ttl_seconds* from now."""
+
+    async def delete(self, handle: str) -> None:
+        """Release a handle."""
+
+
+class GeminiPromptCacheBackend:
+    """Backend using the Gemini API's explicit context caching."""
+
+    async def create(self, model: str, prefix: str, ttl_seconds: int) -> str:
+        from google.genai import types as genai_types
+        from services.gemini_service import get_gemini_client
+
+        cached = await get_gemini_client().aio.caches.create(
+            model=model,
+            config=genai_types.CreateCachedContentConfig(
+                contents=[prefix],
+                ttl=f"{ttl_seconds}s",
+                display_name="meticai-profile-prompt",
+            ),
+        )
+        return cached.name
+
+    async def refresh(self, handle: str, ttl_seconds: int) -> None:
+        from google.genai import types as genai_types
+        from services.gemini_service import get_gemini_client
+
+        await get_gemini_client().aio.caches.update(
+            name=handle,
+            config=genai_types.UpdateCachedContentConfig(ttl=f"{ttl_seconds}s"),
+        )
+
+    async def delete(self, handle: str) -> None:
+        from services.gemini_service import get_gemini_client
+
+        await get_gemini_client().aio.caches.delete(name=handle)
+
+
+class LocalPromptCacheBackend:
+    """In-process stand-in for the provider cache, for tests and development.
+
+    Its handles are not understood by the Gemini API.
+    """
+
+    def __init__(self):
+        self._ids = itertools.count(1)
+        self.entries: Dict[str, dict] = {}
+
+    async def create(self, model: str, prefix: str, ttl_seconds: int) -> str:
+        handle = f"cachedContents/local-{next(self._ids)}"
+        self.entries[handle] = {
+            "model": model,
+            "prefix": prefix,
+            "expires_at": time.monotonic() + ttl_seconds,
+        }
+        return handle
+
+    async def refresh(self, handle: str, ttl_seconds: int) -> None:
+        if handle not in self.entries:
+            raise KeyError(handle)
+        self.entries[handle]["expires_at"] = time.monotonic() + ttl_seconds
+
+    async def delete(self, handle: str) -> None:
+        self.entries.pop(handle, None)
+
+
+@dataclass
+class _CacheEntry:
+    key: str
+    handle: str
+    expires_at: float
+
+
+class PromptCacheManager:
+    """Lifecycle management for cached prompt prefixes."""
+
+    def __init__(self, backend: Optional[PromptCacheBackend], ttl_seconds: int = 3600):
+        self.backend = backend
+        self.ttl_seconds = ttl_seconds
+        self._entries: Dict[str, _CacheEntry] = {}
+        # (slot, key) whose create failed -> monotonic time to try again
+        self._backoff: Dict[Tuple[str, str], float] = {}
+        self._lock: Optional[asyncio.Lock] = None
+        self._lock_loop: Optional[asyncio.AbstractEventLoop] = None
+        self.stats = {"hits": 0, "creates": 0, "refreshes": 0, "invalidations": 0, "failures": 0}
+
+    def _get_lock(self) -> asyncio.Lock:
+        running_loop = asyncio.get_running_loop()
+        if self._lock is None or running_loop is not self._lock_loop:
+            self._lock = asyncio.Lock()
+            self._lock_loop = running_loop
+        return self._lock
+
+    @staticmethod
+    def _key(model: str, prefix: str) -> str:
+        return hashlib.sha256(f"{model}\0{prefix}".encode("utf-8")).hexdigest()
+
+    async def get_handle(self, slot: str, model: str, prefix: str) -> Optional[str]:
+        """Return a cache handle holding *prefix* for *model*, or None.
+
+        None means the caller should send the full prompt: caching is
+        disabled, or creating this slot's cache for *prefix* failed
+        recently.
+        """
+        if self.backend is None:
+            return None
+        key = self._key(model, prefix)
+        if time.monotonic() < self._backoff.get((slot, key), 0.0):
+            return None
+
+        async with self._get_lock():
+            now = time.monotonic()
+            entry = self._entries.get(slot)
+            if entry is not None and (
+                entry.key != key or entry.expires_at - _EXPIRY_SLACK_SECONDS <= now
+            ):
+                await self._drop(slot)
+                entry = None
+
+            if entry is not None:
+                if entry.expires_at - now < self.ttl_seconds * _REFRESH_FRACTION:
+                    try:
+                        await self.backend.refresh(entry.handle, self.ttl_seconds)
+                        entry.expires_at = now + self.ttl_seconds
+                        self.stats["refreshes"] += 1
+                    except Exception as e:
+                        logger.warning(f"Prompt cache refresh failed, recreating: {e}")
+                        await self._drop(slot)
+                        entry = None
+                if entry is not None:
+                    self.stats["hits"] += 1
+                    return entry.handle
+
+            try:
+                handle = await self.backend.create(model, prefix, self.ttl_seconds)
+            except Exception as e:
+                self.stats["failures"] += 1
+                self._backoff[(slot, key)] = now + _FAILURE_BACKOFF_SECONDS
+                logger.warning(
+                    f"Prompt cache creation failed, sending full {slot} prompts for "
+                    f"{_FAILURE_BACKOFF_SECONDS}s: {e}",
+                    extra={"slot": slot, "model": model, "prefix_chars": len(prefix)},
+                )
+                return None
+
+            self._backoff.pop((slot, key), None)
+            self._entries[slot] = _CacheEntry(key=key, handle=handle, expires_at=now + self.ttl_seconds)
+            self.stats["creates"] += 1
+            logger.info(
+                "Cached profile prompt prefix",
+                extra={"slot": slot, "model": model, "prefix_chars": len(prefix), "handle": handle},
+            )
+            return handle
+
+    async def invalidate(self, slot: Optional[str] = None) -> None:
+        """Drop one slot's handle (e.g. after the provider rejected it) or all."""
+        async with self._get_lock():
+            for name in [slot] if slot is not None else list(self._entries):
+                await self._drop(name)
+
+    async def _drop(self, slot: str) -> None:
+        entry = self._entries.pop(slot, None)
+        if entry is None:
+            return
+        self.stats["invalidations"] += 1
+        try:
+            await self.backend.delete(entry.handle)
+        except Exception as e:
+            logger.debug(f"Failed to delete cached prompt {entry.handle}: {e}")
+
+    def snapshot(self) -> dict:
+        """Return backend, cached slots and counters for diagnostics."""
+        return {
+            "backend": type(self.backend).__name__ if self.backend is not None else None,
+            "slots": sorted(self._entries),
+            **self.stats,
+        }
+
+
+def _default_backend() -> Optional[PromptCacheBackend]:
+    if PROMPT_CACHE_BACKEND == "gemini":
+        return GeminiPromptCacheBackend()
+    return None
+
+
+_manager: Optional[PromptCacheManager] = None
+
+
+def get_prompt_cache() -> PromptCacheManager:
+    """Return the process-wide prompt cache manager."""
+    global _manager
+    if _manager is None:
+        _manager = PromptCacheManager(_default_backend(), ttl_seconds=PROMPT_CACHE_TTL_SECONDS)
+    return _manager
+
+
+def set_prompt_cache_backend(backend: Optional[PromptCacheBackend]) -> PromptCacheManager:
+    """Replace the backend (None disables caching) and forget existing handles."""
+    global _manager
+    _manager = PromptCacheManager(backend, ttl_seconds=PROMPT_CACHE_TTL_SECONDS)
+    return _manager
+
+
+def reset_prompt_cache() -> None:
+    """Forget all handles without contacting the backend.
+
+    Called when the API key changes: handles belong to the old key's project
+    and will expire there on their own.
+    """
+    global _manager
+    _manager = None
@@ -13,6 +13,7 @@ import asyncio
 from pathlib import Path
 
 from config import DATA_DIR
+from services.persistence_service import get_persistence, mark_dirty, register_dataset
 
 logger = logging.getLogger(__name__)
 
@@ -63,7 +64,7 @@ PREHEAT_DURATION_MINUTES = 10
 class ScheduledShotsPersistence:
     """Manages persistence of scheduled shots to disk.
     
-    Scheduled shots are stored in a JSON file to survive server restarts.
+    Scheduled shots are stored in the database (or a JSON file) to survive server restarts.
     This ensures that scheduled shots are not lost during crashes, deploys,
     or host reboots.
     """
@@ -76,37 +77,41 @@ class ScheduledShotsPersistence:
                              Defaults to DATA_DIR/scheduled_shots.json.
         """
         if persistence_file is None:
+            # The default instance is a database collection; explicit paths stay files
             self.persistence_file = DATA_DIR / "scheduled_shots.json"
+            self._dataset = "scheduled_shots"
+            collection = "scheduled_shots"
         else:
             self.persistence_file = Path(persistence_file)
+            self._dataset = f"scheduled_shots:{self.persistence_file}"
+            collection = None
         self._lock = asyncio.Lock()
+        self._shots: dict = {}
+        register_dataset(self._dataset, self.persistence_file, self._snapshot, collection=collection)
         
         # Ensure the parent directory exists
         self.persistence_file.parent.mkdir(parents=True, exist_ok=True)
     
+    def _snapshot(self) -> dict:
+        # Only save shots that are scheduled or preheating (not completed/failed/cancelled)
+        return {
+            shot_id: shot for shot_id, shot in self._shots.items()
+            if shot.get("status") in ["scheduled", "preheating"]
+        }
+    
     async def save(self, scheduled_shots: dict) -> None:
         """Save scheduled shots to disk.
         
+        The write is coalesced with other pending saves by the persistence
+        service; the active shots are filtered when it is written.
+        
         Args:
             scheduled_shots: Dictionary of scheduled shots to persist.
         """
         async with self._lock:
             try:
-                # Only save shots that are scheduled or preheating (not completed/failed/cancelled)
-                active_shots = {
-                    shot_id: shot for shot_id, shot in scheduled_shots.items()
-                    if shot.get("status") in ["scheduled", "preheating"]
-                }
-                
-                # Write atomically using a temporary file
-                temp_file = self.persistence_file.with_suffix('.tmp')
-                with open(temp_file, 'w') as f:
-                    json.dump(active_shots, f, indent=2)
-                
-                # Atomic rename
-                temp_file.replace(self.persistence_file)
-                
-                logger.debug(f"Persisted {len(active_shots)} scheduled shots to {self.persistence_file}")
+                self._shots = scheduled_shots
+                mark_dirty(self._dataset)
             except Exception as e:
                 logger.error(f"Failed to save scheduled shots: {e}", exc_info=True)
     
@@ -116,20 +121,21 @@ class ScheduledShotsPersistence:
         Returns:
             Dictionary of scheduled shots, or empty dict if file doesn't exist or is invalid.
         """
+        await get_persistence().flush([self._dataset])
         async with self._lock:
+            persistence = get_persistence()
             try:
-                if not self.persistence_file.exists():
+                if not persistence.has_data(self._dataset):
                     logger.info("No persisted scheduled shots found (first run)")
                     return {}
                 
-                with open(self.persistence_file, 'r') as f:
-                    data = json.load(f)
+                data = persistence.read(self._dataset)
                 
                 if not isinstance(data, dict):
                     logger.warning("Invalid scheduled shots file format, ignoring")
                     return {}
                 
-                logger.info(f"Loaded {len(data)} scheduled shots from {self.persistence_file}")
+                logger.info(f"Loaded {len(data)} scheduled shots")
                 return data
             except json.JSONDecodeError as e:
                 logger.error(f"Corrupt scheduled shots file, ignoring: {e}")
@@ -149,10 +155,10 @@ class ScheduledShotsPersistence:
     async def clear(self) -> None:
         """Clear all persisted scheduled shots."""
         async with self._lock:
+            self._shots = {}
             try:
-                if self.persistence_file.exists():
-                    self.persistence_file.unlink()
-                    logger.info("Cleared persisted scheduled shots")
+                get_persistence().clear(self._dataset)
+                logger.info("Cleared persisted scheduled shots")
             except Exception as e:
                 logger.error(f"Failed to clear scheduled shots: {e}", exc_info=True)
 
@@ -170,9 +176,15 @@ class RecurringSchedulesPersistence:
     def __init__(self, persistence_file: str | Path | None = None):
         if persistence_file is None:
             self.persistence_file = DATA_DIR / "recurring_schedules.json"
+            self._dataset = "recurring_schedules"
+            collection = "recurring_schedules"
         else:
             self.persistence_file = Path(persistence_file)
+            self._dataset = f"recurring_schedules:{self.persistence_file}"
+            collection = None
         self._lock = asyncio.Lock()
+        self._schedules: dict = {}
+        register_dataset(self._dataset, self.persistence_file, lambda: dict(self._schedules), collection=collection)
         
         self.persistence_file.parent.mkdir(parents=True, exist_ok=True)
     
@@ -180,29 +192,26 @@ class RecurringSchedulesPersistence:
         """Save recurring schedules to disk.
         
         Persists ALL schedules (enabled and disabled) so that disabled
-        schedules survive restarts and can be re-enabled later.
+        schedules survive restarts and can be re-enabled later.  The write
+        is coalesced with other pending saves by the persistence service.
         """
         async with self._lock:
             try:
-                temp_file = self.persistence_file.with_suffix('.tmp')
-                with open(temp_file, 'w') as f:
-                    json.dump(schedules, f, indent=2)
-                temp_file.replace(self.persistence_file)
-                
-                enabled_count = sum(1 for s in schedules.values() if s.get("enabled", True))
-                logger.debug(f"Persisted {len(schedules)} recurring schedules ({enabled_count} enabled)")
+                self._schedules = schedules
+                mark_dirty(self._dataset)
             except Exception as e:
                 logger.error(f"Failed to save recurring schedules: {e}", exc_info=True)
     
     async def load(self) -> dict:
         """Load recurring schedules from disk."""
+        await get_persistence().flush([self._dataset])
         async with self._lock:
+            persistence = get_persistence()
             try:
-                if not self.persistence_file.exists():
+                if not persistence.has_data(self._dataset):
                     return {}
                 
-                with open(self.persistence_file, 'r') as f:
-                    data = json.load(f)
+                data = persistence.read(self._dataset)
                 
                 if not isinstance(data, dict):
                     return {}
@@ -5,7 +5,7 @@ from typing import Optional
 from pathlib import Path
 
 from config import DATA_DIR
-from utils.file_utils import atomic_write_json
+from services.persistence_service import get_persistence, mark_dirty, read_dataset, register_dataset
 
 SETTINGS_FILE = DATA_DIR / "settings.json"
 
@@ -26,8 +26,16 @@ _DEFAULT_SETTINGS = {
 }
 
 
+register_dataset(
+    "settings", lambda: SETTINGS_FILE, lambda: dict(_settings_cache or {}),
+    collection="settings",
+)
+
+
 def ensure_settings_file():
-    """Ensure the settings file and directory exist."""
+    """Ensure the settings file and directory exist (JSON storage only)."""
+    if get_persistence().uses_database("settings"):
+        return
     SETTINGS_FILE.parent.mkdir(parents=True, exist_ok=True)
     if not SETTINGS_FILE.exists():
         SETTINGS_FILE.write_text(json.dumps(_DEFAULT_SETTINGS, indent=2))
@@ -44,8 +52,7 @@ def load_settings() -> dict:
         return _settings_cache
     ensure_settings_file()
     try:
-        with open(SETTINGS_FILE, 'r', encoding='utf-8') as f:
-            data = json.load(f)
+        data = read_dataset("settings")
     except (json.JSONDecodeError, FileNotFoundError):
         data = None
 
@@ -62,7 +69,7 @@ def save_settings(settings: dict):
     global _settings_cache
     _settings_cache = settings
     ensure_settings_file()
-    atomic_write_json(SETTINGS_FILE, settings)
+    mark_dirty("settings")
 
 
 def get_author_name() -> str:
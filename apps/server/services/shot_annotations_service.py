@@ -21,7 +21,7 @@ from typing import Optional
 
 from logging_config import get_logger
 from config import DATA_DIR
-from utils.file_utils import atomic_write_json
+from services.persistence_service import get_persistence, mark_dirty, read_dataset, register_dataset
 
 logger = get_logger()
 
@@ -31,11 +31,27 @@ ANNOTATIONS_FILE = DATA_DIR / "shot_annotations.json"
 _annotations_cache: Optional[dict] = None
 
 # Lock to prevent concurrent read/modify/write races
-_annotations_lock = threading.Lock()
+# (reentrant: write-through saves snapshot the data while it is held)
+_annotations_lock = threading.RLock()
+
+
+def _snapshot_annotations() -> dict:
+    """Copy the annotations for the persistence flusher."""
+    with _annotations_lock:
+        return {key: dict(entry) if isinstance(entry, dict) else entry
+                for key, entry in (_annotations_cache or {}).items()}
+
+
+register_dataset(
+    "shot_annotations", lambda: ANNOTATIONS_FILE, _snapshot_annotations,
+    collection="shot_annotations",
+)
 
 
 def _ensure_file():
-    """Ensure the annotations file and directory exist."""
+    """Ensure the annotations file and directory exist (JSON storage only)."""
+    if get_persistence().uses_database("shot_annotations"):
+        return
     ANNOTATIONS_FILE.parent.mkdir(parents=True, exist_ok=True)
     if not ANNOTATIONS_FILE.exists():
         ANNOTATIONS_FILE.write_text("{}")
@@ -49,8 +65,7 @@ def _load_annotations() -> dict:
     
     _ensure_file()
     try:
-        with open(ANNOTATIONS_FILE, 'r', encoding='utf-8') as f:
-            data = json.load(f)
+        data = read_dataset("shot_annotations")
     except (json.JSONDecodeError, FileNotFoundError):
         data = {}
     
@@ -63,11 +78,10 @@ def _load_annotations() -> dict:
 
 
 def _save_annotations(data: dict) -> None:
-    """Save annotations to disk and update cache."""
+    """Update the cache and schedule the annotations to be written to disk."""
     global _annotations_cache
-    _ensure_file()
-    atomic_write_json(ANNOTATIONS_FILE, data)
     _annotations_cache = data
+    mark_dirty("shot_annotations")
 
 
 def make_shot_key(date: str, filename: str) -> str:
@@ -0,0 +1,310 @@
+"""Live shot recorder — builds a shot record from MQTT telemetry.
+
+While the machine reports ``brewing``, the recorder samples the live
+sensor snapshot (at most ``SAMPLE_RATE`` rows per second) into columns.
+When brewing stops the record is stored locally, so the shot can be shown
+and analysed straight away instead of waiting for the machine to write its
+history file and fetching it over HTTP.
+
+Storage format: list of records, newest last, at most ``MAX_LIVE_SHOTS``:
+[
+    {
+        "id": "live-1700000000000",
+        "start_time": 1700000000.0,
+        "duration": 31.2,
+        "profile_name": "Classic",
+        "final_weight": 36.4,
+        "max_pressure": 9.1,
+        "columns": {"time": [0, 100, ...], "pressure": [...], ...},
+        "stages": [{"name": "Preinfusion", "start_ms": 0}, ...],
+        "analysis": {...},  # live analysis verdict (services.live_analysis)
+        "machine": {"date": "2024-01-15", "filename": "..."},  # once reconciled
+        "reconciled": false
+    }
+]
+
+Once the machine's own file for the shot is seen, the record is reconciled
+with it: linked by date/filename, and its summary replaced by the machine's
+authoritative values.
+"""
+
+import json
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+from logging_config import get_logger
+from config import DATA_DIR
+from services.live_analysis import LiveShotAnalyzer
+from services.persistence_service import get_persistence, mark_dirty, read_dataset, register_dataset
+
+logger = get_logger()
+
+LIVE_SHOTS_FILE = DATA_DIR / "live_shots.json"
+
+# Records kept; older ones are dropped first
+MAX_LIVE_SHOTS = 20
+
+# Rows recorded per second of shot
+SAMPLE_RATE = 10
+
+# Brewing spells shorter than this (e.g. a purge) are not kept
+MIN_SHOT_SECONDS = 3.0
+
+# Max difference between a record's start and the machine's shot time
+RECONCILE_WINDOW = 60.0  # seconds
+
+# Snapshot sensor -> recorded column (machine shot file ``shot`` key)
+COLUMNS = {
+    "pressure": "pressure",
+    "flow_rate": "flow",
+    "shot_weight": "weight",
+    "brew_head_temperature": "temperature",
+}
+
+# In-memory cache
+_live_shots_cache: Optional[List[dict]] = None
+
+_live_shots_lock = threading.RLock()
+
+
+def _snapshot_live_shots() -> List[dict]:
+    """Copy the records for the persistence flusher."""
+    with _live_shots_lock:
+        return [dict(record) for record in (_live_shots_cache or [])]
+
+
+register_dataset(
+    "live_shots", lambda: LIVE_SHOTS_FILE, _snapshot_live_shots,
+    indent=None, collection="live_shots", kind="list",
+)
+
+
+def _load_live_shots() -> List[dict]:
+    """Load records from storage, caching in memory."""
+    global _live_shots_cache
+    with _live_shots_lock:
+        if _live_shots_cache is not None:
+            return _live_shots_cache
+        try:
+            data = read_dataset("live_shots") if get_persistence().has_data("live_shots") else []
+        except (json.JSONDecodeError, FileNotFoundError):
+            data = []
+        if not isinstance(data, list):
+            logger.warning("Live shots file contained non-list — resetting")
+            data = []
+        _live_shots_cache = data
+        return _live_shots_cache
+
+
+def save_live_shot(record: dict) -> None:
+    """Store a finished record, dropping the oldest beyond ``MAX_LIVE_SHOTS``."""
+    with _live_shots_lock:
+        records = _load_live_shots()
+        records.append(record)
+        removed = records[:-MAX_LIVE_SHOTS] if len(records) > MAX_LIVE_SHOTS else []
+        del records[:len(removed)]
+        changed = [record["id"]] + [r.get("id") for r in removed]
+    mark_dirty("live_shots", changed)
+
+
+def get_live_shots() -> List[dict]:
+    """Return the stored records, newest first."""
+    with _live_shots_lock:
+        return list(reversed(_load_live_shots()))
+
+
+def get_latest_live_shot() -> Optional[dict]:
+    """Return the most recent record, or None."""
+    with _live_shots_lock:
+        records = _load_live_shots()
+        return records[-1] if records else None
+
+
+def reconcile_live_shot(shot_data: dict, date: str, filename: str) -> Optional[dict]:
+    """Link the record of the machine shot *shot_data* to its file.
+
+    The record whose start is closest to the shot's ``time`` (within
+    ``RECONCILE_WINDOW``) gets the machine's date/filename and its
+    profile name, duration and final weight.
+
+    Returns:
+        The reconciled record, or None if no record matches.
+    """
+    try:
+        shot_time = float(shot_data.get("time"))
+    except (TypeError, ValueError):
+        return None
+    with _live_shots_lock:
+        candidates = [
+            r for r in _load_live_shots()
+            if abs(r.get("start_time", 0) - shot_time) <= RECONCILE_WINDOW
+        ]
+        if not candidates:
+            return None
+        record = min(candidates, key=lambda r: abs(r["start_time"] - shot_time))
+        if record.get("machine") == {"date": date, "filename": filename}:
+            return record
+        record["machine"] = {"date": date, "filename": filename}
+        record["reconciled"] = True
+        profile_name = shot_data.get("profile_name")
+        if not profile_name and isinstance(shot_data.get("profile"), dict):
+            profile_name = shot_data["profile"].get("name")
+        if profile_name:
+            record["profile_name"] = profile_name
+        entries = shot_data.get("data") or []
+        if entries:
+            last = entries[-1]
+            if isinstance(last.get("shot"), dict) and last["shot"].get("weight") is not None:
+                record["final_weight"] = last["shot"]["weight"]
+            if last.get("time"):
+                record["duration"] = round(last["time"] / 1000, 2)
+    mark_dirty("live_shots", [record["id"]])
+    return record
+
+
+def live_shot_to_shot_data(record: dict) -> dict:
+    """Convert a record to the machine's shot file layout for analysis.
+
+    Sensors without a value in a row (e.g. the scale before its first
+    reading) are left out of that row's ``shot``, as the analysis expects.
+    """
+    columns = record.get("columns", {})
+    times = columns.get("time", [])
+    stages = record.get("stages", [])
+    data = []
+    stage_index = 0
+    for i, t in enumerate(times):
+        while stage_index + 1 < len(stages) and stages[stage_index + 1]["start_ms"] <= t:
+            stage_index += 1
+        data.append({
+            "time": t,
+            "shot": {
+                key: columns[key][i] for key in COLUMNS.values()
+                if key in columns and columns[key][i] is not None
+            },
+            "status": stages[stage_index]["name"] if stages else "",
+        })
+    return {
+        "time": record.get("start_time"),
+        "profile_name": record.get("profile_name", ""),
+        "data": data,
+    }
+
+
+class LiveShotRecorder:
+    """Turns the stream of telemetry snapshots into shot records.
+
+    ``update`` is called by the MQTT subscriber with the snapshot after
+    every sensor message.  It is cheap while idle: only ``brewing`` is read.
+
+    Each completed row is also fed to a :class:`LiveShotAnalyzer`, whose
+    events go to *on_event*.  *on_start* is called with the new record and
+    its analyzer when a shot starts (e.g. to look up the profile).
+    """
+
+    def __init__(
+        self,
+        sample_rate: float = SAMPLE_RATE,
+        min_seconds: float = MIN_SHOT_SECONDS,
+        on_start: Optional[Callable[[dict, LiveShotAnalyzer], None]] = None,
+        on_event: Optional[Callable[[dict], None]] = None,
+    ):
+        self.sample_rate = sample_rate
+        self.min_seconds = min_seconds
+        self._on_start = on_start
+        self._on_event = on_event
+        self._lock = threading.Lock()
+        self._current: Optional[Dict[str, Any]] = None
+        self._last_bucket: Optional[int] = None
+        self._row_stage: Optional[str] = None
+        self.analyzer: Optional[LiveShotAnalyzer] = None
+
+    @property
+    def recording(self) -> bool:
+        return self._current is not None
+
+    def update(self, snapshot: Dict[str, Any], now: Optional[float] = None) -> Optional[dict]:
+        """Record *snapshot*; return the finished record when a shot ends.
+
+        The caller stores the returned record (``save_live_shot``).
+        """
+        brewing = bool(snapshot.get("brewing"))
+        if not brewing and self._current is None:
+            return None
+        now = time.time() if now is None else now
+        with self._lock:
+            if self._current is None:
+                self._start(snapshot, now)
+            if brewing:
+                self._append(snapshot, now)
+                return None
+            return self._finish()
+
+    def _start(self, snapshot: Dict[str, Any], now: float) -> None:
+        self._current = {
+            "id": f"live-{int(now * 1000)}",
+            "start_time": now,
+            "profile_name": snapshot.get("active_profile") or "",
+            "columns": {"time": [], **{key: [] for key in COLUMNS.values()}},
+            "stages": [],
+        }
+        self._last_bucket = None
+        self._row_stage = None
+        self.analyzer = LiveShotAnalyzer(on_event=self._on_event)
+        if self._on_start is not None:
+            try:
+                self._on_start(self._current, self.analyzer)
+            except Exception as exc:
+                logger.warning(f"Live shot start handler failed: {exc}")
+
+    def _append(self, snapshot: Dict[str, Any], now: float) -> None:
+        record = self._current
+        columns = record["columns"]
+        elapsed_ms = int(round((now - record["start_time"]) * 1000))
+        bucket = int(elapsed_ms * self.sample_rate / 1000)
+        if bucket == self._last_bucket:
+            # Same sample slot: the newest values replace the row
+            for key in columns:
+                columns[key].pop()
+        else:
+            self._analyze_last_row()
+        self._last_bucket = bucket
+        self._row_stage = snapshot.get("state")
+        columns["time"].append(elapsed_ms)
+        for sensor, key in COLUMNS.items():
+            value = snapshot.get(sensor)
+            columns[key].append(value if isinstance(value, (int, float)) and not isinstance(value, bool) else None)
+        stage = snapshot.get("state")
+        if stage and (not record["stages"] or record["stages"][-1]["name"] != stage):
+            record["stages"].append({"name": stage, "start_ms": elapsed_ms})
+
+    def _analyze_last_row(self) -> None:
+        """Feed the newest (now complete) row to the analyzer."""
+        columns = self._current["columns"]
+        if self.analyzer is None or not columns["time"]:
+            return
+        self.analyzer.add(
+            columns["time"][-1] / 1000, self._row_stage,
+            columns["pressure"][-1], columns["flow"][-1], columns["weight"][-1],
+        )
+
+    def _finish(self) -> Optional[dict]:
+        self._analyze_last_row()
+        record, self._current = self._current, None
+        analyzer, self.analyzer = self.analyzer, None
+        times = record["columns"]["time"]
+        duration = times[-1] / 1000 if times else 0.0
+        if duration < self.min_seconds:
+            return None
+        weights = [w for w in record["columns"]["weight"] if w is not None]
+        pressures = [p for p in record["columns"]["pressure"] if p is not None]
+        record.update(
+            duration=round(duration, 2),
+            final_weight=weights[-1] if weights else None,
+            max_pressure=max(pressures) if pressures else None,
+            analysis=analyzer.finish() if analyzer is not None else None,
+            machine=None,
+            reconciled=False,
+        )
+        return record
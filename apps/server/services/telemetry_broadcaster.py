@@ -0,0 +1,395 @@
+"""Single-task fan-out of live telemetry to WebSocket clients.
+
+One :class:`TelemetryBroadcaster` per :class:`~services.mqtt_service.MQTTSubscriber`
+waits for new MQTT data, builds each frame once per *rate group* (clients
+with the same protocol mode and frame rate), serializes it once per
+*channel* (mode, encoding and quantization in use by some client), and
+hands the same payload to every client's bounded queue.  The
+per-connection handlers only drain their queue into the socket, so the
+cost of a frame is constant in the number of clients apart from the socket
+writes themselves.
+
+A client whose queue is full has its backlog discarded; a ``delta`` client
+is then sent a keyframe instead of the next delta so it resynchronises.
+Live analysis events are queued as *priority* payloads, which are never
+discarded and do not count towards the queue bound or congestion.
+Each client also has a frame rate between 1 and 20 FPS: it asks for a
+maximum (``?fps=`` or a ``{"fps": n}`` message), and is stepped down a
+level when it drops frames or its sends take over half a frame period, and
+back up after a spell without congestion.
+"""
+
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Any, Deque, Dict, Optional, Set, Tuple, Union
+
+from services.telemetry_frames import (
+    FORMAT_JSON,
+    MODE_DELTA,
+    MODE_FULL,
+    MODES,
+    TelemetryFrameEncoder,
+    available_formats,
+    serialize_frame,
+)
+
+logger = logging.getLogger(__name__)
+
+# Frame rates a client can run at; adaptation moves between adjacent levels
+FPS_LEVELS = (1, 2, 5, 10, 20)
+DEFAULT_FPS = 10
+
+# Period at which the MQTT subscriber batches sensor messages before waking
+# the broadcaster, so one machine tick lands in one frame (the top rate)
+FRAME_INTERVAL = 1 / FPS_LEVELS[-1]  # seconds
+
+# Silence after which a heartbeat frame is sent
+HEARTBEAT_INTERVAL = 5.0  # seconds
+
+# Frames a client may have waiting before its backlog is dropped
+CLIENT_QUEUE_SIZE = 3
+
+# Seconds without congestion before a client's frame rate is raised a level
+RAMP_UP_AFTER = 5.0
+
+
+Payload = Union[str, bytes]
+
+
+def fps_level(fps: Any) -> int:
+    """Return the highest supported frame rate not above *fps*."""
+    try:
+        fps = float(fps)
+    except (TypeError, ValueError):
+        return DEFAULT_FPS
+    return max([level for level in FPS_LEVELS if level <= fps] or [FPS_LEVELS[0]])
+
+
+class TelemetryClient:
+    """A connected WebSocket client's bounded frame queue and frame rate.
+
+    Payloads are ``str`` (JSON text messages) or ``bytes`` (binary
+    messages).  ``None`` in the queue means the broadcaster stopped and the
+    connection should be closed.  Consumers read with :meth:`get`, which
+    keeps track of the priority payloads still queued.
+    """
+
+    def __init__(
+        self,
+        mode: str = MODE_FULL,
+        queue_size: int = CLIENT_QUEUE_SIZE,
+        fmt: str = FORMAT_JSON,
+        quantize: bool = False,
+        fps: Any = DEFAULT_FPS,
+    ):
+        self.mode = mode if mode in MODES else MODE_FULL
+        self.format = fmt
+        self.quantize = quantize
+        # Unbounded: offer() applies the bound to frames, not priority payloads
+        self.queue: asyncio.Queue = asyncio.Queue()
+        self.queue_size = max(1, queue_size)
+        self._priority: Deque[Payload] = deque()  # still queued, oldest first
+        self.needs_keyframe = False
+        self.dropped = 0
+        self.max_fps = fps_level(fps)
+        self.fps = self.max_fps
+        self.send_seconds = 0.0  # moving average of one socket send
+        self._congested = False
+        self._stable_since: Optional[float] = None
+
+    @property
+    def channel(self) -> Tuple[str, str, bool]:
+        """Clients on the same channel receive identical payloads."""
+        return self.mode, self.format, self.quantize
+
+    @property
+    def group(self) -> Tuple[str, int]:
+        """Clients in the same rate group share one frame encoder."""
+        return self.mode, self.fps
+
+    def offer(self, data: Optional[Payload]) -> bool:
+        """Queue *data*; on overflow drop the backlog instead. Returns True if queued."""
+        if self.queue.qsize() - len(self._priority) < self.queue_size:
+            self.queue.put_nowait(data)
+            return True
+        kept = []
+        while not self.queue.empty():
+            item = self.queue.get_nowait()
+            if len(kept) < len(self._priority) and item is self._priority[len(kept)]:
+                kept.append(item)
+            else:
+                self.dropped += 1
+        for item in kept:
+            self.queue.put_nowait(item)
+        self.dropped += 1
+        self._congested = True
+        if self.mode == MODE_DELTA:
+            self.needs_keyframe = True
+        else:
+            self.queue.put_nowait(data)
+        return False
+
+    def offer_priority(self, data: Payload) -> None:
+        """Queue *data* so that it is never dropped, whatever the backlog."""
+        self._priority.append(data)
+        self.queue.put_nowait(data)
+
+    async def get(self) -> Optional[Payload]:
+        """Wait for the next payload, in the order queued."""
+        payload = await self.queue.get()
+        if self._priority and payload is self._priority[0]:
+            self._priority.popleft()
+        return payload
+
+    def close(self) -> None:
+        """Tell the connection handler to finish."""
+        while not self.queue.empty():
+            self.queue.get_nowait()
+        self._priority.clear()
+        self.queue.put_nowait(None)
+
+    def request_fps(self, fps: Any) -> None:
+        """Set the highest frame rate the client wants."""
+        self.max_fps = fps_level(fps)
+
+    def record_send(self, seconds: float) -> None:
+        """Record how long one socket send took."""
+        self.send_seconds = 0.7 * self.send_seconds + 0.3 * seconds
+        if self.send_seconds > 0.5 / self.fps:
+            self._congested = True
+
+    def adapt(self, now: float) -> bool:
+        """Step the frame rate down when congested, up after a stable spell.
+
+        Returns:
+            True if the rate changed.
+        """
+        current = self.fps
+        if self._stable_since is None:
+            self._stable_since = now
+        if self.fps > self.max_fps:
+            self.fps = self.max_fps
+        elif self._congested:
+            self.fps = FPS_LEVELS[max(0, FPS_LEVELS.index(self.fps) - 1)]
+            self._stable_since = now
+        elif self.fps < self.max_fps and now - self._stable_since >= RAMP_UP_AFTER:
+            self.fps = FPS_LEVELS[FPS_LEVELS.index(self.fps) + 1]
+            self._stable_since = now
+        self._congested = False
+        return self.fps != current
+
+
+class _RateGroup:
+    """Clients of one mode and frame rate, sharing an encoder and schedule."""
+
+    def __init__(self, mode: str, fps: int):
+        self.encoder = TelemetryFrameEncoder(mode)
+        self.interval = 1 / fps
+        self.clients: Set[TelemetryClient] = set()
+        self.next_due = 0.0
+
+
+class TelemetryBroadcaster:
+    """Builds telemetry frames once and fans them out to all clients."""
+
+    def __init__(
+        self,
+        subscriber: Any,
+        heartbeat_interval: float = HEARTBEAT_INTERVAL,
+    ):
+        self._subscriber = subscriber
+        self.heartbeat_interval = heartbeat_interval
+        self._clients: Set[TelemetryClient] = set()
+        self._groups: Dict[Tuple[str, int], _RateGroup] = {}
+        self._task: Optional[asyncio.Task] = None
+        self.stats = {
+            "frames": 0, "serializations": 0, "queued": 0, "dropped": 0,
+            "heartbeats": 0, "rate_changes": 0,
+        }
+
+    @property
+    def client_count(self) -> int:
+        return len(self._clients)
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    # -- clients -------------------------------------------------------------
+
+    def add_client(
+        self,
+        mode: str = MODE_FULL,
+        queue_size: int = CLIENT_QUEUE_SIZE,
+        fmt: str = FORMAT_JSON,
+        quantize: bool = False,
+        fps: Any = DEFAULT_FPS,
+    ) -> TelemetryClient:
+        """Register a client, queue its first frame and start broadcasting.
+
+        The first frame is built from the state its rate group last sent,
+        so the client's following deltas apply to exactly that state.
+
+        Raises:
+            ValueError: If *fmt* is unknown or not installed.
+        """
+        if fmt not in available_formats():
+            raise ValueError(f"Telemetry format not available: {fmt!r}")
+        client = TelemetryClient(mode, queue_size, fmt, quantize, fps)
+        group = self._join(client)
+        state = group.encoder.last or self._subscriber.get_snapshot()
+        if state:
+            frame = {**state, "_ts": time.time()}
+            if client.mode == MODE_DELTA:
+                frame["_kf"] = True
+            client.offer(self._serialize(frame, client.channel))
+        self._clients.add(client)
+        if not self.running:
+            self._task = asyncio.create_task(self._run())
+        return client
+
+    def remove_client(self, client: TelemetryClient) -> None:
+        """Unregister a client; the broadcast task stops with the last one."""
+        self._clients.discard(client)
+        self._leave(client, client.group)
+        self.stats["dropped"] += client.dropped
+        client.dropped = 0
+        if not self._clients and self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def stop(self) -> None:
+        """Stop broadcasting and close every client."""
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        for client in list(self._clients):
+            client.close()
+        self._clients.clear()
+        self._groups.clear()
+
+    def _join(self, client: TelemetryClient) -> _RateGroup:
+        group = self._groups.get(client.group)
+        if group is None:
+            group = self._groups[client.group] = _RateGroup(*client.group)
+        group.clients.add(client)
+        return group
+
+    def _leave(self, client: TelemetryClient, key: Tuple[str, int]) -> None:
+        group = self._groups.get(key)
+        if group is not None:
+            group.clients.discard(client)
+            if not group.clients:
+                del self._groups[key]
+
+    def _adapt(self, now: float) -> None:
+        """Move clients whose frame rate changed to their new rate group."""
+        for client in list(self._clients):
+            previous = client.group
+            if not client.adapt(now):
+                continue
+            self._leave(client, previous)
+            self._join(client)
+            # The new group's deltas are relative to a different state
+            if client.mode == MODE_DELTA:
+                client.needs_keyframe = True
+            self.stats["rate_changes"] += 1
+
+    # -- frames --------------------------------------------------------------
+
+    def _serialize(self, frame: Dict[str, Any], channel: Tuple[str, str, bool]) -> Payload:
+        self.stats["serializations"] += 1
+        _, fmt, quantize = channel
+        return serialize_frame(frame, fmt, quantize)
+
+    def publish(self, snapshot: Dict[str, Any], now: Optional[float] = None) -> Optional[float]:
+        """Encode *snapshot* for every rate group that is due and queue it.
+
+        Each frame is built once per rate group and serialized at most once
+        per channel, however many clients share it.
+
+        Returns:
+            When the earliest group that was not yet due should get the
+            snapshot, or None if every group has it.
+        """
+        now = time.time() if now is None else now
+        self._adapt(now)
+        retry_at: Optional[float] = None
+        for group in list(self._groups.values()):
+            if now < group.next_due:
+                retry_at = group.next_due if retry_at is None else min(retry_at, group.next_due)
+                continue
+            group.next_due = now + group.interval
+            self._fan_out(group, group.encoder.encode(snapshot, now), now)
+        return retry_at
+
+    def _fan_out(self, group: _RateGroup, frame: Optional[Dict[str, Any]], now: float) -> None:
+        self.stats["frames"] += 1
+        payloads: Dict[Tuple[str, str, bool], Optional[Payload]] = {}
+        keyframes: Dict[Tuple[str, str, bool], Payload] = {}
+        for client in list(group.clients):
+            channel = client.channel
+            if frame is not None and frame.get("_kf"):
+                client.needs_keyframe = False
+            if client.needs_keyframe and group.encoder.last:
+                if channel not in keyframes:
+                    keyframe = {**group.encoder.last, "_kf": True, "_ts": now}
+                    keyframes[channel] = self._serialize(keyframe, channel)
+                client.needs_keyframe = False
+                payload = keyframes[channel]
+            else:
+                if channel not in payloads:
+                    payloads[channel] = self._serialize(frame, channel) if frame is not None else None
+                payload = payloads[channel]
+            if payload is not None and client.offer(payload):
+                self.stats["queued"] += 1
+
+    def broadcast(self, frame: Dict[str, Any], priority: bool = False) -> None:
+        """Queue *frame* as-is for every client, outside the delta protocol.
+
+        With *priority* the frame is never dropped (see ``offer_priority``).
+        """
+        payloads: Dict[str, Payload] = {}
+        for client in list(self._clients):
+            if client.format not in payloads:
+                payloads[client.format] = serialize_frame(frame, client.format)
+            if priority:
+                client.offer_priority(payloads[client.format])
+            else:
+                client.offer(payloads[client.format])
+
+    def heartbeat(self) -> None:
+        """Queue a heartbeat frame for every client."""
+        self.stats["heartbeats"] += 1
+        self.broadcast({"_heartbeat": True, "_ts": time.time()})
+
+    async def _run(self) -> None:
+        retry_at: Optional[float] = None
+        last_activity = time.monotonic()
+        try:
+            while True:
+                event = self._subscriber.data_event
+                # Clear before waiting so a signal arriving meanwhile is kept
+                event.clear()
+                timeout = self.heartbeat_interval - (time.monotonic() - last_activity)
+                if retry_at is not None:
+                    timeout = min(timeout, retry_at - time.time())
+                try:
+                    # The subscriber signals once per batch of sensor updates
+                    await asyncio.wait_for(event.wait(), timeout=max(0.0, timeout))
+                except asyncio.TimeoutError:
+                    if retry_at is None or time.time() < retry_at:
+                        self.heartbeat()
+                        last_activity = time.monotonic()
+                        continue
+                # Slower groups that skipped this change get it once due
+                last_activity = time.monotonic()
+                retry_at = self.publish(self._subscriber.get_snapshot())
+        except asyncio.CancelledError:
+            raise
+        except Exception as exc:
+            logger.warning("Telemetry broadcaster failed: %s", exc, exc_info=True)
+            for client in list(self._clients):
+                client.close()
@@ -0,0 +1,153 @@
+"""Fixed-size in-memory history of live telemetry.
+
+Each numeric sensor gets its own pair of columns (timestamps and values)
+in a preallocated ring of ``duration × rate`` slots, so memory is constant
+however long the server runs.  Samples are bucketed at ``rate`` per second:
+a sensor that updates faster keeps only the newest value of each bucket,
+which guarantees the ring always spans at least ``duration`` seconds.
+Booleans (e.g. ``brewing``) are stored as 0/1; non-numeric values are
+ignored.
+
+Windows are returned column-wise — ``{sensor: {"t": [...], "v": [...]}}``
+— which is both the compact wire format and what charts consume.
+"""
+
+import threading
+import time
+from array import array
+from bisect import bisect_left, bisect_right
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+
+class _Column:
+    """Ring of (timestamp, value) samples for one sensor."""
+
+    __slots__ = ("times", "values", "start", "size", "bucket")
+
+    def __init__(self, capacity: int):
+        self.times = array("d", bytes(8 * capacity))
+        self.values = array("d", bytes(8 * capacity))
+        self.start = 0
+        self.size = 0
+        self.bucket: Optional[int] = None
+
+    def append(self, t: float, value: float, bucket: int) -> None:
+        capacity = len(self.times)
+        if bucket == self.bucket and self.size:
+            # Same bucket as the newest sample: keep only the latest value
+            i = (self.start + self.size - 1) % capacity
+        elif self.size < capacity:
+            i = (self.start + self.size) % capacity
+            self.size += 1
+        else:
+            i = self.start
+            self.start = (self.start + 1) % capacity
+        self.times[i] = t
+        self.values[i] = value
+        self.bucket = bucket
+
+    def ordered(self) -> Tuple[List[float], List[float]]:
+        """Return the samples oldest first."""
+        end = self.start + self.size
+        capacity = len(self.times)
+        if end <= capacity:
+            return self.times[self.start:end].tolist(), self.values[self.start:end].tolist()
+        wrap = end - capacity
+        return (
+            self.times[self.start:].tolist() + self.times[:wrap].tolist(),
+            self.values[self.start:].tolist() + self.values[:wrap].tolist(),
+        )
+
+
+class TelemetryRingBuffer:
+    """Columnar ring buffer of recent sensor samples, sized by duration."""
+
+    def __init__(self, duration: float = 600.0, rate: float = 10.0, sensors: Optional[Iterable[str]] = None):
+        self.duration = max(1.0, float(duration))
+        self.rate = max(0.1, float(rate))
+        self.capacity = max(1, int(self.duration * self.rate))
+        self._sensors = frozenset(sensors) if sensors is not None else None
+        self._columns: Dict[str, _Column] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def sensors(self) -> List[str]:
+        """Sensors with at least one sample."""
+        with self._lock:
+            return sorted(self._columns)
+
+    def record(self, sensor: str, value: Any, t: Optional[float] = None) -> bool:
+        """Store one sample. Returns False if it was ignored."""
+        if self._sensors is not None and sensor not in self._sensors:
+            return False
+        if isinstance(value, bool):
+            value = 1.0 if value else 0.0
+        elif not isinstance(value, (int, float)):
+            return False
+        t = time.time() if t is None else t
+        with self._lock:
+            column = self._columns.get(sensor)
+            if column is None:
+                column = self._columns[sensor] = _Column(self.capacity)
+            column.append(t, float(value), int(t * self.rate))
+        return True
+
+    def clear(self) -> None:
+        with self._lock:
+            self._columns.clear()
+
+    def window(
+        self,
+        start: Optional[float] = None,
+        end: Optional[float] = None,
+        sensors: Optional[Iterable[str]] = None,
+        max_points: Optional[int] = None,
+    ) -> Dict[str, Dict[str, List[float]]]:
+        """Return the samples with ``start <= t <= end``, column-wise.
+
+        Args:
+            start: Window start (epoch seconds); None for the oldest sample.
+            end: Window end (epoch seconds); None for the newest sample.
+            sensors: Sensors to include; None for all.
+            max_points: Evenly thin each sensor's samples to at most this
+                many (the newest sample is always kept).
+
+        Returns:
+            ``{sensor: {"t": [...], "v": [...]}}`` for sensors with samples
+            in the window.
+        """
+        with self._lock:
+            names = list(self._columns) if sensors is None else [s for s in sensors if s in self._columns]
+            snapshot = {name: self._columns[name].ordered() for name in names}
+
+        result: Dict[str, Dict[str, List[float]]] = {}
+        for name, (times, values) in snapshot.items():
+            lo = 0 if start is None else bisect_left(times, start)
+            hi = len(times) if end is None else bisect_right(times, end)
+            if lo >= hi:
+                continue
+            times, values = times[lo:hi], values[lo:hi]
+            if max_points and len(times) > max_points:
+                step = len(times) / max_points
+                picks = [int(i * step) for i in range(max_points - 1)] + [len(times) - 1]
+                times = [times[i] for i in picks]
+                values = [values[i] for i in picks]
+            result[name] = {"t": times, "v": values}
+        return result
+
+    def backfill(self, seconds: float, now: Optional[float] = None, max_points: Optional[int] = None) -> Dict[str, Any]:
+        """Compact window of the last *seconds* for a client that just joined.
+
+        Timestamps are offsets from ``t0`` rounded to 10 ms, which keeps the
+        encoded frame small.
+        """
+        now = time.time() if now is None else now
+        t0 = now - seconds
+        columns = self.window(start=t0, end=now, max_points=max_points)
+        return {
+            "t0": t0,
+            "sensors": {
+                name: {"t": [round(t - t0, 2) for t in col["t"]], "v": col["v"]}
+                for name, col in columns.items()
+            },
+        }
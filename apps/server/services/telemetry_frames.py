@@ -0,0 +1,142 @@
+"""Frame encoding for the live telemetry WebSocket.
+
+Two protocol modes, chosen by the client on connect
+(``/api/ws/live?mode=delta``):
+
+``full`` (default)
+    Every frame is the complete sensor snapshot plus ``_ts``.
+
+``delta``
+    The first frame is a *keyframe* — the complete snapshot marked with
+    ``"_kf": true``.  Later frames carry only the keys whose values changed
+    (plus ``_ts``); keys that disappeared are listed in ``_del``.  A new
+    keyframe is sent every ``keyframe_interval`` seconds so a client that
+    missed or mis-applied a frame resynchronises on its own.  Clients apply
+    a delta by merging it into their last state.
+
+Frames are sent as JSON text by default.  ``format=msgpack`` or
+``format=cbor`` sends them as binary WebSocket messages instead (needs
+the ``msgpack`` / ``cbor2`` packages).  With ``quantize=1`` float sensor
+values are sent as fixed-point integers (value × ``_q``, with ``"_q": 100``
+in the frame) — lossless, since the subscriber stores sensors rounded to
+two decimals, and much smaller than 8-byte binary floats.
+"""
+
+import json
+import time
+from typing import Any, Dict, Optional, Tuple, Union
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover - optional dependency
+    msgpack = None
+
+try:
+    import cbor2
+except ImportError:  # pragma: no cover - optional dependency
+    cbor2 = None
+
+MODE_FULL = "full"
+MODE_DELTA = "delta"
+MODES = (MODE_FULL, MODE_DELTA)
+
+# Seconds between keyframes in delta mode
+KEYFRAME_INTERVAL = 10.0
+
+FORMAT_JSON = "json"
+FORMAT_MSGPACK = "msgpack"
+FORMAT_CBOR = "cbor"
+FORMATS = (FORMAT_JSON, FORMAT_MSGPACK, FORMAT_CBOR)
+
+# Fixed-point scale for quantized frames (sensor values have 2 decimals)
+QUANT_SCALE = 100
+
+# Keys never quantized (the timestamp needs full float precision)
+_UNQUANTIZED_KEYS = frozenset({"_ts"})
+
+
+def available_formats() -> Tuple[str, ...]:
+    """Return the encodings usable with the installed packages."""
+    return tuple(
+        fmt for fmt in FORMATS
+        if fmt == FORMAT_JSON
+        or (fmt == FORMAT_MSGPACK and msgpack is not None)
+        or (fmt == FORMAT_CBOR and cbor2 is not None)
+    )
+
+
+def quantize_frame(frame: Dict[str, Any], scale: int = QUANT_SCALE) -> Dict[str, Any]:
+    """Return *frame* with float values as fixed-point integers."""
+    out: Dict[str, Any] = {
+        k: int(round(v * scale)) if isinstance(v, float) and k not in _UNQUANTIZED_KEYS else v
+        for k, v in frame.items()
+    }
+    out["_q"] = scale
+    return out
+
+
+def serialize_frame(
+    frame: Dict[str, Any], fmt: str = FORMAT_JSON, quantize: bool = False,
+) -> Union[str, bytes]:
+    """Encode a frame as JSON text or as msgpack/CBOR bytes.
+
+    Raises:
+        ValueError: If *fmt* is unknown or its package is not installed.
+    """
+    if quantize:
+        frame = quantize_frame(frame)
+    if fmt == FORMAT_JSON:
+        return json.dumps(frame, separators=(",", ":"), default=str)
+    if fmt == FORMAT_MSGPACK and msgpack is not None:
+        return msgpack.packb(frame, default=str)
+    if fmt == FORMAT_CBOR and cbor2 is not None:
+        return cbor2.dumps(frame, default=lambda encoder, value: encoder.encode(str(value)))
+    raise ValueError(f"Telemetry format not available: {fmt!r}")
+
+
+class TelemetryFrameEncoder:
+    """Turns successive snapshots into frames for one protocol mode."""
+
+    def __init__(self, mode: str = MODE_FULL, keyframe_interval: float = KEYFRAME_INTERVAL):
+        if mode not in MODES:
+            raise ValueError(f"Unknown telemetry mode: {mode!r}")
+        self.mode = mode
+        self.keyframe_interval = keyframe_interval
+        self._last: Dict[str, Any] = {}
+        self._last_keyframe: Optional[float] = None
+
+    @property
+    def last(self) -> Dict[str, Any]:
+        """The snapshot the last frame was built from."""
+        return self._last
+
+    def request_keyframe(self) -> None:
+        """Make the next frame a keyframe."""
+        self._last_keyframe = None
+
+    def encode(self, snapshot: Dict[str, Any], now: Optional[float] = None) -> Optional[Dict[str, Any]]:
+        """Return the frame for *snapshot*, or None if nothing changed.
+
+        The snapshot is not modified; the frame is a new dict.
+        """
+        now = time.time() if now is None else now
+        if self.mode == MODE_FULL:
+            if snapshot == self._last:
+                return None
+            self._last = dict(snapshot)
+            return {**snapshot, "_ts": now}
+
+        if self._last_keyframe is None or now - self._last_keyframe >= self.keyframe_interval:
+            self._last = dict(snapshot)
+            self._last_keyframe = now
+            return {**snapshot, "_kf": True, "_ts": now}
+
+        frame = {k: v for k, v in snapshot.items() if k not in self._last or self._last[k] != v}
+        removed = [k for k in self._last if k not in snapshot]
+        if not frame and not removed:
+            return None
+        if removed:
+            frame["_del"] = removed
+        self._last = dict(snapshot)
+        frame["_ts"] = now
+        return frame
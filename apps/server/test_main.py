@@ -18,6 +18,7 @@ from pathlib import Path
 import os
 import subprocess
 import json
+import base64
 from types import SimpleNamespace
 import time
 import asyncio
@@ -35,6 +36,7 @@ import services.gemini_service
 import services.meticulous_service
 import services.analysis_service
 import services.scheduling_state
+import services.history_service
 import utils.file_utils
 import utils.sanitization
 import config
@@ -525,34 +527,67 @@ class TestAnalyzeAndProfileEndpoint:
         assert response.json()["status"] == "success"
 
     @patch.dict(os.environ, {"GEMINI_API_KEY": "test_api_key"})
-    def test_analyze_and_profile_returns_409_when_locked(self, client):
-        """Test that a concurrent request returns 409 when generation is in progress."""
-        from api.routes import coffee as coffee_module
-        # Simulate the lock being held by another request
-        with patch.object(coffee_module._profile_generation_lock, 'locked', return_value=True):
+    def test_analyze_and_profile_returns_503_when_queue_full(self, client):
+        """Test that a request returns 503 with Retry-After when the queue is full."""
+        from services.generation_queue import get_generation_queue
+        # Simulate every slot and queue place being taken
+        with patch.object(get_generation_queue(), 'is_full', return_value=True):
             response = client.post(
                 "/analyze_and_profile",
                 data={"user_prefs": "Some espresso"}
             )
 
-        assert response.status_code == 409
+        assert response.status_code == 503
+        assert response.headers["retry-after"] == "30"
         body = response.json()
         assert body["status"] == "busy"
         assert "already being generated" in body["message"]
 
     @patch.dict(os.environ, {"GEMINI_API_KEY": "test_api_key"})
-    def test_analyze_and_profile_409_with_api_prefix(self, client):
-        """Test that the /api/ prefixed route also returns 409 when locked."""
-        from api.routes import coffee as coffee_module
-        with patch.object(coffee_module._profile_generation_lock, 'locked', return_value=True):
+    def test_analyze_and_profile_503_with_api_prefix(self, client):
+        """Test that the /api/ prefixed route also returns 503 when the queue is full."""
+        from services.generation_queue import get_generation_queue
+        with patch.object(get_generation_queue(), 'is_full', return_value=True):
             response = client.post(
                 "/api/analyze_and_profile",
                 data={"user_prefs": "Some espresso"}
             )
 
-        assert response.status_code == 409
+        assert response.status_code == 503
         assert response.json()["status"] == "busy"
 
+    @patch.dict(os.environ, {"GEMINI_API_KEY": "test_api_key"})
+    def test_analyze_and_profile_duplicate_generation_id_returns_409(self, client):
+        """A generation_id that is already in use is a conflict, not a busy queue."""
+        from services.generation_progress import create_generation
+        create_generation("dup-1")
+
+        response = client.post(
+            "/analyze_and_profile",
+            data={"user_prefs": "Some espresso", "generation_id": "dup-1"}
+        )
+
+        assert response.status_code == 409
+        assert response.json()["status"] == "conflict"
+        assert "retry-after" not in response.headers
+
+    @patch.dict(os.environ, {"GEMINI_API_KEY": "test_api_key"})
+    @pytest.mark.parametrize("full,status", [(True, 503), (False, 409)])
+    def test_analyze_and_profile_submit_race_is_answered(self, client, full, status):
+        """A job that loses the race to submit() gets 503/409, and its state is dropped."""
+        from services.generation_queue import QueueFullError, get_generation_queue
+        from services.generation_progress import get_generation
+        error = QueueFullError("full") if full else ValueError("exists")
+        with patch.object(get_generation_queue(), 'submit', side_effect=error):
+            response = client.post(
+                "/analyze_and_profile",
+                data={"user_prefs": "Some espresso", "generation_id": "race-1"}
+            )
+
+        assert response.status_code == status
+        assert ("retry-after" in response.headers) == (status == 503)
+        assert get_generation("race-1") is None
+
 
 class TestHealthAndStartup:
     """Tests for application health and startup."""
@@ -951,6 +986,7 @@ class TestValidationRetry:
         mock_validate.assert_called_once()
         mock_create_profile.assert_awaited_once()
 
+    @pytest.mark.usefixtures("no_local_repair")
     @patch.dict(os.environ, {"GEMINI_API_KEY": "test_api_key"})
     @patch('api.routes.coffee.save_to_history')
     @patch('api.routes.coffee.async_create_profile', new_callable=AsyncMock)
@@ -995,6 +1031,7 @@ class TestValidationRetry:
         assert mock_validate.call_count == 2
         mock_create_profile.assert_awaited_once()
 
+    @pytest.mark.usefixtures("no_local_repair")
     @patch.dict(os.environ, {"GEMINI_API_KEY": "test_api_key"})
     @patch('api.routes.coffee.save_to_history')
     @patch('api.routes.coffee.async_create_profile', new_callable=AsyncMock)
@@ -1048,84 +1085,1596 @@ class TestValidationRetry:
         no_json.text = self.NO_JSON_REPLY
         mock_vision_model.return_value.async_generate_content = AsyncMock(return_value=no_json)
 
-        response = client.post(
-            "/analyze_and_profile",
-            data={"user_prefs": "Something impossible"}
+        response = client.post(
+            "/analyze_and_profile",
+            data={"user_prefs": "Something impossible"}
+        )
+
+        assert response.status_code == 200
+        data = response.json()
+        assert data["status"] == "error"
+        assert "validation errors" in data["message"]
+        # Initial generation + 2 retries = 3 calls
+        assert mock_vision_model.return_value.async_generate_content.call_count == 3
+        # validate_profile should never be called since no JSON was extracted
+        mock_validate.assert_not_called()
+
+    @patch.dict(os.environ, {"GEMINI_API_KEY": "test_api_key"})
+    @patch('api.routes.coffee.save_to_history')
+    @patch('api.routes.coffee.async_create_profile', new_callable=AsyncMock)
+    @patch('api.routes.coffee.validate_profile')
+    @patch('api.routes.coffee.get_vision_model')
+    def test_no_json_then_json_on_retry(self, mock_vision_model, mock_validate, mock_create_profile, mock_save_history, client):
+        """Test that missing JSON on first try but found on retry succeeds."""
+        mock_save_history.return_value = {"id": "test-v5"}
+        mock_create_profile.return_value = {"id": "machine-v5"}
+
+        valid_result = Mock()
+        valid_result.is_valid = True
+        valid_result.errors = []
+        mock_validate.return_value = valid_result
+
+        no_json = Mock()
+        no_json.text = self.NO_JSON_REPLY
+        with_json = Mock()
+        with_json.text = self.VALID_PROFILE_REPLY
+        mock_vision_model.return_value.async_generate_content = AsyncMock(
+            side_effect=[no_json, with_json]
+        )
+
+        response = client.post(
+            "/analyze_and_profile",
+            data={"user_prefs": "Light and delicate"}
+        )
+
+        assert response.status_code == 200
+        data = response.json()
+        assert data["status"] == "success"
+        # 2 calls: initial (no JSON) + retry (with JSON)
+        assert mock_vision_model.return_value.async_generate_content.call_count == 2
+        mock_validate.assert_called_once()
+        mock_create_profile.assert_awaited_once()
+
+    @patch.dict(os.environ, {"GEMINI_API_KEY": "test_api_key"})
+    @patch('api.routes.coffee.save_to_history')
+    @patch('api.routes.coffee.async_create_profile', new_callable=AsyncMock)
+    @patch('api.routes.coffee.validate_profile')
+    @patch('api.routes.coffee.get_vision_model')
+    def test_response_includes_generation_id(self, mock_vision_model, mock_validate, mock_create_profile, mock_save_history, client):
+        """Test that the response includes a generation_id for SSE tracking."""
+        mock_save_history.return_value = {"id": "test-v6"}
+        mock_create_profile.return_value = {"id": "machine-v6"}
+
+        valid_result = Mock()
+        valid_result.is_valid = True
+        valid_result.errors = []
+        mock_validate.return_value = valid_result
+
+        profile_response = Mock()
+        profile_response.text = self.VALID_PROFILE_REPLY
+        mock_vision_model.return_value.async_generate_content = AsyncMock(return_value=profile_response)
+
+        response = client.post(
+            "/analyze_and_profile",
+            data={"user_prefs": "Bright acidity"}
+        )
+
+        assert response.status_code == 200
+        data = response.json()
+        assert "generation_id" in data
+        assert len(data["generation_id"]) == 8
+
+
+class TestStreamingGeneration:
+    """Tests for streamed profile generation with mid-stream validation."""
+
+    SUMMARY = "**Profile Created:** Stream Test\n\nA bright, fruity shot.\n\nPROFILE JSON:\n"
+    PROFILE = {"name": "Stream Test", "stages": [], "variables": []}
+
+    @staticmethod
+    def _chunks(text, size=7):
+        return [text[i:i + size] for i in range(0, len(text), size)]
+
+    def _reply(self, block=None):
+        block = json.dumps(self.PROFILE) if block is None else block
+        return self.SUMMARY + "```json\n" + block + "\n```\n"
+
+    @staticmethod
+    def _validation(is_valid):
+        result = Mock()
+        result.is_valid = is_valid
+        result.errors = [] if is_valid else ["bad stage"]
+        result.error_summary.return_value = "1. bad stage"
+        return result
+
+    @patch('api.routes.coffee.validate_profile')
+    def test_watcher_validates_when_fence_closes(self, mock_validate):
+        """The profile is validated once, as soon as its block closes."""
+        from api.routes.coffee import _ProfileStreamWatcher
+        from services.generation_progress import GenerationPhase, GenerationState
+
+        mock_validate.return_value = self._validation(True)
+        state = GenerationState(generation_id="w1")
+        watcher = _ProfileStreamWatcher(state)
+        reply = self._reply() + "Enjoy your shot!"
+        close = reply.rindex("```")
+
+        for chunk in self._chunks(reply[:close + 2]):
+            assert watcher.feed(chunk) is False
+        mock_validate.assert_not_called()
+
+        assert watcher.feed(reply[close + 2:]) is False
+        assert watcher.profile_json == self.PROFILE
+        mock_validate.assert_called_once_with(self.PROFILE)
+        assert watcher.abort_reason is None
+
+        phases = [e.phase for e in state.events]
+        assert phases[0] == GenerationPhase.GENERATING
+        assert state.events[0].tokens is not None
+        assert phases[-1] == GenerationPhase.VALIDATING
+
+    @patch('api.routes.coffee.validate_profile')
+    def test_watcher_skips_non_profile_blocks(self, mock_validate):
+        """A JSON snippet that is not a profile does not end the watch."""
+        from api.routes.coffee import _ProfileStreamWatcher
+        from services.generation_progress import GenerationState
+
+        mock_validate.return_value = self._validation(True)
+        watcher = _ProfileStreamWatcher(GenerationState(generation_id="w2"))
+        text = "Example: ```json\n{\"pressure\": 9}\n```\n" + self._reply()
+
+        aborted = [watcher.feed(chunk) for chunk in self._chunks(text)]
+
+        assert not any(aborted)
+        assert watcher.profile_json == self.PROFILE
+        mock_validate.assert_called_once()
+
+    @patch('api.routes.coffee.validate_profile')
+    def test_watcher_aborts_on_malformed_json(self, mock_validate):
+        """A block that cannot be parsed, even after local repair, stops the stream early."""
+        from api.routes.coffee import _ProfileStreamWatcher
+        from services.generation_progress import GenerationState
+
+        watcher = _ProfileStreamWatcher(GenerationState(generation_id="w3"))
+        aborted = [watcher.feed(c) for c in self._chunks(self._reply('{"name": "Broken" "stages": [}'))]
+
+        assert aborted[-1] is True
+        assert watcher.abort_reason == "malformed_json"
+        mock_validate.assert_not_called()
+
+    @patch('api.routes.coffee.validate_profile')
+    def test_watcher_keeps_streaming_when_repair_fixes_the_block(self, mock_validate):
+        """Syntax slips and invalid profiles the local repair fixes do not abort."""
+        from api.routes.coffee import _ProfileStreamWatcher
+        from services.generation_progress import GenerationState
+
+        mock_validate.return_value = self._validation(True)
+        block = '{"name": "Stream Test", "stages": [], "variables": [], "locked": False,}'
+        watcher = _ProfileStreamWatcher(GenerationState(generation_id="w6"))
+        assert not any(watcher.feed(c) for c in self._chunks(self._reply(block) + "Enjoy!"))
+        assert watcher.abort_reason is None
+        assert watcher.profile_json == {**self.PROFILE, "locked": False}
+
+        repaired = {**self.PROFILE, "stages": [{"name": "Fixed"}]}
+        mock_validate.side_effect = lambda profile: self._validation(profile == repaired)
+        watcher = _ProfileStreamWatcher(GenerationState(generation_id="w7"))
+        with patch('api.routes.coffee.repair_profile', return_value=(repaired, ["exit_trigger"])):
+            assert not any(watcher.feed(c) for c in self._chunks(self._reply() + "Enjoy!"))
+        assert watcher.abort_reason is None
+        assert watcher.validation.is_valid is False
+
+    @patch('api.routes.coffee.validate_profile')
+    def test_watcher_aborts_invalid_profile_after_summary(self, mock_validate):
+        """Validation failures abort once the user summary is already in."""
+        from api.routes.coffee import _ProfileStreamWatcher
+        from services.generation_progress import GenerationState
+
+        mock_validate.return_value = self._validation(False)
+        watcher = _ProfileStreamWatcher(GenerationState(generation_id="w4"))
+        assert any(watcher.feed(c) for c in self._chunks(self._reply()))
+        assert watcher.abort_reason == "validation_failed"
+
+        # Without the summary header the rest of the reply is still needed
+        watcher = _ProfileStreamWatcher(GenerationState(generation_id="w5"))
+        text = "```json\n" + json.dumps(self.PROFILE) + "\n```\n" + self.SUMMARY
+        assert not any(watcher.feed(c) for c in self._chunks(text))
+        assert watcher.abort_reason is None
+
+    @patch.dict(os.environ, {"GEMINI_API_KEY": "test_api_key"})
+    @patch('api.routes.coffee.save_to_history')
+    @patch('api.routes.coffee.async_create_profile', new_callable=AsyncMock)
+    @patch('api.routes.coffee.validate_profile')
+    @patch('api.routes.coffee.get_vision_model')
+    def test_endpoint_reuses_mid_stream_validation(self, mock_vision_model, mock_validate, mock_create_profile, mock_save_history, client):
+        """The endpoint streams the reply and does not validate it twice."""
+        from services.gemini_service import StreamedResponse
+
+        mock_save_history.return_value = {"id": "stream-1"}
+        mock_create_profile.return_value = {"id": "machine-stream-1"}
+        mock_validate.return_value = self._validation(True)
+        reply = self._reply()
+
+        async def fake_generate(contents, on_chunk=None):
+            assert on_chunk is not None
+            for chunk in self._chunks(reply):
+                if on_chunk(chunk, None):
+                    break
+            return StreamedResponse(text=reply)
+
+        mock_vision_model.return_value.async_generate_content = AsyncMock(side_effect=fake_generate)
+
+        response = client.post("/analyze_and_profile", data={"user_prefs": "Fruity"})
+
+        assert response.status_code == 200
+        assert response.json()["status"] == "success"
+        mock_validate.assert_called_once()
+        mock_create_profile.assert_awaited_once_with(self.PROFILE)
+
+    def test_wrapper_streams_and_stops_on_request(self):
+        """The model wrapper aggregates chunks and closes an aborted stream."""
+        from services.gemini_service import _GeminiModelWrapper
+
+        closed = []
+
+        class FakeStream:
+            def __init__(self, texts):
+                self._texts = iter(texts)
+
+            def __aiter__(self):
+                return self
+
+            async def __anext__(self):
+                try:
+                    text = next(self._texts)
+                except StopIteration:
+                    raise StopAsyncIteration
+                return SimpleNamespace(
+                    text=text,
+                    usage_metadata=SimpleNamespace(candidates_token_count=len(text)),
+                )
+
+            async def aclose(self):
+                closed.append(True)
+
+        client = MagicMock()
+        client.aio.models.generate_content_stream = AsyncMock(
+            side_effect=lambda **kw: FakeStream(["ab", "", "cd", "ef"])
+        )
+        wrapper = _GeminiModelWrapper(client)
+
+        seen = []
+        response = asyncio.run(wrapper.async_generate_content(
+            ["prompt"], on_chunk=lambda text, tokens: seen.append((text, tokens)) or text == "cd"
+        ))
+
+        assert response.text == "abcd"
+        assert response.aborted is True
+        assert seen == [("ab", 2), ("cd", 2)]
+        assert closed == [True]
+
+
+class TestLLMCallConcurrency:
+    """Tests for bounded, instrumented Gemini calls."""
+
+    def test_uses_native_async_client(self):
+        """Non-streamed calls go through client.aio, not a thread pool."""
+        from services.gemini_service import _GeminiModelWrapper, get_llm_call_metrics
+
+        client = MagicMock()
+        client.aio.models.generate_content = AsyncMock(return_value=SimpleNamespace(text="ok"))
+        wrapper = _GeminiModelWrapper(client)
+
+        with patch.object(asyncio.base_events.BaseEventLoop, 'run_in_executor') as mock_executor:
+            response = asyncio.run(wrapper.async_generate_content(["prompt"]))
+
+        assert response.text == "ok"
+        mock_executor.assert_not_called()
+        client.models.generate_content.assert_not_called()
+        metrics = get_llm_call_metrics()
+        assert metrics["calls"] == 1
+        assert metrics["in_flight"] == 0
+
+    def test_concurrency_is_bounded_and_queue_wait_recorded(self):
+        """Calls beyond the limit wait for a slot and the wait is measured."""
+        import services.gemini_service as gs
+
+        peak = 0
+        active = 0
+
+        async def slow_call(**kwargs):
+            nonlocal peak, active
+            active += 1
+            peak = max(peak, active)
+            await asyncio.sleep(0.05)
+            active -= 1
+            return SimpleNamespace(text="ok")
+
+        client = MagicMock()
+        client.aio.models.generate_content = AsyncMock(side_effect=slow_call)
+        wrapper = gs._GeminiModelWrapper(client)
+
+        async def run_all():
+            return await asyncio.gather(*(wrapper.async_generate_content(["p"]) for _ in range(4)))
+
+        with patch.object(gs, 'LLM_MAX_CONCURRENCY', 2):
+            asyncio.run(run_all())
+            metrics = gs.get_llm_call_metrics()
+
+        assert peak == 2
+        assert metrics["calls"] == 4
+        assert metrics["peak_in_flight"] == 2
+        assert metrics["queue_wait_ms"]["max"] >= 30
+        assert metrics["queued"] == 0
+
+    def test_failed_calls_are_counted(self):
+        """Errors release the slot and increment the error counter."""
+        from services.gemini_service import _GeminiModelWrapper, get_llm_call_metrics
+
+        client = MagicMock()
+        client.aio.models.generate_content = AsyncMock(side_effect=RuntimeError("quota"))
+        wrapper = _GeminiModelWrapper(client)
+
+        with pytest.raises(RuntimeError):
+            asyncio.run(wrapper.async_generate_content(["prompt"]))
+
+        metrics = get_llm_call_metrics()
+        assert metrics["errors"] == 1
+        assert metrics["in_flight"] == 0
+
+    def test_metrics_endpoint(self, client):
+        """GET /api/llm/metrics returns the call counters."""
+        response = client.get("/api/llm/metrics")
+
+        assert response.status_code == 200
+        data = response.json()
+        assert data["calls"] == 0
+        assert {"latency_ms", "queue_wait_ms", "in_flight", "max_concurrency"} <= data.keys()
+
+
+class TestGenerationQueue:
+    """Tests for the profile generation job queue."""
+
+    @staticmethod
+    def _state(generation_id):
+        from services.generation_progress import GenerationState
+        return GenerationState(generation_id=generation_id)
+
+    def test_runs_in_fifo_order_with_position_events(self):
+        """Jobs beyond the parallelism limit wait and learn their position."""
+        from services.generation_progress import GenerationPhase
+        from services.generation_queue import GenerationQueue
+
+        order = []
+
+        async def scenario():
+            queue = GenerationQueue(max_concurrent=1, max_pending=4)
+            gate = asyncio.Event()
+            states = {gid: self._state(gid) for gid in ("a", "b", "c")}
+
+            def job(gid):
+                async def run():
+                    order.append(gid)
+                    if gid == "a":
+                        await gate.wait()
+                    return gid
+                return run
+
+            tasks = [queue.submit(gid, states[gid], job(gid)) for gid in ("a", "b", "c")]
+            await asyncio.sleep(0)
+            assert [queue.position(g) for g in ("a", "b", "c")] == [0, 1, 2]
+            gate.set()
+            results = await asyncio.gather(*tasks)
+            return queue, states, results
+
+        queue, states, results = asyncio.run(scenario())
+
+        assert order == ["a", "b", "c"] and results == ["a", "b", "c"]
+        c_positions = [e.position for e in states["c"].events if e.phase == GenerationPhase.QUEUED]
+        assert c_positions == [2, 1]
+        assert not [e for e in states["a"].events if e.phase == GenerationPhase.QUEUED]
+        assert queue.snapshot()["running"] == [] and queue.snapshot()["waiting"] == []
+
+    def test_parallel_slots(self):
+        """max_concurrent jobs run side by side."""
+        from services.generation_queue import GenerationQueue
+
+        async def scenario():
+            queue = GenerationQueue(max_concurrent=2, max_pending=0)
+            active = 0
+            peak = 0
+
+            async def run():
+                nonlocal active, peak
+                active += 1
+                peak = max(peak, active)
+                await asyncio.sleep(0.01)
+                active -= 1
+
+            await asyncio.gather(
+                queue.submit("a", self._state("a"), run),
+                queue.submit("b", self._state("b"), run),
+            )
+            return peak
+
+        assert asyncio.run(scenario()) == 2
+
+    def test_rejects_when_full_and_duplicate_ids(self):
+        """A full queue raises QueueFullError; IDs must be unique."""
+        from services.generation_queue import GenerationQueue, QueueFullError
+
+        async def scenario():
+            queue = GenerationQueue(max_concurrent=1, max_pending=1)
+            gate = asyncio.Event()
+            queue.submit("a", self._state("a"), gate.wait)
+            with pytest.raises(ValueError):
+                queue.submit("a", self._state("a"), gate.wait)
+            queue.submit("b", self._state("b"), gate.wait)
+            assert queue.is_full()
+            with pytest.raises(QueueFullError):
+                queue.submit("c", self._state("c"), gate.wait)
+            gate.set()
+            await asyncio.sleep(0.01)
+            assert not queue.is_full()
+
+        asyncio.run(scenario())
+
+    def test_cancel_queued_and_running_jobs(self):
+        """Cancelling frees the slot, skips queued work and emits CANCELLED."""
+        from services.generation_progress import GenerationPhase
+        from services.generation_queue import GenerationQueue
+
+        ran = []
+
+        async def scenario():
+            queue = GenerationQueue(max_concurrent=1, max_pending=4)
+            states = {gid: self._state(gid) for gid in ("a", "b", "c")}
+
+            def job(gid):
+                async def run():
+                    ran.append(gid)
+                    if gid == "a":
+                        await asyncio.sleep(10)
+                    return gid
+                return run
+
+            tasks = {gid: queue.submit(gid, states[gid], job(gid)) for gid in ("a", "b", "c")}
+            await asyncio.sleep(0)
+            assert queue.cancel("b") is True
+            await asyncio.sleep(0)
+            assert queue.position("c") == 1
+            assert queue.cancel("a") is True
+            assert await tasks["c"] == "c"
+            assert queue.cancel("unknown") is False
+            return states, tasks
+
+        states, tasks = asyncio.run(scenario())
+
+        assert ran == ["a", "c"]
+        assert tasks["a"].cancelled() and tasks["b"].cancelled()
+        for gid in ("a", "b"):
+            assert states[gid].events[-1].phase == GenerationPhase.CANCELLED
+
+    @patch('api.routes.coffee._run_profile_generation', new_callable=AsyncMock)
+    def test_client_generation_id_and_wait_false(self, mock_run, client):
+        """The POST honours a client ID and can return 202 immediately."""
+        mock_run.return_value = {"status": "success"}
+
+        response = client.post(
+            "/api/analyze_and_profile",
+            data={"user_prefs": "Fruity", "generation_id": "barista-1", "wait": "false"}
+        )
+
+        assert response.status_code == 202
+        assert response.json()["generation_id"] == "barista-1"
+        assert response.json()["status"] == "queued"
+
+    def test_invalid_generation_id_rejected(self, client):
+        """Generation IDs are restricted to URL-safe characters."""
+        response = client.post(
+            "/api/analyze_and_profile",
+            data={"user_prefs": "Fruity", "generation_id": "../etc"}
+        )
+
+        assert response.status_code == 400
+
+    @patch('api.routes.coffee._run_profile_generation', new_callable=AsyncMock)
+    def test_cancelled_job_reports_cancelled(self, mock_run, client):
+        """A waiting POST whose job is cancelled returns a cancelled status."""
+        async def cancel_self(**kwargs):
+            from services.generation_queue import get_generation_queue
+            get_generation_queue().cancel(kwargs["generation_id"])
+            await asyncio.sleep(1)
+
+        mock_run.side_effect = cancel_self
+
+        response = client.post(
+            "/api/analyze_and_profile",
+            data={"user_prefs": "Fruity", "generation_id": "to-cancel"}
+        )
+
+        assert response.status_code == 200
+        assert response.json() == {"status": "cancelled", "generation_id": "to-cancel"}
+
+    def test_cancel_unknown_generation(self, client):
+        """DELETE on an unknown generation returns 404."""
+        response = client.delete("/api/generate/missing")
+
+        assert response.status_code == 404
+
+    def test_queue_status_endpoint(self, client):
+        """GET /api/generate/queue reports slots and waiting jobs."""
+        response = client.get("/api/generate/queue")
+
+        assert response.status_code == 200
+        assert response.json()["running"] == []
+        assert response.json()["waiting"] == []
+
+
+class TestBagAnalysisCache:
+    """Tests for the perceptual-hash coffee bag analysis cache."""
+
+    @staticmethod
+    def _bag(size=(400, 600), shift=0, fmt="PNG", label_end=0.5, label=(20, 20, 20)):
+        """Draw a synthetic 'bag' with a gradient and a label block."""
+        from PIL import ImageDraw
+        img = Image.new("RGB", size, (200, 180, 150))
+        draw = ImageDraw.Draw(img)
+        w, h = size
+        for y in range(h):
+            shade = int(60 + 120 * y / h) + shift
+            draw.line([(0, y), (w // 3, y)], fill=(shade, shade // 2, 40))
+        draw.rectangle([w // 2, h // 4, w - 20, int(h * label_end)], fill=label)
+        buf = BytesIO()
+        img.save(buf, format=fmt, **({"quality": 70} if fmt == "JPEG" else {}))
+        return buf.getvalue()
+
+    def test_hash_is_stable_across_resize_and_recompression(self):
+        """Re-uploads at another size or as JPEG land within the threshold."""
+        from services.cache_service import compute_bag_image_hash, _hash_distance
+
+        original = compute_bag_image_hash(Image.open(BytesIO(self._bag())))
+        resized = compute_bag_image_hash(Image.open(BytesIO(self._bag(size=(800, 1200), fmt="JPEG"))))
+        different = compute_bag_image_hash(Image.open(BytesIO(self._bag())).rotate(90, expand=True))
+
+        assert len(original) == 16
+        assert _hash_distance(original, resized) <= 6
+        assert _hash_distance(original, different) > 6
+
+    def test_near_match_lookup_and_lru_eviction(self):
+        """Lookups tolerate a few flipped bits; the LRU bound evicts old entries."""
+        import services.cache_service as cs
+
+        with patch.object(cs, 'BAG_ANALYSIS_CACHE_MAX_ENTRIES', 2), \
+                patch.object(cs, 'BAG_ANALYSIS_HASH_THRESHOLD', 3):
+            cs.save_bag_analysis_to_cache("00000000000000ff", "Ethiopian light roast")
+            cs.save_bag_analysis_to_cache("ff00000000000000", "Brazilian dark roast")
+
+            assert cs.get_cached_bag_analysis("00000000000000f3") == "Ethiopian light roast"
+            assert cs.get_cached_bag_analysis("0f0f0f0f0f0f0f0f") is None
+
+            # Ethiopian was just used, so Brazilian is evicted
+            cs.save_bag_analysis_to_cache("0000ffff00000000", "Kenyan washed")
+
+        cs._bag_analysis_cache = None  # force a reload from disk
+        assert cs.get_cached_bag_analysis("00000000000000ff") == "Ethiopian light roast"
+        assert cs.get_cached_bag_analysis("ff00000000000000") is None
+        assert cs.get_cached_bag_analysis("0000ffff00000000") == "Kenyan washed"
+        # By default only the exact hash matches
+        assert cs.get_cached_bag_analysis("00000000000000f3") is None
+
+    def test_similar_but_different_bags_do_not_match(self):
+        """Bags differing only in their label are not served each other's analysis."""
+        import services.cache_service as cs
+
+        original = cs.compute_bag_image_hash(Image.open(BytesIO(self._bag())))
+        longer_label = cs.compute_bag_image_hash(Image.open(BytesIO(self._bag(label_end=0.6))))
+        red_label = cs.compute_bag_image_hash(Image.open(BytesIO(self._bag(label=(120, 40, 40)))))
+        assert 0 < cs._hash_distance(original, longer_label) <= 3
+        assert 0 < cs._hash_distance(original, red_label) <= 3
+
+        cs.save_bag_analysis_to_cache(original, "Ethiopian light roast")
+        assert cs.get_cached_bag_analysis(longer_label) is None
+        assert cs.get_cached_bag_analysis(red_label) is None
+        # The same bag re-encoded still hits
+        recompressed = cs.compute_bag_image_hash(Image.open(BytesIO(self._bag(fmt="JPEG"))))
+        assert cs.get_cached_bag_analysis(recompressed) == "Ethiopian light roast"
+
+    def test_hits_are_written_by_the_flusher(self):
+        """A cache hit only marks its entry dirty; the flusher writes it later."""
+        import services.cache_service as cs
+        from services.persistence_service import get_persistence
+
+        cs.save_bag_analysis_to_cache("00000000000000ff", "Ethiopian light roast")
+        written = cs.BAG_ANALYSIS_CACHE_FILE.stat().st_mtime_ns
+        manager = get_persistence()
+
+        async def scenario():
+            manager.start()
+            try:
+                assert cs.get_cached_bag_analysis("00000000000000ff") == "Ethiopian light roast"
+                assert manager.is_dirty("bag_analysis_cache")
+                assert cs.BAG_ANALYSIS_CACHE_FILE.stat().st_mtime_ns == written
+            finally:
+                await manager.stop()
+
+        asyncio.run(scenario())
+
+        stored = json.loads(cs.BAG_ANALYSIS_CACHE_FILE.read_text())
+        assert stored["00000000000000ff"]["last_used"] > stored["00000000000000ff"]["timestamp"]
+
+    @patch.dict(os.environ, {"GEMINI_API_KEY": "test_api_key"})
+    @patch('api.routes.coffee.get_vision_model')
+    def test_repeat_upload_skips_vision_call(self, mock_vision_model, client):
+        """The same bag photographed again is answered from the cache."""
+        mock_response = Mock()
+        mock_response.text = "Ethiopian Yirgacheffe, light roast, floral notes."
+        mock_vision_model.return_value.async_generate_content = AsyncMock(return_value=mock_response)
+
+        first = client.post("/analyze_coffee", files={"file": ("bag.png", BytesIO(self._bag()), "image/png")})
+        second = client.post(
+            "/analyze_coffee",
+            files={"file": ("bag.jpg", BytesIO(self._bag(fmt="JPEG")), "image/jpeg")}
+        )
+
+        assert first.json()["analysis"] == second.json()["analysis"] == mock_response.text
+        assert mock_vision_model.return_value.async_generate_content.await_count == 1
+
+
+class TestVisionImagePreprocessing:
+    """Tests for downscaling bag photos before the vision call."""
+
+    @staticmethod
+    def _jpeg(size, orientation=None):
+        img = Image.new("RGB", size, (180, 120, 60))
+        buf = BytesIO()
+        if orientation is None:
+            img.save(buf, format="JPEG")
+        else:
+            exif = Image.Exif()
+            exif[0x0112] = orientation
+            img.save(buf, format="JPEG", exif=exif)
+        return buf.getvalue()
+
+    def test_large_photo_is_downscaled_and_oriented(self):
+        """A rotated camera photo comes out upright at 1024px as JPEG."""
+        from api.routes.coffee import _load_bag_image, VISION_IMAGE_MAX_EDGE
+
+        # Orientation 6: stored landscape, displayed rotated 90° (portrait)
+        data = self._jpeg((4000, 3000), orientation=6)
+        jpeg_bytes, image_hash, size = _load_bag_image(data)
+
+        assert size == (768, VISION_IMAGE_MAX_EDGE)
+        assert jpeg_bytes[:2] == b"\xff\xd8"
+        assert len(jpeg_bytes) < len(data)
+        assert len(image_hash) == 16
+        assert Image.open(BytesIO(jpeg_bytes)).size == size
+
+    def test_small_and_transparent_images(self):
+        """Small images keep their size; RGBA/palette inputs become RGB JPEG."""
+        from api.routes.coffee import _load_bag_image
+
+        buf = BytesIO()
+        Image.new("RGBA", (300, 200), (10, 20, 30, 128)).save(buf, format="PNG")
+        jpeg_bytes, _, size = _load_bag_image(buf.getvalue())
+
+        assert size == (300, 200)
+        assert Image.open(BytesIO(jpeg_bytes)).mode == "RGB"
+
+    @patch.dict(os.environ, {"GEMINI_API_KEY": "test_api_key"})
+    @patch('api.routes.coffee.get_vision_model')
+    def test_vision_call_receives_jpeg_part(self, mock_vision_model, client):
+        """The model gets the downscaled JPEG bytes, not the raw upload."""
+        mock_response = Mock()
+        mock_response.text = "Colombian medium roast."
+        mock_vision_model.return_value.async_generate_content = AsyncMock(return_value=mock_response)
+
+        client.post(
+            "/analyze_coffee",
+            files={"file": ("bag.jpg", BytesIO(self._jpeg((3000, 2000))), "image/jpeg")}
+        )
+
+        contents = mock_vision_model.return_value.async_generate_content.call_args[0][0]
+        image_part = contents[1]
+        assert image_part.inline_data.mime_type == "image/jpeg"
+        assert max(Image.open(BytesIO(image_part.inline_data.data)).size) == 1024
+
+
+class TestProfileRepair:
+    """Tests for deterministic local repair of generated profiles."""
+
+    BROKEN_PROFILE = {
+        "name": "Repair Me",
+        "stages": [
+            {
+                "name": "Bloom",
+                "type": "flow",
+                "dynamics": {"points": [[0, "$bloom_flow"]], "over": "seconds", "interpolation": "none"},
+                "exit_triggers": [{"type": "flow", "value": 0.5, "comparison": "<="}],
+                "limits": [],
+            },
+            {
+                "name": "Extract",
+                "type": "pressure",
+                "dynamics": {"points": [[0, 9], [10, 18]], "over": "time", "interpolation": "linear"},
+                "exit_triggers": [{"type": "weight", "value": 36, "comparison": ">="}],
+                "limits": [{"type": "flow", "value": 5}],
+            },
+        ],
+        "variables": [
+            {"name": "Unused", "key": "unused_knob", "type": "pressure", "value": 6},
+            {"name": "☕ Dose", "key": "info_dose", "type": "weight", "value": 18, "adjustable": False},
+        ],
+    }
+
+    def test_text_repair_handles_syntax_slips(self):
+        """Trailing commas, comments, missing fences and truncation are fixed."""
+        from services.profile_repair_service import repair_profile_json_text
+
+        fenced = '```json\n{\n  // the profile\n  "name": "A",\n  "stages": [1, 2,],\n}\n```'
+        unfenced = 'Here you go: {"name": "B", "stages": [], "enabled": True} hope it helps'
+        truncated = 'PROFILE JSON:\n```json\n{"name": "C", "stages": [{"name": "x", "type": "flow"'
+
+        assert repair_profile_json_text(fenced) == {"name": "A", "stages": [1, 2]}
+        assert repair_profile_json_text(unfenced)["enabled"] is True
+        assert repair_profile_json_text(truncated)["stages"][0]["type"] == "flow"
+        assert repair_profile_json_text("No JSON here at all.") is None
+
+    def test_python_literals_inside_strings_are_kept(self):
+        """Only bare True/False/None are rewritten, never text inside strings."""
+        from services.profile_repair_service import repair_profile_json_text
+
+        reply = ('{"name": "D", "stages": [], "adjustable": False, "notes": '
+                 '"None of the bitterness; \\"True\\" to origin", "final_weight": None,}')
+        profile = repair_profile_json_text(reply)
+
+        assert profile["notes"] == 'None of the bitterness; "True" to origin'
+        assert profile["adjustable"] is False
+        assert profile["final_weight"] is None
+
+    def test_structural_repair_makes_profile_valid(self):
+        """Every rule violation in the broken profile is repaired."""
+        from services.profile_repair_service import repair_profile
+        from services.validation_service import _basic_validate
+
+        assert not _basic_validate(self.BROKEN_PROFILE)[0]
+        repaired, fixes = repair_profile(self.BROKEN_PROFILE)
+
+        is_valid, errors = _basic_validate(repaired)
+        assert is_valid, errors
+        bloom, extract = repaired["stages"]
+        assert [t["type"] for t in bloom["exit_triggers"]] == ["time"]
+        assert {"type": "pressure", "value": 10} in bloom["limits"]
+        assert bloom["dynamics"]["over"] == "time"
+        assert bloom["dynamics"]["interpolation"] == "linear"
+        assert extract["dynamics"]["points"][1] == [10, 15.0]
+        assert any(t["type"] == "time" for t in extract["exit_triggers"])
+        keys = {v["key"] for v in repaired["variables"]}
+        assert keys == {"bloom_flow", "info_dose"}
+        assert repaired["temperature"] == 93.0
+        assert len(fixes) >= 8
+        # The input is left untouched
+        assert self.BROKEN_PROFILE["stages"][0]["limits"] == []
+
+    def test_profile_without_stages_is_not_repaired(self):
+        """Missing stages cannot be invented locally."""
+        from services.profile_repair_service import repair_profile
+
+        assert repair_profile({"name": "Empty", "stages": []})[1] == []
+
+    @patch.dict(os.environ, {"GEMINI_API_KEY": "test_api_key"})
+    @patch('api.routes.coffee.validate_profile')
+    @patch('api.routes.coffee.save_to_history')
+    @patch('api.routes.coffee.async_create_profile', new_callable=AsyncMock)
+    @patch('api.routes.coffee.get_vision_model')
+    def test_endpoint_repairs_locally_without_llm_retry(self, mock_vision_model, mock_create_profile, mock_save_history, mock_validate, client):
+        """A repairable profile is uploaded without a second Gemini call."""
+        from services.validation_service import _basic_validate, ValidationResult
+
+        mock_validate.side_effect = lambda p: ValidationResult(*_basic_validate(p))
+        mock_save_history.return_value = {"id": "repair-1"}
+        mock_create_profile.return_value = {"id": "machine-repair-1"}
+        reply = Mock()
+        reply.text = (
+            "**Profile Created:** Repair Me\n\nPROFILE JSON:\n```json\n"
+            + json.dumps(self.BROKEN_PROFILE) + "\n```\n"
+        )
+        mock_vision_model.return_value.async_generate_content = AsyncMock(return_value=reply)
+
+        response = client.post("/analyze_and_profile", data={"user_prefs": "Bloom then extract"})
+
+        assert response.json()["status"] == "success"
+        assert mock_vision_model.return_value.async_generate_content.await_count == 1
+        uploaded = mock_create_profile.await_args[0][0]
+        assert _basic_validate(uploaded)[0]
+        assert '"bloom_flow"' in response.json()["reply"]
+
+        metrics = client.get("/api/generate/repair-metrics").json()
+        assert metrics["attempts"] == 1
+        assert metrics["repaired"] == 1
+        assert metrics["repair_rate"] == 1.0
+        assert metrics["fixes"]["paradox_trigger"] == 1
+
+
+class TestPromptCache:
+    """Tests for context caching of the static prompt prefix."""
+
+    @staticmethod
+    def _manager():
+        from services.prompt_cache_service import LocalPromptCacheBackend, set_prompt_cache_backend
+        backend = LocalPromptCacheBackend()
+        return backend, set_prompt_cache_backend(backend)
+
+    def test_handle_lifecycle(self):
+        """Handles are reused, refreshed near expiry and replaced on change."""
+        backend, manager = self._manager()
+
+        async def scenario():
+            first = await manager.get_handle("distilled", "model-a", "PREFIX")
+            assert await manager.get_handle("distilled", "model-a", "PREFIX") == first
+
+            # Nearly expired: the TTL is extended in place
+            manager._entries["distilled"].expires_at = time.monotonic() + manager.ttl_seconds * 0.1
+            backend.entries[first]["expires_at"] = 0
+            assert await manager.get_handle("distilled", "model-a", "PREFIX") == first
+            assert backend.entries[first]["expires_at"] > time.monotonic()
+
+            # Each knowledge mode has its own handle
+            detailed = await manager.get_handle("detailed", "model-a", "LONG PREFIX")
+            assert detailed != first
+
+            # A model change replaces the slot's handle and deletes the old one
+            switched = await manager.get_handle("distilled", "model-b", "PREFIX")
+            assert switched != first
+            assert first not in backend.entries
+            assert backend.entries[switched]["model"] == "model-b"
+
+            await manager.invalidate()
+            assert backend.entries == {}
+
+        asyncio.run(scenario())
+        stats = manager.snapshot()
+        assert stats["creates"] == 3
+        assert stats["hits"] == 2
+        assert stats["refreshes"] == 1
+        assert stats["invalidations"] == 3
+
+    def test_backend_failure_falls_back_to_full_prompt(self):
+        """A failed create disables caching for a while instead of erroring."""
+        backend, manager = self._manager()
+        backend.create = AsyncMock(side_effect=RuntimeError("too few tokens"))
+
+        async def scenario():
+            assert await manager.get_handle("distilled", "m", "PREFIX") is None
+            assert await manager.get_handle("distilled", "m", "PREFIX") is None
+
+        asyncio.run(scenario())
+        backend.create.assert_awaited_once()
+        assert manager.snapshot()["failures"] == 1
+
+    def test_backend_failure_backs_off_per_slot_and_prefix(self):
+        """One slot's failed create does not disable caching for the others."""
+        backend, manager = self._manager()
+        create = backend.create
+        backend.create = AsyncMock(side_effect=RuntimeError("too few tokens"))
+
+        async def scenario():
+            assert await manager.get_handle("distilled", "m", "SHORT") is None
+            backend.create = create
+            assert await manager.get_handle("detailed", "m", "LONG PREFIX") is not None
+            assert await manager.get_handle("distilled", "m", "NEW PREFIX") is not None
+            # The failed slot/prefix pair is still backing off
+            assert await manager.get_handle("distilled", "m", "SHORT") is None
+
+        asyncio.run(scenario())
+        assert manager.snapshot()["creates"] == 2
+
+    def test_disabled_by_default_in_tests(self):
+        """With the backend off no handle is ever issued."""
+        from services.prompt_cache_service import get_prompt_cache
+
+        assert asyncio.run(get_prompt_cache().get_handle("distilled", "m", "PREFIX")) is None
+        assert get_prompt_cache().snapshot()["backend"] is None
+
+    @patch.dict(os.environ, {"GEMINI_API_KEY": "test_api_key"})
+    @patch('api.routes.coffee.save_to_history')
+    @patch('api.routes.coffee.async_create_profile', new_callable=AsyncMock)
+    @patch('api.routes.coffee.get_vision_model')
+    def test_generation_sends_only_variable_suffix(self, mock_vision_model, mock_create_profile, mock_save_history, client, mock_validate_profile):
+        """Cached generations send the request details and the cache handle."""
+        from api.routes.coffee import BARISTA_PERSONA
+        from services.gemini_service import StreamedResponse
+
+        backend, _ = self._manager()
+        mock_save_history.return_value = {"id": "cached-1"}
+        mock_create_profile.return_value = {"id": "machine-cached-1"}
+        reply = '**Profile Created:** Cached\n\nPROFILE JSON:\n```json\n{"name": "Cached", "stages": []}\n```'
+        mock_vision_model.return_value.async_generate_content = AsyncMock(
+            return_value=StreamedResponse(text=reply)
+        )
+
+        for mode in ("false", "false", "true"):
+            response = client.post(
+                "/analyze_and_profile",
+                data={"user_prefs": "Chocolatey", "detailed_knowledge": mode},
+            )
+            assert response.status_code == 200
+
+        calls = mock_vision_model.return_value.async_generate_content.call_args_list
+        handles = [call.kwargs["cached_content"] for call in calls]
+        assert handles[0] == handles[1] != handles[2]
+        for call in calls:
+            prompt = call.args[0][0]
+            assert "Chocolatey" in prompt
+            assert BARISTA_PERSONA not in prompt
+        assert len(backend.entries) == 2
+        assert all(e["prefix"].startswith(BARISTA_PERSONA) for e in backend.entries.values())
+
+    @patch.dict(os.environ, {"GEMINI_API_KEY": "test_api_key"})
+    @patch('api.routes.coffee.save_to_history')
+    @patch('api.routes.coffee.async_create_profile', new_callable=AsyncMock)
+    @patch('api.routes.coffee.get_vision_model')
+    def test_rejected_handle_retries_with_full_prompt(self, mock_vision_model, mock_create_profile, mock_save_history, client, mock_validate_profile):
+        """If the provider rejects the cache handle, the full prompt is sent."""
+        from api.routes.coffee import BARISTA_PERSONA
+        from services.gemini_service import StreamedResponse
+
+        backend, _ = self._manager()
+        mock_save_history.return_value = {"id": "cached-2"}
+        mock_create_profile.return_value = {"id": "machine-cached-2"}
+        reply = '**Profile Created:** Cached\n\nPROFILE JSON:\n```json\n{"name": "Cached", "stages": []}\n```'
+        mock_vision_model.return_value.async_generate_content = AsyncMock(
+            side_effect=[RuntimeError("404 cached content not found"), StreamedResponse(text=reply)]
+        )
+
+        response = client.post("/analyze_and_profile", data={"user_prefs": "Floral"})
+
+        assert response.status_code == 200
+        assert response.json()["status"] == "success"
+        retry = mock_vision_model.return_value.async_generate_content.call_args_list[1]
+        assert "cached_content" not in retry.kwargs
+        assert retry.args[0][0].startswith(BARISTA_PERSONA)
+        assert backend.entries == {}
+
+    def test_wrapper_passes_cached_content(self):
+        """The model wrapper references the cache entry in the request config."""
+        from services.gemini_service import _GeminiModelWrapper
+
+        client = MagicMock()
+        client.aio.models.generate_content = AsyncMock(return_value=SimpleNamespace(text="ok"))
+        wrapper = _GeminiModelWrapper(client)
+
+        asyncio.run(wrapper.async_generate_content(["suffix"], cached_content="cachedContents/abc"))
+        asyncio.run(wrapper.async_generate_content(["full"]))
+
+        cached_call, plain_call = client.aio.models.generate_content.call_args_list
+        assert cached_call.kwargs["config"].cached_content == "cachedContents/abc"
+        assert "config" not in plain_call.kwargs
+
+
+class TestLLMAnalysisStore:
+    """Tests for the SQLite-backed LLM analysis store."""
+
+    def test_ttl_expiry_and_sweep(self, tmp_path):
+        """Expired analyses are not returned and are removed by the sweeper."""
+        from services.llm_analysis_store import LLMAnalysisStore
+
+        store = LLMAnalysisStore(tmp_path / "llm.db", ttl_seconds=100, max_entries=10)
+        try:
+            store.put("old", "stale", created_at=time.time() - 200)
+            store.put("older", "stale", created_at=time.time() - 300)
+            store.put("new", "fresh")
+
+            assert store.get("old") is None
+            assert store.get("new") == "fresh"
+            assert store.sweep() == 1
+            assert len(store) == 1
+        finally:
+            store.close()
+
+    def test_lru_bound_evicts_least_recently_used(self, tmp_path):
+        """The store keeps at most max_entries, evicting the coldest first."""
+        from services.llm_analysis_store import LLMAnalysisStore
+
+        store = LLMAnalysisStore(tmp_path / "llm.db", ttl_seconds=3600, max_entries=3, hot_size=2)
+        try:
+            for i in range(3):
+                store.put(f"k{i}", f"a{i}", created_at=time.time() - 10 + i)
+            assert store.get("k0") == "a0"  # from disk, not the hot set
+            store.put("k3", "a3")
+
+            assert len(store) == 3
+            assert store.get("k1") is None
+            assert [store.get(k) for k in ("k0", "k2", "k3")] == ["a0", "a2", "a3"]
+        finally:
+            store.close()
+
+    def test_persists_and_imports_legacy_json(self, tmp_path):
+        """Entries survive a reopen and the old JSON cache is imported once."""
+        from services.llm_analysis_store import LLMAnalysisStore
+
+        legacy = tmp_path / "llm_analysis_cache.json"
+        legacy.write_text(json.dumps({
+            "P_2024-01-01_a.json": {"analysis": "kept", "timestamp": time.time()},
+            "P_2024-01-01_b.json": {"analysis": "expired", "timestamp": 0},
+        }))
+        store = LLMAnalysisStore(tmp_path / "llm.db", ttl_seconds=3600, max_entries=10)
+        assert store.import_legacy_json(legacy) == 1
+        store.close()
+
+        reopened = LLMAnalysisStore(tmp_path / "llm.db", ttl_seconds=3600, max_entries=10)
+        try:
+            assert reopened.get("P_2024-01-01_a.json") == "kept"
+            assert reopened.get("P_2024-01-01_b.json") is None
+            assert (tmp_path / "llm_analysis_cache.json.migrated").exists()
+            assert reopened.import_legacy_json(legacy) == 0
+        finally:
+            reopened.close()
+
+
+    def test_async_helpers_query_off_the_event_loop(self, monkeypatch):
+        """Route-facing helpers run the SQLite store in a worker thread."""
+        import threading
+        import services.cache_service as cs
+
+        store = cs._get_llm_store()
+        threads = []
+        for name in ("get", "put"):
+            method = getattr(store, name)
+
+            def traced(*args, _method=method, **kwargs):
+                threads.append(threading.get_ident())
+                return _method(*args, **kwargs)
+
+            monkeypatch.setattr(store, name, traced)
+
+        async def scenario():
+            await cs.async_save_llm_analysis_to_cache("P", "2024-01-15", "a.json", "Even extraction")
+            return await cs.async_get_cached_llm_analysis("P", "2024-01-15", "a.json")
+
+        assert asyncio.run(scenario()) == "Even extraction"
+        assert len(threads) == 2
+        assert threading.get_ident() not in threads
+
+
+class TestPersistenceService:
+    """Tests for write-coalescing persistence of JSON-backed state."""
+
+    def test_writes_through_when_flusher_not_running(self, tmp_path):
+        """Without the background flusher every mark writes immediately."""
+        from services.persistence_service import PersistenceManager
+
+        manager = PersistenceManager(interval_ms=50)
+        data = {"n": 0}
+        manager.register("counter", tmp_path / "counter.json", lambda: data)
+
+        for i in range(3):
+            data["n"] = i
+            manager.mark_dirty("counter")
+
+        assert json.loads((tmp_path / "counter.json").read_text()) == {"n": 2}
+        assert manager.metrics()["writes"] == 3
+        with pytest.raises(KeyError):
+            manager.mark_dirty("unknown")
+
+    def test_burst_of_edits_is_one_write(self, tmp_path, monkeypatch):
+        """Twenty rating edits while the flusher runs produce a single write."""
+        import services.shot_annotations_service as svc
+        from services.persistence_service import get_persistence
+
+        annotations_file = tmp_path / "shot_annotations.json"
+        monkeypatch.setattr(svc, "ANNOTATIONS_FILE", annotations_file)
+        monkeypatch.setattr(svc, "_annotations_cache", None)
+        manager = get_persistence()
+        monkeypatch.setattr(manager, "interval", 0.05)
+
+        async def scenario():
+            manager.start()
+            try:
+                for i in range(20):
+                    svc.set_rating("2024-01-15", f"shot_{i % 4}.json", i % 5 + 1)
+                assert manager.is_dirty("shot_annotations")
+                await asyncio.sleep(0.3)
+                assert not manager.is_dirty("shot_annotations")
+            finally:
+                await manager.stop()
+
+        asyncio.run(scenario())
+
+        metrics = manager.metrics()
+        assert metrics["marks"] == 20
+        assert metrics["writes"] == 1
+        assert metrics["flushes"] == 1
+        assert metrics["last_flush_ms"] >= 0
+        saved = json.loads(annotations_file.read_text())
+        assert saved["2024-01-15/shot_3.json"]["rating"] == 5
+
+    def test_stop_flushes_pending_changes(self, tmp_path):
+        """Changes made just before shutdown are written by stop()."""
+        from services.persistence_service import PersistenceManager
+
+        manager = PersistenceManager(interval_ms=10_000)
+        data = {"sessions": []}
+        manager.register("sessions", lambda: tmp_path / "sessions.json", lambda: data)
+
+        async def scenario():
+            manager.start()
+            data["sessions"].append("s1")
+            manager.mark_dirty("sessions")
+            # Marks from worker threads are handed to the loop safely
+            await asyncio.to_thread(manager.mark_dirty, "sessions")
+            assert not (tmp_path / "sessions.json").exists()
+            await manager.stop()
+
+        asyncio.run(scenario())
+
+        assert json.loads((tmp_path / "sessions.json").read_text()) == {"sessions": ["s1"]}
+        assert manager.metrics()["writes"] == 1
+        assert manager.metrics()["running"] is False
+
+    def test_flush_serializes_in_a_worker_thread(self, tmp_path):
+        """Snapshots are encoded off the loop; marks made meanwhile are kept."""
+        import threading
+        from services.persistence_service import PersistenceManager
+
+        manager = PersistenceManager(interval_ms=10_000)
+        threads = []
+
+        class Marker:
+            def __str__(self):
+                threads.append(threading.current_thread())
+                if len(threads) == 1:
+                    # A worker thread changes the data while it is being written
+                    manager.mark_dirty("items", ["b"])
+                return "marker"
+
+        data = {"a": Marker()}
+        manager.register("items", tmp_path / "items.json", lambda: dict(data))
+
+        async def scenario():
+            manager.start()
+            manager.mark_dirty("items")
+            await manager.flush()
+            assert manager.is_dirty("items")
+            await manager.stop()
+
+        asyncio.run(scenario())
+
+        assert threading.main_thread() not in threads
+        assert manager.metrics()["writes"] == 2
+        assert json.loads((tmp_path / "items.json").read_text()) == {"a": "marker"}
+
+
+class TestDatabaseStorage:
+    """Tests for the SQLite storage backend of persisted state."""
+
+    def test_transaction_rolls_back_all_collections(self, tmp_path):
+        """A failure inside a transaction leaves every collection untouched."""
+        from services.database import Database
+
+        db = Database(tmp_path / "meticai.db")
+        db.repository("a").put("k", {"v": 1})
+        with pytest.raises(RuntimeError):
+            with db.transaction():
+                db.repository("a").put("k", {"v": 2})
+                db.repository("b").put("x", [1, 2])
+                raise RuntimeError("boom")
+
+        assert db.repository("a").get("k") == {"v": 1}
+        assert db.repository("b").count() == 0
+        db.close()
+
+    def test_legacy_json_is_imported_once(self, tmp_path):
+        """Existing JSON files are copied into the database on first use only."""
+        from services.database import Database, import_json_file
+
+        legacy = tmp_path / "history.json"
+        legacy.write_text(json.dumps([{"id": "new"}, {"id": "old"}, {"no_id": True}]))
+        db = Database(tmp_path / "meticai.db")
+
+        assert import_json_file(db, "history", legacy, "list") == 2
+        assert import_json_file(db, "history", legacy, "list") is None
+        assert db.repository("history").keys() == ["new", "old"]
+        assert legacy.exists()
+        db.close()
+
+    def test_manager_writes_only_changed_rows(self, tmp_path):
+        """Flushes write changed rows of all datasets in one transaction."""
+        from services.database import Database
+        from services.persistence_service import PersistenceManager
+
+        db = Database(tmp_path / "meticai.db")
+        (tmp_path / "history.json").write_text(json.dumps([{"id": "a", "n": 1}]))
+        manager = PersistenceManager(backend="sqlite", database=lambda: db)
+        history = [{"id": "a", "n": 1}]
+        settings = {"authorName": "x"}
+        manager.register("history", tmp_path / "history.json", lambda: history,
+                         collection="history", kind="list")
+        manager.register("settings", tmp_path / "settings.json", lambda: settings,
+                         collection="settings")
+
+        assert manager.read("history") == [{"id": "a", "n": 1}]
+        assert not manager.has_data("settings")
+
+        history.insert(0, {"id": "b", "n": 2})
+        manager.mark_dirty("history")
+        assert manager.metrics()["rows_written"] == 1
+
+        async def scenario():
+            manager.start()
+            try:
+                history.pop(0)
+                settings["authorName"] = "y"
+                manager.mark_dirty("history")
+                manager.mark_dirty("settings")
+                await manager.flush()
+            finally:
+                await manager.stop()
+
+        asyncio.run(scenario())
+
+        assert manager.metrics()["rows_written"] == 3
+        assert manager.read("history") == [{"id": "a", "n": 1}]
+        assert manager.read("settings") == {"authorName": "y"}
+        assert not (tmp_path / "settings.json").exists()
+
+        manager.clear("history")
+        assert manager.read("history") == []
+        db.close()
+
+    def test_keyed_marks_and_paged_reads(self, tmp_path):
+        """Saving one entry writes one row; pages are read without the rest."""
+        from services.database import Database
+        from services.persistence_service import PersistenceManager
+
+        db = Database(tmp_path / "meticai.db")
+        history = [{"id": f"e{i}", "n": i} for i in range(2000)]
+        manager = PersistenceManager(backend="sqlite", database=lambda: db)
+        manager.register("history", tmp_path / "history.json", lambda: history,
+                         collection="history", kind="list")
+        manager.mark_dirty("history")
+
+        history.insert(0, {"id": "new", "n": -1})
+        history[5]["n"] = "edited"
+        manager.reset_metrics()
+        manager.mark_dirty("history", ["new", "e4"])
+        history.pop()
+        manager.mark_dirty("history", ["e1999"])
+        assert manager.metrics()["rows_written"] == 3
+
+        cold = PersistenceManager(backend="sqlite", database=lambda: db)
+        cold.register("history", tmp_path / "history.json", lambda: [],
+                      collection="history", kind="list")
+        page, total = cold.read_page("history", 4, 3)
+        assert total == 2000
+        assert page == [{"id": "e3", "n": 3}, {"id": "e4", "n": "edited"}, {"id": "e5", "n": 5}]
+        assert cold.read("history") == history
+        db.close()
+
+    def test_failed_flush_is_retried(self, tmp_path, monkeypatch):
+        """Changes whose write failed stay dirty and land on the next flush."""
+        from services.database import Database, Repository
+        from services.persistence_service import PersistenceManager
+
+        db = Database(tmp_path / "meticai.db")
+        history = [{"id": "a", "n": 1}]
+        manager = PersistenceManager(backend="sqlite", database=lambda: db)
+        manager.register("history", tmp_path / "history.json", lambda: history,
+                         collection="history", kind="list")
+        manager.mark_dirty("history")
+
+        put_serialized = Repository.put_serialized
+        calls = []
+
+        def flaky(self, rows):
+            calls.append(rows)
+            if len(calls) == 1:
+                raise RuntimeError("database is locked")
+            return put_serialized(self, rows)
+
+        monkeypatch.setattr(Repository, "put_serialized", flaky)
+
+        async def scenario():
+            manager.start()
+            try:
+                history[0]["n"] = 2
+                manager.mark_dirty("history", ["a"])
+                await manager.flush()
+                assert manager.is_dirty("history")
+                assert manager._wakeup.is_set()
+                history.append({"id": "b", "n": 3})
+                manager.mark_dirty("history", ["b"])
+                await manager.flush()
+            finally:
+                await manager.stop()
+
+        asyncio.run(scenario())
+
+        assert len(calls) == 2
+        assert manager.metrics()["errors"] == 1
+        assert not manager.is_dirty("history")
+        assert db.repository("history").get("a") == {"id": "a", "n": 2}
+        assert db.repository("history").get("b") == {"id": "b", "n": 3}
+        db.close()
+
+    @patch.dict(os.environ, {"GEMINI_API_KEY": "test_api_key"})
+    def test_single_entries_are_read_by_key(self, client, sqlite_storage, tmp_path, monkeypatch):
+        """Entry, JSON and preview lookups read one row, not the whole history."""
+        import services.history_service as hs
+        from services.history_service import get_entry_by_id, save_to_history
+
+        monkeypatch.setattr(hs, "HISTORY_FILE", tmp_path / "profile_history.json")
+        monkeypatch.setattr(hs, "_history_cache", None)
+
+        preview = base64.b64encode(b"\x89PNG-keyed").decode()
+        entries = [
+            save_to_history(f"Bag {i}", None, f"Profile Created: Profile {i}\n", image_preview=preview)
+            for i in range(3)
+        ]
+        hs._history_cache = None
+
+        entry_id = entries[1]["id"]
+        assert client.get(f"/api/history/{entry_id}").json()["profile_name"] == "Profile 1"
+        assert client.get(f"/api/history/{entry_id}/preview").content == b"\x89PNG-keyed"
+        assert client.get(f"/api/history/{entry_id}/json").status_code == 404
+        assert client.get("/api/history/missing").status_code == 404
+        assert hs._history_cache is None
+
+        # Unsaved edits are served from memory until they are stored
+        manager = hs.get_persistence()
+
+        async def scenario():
+            manager.start()
+            try:
+                history = hs.load_history()
+                await manager.flush()
+                history[1]["profile_name"] = "Edited"
+                hs.save_history(history, [entry_id])
+                assert manager.read_item("history", entry_id)["profile_name"] == "Profile 1"
+                assert get_entry_by_id(entry_id)["profile_name"] == "Edited"
+                other = entries[0]["id"]
+                assert not manager.has_pending("history", other)
+                assert get_entry_by_id(other) == manager.read_item("history", other)
+            finally:
+                await manager.stop()
+
+        asyncio.run(scenario())
+        assert sqlite_storage.repository("history").get(entry_id)["profile_name"] == "Edited"
+
+
+@pytest.mark.usefixtures("storage_backend")
+class TestStorageBackendRoutes:
+    """History, settings and notes routes round-trip through either backend."""
+
+    @pytest.fixture(autouse=True)
+    def isolated_files(self, tmp_path, monkeypatch):
+        import services.history_service as hs
+        import services.settings_service as ss
+        monkeypatch.setattr(hs, "HISTORY_FILE", tmp_path / "profile_history.json")
+        monkeypatch.setattr(ss, "SETTINGS_FILE", tmp_path / "settings.json")
+
+    @staticmethod
+    def _reload():
+        """Drop the in-memory copies so the next read comes from storage."""
+        import services.history_service as hs
+        import services.settings_service as ss
+        hs._history_cache = None
+        ss._settings_cache = None
+
+    @patch.dict(os.environ, {"GEMINI_API_KEY": "test_api_key"})
+    def test_history_round_trip(self, client, storage_backend):
+        import services.history_service as hs
+        from services.history_service import save_to_history
+
+        ids = [
+            save_to_history(f"Bag {i}", None, f"Profile Created: Profile {i}\n\nDescription: test")["id"]
+            for i in range(5)
+        ]
+        self._reload()
+
+        page = client.get("/api/history?limit=2&offset=1").json()
+        assert page["total"] == 5
+        assert [e["id"] for e in page["entries"]] == ids[::-1][1:3]
+
+        assert client.patch(f"/api/history/{ids[0]}/notes", json={"notes": "Sweet"}).status_code == 200
+        assert client.delete(f"/api/history/{ids[1]}").status_code == 200
+        self._reload()
+
+        assert client.get(f"/api/history/{ids[0]}/notes").json()["notes"] == "Sweet"
+        assert client.get(f"/api/history/{ids[1]}").status_code == 404
+        assert client.get("/api/history").json()["total"] == 4
+        assert hs.HISTORY_FILE.exists() == (storage_backend == "json")
+
+    def test_settings_round_trip(self, client):
+        response = client.post("/api/settings", json={"authorName": " Barista ", "autoSync": True})
+        assert response.status_code == 200
+        self._reload()
+
+        settings = client.get("/api/settings").json()
+        assert settings["authorName"] == "Barista"
+        assert settings["autoSync"] is True
+
+
+class TestHistoryImagePreviews:
+    """Tests for history image previews kept in the blob store."""
+
+    PNG = base64.b64encode(b"\x89PNG-preview-bytes").decode()
+
+    def test_preview_stored_as_blob_and_served(self, client):
+        """Saved previews are referenced by digest and served lazily."""
+        from services.blob_store import get_blob
+        from services.history_service import HISTORY_FILE, save_to_history
+
+        entry = save_to_history(
+            "analysis", None, "**Profile Created:** Blob Test\n",
+            image_preview=f"data:image/png;base64,{self.PNG}",
+        )
+
+        assert "image_preview" not in entry
+        assert get_blob(entry["image_preview_hash"]) == b"\x89PNG-preview-bytes"
+        assert self.PNG not in HISTORY_FILE.read_text()
+
+        response = client.get(f"/api/history/{entry['id']}/preview")
+        assert response.status_code == 200
+        assert response.content == b"\x89PNG-preview-bytes"
+        assert response.headers["content-type"] == "image/png"
+        assert "immutable" in response.headers["cache-control"]
+
+        assert client.delete(f"/api/history/{entry['id']}").status_code == 200
+        assert get_blob(entry["image_preview_hash"]) is None
+        assert client.get(f"/api/history/{entry['id']}/preview").status_code == 404
+
+    def test_inline_previews_migrated_on_load(self):
+        """Legacy inline previews are moved out of the history file on load."""
+        from services.blob_store import get_blob
+        from services.history_service import HISTORY_FILE, load_history
+
+        HISTORY_FILE.write_text(json.dumps([
+            {"id": "a", "profile_name": "A", "image_preview": self.PNG},
+            {"id": "b", "profile_name": "B", "image_preview": None},
+        ]))
+
+        history = load_history()
+
+        assert get_blob(history[0]["image_preview_hash"]) == b"\x89PNG-preview-bytes"
+        assert history[0]["image_preview_type"] == "image/jpeg"
+        assert all("image_preview" not in e for e in history)
+        assert self.PNG not in HISTORY_FILE.read_text()
+
+    def test_blob_deleted_only_after_history_is_stored(self, monkeypatch):
+        """A failed history write keeps the blobs its stored entries still use."""
+        from services.blob_store import get_blob
+        from services.history_service import (
+            HISTORY_FILE, load_history, release_image_previews, save_history, save_to_history,
+        )
+        from services.persistence_service import get_persistence
+
+        preview = base64.b64encode(b"\x89PNG-kept-until-stored").decode()
+        entry = save_to_history(
+            "analysis", None, "**Profile Created:** Blob Test\n",
+            image_preview=f"data:image/png;base64,{preview}",
+        )
+        digest = entry["image_preview_hash"]
+        manager = get_persistence()
+        write_batch = manager._write_batch
+        failures = [True]
+
+        def flaky_write(batch):
+            if failures:
+                failures.pop()
+                return [dataset.name for dataset, _, _ in batch]
+            return write_batch(batch)
+
+        monkeypatch.setattr(manager, "_write_batch", flaky_write)
+
+        async def scenario():
+            manager.start()
+            try:
+                save_history([e for e in load_history() if e["id"] != entry["id"]], [entry["id"]])
+                release_image_previews([entry])
+                assert get_blob(digest) is not None
+                await manager.flush()
+                # The stored history still references the blob
+                assert digest in HISTORY_FILE.read_text()
+                assert get_blob(digest) is not None
+                await manager.flush()
+                assert digest not in HISTORY_FILE.read_text()
+                assert get_blob(digest) is None
+            finally:
+                await manager.stop()
+
+        asyncio.run(scenario())
+
+
+class TestHistorySearch:
+    """Tests for the full-text history search index."""
+
+    def _seed(self):
+        from services.history_service import HISTORY_FILE, save_to_history
+        HISTORY_FILE.write_text("[]")
+        ethiopia = save_to_history(
+            "Ethiopian Yirgacheffe, washed, light roast", "bright and floral",
+            "**Profile Created:** Floral Bloom\n",
         )
+        brazil = save_to_history(
+            "Brazil natural, dark roast", "chocolate body",
+            "**Profile Created:** Cocoa Ramp\n",
+        )
+        return ethiopia, brazil
 
-        assert response.status_code == 200
-        data = response.json()
-        assert data["status"] == "error"
-        assert "validation errors" in data["message"]
-        # Initial generation + 2 retries = 3 calls
-        assert mock_vision_model.return_value.async_generate_content.call_count == 3
-        # validate_profile should never be called since no JSON was extracted
-        mock_validate.assert_not_called()
+    def test_search_ranks_and_updates_incrementally(self, client):
+        """Results follow notes edits, deletions and prefix queries."""
+        from services.history_service import update_entry_notes
 
-    @patch.dict(os.environ, {"GEMINI_API_KEY": "test_api_key"})
-    @patch('api.routes.coffee.save_to_history')
-    @patch('api.routes.coffee.async_create_profile', new_callable=AsyncMock)
-    @patch('api.routes.coffee.validate_profile')
-    @patch('api.routes.coffee.get_vision_model')
-    def test_no_json_then_json_on_retry(self, mock_vision_model, mock_validate, mock_create_profile, mock_save_history, client):
-        """Test that missing JSON on first try but found on retry succeeds."""
-        mock_save_history.return_value = {"id": "test-v5"}
-        mock_create_profile.return_value = {"id": "machine-v5"}
+        ethiopia, brazil = self._seed()
 
-        valid_result = Mock()
-        valid_result.is_valid = True
-        valid_result.errors = []
-        mock_validate.return_value = valid_result
+        data = client.get("/api/history/search", params={"q": "roast"}).json()
+        assert {r["id"] for r in data["results"]} == {ethiopia["id"], brazil["id"]}
 
-        no_json = Mock()
-        no_json.text = self.NO_JSON_REPLY
-        with_json = Mock()
-        with_json.text = self.VALID_PROFILE_REPLY
-        mock_vision_model.return_value.async_generate_content = AsyncMock(
-            side_effect=[no_json, with_json]
-        )
+        data = client.get("/api/history/search", params={"q": "light roa"}).json()
+        assert [r["id"] for r in data["results"]] == [ethiopia["id"]]
+        assert data["results"][0]["score"] > 0
 
-        response = client.post(
-            "/analyze_and_profile",
-            data={"user_prefs": "Light and delicate"}
-        )
+        update_entry_notes(brazil["id"], "Great with oat milk")
+        data = client.get("/api/history/search", params={"q": "oat"}).json()
+        assert [r["id"] for r in data["results"]] == [brazil["id"]]
 
-        assert response.status_code == 200
-        data = response.json()
-        assert data["status"] == "success"
-        # 2 calls: initial (no JSON) + retry (with JSON)
-        assert mock_vision_model.return_value.async_generate_content.call_count == 2
-        mock_validate.assert_called_once()
-        mock_create_profile.assert_awaited_once()
+        client.delete(f"/api/history/{brazil['id']}")
+        assert client.get("/api/history/search", params={"q": "oat"}).json()["total"] == 0
 
-    @patch.dict(os.environ, {"GEMINI_API_KEY": "test_api_key"})
-    @patch('api.routes.coffee.save_to_history')
-    @patch('api.routes.coffee.async_create_profile', new_callable=AsyncMock)
-    @patch('api.routes.coffee.validate_profile')
-    @patch('api.routes.coffee.get_vision_model')
-    def test_response_includes_generation_id(self, mock_vision_model, mock_validate, mock_create_profile, mock_save_history, client):
-        """Test that the response includes a generation_id for SSE tracking."""
-        mock_save_history.return_value = {"id": "test-v6"}
-        mock_create_profile.return_value = {"id": "machine-v6"}
+    def test_in_place_edits_are_picked_up(self):
+        """Entries renamed in place by other code are re-indexed on search."""
+        from services.history_service import load_history, save_history, search_history
 
-        valid_result = Mock()
-        valid_result.is_valid = True
-        valid_result.errors = []
-        mock_validate.return_value = valid_result
+        ethiopia, _ = self._seed()
+        assert search_history("floral bloom")
+        history = load_history()
+        next(e for e in history if e["id"] == ethiopia["id"])["profile_name"] = "Jasmine Turbo"
+        save_history(history)
 
-        profile_response = Mock()
-        profile_response.text = self.VALID_PROFILE_REPLY
-        mock_vision_model.return_value.async_generate_content = AsyncMock(return_value=profile_response)
+        assert [e["id"] for e, _ in search_history("jasmine turbo")] == [ethiopia["id"]]
+        assert ethiopia["id"] not in [e["id"] for e, _ in search_history("floral bloom")]
+        assert search_history("  ") == []
 
-        response = client.post(
-            "/analyze_and_profile",
-            data={"user_prefs": "Bright acidity"}
+    def test_nested_profile_edits_are_picked_up(self):
+        """Edits inside an entry's profile JSON dict are re-indexed on search."""
+        from services.history_service import load_history, save_history, search_history
+
+        ethiopia, _ = self._seed()
+        history = load_history()
+        entry = next(e for e in history if e["id"] == ethiopia["id"])
+        entry["profile_json"] = {"name": "Floral Bloom", "stages": [{"name": "Soak"}]}
+        save_history(history)
+        assert [e["id"] for e, _ in search_history("soak")] == [ethiopia["id"]]
+
+        entry["profile_json"]["stages"][0]["name"] = "Velvet ramp"
+        save_history(history)
+
+        assert [e["id"] for e, _ in search_history("velvet")] == [ethiopia["id"]]
+        assert search_history("soak") == []
+
+    def test_writes_do_not_resync_the_whole_index(self):
+        """Service writes keep the index current; keyed saves re-index only their entries."""
+        import services.history_search as history_search
+        from services.history_service import (
+            _search_index, delete_entry, load_history, save_history, search_history,
+            update_entry_notes,
         )
 
-        assert response.status_code == 200
-        data = response.json()
-        assert "generation_id" in data
-        assert len(data["generation_id"]) == 8
+        ethiopia, brazil = self._seed()
+        assert search_history("roast")
+        update_entry_notes(ethiopia["id"], "Lovely with oat milk")
+        delete_entry(brazil["id"])
+        assert _search_index.built and not _search_index.needs_sync
+        assert [e["id"] for e, _ in search_history("oat")] == [ethiopia["id"]]
+        assert search_history("cocoa") == []
+
+        history = load_history()
+        history[0]["profile_name"] = "Jasmine Turbo"
+        save_history(history, [ethiopia["id"]])
+        with patch.object(history_search, "entry_signature", wraps=history_search.entry_signature) as signature:
+            assert [e["id"] for e, _ in search_history("jasmine")] == [ethiopia["id"]]
+        # Only the changed entry was looked at
+        assert signature.call_count == 1
 
 
 class TestUnicodeEscapeInReSubFix:
@@ -1148,6 +2697,7 @@ class TestUnicodeEscapeInReSubFix:
         "```\n"
     )
 
+    @pytest.mark.usefixtures("no_local_repair")
     @patch.dict(os.environ, {"GEMINI_API_KEY": "test_api_key"})
     @patch('api.routes.coffee.save_to_history')
     @patch('api.routes.coffee.async_create_profile', new_callable=AsyncMock)
@@ -1938,10 +3488,9 @@ class TestHistoryAPI:
         }
 
     @patch.dict(os.environ, {"GEMINI_API_KEY": "test_api_key"})
-    @patch('api.routes.history.load_history')
-    def test_get_history_empty(self, mock_load, client):
+    def test_get_history_empty(self, client, monkeypatch):
         """Test getting history when it's empty."""
-        mock_load.return_value = []
+        monkeypatch.setattr(services.history_service, "_history_cache", [])
 
         response = client.get("/api/history")
         
@@ -1953,10 +3502,9 @@ class TestHistoryAPI:
         assert data["offset"] == 0
 
     @patch.dict(os.environ, {"GEMINI_API_KEY": "test_api_key"})
-    @patch('api.routes.history.load_history')
-    def test_get_history_with_entries(self, mock_load, client, sample_history_entry):
+    def test_get_history_with_entries(self, client, sample_history_entry, monkeypatch):
         """Test getting history with existing entries."""
-        mock_load.return_value = [sample_history_entry]
+        monkeypatch.setattr(services.history_service, "_history_cache", [sample_history_entry])
 
         response = client.get("/api/history")
         
@@ -1967,8 +3515,7 @@ class TestHistoryAPI:
         assert data["total"] == 1
 
     @patch.dict(os.environ, {"GEMINI_API_KEY": "test_api_key"})
-    @patch('api.routes.history.load_history')
-    def test_get_history_pagination(self, mock_load, client, sample_history_entry):
+    def test_get_history_pagination(self, client, sample_history_entry, monkeypatch):
         """Test history pagination with limit and offset."""
         # Create multiple entries
         entries = []
@@ -1977,7 +3524,7 @@ class TestHistoryAPI:
             entry["id"] = f"entry-{i}"
             entry["profile_name"] = f"Profile {i}"
             entries.append(entry)
-        mock_load.return_value = entries
+        monkeypatch.setattr(services.history_service, "_history_cache", entries)
 
         # Test with custom limit and offset
         response = client.get("/api/history?limit=3&offset=2")
@@ -1990,12 +3537,11 @@ class TestHistoryAPI:
         assert data["offset"] == 2
 
     @patch.dict(os.environ, {"GEMINI_API_KEY": "test_api_key"})
-    @patch('api.routes.history.load_history')
-    def test_get_history_removes_image_preview(self, mock_load, client, sample_history_entry):
+    def test_get_history_removes_image_preview(self, client, sample_history_entry, monkeypatch):
         """Test that image_preview is removed from list view."""
         entry = sample_history_entry.copy()
         entry["image_preview"] = "base64-thumbnail-data"
-        mock_load.return_value = [entry]
+        monkeypatch.setattr(services.history_service, "_history_cache", [entry])
 
         response = client.get("/api/history")
         
@@ -2005,7 +3551,7 @@ class TestHistoryAPI:
         assert data["entries"][0]["image_preview"] is None
 
     @patch.dict(os.environ, {"GEMINI_API_KEY": "test_api_key"})
-    @patch('api.routes.history.load_history')
+    @patch('services.history_service.load_history')
     def test_get_history_entry_by_id(self, mock_load, client, sample_history_entry):
         """Test getting a specific history entry by ID."""
         mock_load.return_value = [sample_history_entry]
@@ -2019,7 +3565,7 @@ class TestHistoryAPI:
         assert data["profile_json"] is not None
 
     @patch.dict(os.environ, {"GEMINI_API_KEY": "test_api_key"})
-    @patch('api.routes.history.load_history')
+    @patch('services.history_service.load_history')
     def test_get_history_entry_not_found(self, mock_load, client):
         """Test 404 when history entry doesn't exist."""
         mock_load.return_value = []
@@ -2030,8 +3576,8 @@ class TestHistoryAPI:
         assert "not found" in response.json()["detail"].lower()
 
     @patch.dict(os.environ, {"GEMINI_API_KEY": "test_api_key"})
-    @patch('api.routes.history.save_history')
-    @patch('api.routes.history.load_history')
+    @patch('services.history_service.save_history')
+    @patch('services.history_service.load_history')
     def test_delete_history_entry(self, mock_load, mock_save, client, sample_history_entry):
         """Test deleting a specific history entry."""
         mock_load.return_value = [sample_history_entry]
@@ -2040,11 +3586,11 @@ class TestHistoryAPI:
         
         assert response.status_code == 200
         assert response.json()["status"] == "success"
-        # Verify save was called with empty list
-        mock_save.assert_called_once_with([])
+        # Only the deleted entry is written; the index already dropped it
+        mock_save.assert_called_once_with([], [sample_history_entry["id"]], index_updated=True)
 
     @patch.dict(os.environ, {"GEMINI_API_KEY": "test_api_key"})
-    @patch('api.routes.history.load_history')
+    @patch('services.history_service.load_history')
     def test_delete_history_entry_not_found(self, mock_load, client):
         """Test 404 when deleting non-existent entry."""
         mock_load.return_value = []
@@ -2054,8 +3600,8 @@ class TestHistoryAPI:
         assert response.status_code == 404
 
     @patch.dict(os.environ, {"GEMINI_API_KEY": "test_api_key"})
-    @patch('api.routes.history.save_history')
-    @patch('api.routes.history.load_history')
+    @patch('services.history_service.save_history')
+    @patch('services.history_service.load_history')
     def test_clear_history(self, mock_load, mock_save, client, sample_history_entry):
         """Test clearing all history."""
         mock_load.return_value = [sample_history_entry]
@@ -2068,7 +3614,7 @@ class TestHistoryAPI:
         mock_save.assert_called_once_with([])
 
     @patch.dict(os.environ, {"GEMINI_API_KEY": "test_api_key"})
-    @patch('api.routes.history.load_history')
+    @patch('services.history_service.load_history')
     def test_get_profile_json(self, mock_load, client, sample_history_entry):
         """Test getting profile JSON for download."""
         mock_load.return_value = [sample_history_entry]
@@ -2081,7 +3627,7 @@ class TestHistoryAPI:
         assert "ethiopian-sunrise.json" in response.headers["content-disposition"]
 
     @patch.dict(os.environ, {"GEMINI_API_KEY": "test_api_key"})
-    @patch('api.routes.history.load_history')
+    @patch('services.history_service.load_history')
     def test_get_profile_json_not_available(self, mock_load, client, sample_history_entry):
         """Test 404 when profile JSON is not available."""
         entry = sample_history_entry.copy()
@@ -2094,7 +3640,7 @@ class TestHistoryAPI:
         assert "not available" in response.json()["detail"].lower()
 
     @patch.dict(os.environ, {"GEMINI_API_KEY": "test_api_key"})
-    @patch('api.routes.history.load_history')
+    @patch('services.history_service.load_history')
     def test_get_profile_json_entry_not_found(self, mock_load, client):
         """Test 404 when entry doesn't exist for JSON download."""
         mock_load.return_value = []
@@ -2424,17 +3970,40 @@ Description: A test profile
         assert len(saved_history) == 1
         assert saved_history[0]["id"] == entry["id"]
 
+    @patch('services.history_service.save_history')
+    @patch('services.history_service.load_history')
+    def test_save_to_history_keeps_all_entries_by_default(self, mock_load, mock_save):
+        """Test that history is no longer capped at 100 entries."""
+        from services.history_service import save_to_history
+        
+        existing_entries = [{"id": f"entry-{i}"} for i in range(100)]
+        mock_load.return_value = existing_entries
+        
+        entry = save_to_history(
+            coffee_analysis=None,
+            user_prefs="Test",
+            reply="Profile Created: New Profile"
+        )
+        
+        mock_save.assert_called_once()
+        saved_history = mock_save.call_args[0][0]
+        assert len(saved_history) == 101
+        assert saved_history[0]["profile_name"] == "New Profile"
+        # Only the new entry needs writing
+        assert mock_save.call_args[0][1] == [entry["id"]]
+
+    @patch('services.history_service.HISTORY_MAX_ENTRIES', 100)
     @patch('services.history_service.save_history')
     @patch('services.history_service.load_history')
     def test_save_to_history_limits_entries(self, mock_load, mock_save):
-        """Test that history is limited to 100 entries."""
+        """Test that HISTORY_MAX_ENTRIES drops the oldest entries."""
         from services.history_service import save_to_history
         
         # Create 100 existing entries
         existing_entries = [{"id": f"entry-{i}"} for i in range(100)]
         mock_load.return_value = existing_entries
         
-        save_to_history(
+        entry = save_to_history(
             coffee_analysis=None,
             user_prefs="Test",
             reply="Profile Created: New Profile"
@@ -2448,6 +4017,7 @@ Description: A test profile
         assert len(saved_history) == 100
         # New entry should be first
         assert saved_history[0]["profile_name"] == "New Profile"
+        assert mock_save.call_args[0][1] == [entry["id"], "entry-99"]
 
     @patch('services.history_service.save_history')
     @patch('services.history_service.load_history')
@@ -5102,6 +6672,114 @@ class TestImageProxyEndpoint:
         mock_set_cache.assert_called_once_with("Settings IP", b"settings_ip_png")
 
 
+class TestImageCacheWarmup:
+    """Tests for the startup profile image cache warm-up."""
+
+    @staticmethod
+    def _profile(name, image):
+        profile = SimpleNamespace(name=name, display=SimpleNamespace(image=image))
+        return profile
+
+    @staticmethod
+    def _data_uri(payload: bytes) -> str:
+        import base64
+        return f"data:image/png;base64,{base64.b64encode(payload).decode('utf-8')}"
+
+    @pytest.mark.asyncio
+    async def test_warmup_fetches_and_caches_all_images(self, tmp_path, monkeypatch):
+        """Every profile with an image is cached and its source hash recorded."""
+        import services.cache_service as cs
+        from api.routes import profiles as profiles_mod
+
+        monkeypatch.setattr(cs, "IMAGE_CACHE_DIR", tmp_path)
+        monkeypatch.setattr(cs, "IMAGE_CACHE_INDEX_FILE", tmp_path / "index.json")
+        monkeypatch.setattr(cs, "_image_cache_index", None)
+
+        catalogue = [
+            self._profile("Alpha", self._data_uri(b"alpha_png")),
+            self._profile("Beta", self._data_uri(b"beta_png")),
+            SimpleNamespace(name="No Image", display=None),
+        ]
+        with patch.object(profiles_mod, "async_fetch_all_profiles", new_callable=AsyncMock, return_value=catalogue):
+            stats = await profiles_mod.warm_profile_image_cache(concurrency=2, fetch_interval=0)
+
+        assert stats == {"fetched": 2, "skipped": 0, "failed": 0}
+        assert cs._get_cached_image("Alpha") == b"alpha_png"
+        assert cs._get_cached_image_source_hash("Beta") == cs.compute_image_source_hash(self._data_uri(b"beta_png"))
+        assert json.loads((tmp_path / "index.json").read_text())["alpha"]
+
+    @pytest.mark.asyncio
+    async def test_warmup_skips_images_with_matching_hash(self, tmp_path, monkeypatch):
+        """Already-cached images with a matching source hash are not refetched."""
+        import services.cache_service as cs
+        from api.routes import profiles as profiles_mod
+
+        monkeypatch.setattr(cs, "IMAGE_CACHE_DIR", tmp_path)
+        monkeypatch.setattr(cs, "IMAGE_CACHE_INDEX_FILE", tmp_path / "index.json")
+        monkeypatch.setattr(cs, "_image_cache_index", None)
+
+        unchanged = self._data_uri(b"same_png")
+        cs._set_cached_image("Same", b"same_png")
+        cs._set_cached_image_source_hash("Same", cs.compute_image_source_hash(unchanged))
+        cs._set_cached_image("Changed", b"old_png")
+        cs._set_cached_image_source_hash("Changed", cs.compute_image_source_hash("stale"))
+
+        catalogue = [
+            self._profile("Same", unchanged),
+            self._profile("Changed", self._data_uri(b"new_png")),
+        ]
+        with patch.object(profiles_mod, "async_fetch_all_profiles", new_callable=AsyncMock, return_value=catalogue):
+            with patch.object(profiles_mod, "_fetch_profile_image", wraps=profiles_mod._fetch_profile_image) as mock_fetch:
+                stats = await profiles_mod.warm_profile_image_cache(fetch_interval=0)
+
+        assert stats == {"fetched": 1, "skipped": 1, "failed": 0}
+        mock_fetch.assert_called_once_with(self._data_uri(b"new_png"))
+        assert cs._get_cached_image("Changed") == b"new_png"
+
+    @pytest.mark.asyncio
+    async def test_warmup_counts_failures_and_continues(self, tmp_path, monkeypatch):
+        """A failing image fetch does not abort the warm-up."""
+        import services.cache_service as cs
+        from api.routes import profiles as profiles_mod
+
+        monkeypatch.setattr(cs, "IMAGE_CACHE_DIR", tmp_path)
+        monkeypatch.setattr(cs, "IMAGE_CACHE_INDEX_FILE", tmp_path / "index.json")
+        monkeypatch.setattr(cs, "_image_cache_index", None)
+
+        catalogue = [
+            self._profile("Broken", "data:image/png;base64,!!!"),
+            self._profile("Good", self._data_uri(b"good_png")),
+        ]
+        with patch.object(profiles_mod, "async_fetch_all_profiles", new_callable=AsyncMock, return_value=catalogue):
+            stats = await profiles_mod.warm_profile_image_cache(fetch_interval=0)
+
+        assert stats == {"fetched": 1, "skipped": 0, "failed": 1}
+        assert cs._get_cached_image("Broken") is None
+
+    def test_thumbnail_downscales_oversized_images(self):
+        """Oversized images are thumbnailed; small ones are kept byte-for-byte."""
+        from api.routes.profiles import _thumbnail_image, IMAGE_WARMUP_THUMBNAIL_SIZE
+
+        big = BytesIO()
+        Image.new("RGB", (2048, 1024), (10, 20, 30)).save(big, format="JPEG")
+        thumb = _thumbnail_image(big.getvalue())
+        assert max(Image.open(BytesIO(thumb)).size) == IMAGE_WARMUP_THUMBNAIL_SIZE
+
+        small = BytesIO()
+        Image.new("RGB", (64, 64)).save(small, format="PNG")
+        assert _thumbnail_image(small.getvalue()) == small.getvalue()
+        assert _thumbnail_image(b"not an image") == b"not an image"
+
+    @pytest.mark.asyncio
+    async def test_warmup_task_swallows_errors(self):
+        """The background task logs machine errors instead of crashing."""
+        from api.routes import profiles as profiles_mod
+
+        with patch.object(profiles_mod, "warm_profile_image_cache", new_callable=AsyncMock, side_effect=RuntimeError("offline")) as mock_warm:
+            await profiles_mod.image_cache_warmup_task(delay=0)
+        mock_warm.assert_awaited_once()
+
+
 class TestAdditionalEndpoints:
     """Tests for additional utility endpoints."""
 
@@ -6324,25 +8002,33 @@ class TestDataFileManagement:
             assert isinstance(history, list)
             assert len(history) == 0
     
-    def test_ensure_llm_cache_file_creates_file(self):
-        """Test that _ensure_llm_cache_file creates cache file."""
-        from services.cache_service import _ensure_llm_cache_file, LLM_CACHE_FILE
-        
-        # Delete file if it exists
-        if LLM_CACHE_FILE.exists():
-            LLM_CACHE_FILE.unlink()
-        
-        # Call ensure function
-        _ensure_llm_cache_file()
+    def test_ensure_functions_skip_files_under_sqlite(self, sqlite_storage):
+        """No legacy JSON files are created for datasets kept in the database."""
+        from services.cache_service import _ensure_shot_cache_file, SHOT_CACHE_FILE
+        from services.history_service import ensure_history_file, load_history, HISTORY_FILE
+        from services.settings_service import ensure_settings_file, load_settings, SETTINGS_FILE
+        from services.shot_annotations_service import _ensure_file, ANNOTATIONS_FILE
+
+        files = (SETTINGS_FILE, HISTORY_FILE, SHOT_CACHE_FILE, ANNOTATIONS_FILE)
+        for path in files:
+            path.unlink(missing_ok=True)
+
+        ensure_settings_file()
+        ensure_history_file()
+        _ensure_shot_cache_file()
+        _ensure_file()
+        assert load_settings()["mqttEnabled"] is True
+        assert load_history() == []
+
+        assert not any(path.exists() for path in files)
+
+    def test_llm_store_creates_database(self):
+        """Test that the LLM analysis store creates its database on first use."""
+        from services.cache_service import _get_llm_store, LLM_CACHE_DB
         
-        # File should now exist
-        assert LLM_CACHE_FILE.exists()
+        _get_llm_store()
         
-        # Should contain empty dict
-        with open(LLM_CACHE_FILE) as f:
-            cache = json.load(f)
-            assert isinstance(cache, dict)
-            assert len(cache) == 0
+        assert LLM_CACHE_DB.exists()
     
     def test_ensure_shot_cache_file_creates_file(self):
         """Test that _ensure_shot_cache_file creates cache file."""
@@ -9798,15 +11484,6 @@ class TestMoreSchedulingEndpoints:
 class TestMoreCacheFunctions:
     """Additional cache function tests."""
 
-    def test_ensure_llm_cache_file(self):
-        """Test LLM cache file creation."""
-        from services.cache_service import _ensure_llm_cache_file, LLM_CACHE_FILE
-        
-        _ensure_llm_cache_file()
-        
-        # File should exist after ensuring
-        assert LLM_CACHE_FILE.exists() or True  # May not exist in test env
-
     def test_get_llm_cache_key(self):
         """Test cache key generation."""
         from services.cache_service import _get_llm_cache_key
@@ -10424,6 +12101,47 @@ class TestMQTTSubscriberOnMessage:
         assert "pressure" not in sub.snapshot
 
 
+class TestMQTTSignalCoalescing:
+    """Tests for batching MQTT updates into few event-loop wake-ups."""
+
+    def test_burst_is_applied_with_few_wakeups(self):
+        import threading
+        from services.mqtt_service import MQTTSubscriber
+
+        def burst(sub):
+            for tick in range(20):
+                for key in ("pressure", "flow_rate", "shot_weight", "shot_timer", "power"):
+                    msg = MagicMock(topic=f"meticulous_espresso/sensor/{key}/state",
+                                    payload=str(tick).encode())
+                    sub._on_message(None, None, msg)
+
+        async def scenario():
+            sub = MQTTSubscriber()
+            sub._loop = asyncio.get_running_loop()
+            sub.data_event = asyncio.Event()
+            sub.coalesce_interval = 0.02
+            thread = threading.Thread(target=burst, args=(sub,))
+            thread.start()
+            while thread.is_alive():
+                await asyncio.sleep(0.005)
+            await asyncio.sleep(0.1)
+            return sub
+
+        sub = asyncio.run(scenario())
+        stats = sub.metrics()
+
+        assert sub.snapshot["pressure"] == 19.0 and sub.snapshot["power"] == 19.0
+        assert sub.data_event.is_set()
+        assert stats["messages"] == 100
+        assert stats["lock_acquisitions"] == stats["flushes"] <= stats["wakeups"] < 50
+        assert sub.buffer.window()["pressure"]["v"][-1] == 19.0
+
+    def test_bridge_status_reports_signalling(self, client):
+        with patch("api.routes.bridge.get_bridge_status", return_value={}):
+            response = client.get("/api/bridge/status")
+        assert "messages" in response.json()["mqtt_subscriber"]["signalling"]
+
+
 class TestWebSocketEndpoint:
     """Tests for the /api/ws/live WebSocket endpoint."""
 
@@ -10442,6 +12160,673 @@ class TestWebSocketEndpoint:
             pytest.fail(f"WebSocket connection raised: {exc}")
 
 
+class TestTelemetryFrames:
+    """Tests for full and delta telemetry frame encoding."""
+
+    SNAPSHOT = {
+        "pressure": 0.0, "flow_rate": 0.0, "shot_weight": 0.0, "shot_timer": 0.0,
+        "boiler_temperature": 93.2, "brew_head_temperature": 91.8,
+        "target_temperature": 93.0, "target_weight": 36.0, "brewing": True,
+        "state": "Brewing", "active_profile": "Slow Bloom", "total_shots": 1234,
+        "voltage": 230, "firmware_version": "1.2.3", "availability": "online",
+    }
+
+    def test_delta_frames_carry_changed_keys_only(self):
+        from services.telemetry_frames import TelemetryFrameEncoder
+
+        encoder = TelemetryFrameEncoder("delta", keyframe_interval=10)
+        snapshot = dict(self.SNAPSHOT)
+        first = encoder.encode(snapshot, now=0.0)
+        assert first["_kf"] is True and first["pressure"] == 0.0
+
+        full_bytes = delta_bytes = 0
+        for tick in range(1, 50):
+            snapshot.update(pressure=tick / 5, shot_weight=tick / 2)
+            frame = encoder.encode(snapshot, now=tick * 0.1)
+            assert set(frame) == {"pressure", "shot_weight", "_ts"}
+            delta_bytes += len(json.dumps(frame))
+            full_bytes += len(json.dumps({**snapshot, "_ts": tick * 0.1}))
+        assert delta_bytes < full_bytes * 0.2
+
+        assert encoder.encode(snapshot, now=5.0) is None
+        del snapshot["voltage"]
+        assert encoder.encode(snapshot, now=5.1) == {"_del": ["voltage"], "_ts": 5.1}
+        assert encoder.encode(snapshot, now=10.0)["_kf"] is True
+
+    def test_full_mode_and_unknown_mode(self):
+        from services.telemetry_frames import TelemetryFrameEncoder
+
+        encoder = TelemetryFrameEncoder()
+        assert encoder.encode({"pressure": 1.0}, now=1.0) == {"pressure": 1.0, "_ts": 1.0}
+        assert encoder.encode({"pressure": 1.0}, now=1.1) is None
+        with pytest.raises(ValueError):
+            TelemetryFrameEncoder("bogus")
+
+    def test_websocket_delta_mode_sends_keyframe(self, client):
+        from services.mqtt_service import get_mqtt_subscriber
+
+        get_mqtt_subscriber().snapshot.update(pressure=8.5, brewing=True)
+        try:
+            with client.websocket_connect("/api/ws/live?mode=delta") as ws:
+                frame = ws.receive_json()
+                ws.close()
+        finally:
+            get_mqtt_subscriber().snapshot.clear()
+        assert frame["_kf"] is True
+        assert frame["pressure"] == 8.5
+
+
+class TestTelemetryEncodings:
+    """Tests for binary and quantized telemetry frames."""
+
+    FRAME = {"pressure": 9.13, "flow_rate": 2.05, "shot_weight": 18.4,
+             "brewing": True, "state": "Brewing", "_ts": 1700000000.123}
+
+    def test_quantized_binary_round_trip(self):
+        import cbor2
+        import msgpack
+        from services.telemetry_frames import serialize_frame
+
+        packed = serialize_frame(self.FRAME, "msgpack", quantize=True)
+        decoded = msgpack.unpackb(packed)
+        assert decoded["pressure"] == 913 and decoded["_q"] == 100
+        assert decoded["_ts"] == self.FRAME["_ts"]
+        assert decoded["brewing"] is True
+
+        cbor = cbor2.loads(serialize_frame(self.FRAME, "cbor", quantize=True))
+        assert cbor == msgpack.unpackb(packed)
+        assert len(packed) < len(serialize_frame(self.FRAME, "json"))
+        assert cbor2.loads(serialize_frame(self.FRAME, "cbor")) == self.FRAME
+
+    def test_websocket_msgpack_format(self, client):
+        import msgpack
+        from services.mqtt_service import get_mqtt_subscriber
+
+        get_mqtt_subscriber().snapshot.update(pressure=8.5)
+        try:
+            with client.websocket_connect("/api/ws/live?format=msgpack&quantize=1") as ws:
+                frame = msgpack.unpackb(ws.receive_bytes())
+                ws.close()
+        finally:
+            get_mqtt_subscriber().snapshot.clear()
+        assert frame["pressure"] == 850 and frame["_q"] == 100
+
+    def test_unavailable_format_closes_socket(self, client, monkeypatch):
+        import services.telemetry_frames as frames
+        from starlette.websockets import WebSocketDisconnect
+
+        monkeypatch.setattr(frames, "cbor2", None)
+        assert "cbor" not in frames.available_formats()
+        with client.websocket_connect("/api/ws/live?format=cbor") as ws:
+            with pytest.raises(WebSocketDisconnect) as exc_info:
+                ws.receive_bytes()
+        assert exc_info.value.code == 1003
+
+
+class TestTelemetryBroadcaster:
+    """Tests for the shared telemetry fan-out."""
+
+    class _Subscriber:
+        def __init__(self):
+            self.snapshot = {}
+            self.data_event = asyncio.Event()
+
+        def get_snapshot(self):
+            return dict(self.snapshot)
+
+    def test_frames_serialized_once_for_all_clients(self):
+        from services.telemetry_broadcaster import TelemetryBroadcaster
+
+        async def scenario():
+            sub = self._Subscriber()
+            broadcaster = TelemetryBroadcaster(sub)
+            full = [broadcaster.add_client("full") for _ in range(5)]
+            delta = [broadcaster.add_client("delta") for _ in range(5)]
+            for tick in range(3):
+                sub.snapshot["pressure"] = float(tick)
+                broadcaster.publish(sub.get_snapshot(), now=tick)
+            first = [c.queue.get_nowait() for c in full]
+            keyframe = delta[0].queue.get_nowait()
+            broadcaster.stop()
+            return broadcaster, first, keyframe
+
+        broadcaster, first, keyframe = asyncio.run(scenario())
+
+        assert broadcaster.stats["serializations"] == 6  # 3 ticks x 2 modes
+        assert all(text is first[0] for text in first)
+        assert json.loads(keyframe) == {"pressure": 0.0, "_kf": True, "_ts": 0}
+
+    def test_overflowing_delta_client_gets_keyframe(self):
+        from services.telemetry_broadcaster import TelemetryBroadcaster
+
+        async def scenario():
+            sub = self._Subscriber()
+            broadcaster = TelemetryBroadcaster(sub)
+            slow = broadcaster.add_client("delta", queue_size=2)
+            for tick in range(4):
+                broadcaster.publish({"pressure": float(tick), "state": "Brewing"}, now=tick)
+            frames = []
+            while not slow.queue.empty():
+                frames.append(json.loads(slow.queue.get_nowait()))
+            broadcaster.publish({"pressure": 9.0, "state": "Brewing"}, now=5)
+            frames.append(json.loads(slow.queue.get_nowait()))
+            broadcaster.stop()
+            return slow, frames
+
+        slow, frames = asyncio.run(scenario())
+
+        # Ticks 0-1 queued, tick 2 overflowed, tick 3 resynchronised the client
+        assert slow.dropped == 3
+        assert frames == [
+            {"pressure": 3.0, "state": "Brewing", "_kf": True, "_ts": 3},
+            {"pressure": 9.0, "_ts": 5},
+        ]
+
+    def test_analysis_frames_survive_congestion(self):
+        from services.telemetry_broadcaster import TelemetryBroadcaster
+
+        async def scenario():
+            sub = self._Subscriber()
+            broadcaster = TelemetryBroadcaster(sub)
+            slow = broadcaster.add_client("delta", queue_size=2)
+            for tick in (1, 2):
+                broadcaster.publish({"pressure": float(tick)}, now=tick)
+            # The queue is full of frames; the verdict still goes in
+            broadcaster.broadcast({"_analysis": {"type": "verdict"}, "_ts": 2.5}, priority=True)
+            assert slow.queue.qsize() == 3 and not slow._congested
+            for tick in (3, 4):
+                broadcaster.publish({"pressure": float(tick)}, now=tick)
+            frames = []
+            while not slow.queue.empty():
+                frames.append(json.loads(await slow.get()))
+            broadcaster.stop()
+            return slow, frames
+
+        slow, frames = asyncio.run(scenario())
+
+        # Tick 3 overflowed: both queued frames and tick 3 were dropped
+        assert frames == [
+            {"_analysis": {"type": "verdict"}, "_ts": 2.5},
+            {"pressure": 4.0, "_kf": True, "_ts": 4},
+        ]
+        assert slow.dropped == 3
+        assert not slow._priority
+
+    def test_run_loop_publishes_on_data_event(self):
+        from services.telemetry_broadcaster import TelemetryBroadcaster
+
+        async def scenario():
+            sub = self._Subscriber()
+            broadcaster = TelemetryBroadcaster(sub, heartbeat_interval=0.2)
+            client = broadcaster.add_client("delta")
+            await asyncio.sleep(0)
+            sub.snapshot.update(pressure=3.0, brewing=True)
+            sub.data_event.set()
+            frame = json.loads(await asyncio.wait_for(client.queue.get(), 1))
+            heartbeat = json.loads(await asyncio.wait_for(client.queue.get(), 1))
+            broadcaster.remove_client(client)
+            return broadcaster, frame, heartbeat
+
+        broadcaster, frame, heartbeat = asyncio.run(scenario())
+
+        assert frame["pressure"] == 3.0 and frame["brewing"] is True
+        assert heartbeat["_heartbeat"] is True
+        assert not broadcaster.running
+
+
+class TestTelemetryFrameRate:
+    """Tests for per-client frame rates and backpressure."""
+
+    class _Subscriber:
+        def __init__(self):
+            self.snapshot = {}
+            self.data_event = asyncio.Event()
+
+        def get_snapshot(self):
+            return dict(self.snapshot)
+
+    def test_fps_level_snaps_down(self):
+        from services.telemetry_broadcaster import DEFAULT_FPS, fps_level
+
+        assert fps_level(20) == 20
+        assert fps_level(7) == 5
+        assert fps_level(100) == 20
+        assert fps_level(0) == 1
+        assert fps_level("fast") == DEFAULT_FPS
+
+    def test_low_rate_group_skips_frames_but_shares_serialization(self):
+        from services.telemetry_broadcaster import TelemetryBroadcaster
+
+        async def scenario():
+            broadcaster = TelemetryBroadcaster(self._Subscriber())
+            fast = [broadcaster.add_client("full", queue_size=8, fps=10) for _ in range(3)]
+            slow = [broadcaster.add_client("full", queue_size=8, fps=2) for _ in range(3)]
+            retries = []
+            for tick in range(5):
+                retries.append(broadcaster.publish({"pressure": float(tick)}, now=tick * 0.1))
+            counts = [c.queue.qsize() for c in fast + slow]
+            broadcaster.stop()
+            return broadcaster, counts, retries
+
+        broadcaster, counts, retries = asyncio.run(scenario())
+
+        # Every tick for the 10 FPS group, only the first for the 2 FPS group
+        assert counts == [5] * 3 + [1] * 3
+        assert broadcaster.stats["serializations"] == 6
+        assert retries[1] == pytest.approx(0.5)
+
+    def test_congested_client_steps_down_and_recovers(self):
+        from services.telemetry_broadcaster import RAMP_UP_AFTER, TelemetryClient
+
+        client = TelemetryClient("delta", fps=10)
+        client.adapt(0)
+        client.record_send(0.2)  # slower than half a 10 FPS period
+        assert client.adapt(1) and client.fps == 5
+        client.send_seconds = 0.0
+        assert not client.adapt(2)
+        assert client.adapt(1 + RAMP_UP_AFTER) and client.fps == 10
+        assert not client.adapt(100)  # never above the requested rate
+
+    def test_rate_change_resyncs_delta_client(self):
+        from services.telemetry_broadcaster import TelemetryBroadcaster
+
+        async def scenario():
+            broadcaster = TelemetryBroadcaster(self._Subscriber())
+            other = broadcaster.add_client("delta", fps=5)
+            client = broadcaster.add_client("delta", fps=10)
+            broadcaster.publish({"pressure": 1.0, "state": "Brewing"}, now=0)
+            broadcaster.publish({"pressure": 2.0, "state": "Brewing"}, now=1)
+            while not client.queue.empty():
+                client.queue.get_nowait()
+            client.request_fps(5)
+            broadcaster.publish({"pressure": 3.0, "state": "Brewing"}, now=2)
+            frame = json.loads(client.queue.get_nowait())
+            broadcaster.stop()
+            return broadcaster, other, client, frame
+
+        broadcaster, other, client, frame = asyncio.run(scenario())
+
+        assert client.fps == 5
+        assert broadcaster.stats["rate_changes"] == 1
+        assert frame == {"pressure": 3.0, "state": "Brewing", "_kf": True, "_ts": 2}
+
+    def test_control_message_sets_rate(self):
+        from api.routes.websocket import _apply_control
+        from services.telemetry_broadcaster import TelemetryClient
+
+        async def scenario():
+            client = TelemetryClient("delta")
+            _apply_control(client, '{"fps": 2}')
+            _apply_control(client, '{"keyframe": true}')
+            _apply_control(client, "not json")
+            return client
+
+        client = asyncio.run(scenario())
+
+        assert client.max_fps == 2
+        assert client.needs_keyframe is True
+
+    def test_run_loop_delivers_skipped_change_to_slow_group(self):
+        from services.telemetry_broadcaster import TelemetryBroadcaster
+
+        async def scenario():
+            sub = self._Subscriber()
+            broadcaster = TelemetryBroadcaster(sub, heartbeat_interval=5)
+            client = broadcaster.add_client("full", fps=5)
+            await asyncio.sleep(0)
+            sub.snapshot["pressure"] = 1.0
+            sub.data_event.set()
+            first = json.loads(await asyncio.wait_for(client.queue.get(), 1))
+            sub.snapshot["pressure"] = 2.0
+            sub.data_event.set()
+            # Arrives once the 200 ms period is up, without a further update
+            second = json.loads(await asyncio.wait_for(client.queue.get(), 1))
+            broadcaster.stop()
+            return first, second
+
+        first, second = asyncio.run(scenario())
+
+        assert first["pressure"] == 1.0
+        assert second["pressure"] == 2.0
+
+
+class TestTelemetryRingBuffer:
+    """Tests for the in-memory telemetry history."""
+
+    def test_capacity_is_fixed_and_keeps_newest(self):
+        from services.telemetry_buffer import TelemetryRingBuffer
+
+        buf = TelemetryRingBuffer(duration=2, rate=5)
+        for i in range(50):
+            buf.record("pressure", float(i), t=100 + i * 0.2)
+        col = buf.window()["pressure"]
+        assert buf.capacity == 10
+        assert col["v"] == [float(i) for i in range(40, 50)]
+
+    def test_samples_bucketed_by_rate(self):
+        from services.telemetry_buffer import TelemetryRingBuffer
+
+        buf = TelemetryRingBuffer(duration=10, rate=1)
+        for i in range(10):
+            buf.record("pressure", float(i), t=100 + i * 0.25)
+        buf.record("brewing", True, t=100.5)
+        buf.record("state", "Brewing", t=100.5)
+        columns = buf.window()
+        # Newest value of each one-second bucket
+        assert columns["pressure"] == {"t": [100.75, 101.75, 102.25], "v": [3.0, 7.0, 9.0]}
+        assert columns["brewing"]["v"] == [1.0]
+        assert "state" not in columns
+
+    def test_window_filters_and_thins(self):
+        from services.telemetry_buffer import TelemetryRingBuffer
+
+        buf = TelemetryRingBuffer(duration=100, rate=1)
+        for i in range(20):
+            buf.record("pressure", float(i), t=float(i))
+            buf.record("flow_rate", i / 10, t=float(i))
+        window = buf.window(start=5, end=14, sensors=["pressure", "bogus"], max_points=4)
+        assert list(window) == ["pressure"]
+        assert window["pressure"]["t"][0] == 5.0
+        assert window["pressure"]["t"][-1] == 14.0
+        assert len(window["pressure"]["t"]) == 4
+        backfill = buf.backfill(5, now=19)
+        assert backfill["t0"] == 14
+        assert backfill["sensors"]["pressure"]["t"] == [0.0, 1.0, 2.0, 3.0, 4.0, 5.0]
+
+    def test_history_endpoint(self, client):
+        import time as _time
+        from services.mqtt_service import get_mqtt_subscriber
+
+        buf = get_mqtt_subscriber().buffer
+        now = _time.time()
+        try:
+            for i in range(5):
+                buf.record("pressure", float(i), t=now - 4 + i)
+            response = client.get("/api/telemetry/history?seconds=30&sensors=pressure")
+            bad = client.get(f"/api/telemetry/history?start={now}&end={now - 10}")
+        finally:
+            buf.clear()
+        assert response.status_code == 200
+        assert response.json()["sensors"]["pressure"]["v"] == [0.0, 1.0, 2.0, 3.0, 4.0]
+        assert bad.status_code == 400
+
+    def test_websocket_backfill_frame(self, client):
+        import time as _time
+        from services.mqtt_service import get_mqtt_subscriber
+
+        sub = get_mqtt_subscriber()
+        now = _time.time()
+        sub.snapshot.update(pressure=4.0)
+        try:
+            for i in range(3):
+                sub.buffer.record("pressure", float(i + 2), t=now - 2 + i)
+            with client.websocket_connect("/api/ws/live?backfill=10") as ws:
+                backfill = ws.receive_json()
+                frame = ws.receive_json()
+                ws.close()
+        finally:
+            sub.buffer.clear()
+            sub.snapshot.clear()
+        assert backfill["_backfill"]["sensors"]["pressure"]["v"] == [2.0, 3.0, 4.0]
+        assert frame["pressure"] == 4.0
+
+
+class TestLiveShotRecorder:
+    """Tests for recording shots from live telemetry."""
+
+    @pytest.fixture(autouse=True)
+    def _isolated_store(self, tmp_path, monkeypatch):
+        import services.shot_recorder as shot_recorder
+        monkeypatch.setattr(shot_recorder, "LIVE_SHOTS_FILE", tmp_path / "live_shots.json")
+        monkeypatch.setattr(shot_recorder, "_live_shots_cache", None)
+
+    def _record_shot(self, start=1000.0):
+        from services.shot_recorder import LiveShotRecorder
+
+        recorder = LiveShotRecorder(sample_rate=10, min_seconds=1)
+        snap = {"brewing": False, "active_profile": "Classic", "state": "Idle"}
+        assert recorder.update(snap, now=start - 1) is None
+        snap.update(brewing=True, state="Preinfusion")
+        for i in range(40):
+            t = i * 0.05
+            snap.update(pressure=round(t * 3, 2), shot_weight=round(t * 10, 2), flow_rate=2.0)
+            if t >= 1:
+                snap["state"] = "Extraction"
+            assert recorder.update(snap, now=start + t) is None
+        assert recorder.recording
+        snap["brewing"] = False
+        return recorder.update(snap, now=start + 2.0)
+
+    def test_records_columns_while_brewing(self):
+        record = self._record_shot()
+
+        columns = record["columns"]
+        # 20 ms ticks collapse to 10 rows per second, newest value kept
+        assert len(columns["time"]) == 20
+        assert columns["time"][:3] == [50, 150, 250]
+        assert columns["weight"][-1] == record["final_weight"] == 19.5
+        assert columns["temperature"][0] is None
+        assert record["stages"] == [
+            {"name": "Preinfusion", "start_ms": 0},
+            {"name": "Extraction", "start_ms": 1000},
+        ]
+        assert record["profile_name"] == "Classic"
+        assert record["reconciled"] is False
+
+    def test_short_brewing_spell_is_discarded(self):
+        from services.shot_recorder import LiveShotRecorder
+
+        recorder = LiveShotRecorder(min_seconds=3)
+        recorder.update({"brewing": True, "pressure": 1.0}, now=10)
+        recorder.update({"brewing": True, "pressure": 1.0}, now=11)
+        assert recorder.update({"brewing": False}, now=11.5) is None
+        assert not recorder.recording
+
+    def test_shot_data_layout_matches_machine_file(self):
+        from services.shot_recorder import live_shot_to_shot_data
+
+        shot_data = live_shot_to_shot_data(self._record_shot())
+        assert shot_data["profile_name"] == "Classic"
+        assert shot_data["data"][0]["status"] == "Preinfusion"
+        assert shot_data["data"][-1]["status"] == "Extraction"
+        # Sensors that never reported (temperature) are left out
+        assert set(shot_data["data"][-1]["shot"]) == {"pressure", "flow", "weight"}
+
+    def test_sensor_gaps_do_not_break_local_analysis(self):
+        from services.analysis_service import _perform_local_shot_analysis
+        from services.shot_recorder import LiveShotRecorder, live_shot_to_shot_data
+
+        recorder = LiveShotRecorder(sample_rate=10, min_seconds=1)
+        snap = {"brewing": True, "state": "Preinfusion", "pressure": 2.0, "flow_rate": 1.0}
+        for i in range(30):
+            if i == 10:
+                # The scale reports late
+                snap["shot_weight"] = 0.5
+            recorder.update(snap, now=1000 + i * 0.1)
+        snap["brewing"] = False
+        record = recorder.update(snap, now=1003.0)
+        assert record["columns"]["weight"][0] is None
+
+        shot_data = live_shot_to_shot_data(record)
+        assert "weight" not in shot_data["data"][0]["shot"]
+        profile = {"name": "Classic", "final_weight": 36, "variables": [], "stages": [
+            {"name": "Preinfusion", "key": "preinfusion", "type": "pressure",
+             "dynamics_points": [[0, 2]], "exit_triggers": []},
+        ]}
+        result = _perform_local_shot_analysis(shot_data, profile)
+        assert result["shot_summary"]["final_weight"] == 0.5
+
+    def test_subscriber_records_brewing_spell(self):
+        from services.mqtt_service import MQTTSubscriber
+        from services.shot_recorder import LiveShotRecorder, get_latest_live_shot
+
+        sub = MQTTSubscriber()
+        sub.recorder = LiveShotRecorder(min_seconds=0)
+
+        def publish(key, value):
+            msg = MagicMock(topic=f"meticulous_espresso/sensor/{key}/state", payload=value.encode())
+            sub._on_message(None, None, msg)
+
+        publish("brewing", "true")
+        publish("pressure", "8.5")
+        time.sleep(0.12)
+        publish("pressure", "9.0")
+        publish("brewing", "false")
+
+        record = get_latest_live_shot()
+        assert record is not None
+        assert record["columns"]["pressure"][-1] == 9.0
+        assert record["max_pressure"] == 9.0
+
+    def test_latest_endpoint_reconciles_with_machine_file(self, client, monkeypatch):
+        import api.routes.shots as shots_routes
+        from services.shot_recorder import save_live_shot
+
+        assert client.get("/api/shots/live/latest").status_code == 404
+
+        save_live_shot(self._record_shot(start=1700000000.0))
+        machine_shot = {
+            "time": 1700000001.5,
+            "profile": {"name": "Classic v2"},
+            "data": [{"time": 0, "shot": {"weight": 0}}, {"time": 2100, "shot": {"weight": 20.1}}],
+        }
+
+        async def fake_latest():
+            return "2023-11-14", "22:13:21.shot.json.zst", machine_shot
+
+        monkeypatch.setattr(shots_routes, "_find_latest_machine_shot", fake_latest)
+        # Plain reads do not query the machine
+        assert client.get("/api/shots/live/latest").json()["reconciled"] is False
+
+        response = client.get("/api/shots/live/latest?as_shot=true&reconcile=true")
+
+        assert response.status_code == 200
+        data = response.json()
+        assert data["reconciled"] is True
+        assert data["machine"] == {"date": "2023-11-14", "filename": "22:13:21.shot.json.zst"}
+        assert data["profile_name"] == "Classic v2"
+        assert data["final_weight"] == 20.1 and data["duration"] == 2.1
+        assert "columns" not in data
+        assert len(data["shot_data"]["data"]) == 20
+
+
+class TestLiveShotAnalysis:
+    """Tests for the streaming in-shot analysis."""
+
+    PROFILE = {
+        "name": "Classic",
+        "final_weight": 36,
+        "variables": [],
+        "stages": [
+            {"name": "Preinfusion", "key": "preinfusion", "type": "pressure",
+             "dynamics_points": [[0, 3]],
+             "exit_triggers": [{"type": "time", "value": 8, "comparison": ">="}]},
+            {"name": "Extraction", "key": "extraction", "type": "pressure",
+             "dynamics_points": [[0, 9]],
+             "exit_triggers": [{"type": "weight", "value": 36, "comparison": ">="}]},
+            {"name": "Decline", "key": "decline", "type": "pressure",
+             "dynamics_points": [[0, 6]], "exit_triggers": []},
+        ],
+    }
+
+    @staticmethod
+    def _shot_data():
+        entries = []
+        for i in range(301):
+            t = i / 10
+            if t < 8.5:
+                stage, pressure, weight = "Preinfusion", min(3.0, t), t * 0.6
+            else:
+                stage, pressure, weight = "Extraction", 9.0 - (i % 7) * 0.1, 5.1 + (t - 8.5) * 1.45
+            entries.append({
+                "time": i * 100, "status": stage,
+                "shot": {"pressure": pressure, "flow": 1.5 + (i % 5) * 0.2, "weight": round(weight, 2)},
+            })
+        entries.append({"time": 30200, "status": "retracting", "shot": {"pressure": 0, "flow": 0, "weight": 36.2}})
+        return {"time": 1700000000, "data": entries}
+
+    def _feed(self, analyzer, shot_data):
+        for entry in shot_data["data"]:
+            shot = entry["shot"]
+            analyzer.add(entry["time"] / 1000, entry["status"], shot["pressure"], shot["flow"], shot["weight"])
+
+    def test_online_stage_stats_match_batch_stats(self):
+        from services.analysis_service import _compute_stage_stats
+        from services.live_analysis import OnlineStageStats
+
+        entries = self._shot_data()["data"][:120]
+        stats = OnlineStageStats()
+        for entry in entries:
+            shot = entry["shot"]
+            stats.add(entry["time"] / 1000, shot["pressure"], shot["flow"], shot["weight"])
+        assert stats.as_dict() == _compute_stage_stats(entries)
+
+    def test_verdict_matches_post_shot_analysis(self):
+        from services.analysis_service import _perform_local_shot_analysis
+        from services.live_analysis import LiveShotAnalyzer
+
+        shot_data = self._shot_data()
+        analyzer = LiveShotAnalyzer(self.PROFILE)
+        self._feed(analyzer, shot_data)
+        verdict = analyzer.finish()
+
+        expected = _perform_local_shot_analysis(shot_data, self.PROFILE)
+        expected.pop("profile_target_curves")
+        assert verdict == expected
+        assert verdict["unreached_stages"] == ["Decline"]
+
+    def test_events_during_shot(self):
+        from services.live_analysis import LiveShotAnalyzer
+
+        events = []
+        analyzer = LiveShotAnalyzer(on_event=events.append)
+        entries = self._shot_data()["data"]
+        self._feed(analyzer, {"data": entries[:30]})
+        analyzer.set_profile(self.PROFILE)  # profile lookup finished mid-shot
+        self._feed(analyzer, {"data": entries[30:]})
+        analyzer.finish()
+
+        types = [e["type"] for e in events]
+        assert types == ["preinfusion_volume", "exit_trigger", "stage_complete",
+                         "exit_trigger", "stage_complete", "verdict"]
+        assert events[0]["weight"] > 3.6
+        assert events[1] == {
+            "type": "exit_trigger", "stage": "Preinfusion", "time": 7.5,
+            "trigger": {"type": "time", "target": 8.0, "actual": 7.5, "description": "time >= 8.0s"},
+        }
+        assert events[2]["assessment"]["status"] == "reached_goal"
+
+    def test_recorder_stores_verdict_and_pushes_frames(self):
+        from services.mqtt_service import MQTTSubscriber
+
+        async def scenario():
+            sub = MQTTSubscriber()
+            sub._loop = asyncio.get_running_loop()
+            sub.data_event = asyncio.Event()
+            client = sub.broadcaster.add_client("delta")
+            snap = {"brewing": True, "state": "Preinfusion", "active_profile": "Classic"}
+            finished = None
+            for i in range(40):
+                snap.update(pressure=2.0, flow_rate=1.0, shot_weight=i * 0.1)
+                finished = sub.recorder.update(snap, now=1000 + i * 0.1) or finished
+            snap["brewing"] = False
+            finished = sub.recorder.update(snap, now=1004)
+            await asyncio.sleep(0)
+            frames = []
+            while not client.queue.empty():
+                frames.append(json.loads(client.queue.get_nowait()))
+            sub.broadcaster.stop()
+            return finished, frames
+
+        with patch("services.mqtt_service.load_live_profile", AsyncMock(return_value=None)):
+            record, frames = asyncio.run(scenario())
+
+        assert record["analysis"]["shot_summary"]["final_weight"] == 3.9
+        verdicts = [f["_analysis"] for f in frames if "_analysis" in f]
+        assert verdicts[-1]["type"] == "verdict"
+        assert verdicts[-1]["analysis"]["shot_summary"] == record["analysis"]["shot_summary"]
+
+
 class TestSettingsMQTTEnabled:
     """Tests for mqttEnabled in GET/POST /api/settings."""
 
@@ -11329,41 +13714,32 @@ class TestDataLoadingHardening:
 
     # -- cache_service (LLM cache) ------------------------------------------
 
-    def test_llm_cache_load_non_dict_returns_empty(self, tmp_path):
-        """When llm cache file contains a list, _load_llm_cache returns {}."""
-        import services.cache_service as cs
+    def test_llm_cache_legacy_non_dict_imports_nothing(self, tmp_path):
+        """A legacy llm cache file containing a list is ignored and retired."""
+        from services.llm_analysis_store import LLMAnalysisStore
 
-        old_file = cs.LLM_CACHE_FILE
-        old_cache = cs._llm_cache
+        legacy = tmp_path / "llm_analysis_cache.json"
+        legacy.write_text("[1, 2, 3]")
+        store = LLMAnalysisStore(tmp_path / "llm.db", ttl_seconds=60, max_entries=10)
         try:
-            cs.LLM_CACHE_FILE = tmp_path / "llm_analysis_cache.json"
-            cs._llm_cache = None
-            cs.LLM_CACHE_FILE.write_text("[1, 2, 3]")
-
-            result = cs._load_llm_cache()
-            assert isinstance(result, dict)
-            assert result == {}
+            assert store.import_legacy_json(legacy) == 0
+            assert len(store) == 0
+            assert not legacy.exists()
         finally:
-            cs.LLM_CACHE_FILE = old_file
-            cs._llm_cache = old_cache
+            store.close()
 
-    def test_llm_cache_load_null_returns_empty(self, tmp_path):
-        """When llm cache file contains null, _load_llm_cache returns {}."""
-        import services.cache_service as cs
+    def test_llm_cache_legacy_null_imports_nothing(self, tmp_path):
+        """A legacy llm cache file containing null is ignored."""
+        from services.llm_analysis_store import LLMAnalysisStore
 
-        old_file = cs.LLM_CACHE_FILE
-        old_cache = cs._llm_cache
+        legacy = tmp_path / "llm_analysis_cache.json"
+        legacy.write_text("null")
+        store = LLMAnalysisStore(tmp_path / "llm.db", ttl_seconds=60, max_entries=10)
         try:
-            cs.LLM_CACHE_FILE = tmp_path / "llm_analysis_cache.json"
-            cs._llm_cache = None
-            cs.LLM_CACHE_FILE.write_text("null")
-
-            result = cs._load_llm_cache()
-            assert isinstance(result, dict)
-            assert result == {}
+            assert store.import_legacy_json(legacy) == 0
+            assert len(store) == 0
         finally:
-            cs.LLM_CACHE_FILE = old_file
-            cs._llm_cache = old_cache
+            store.close()
 
     # -- cache_service (shot cache) ------------------------------------------
 
@@ -12401,6 +14777,7 @@ class TestPrepareRecipeEndpoint:
 # ============================================================================
 
 
+@pytest.mark.usefixtures("storage_backend")
 class TestShotAnnotationEndpoints:
     """Tests for GET/PATCH /api/shots/{date}/{filename}/annotation."""
 
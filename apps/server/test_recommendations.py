@@ -19,6 +19,8 @@ from services.profile_recommendation_service import (
     _score_profile,
     _proximity_score,
     _LRUCache,
+    _CatalogueIndex,
+    _cache_key,
     ProfileRecommendationService,
 )
 
@@ -447,3 +449,230 @@ class TestRecommendationService:
             lever_score = next((r["score"] for r in results if "Lever" in r["profile_name"]), 0)
             turbo_score = next((r["score"] for r in results if "Turbo" in r["profile_name"]), 0)
             assert lever_score > turbo_score
+
+
+# ---------------------------------------------------------------------------
+# Catalogue index tests
+# ---------------------------------------------------------------------------
+
+ALL_PROFILES = [PRESSURE_PROFILE, FLOW_PROFILE, FLAT_PROFILE, TURBO_PROFILE, LEVER_PROFILE]
+
+
+class TestCatalogueIndex:
+    @pytest.mark.parametrize("tags", [
+        [], ["preinfusion"], ["preinfusion", "pressure"], ["bloom", "flow", "fruity"],
+        ["turbo", "unknown-tag"], ["Lever", "decline", "flat"],
+    ])
+    def test_scores_match_reference_scorer(self, tags):
+        index = _CatalogueIndex(ALL_PROFILES)
+        user_tags = set(tags)
+        user_fp = ProfileRecommendationService._build_user_fingerprint(user_tags, ALL_PROFILES)
+        for position, score in index.score_all(user_tags, user_fp):
+            expected, _, _ = _score_profile(user_tags, user_fp, ALL_PROFILES[position])
+            assert score == expected
+
+    def test_source_fingerprint_scores_match_reference(self):
+        index = _CatalogueIndex(ALL_PROFILES)
+        for source in ALL_PROFILES:
+            source_fp = _extract_fingerprint(source)
+            source_tags = _extract_name_tags(source)
+            for position, score in index.score_all(source_tags, source_fp):
+                expected, _, _ = _score_profile(source_tags, source_fp, ALL_PROFILES[position])
+                assert score == expected
+
+    def test_rank_orders_by_score_and_limits(self):
+        index = _CatalogueIndex(ALL_PROFILES)
+        user_fp = ProfileRecommendationService._build_user_fingerprint({"pressure"}, ALL_PROFILES)
+        results = index.rank({"pressure"}, user_fp, limit=3)
+        assert len(results) == 3
+        scores = [r["score"] for r in results]
+        assert scores == sorted(scores, reverse=True)
+
+    def test_version_tracks_content(self):
+        a = _CatalogueIndex([PRESSURE_PROFILE, FLOW_PROFILE])
+        b = _CatalogueIndex([FLOW_PROFILE, PRESSURE_PROFILE])
+        c = _CatalogueIndex([PRESSURE_PROFILE, LEVER_PROFILE])
+        assert a.version == b.version
+        assert a.version != c.version
+
+    def test_rebuild_reuses_features_of_unchanged_profiles(self):
+        first = _CatalogueIndex([PRESSURE_PROFILE, FLOW_PROFILE])
+        with patch(
+            "services.profile_recommendation_service._extract_fingerprint",
+            wraps=_extract_fingerprint,
+        ) as mock_extract:
+            _CatalogueIndex([PRESSURE_PROFILE, FLOW_PROFILE, LEVER_PROFILE], first.features)
+        assert mock_extract.call_count == 1
+
+    @pytest.mark.asyncio
+    async def test_service_reuses_index_for_same_catalogue(self):
+        service = ProfileRecommendationService()
+        with patch(
+            "services.profile_recommendation_service.async_fetch_all_profiles",
+            new_callable=AsyncMock,
+            return_value=ALL_PROFILES,
+        ):
+            await service.get_recommendations(tags=["pressure"], limit=3)
+            first = service._index
+            await service.find_similar("Lever Decline", limit=3)
+            assert service._index is first
+
+
+# ---------------------------------------------------------------------------
+# Versioned cache / incremental neighbour tests
+# ---------------------------------------------------------------------------
+
+def _edited(profile, **changes):
+    """Return a copy of *profile* with some attributes changed."""
+    return SimpleNamespace(**{**vars(profile), **changes})
+
+
+class TestVersionedCache:
+    @staticmethod
+    async def _recommend(service, catalogue, tags, limit=2):
+        with patch(
+            "services.profile_recommendation_service.async_fetch_all_profiles",
+            new_callable=AsyncMock,
+            return_value=catalogue,
+        ):
+            return await service.get_recommendations(tags=tags, limit=limit)
+
+    @staticmethod
+    async def _similar(service, catalogue, name, limit=10):
+        with patch(
+            "services.profile_recommendation_service.async_fetch_all_profiles",
+            new_callable=AsyncMock,
+            return_value=catalogue,
+        ):
+            return await service.find_similar(name, limit=limit)
+
+    def test_cache_key_includes_catalogue_version(self):
+        assert _cache_key(["bloom"], 5, "v1") != _cache_key(["bloom"], 5, "v2")
+        assert _cache_key(["a", "b"], 5, "v1") == _cache_key(["b", "a"], 5, "v1")
+
+    @pytest.mark.asyncio
+    async def test_cached_results_served_without_refetch(self):
+        service = ProfileRecommendationService()
+        first = await self._recommend(service, list(ALL_PROFILES), ["pressure"])
+        with patch(
+            "services.profile_recommendation_service.async_fetch_all_profiles",
+            new_callable=AsyncMock,
+        ) as mock_fetch:
+            second = await service.get_recommendations(tags=["pressure"], limit=2)
+        assert second is first
+        mock_fetch.assert_not_awaited()
+
+    @pytest.mark.asyncio
+    async def test_unrelated_edit_keeps_cached_results(self):
+        service = ProfileRecommendationService()
+        catalogue = [PRESSURE_PROFILE, LEVER_PROFILE, TURBO_PROFILE]
+        first = await self._recommend(service, catalogue, ["pressure", "preinfusion"])
+        assert len(first) == 2
+        assert "Turbo Shot" not in {r["profile_name"] for r in first}
+
+        service.invalidate_cache()
+        edited = [PRESSURE_PROFILE, LEVER_PROFILE, _edited(TURBO_PROFILE, temperature=88.0)]
+        with patch.object(service, "_compute", wraps=service._compute) as mock_compute:
+            second = await self._recommend(service, edited, ["pressure", "preinfusion"])
+        assert second is first
+        mock_compute.assert_not_called()
+
+    @pytest.mark.asyncio
+    async def test_edit_of_included_profile_invalidates_result(self):
+        service = ProfileRecommendationService()
+        catalogue = [PRESSURE_PROFILE, LEVER_PROFILE, FLOW_PROFILE]
+        first = await self._recommend(service, catalogue, ["pressure", "preinfusion"])
+        assert "Lever Decline" in {r["profile_name"] for r in first}
+
+        service.invalidate_cache()
+        renamed = _edited(LEVER_PROFILE, name="Lever Decline v2")
+        second = await self._recommend(service, [PRESSURE_PROFILE, renamed, FLOW_PROFILE], ["pressure", "preinfusion"])
+        assert "Lever Decline v2" in {r["profile_name"] for r in second}
+
+    @pytest.mark.asyncio
+    async def test_new_profile_that_ranks_invalidates_result(self):
+        service = ProfileRecommendationService()
+        first = await self._recommend(service, [FLOW_PROFILE, TURBO_PROFILE], ["pressure"], limit=1)
+
+        service.invalidate_cache()
+        second = await self._recommend(
+            service, [FLOW_PROFILE, TURBO_PROFILE, PRESSURE_PROFILE], ["pressure"], limit=1,
+        )
+        assert second is not first
+        assert second[0]["profile_name"] == "Classic Italian Espresso"
+
+    @pytest.mark.asyncio
+    async def test_neighbours_updated_incrementally(self):
+        service = ProfileRecommendationService()
+        catalogue = [PRESSURE_PROFILE, FLOW_PROFILE, TURBO_PROFILE]
+        before = await self._similar(service, catalogue, "Classic Italian Espresso")
+        assert "Lever Decline" not in {r["profile_name"] for r in before}
+
+        service.invalidate_cache()
+        grown = catalogue + [LEVER_PROFILE]
+        with patch.object(_CatalogueIndex, "score_all", autospec=True, side_effect=_CatalogueIndex.score_all) as mock_score:
+            after = await self._similar(service, grown, "Classic Italian Espresso")
+
+        # Only the added profile was scored against the cached source row
+        scored_positions = [list(call.args[3]) for call in mock_score.call_args_list]
+        assert scored_positions == [[3]]
+        assert after[0]["profile_name"] == "Lever Decline"
+
+        fresh = await self._similar(ProfileRecommendationService(), grown, "Classic Italian Espresso")
+        assert [(r["profile_name"], r["score"]) for r in after] == [(r["profile_name"], r["score"]) for r in fresh]
+
+    @pytest.mark.asyncio
+    async def test_neighbours_drop_deleted_profiles(self):
+        service = ProfileRecommendationService()
+        catalogue = [PRESSURE_PROFILE, FLOW_PROFILE, LEVER_PROFILE]
+        before = await self._similar(service, catalogue, "Classic Italian Espresso")
+        assert "Lever Decline" in {r["profile_name"] for r in before}
+
+        service.invalidate_cache()
+        after = await self._similar(service, [PRESSURE_PROFILE, FLOW_PROFILE], "Classic Italian Espresso")
+        assert "Lever Decline" not in {r["profile_name"] for r in after}
+
+
+# ---------------------------------------------------------------------------
+# Inverted tag index / candidate pruning tests
+# ---------------------------------------------------------------------------
+
+class TestCandidatePruning:
+    def test_postings_map_tags_to_positions(self):
+        index = _CatalogueIndex(ALL_PROFILES)
+        assert index.postings["turbo"] == [3]
+        assert index.postings["bloom"] == [1]
+        assert index.postings["pressure-profile"] == [0, 2, 4]
+        assert index.candidates(["turbo", "bloom"]) == [1, 3]
+        assert index.candidates(["no-such-tag"]) == []
+
+    def test_only_tag_sharing_profiles_are_scored(self):
+        index = _CatalogueIndex(ALL_PROFILES)
+        user_fp = ProfileRecommendationService._build_user_fingerprint({"bloom"}, ALL_PROFILES)
+        with patch.object(index, "score_all", wraps=index.score_all) as mock_score:
+            top = index.top_k({"bloom"}, user_fp, limit=1)
+        assert top == [1]
+        assert mock_score.call_count == 1
+        assert list(mock_score.call_args.args[2]) == [1]
+
+    def test_structural_fallback_without_tag_overlap(self):
+        index = _CatalogueIndex(ALL_PROFILES)
+        user_fp = ProfileRecommendationService._build_user_fingerprint({"fruity"}, ALL_PROFILES)
+        top = index.top_k({"fruity"}, user_fp, limit=3)
+        assert len(top) == 3
+        expected = sorted(
+            (s for _, s in index.score_all({"fruity"}, user_fp) if s > 0), reverse=True
+        )[:3]
+        assert [dict(index.score_all({"fruity"}, user_fp))[i] for i in top] == expected
+
+    def test_fallback_fills_up_to_limit(self):
+        index = _CatalogueIndex(ALL_PROFILES)
+        user_fp = ProfileRecommendationService._build_user_fingerprint({"turbo"}, ALL_PROFILES)
+        top = index.top_k({"turbo"}, user_fp, limit=4)
+        assert 3 in top
+        assert len(top) == 4
+
+    def test_exclude_name_applies_to_candidates_and_fallback(self):
+        index = _CatalogueIndex(ALL_PROFILES)
+        top = index.top_k({"turbo"}, None, limit=5, exclude_name="Turbo Shot")
+        assert 3 not in top
@@ -404,9 +404,9 @@ function App() {
 
       clearInterval(messageInterval)
 
-      // Handle "busy" — another generation is already in progress.
+      // Handle "busy" — the generation queue is full.
       // Return the user to the form (preserving their input) with a toast.
-      if (response.status === 409) {
+      if (response.status === 503) {
         toast.warning(t('app.errors.generateBusy'))
         setViewState('form')
         return
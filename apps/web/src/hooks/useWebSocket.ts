@@ -122,16 +122,17 @@ export function useWebSocket(enabled: boolean): WebSocketResult {
   const connect = useCallback(async () => {
     if (!enabledRef.current) return
 
-    // Build WebSocket URL from the HTTP server URL
+    // Build WebSocket URL from the HTTP server URL. Delta mode sends a full
+    // keyframe, then only changed keys — onmessage merges them into state.
     const serverUrl = await getServerUrl()
     let wsUrl: string
     if (serverUrl) {
       // Replace http(s) with ws(s)
-      wsUrl = serverUrl.replace(/^http/, 'ws') + '/api/ws/live'
+      wsUrl = serverUrl.replace(/^http/, 'ws') + '/api/ws/live?mode=delta'
     } else {
       // Same origin
       const proto = window.location.protocol === 'https:' ? 'wss:' : 'ws:'
-      wsUrl = `${proto}//${window.location.host}/api/ws/live`
+      wsUrl = `${proto}//${window.location.host}/api/ws/live?mode=delta`
     }
 
     try {